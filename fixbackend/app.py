@@ -46,7 +46,7 @@ from fixbackend.cloud_accounts.router import cloud_accounts_callback_router, clo
 from fixbackend.config import Config
 from fixbackend.customer_support.router import admin_console_router
 from fixbackend.dependencies import ServiceNames as SN, FixDependency, FixDependencies  # noqa
-from fixbackend.errors import ClientError, NotAllowed, ResourceNotFound, WrongState
+from fixbackend.errors import ClientError, NotAllowed, ResourceGone, ResourceNotFound, WrongState
 from fixbackend.events.router import websocket_router
 from fixbackend.inventory.inventory_client import InventoryException
 from fixbackend.inventory.inventory_router import inventory_router
@@ -202,6 +202,10 @@ async def fast_api_app(cfg: Config, deps: FixDependencies) -> FastAPI:
     async def resource_not_found_handler(_: Request, exception: ResourceNotFound) -> Response:
         return JSONResponse(status_code=404, content={"detail": str(exception)})
 
+    @app.exception_handler(ResourceGone)
+    async def resource_gone_handler(_: Request, exception: ResourceGone) -> Response:
+        return JSONResponse(status_code=410, content={"detail": str(exception)})
+
     @app.exception_handler(InventoryException)
     async def inventory_exception_handler(_: Request, exception: InventoryException) -> Response:
         return JSONResponse(status_code=exception.status, content={"detail": str(exception)})
@@ -22,6 +22,7 @@
 import logging
 from dataclasses import replace
 from datetime import timedelta
+from functools import partial
 from ssl import Purpose, create_default_context
 from typing import Any, Dict
 
@@ -38,6 +39,7 @@ from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from fixbackend.analytics.domain_event_to_analytics import analytics
 from fixbackend.auth.api_token_service import ApiTokenService
 from fixbackend.auth.auth_backend import FixJWTStrategy
+from fixbackend.auth.auth_cache import UserCache
 from fixbackend.auth.user_manager import UserManager
 from fixbackend.auth.user_repository import UserRepository
 from fixbackend.auth.user_verifier import AuthEmailSender
@@ -65,6 +67,7 @@ from fixbackend.domain_events.consumers import (
 )
 from fixbackend.domain_events.publisher_impl import DomainEventPublisherImpl
 from fixbackend.domain_events.subscriber import DomainEventSubscriber
+from fixbackend.events.websocket_event_hub import WebsocketEventHub
 from fixbackend.fix_jwt import JwtService
 from fixbackend.graph_db.service import GraphDatabaseAccessManager
 from fixbackend.inventory.inventory_client import InventoryClient
@@ -101,22 +104,35 @@ def create_redis(url: str, cfg: Config) -> Redis:
     return Redis.from_url(url, decode_responses=True, **kwargs)
 
 
-async def base_dependencies(cfg: Config) -> FixDependencies:
-    deps = FixDependencies()
-    deps.add(SN.config, cfg)
-    ca_cert_path = str(cfg.ca_cert) if cfg.ca_cert else None
+def create_http_client(cfg: Config, *, max_connections: int = 512, max_keepalive_connections: int = 50) -> AsyncClient:
     client_context = create_default_context(purpose=Purpose.SERVER_AUTH)
-    if ca_cert_path:
-        client_context.load_verify_locations(ca_cert_path)
-    deps.add(
-        SN.http_client,
-        AsyncClient(
-            verify=client_context or True,
-            timeout=Timeout(pool=10, connect=10, read=60, write=60),
-            follow_redirects=True,
-            limits=Limits(max_connections=512, max_keepalive_connections=50),
+    if cfg.ca_cert:
+        client_context.load_verify_locations(str(cfg.ca_cert))
+    return AsyncClient(
+        verify=client_context or True,
+        timeout=Timeout(pool=10, connect=10, read=60, write=60),
+        follow_redirects=True,
+        limits=Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive_connections),
+    )
+
+
+def create_inventory_client(cfg: Config, http_client: AsyncClient) -> InventoryClient:
+    # every graph db server gets its own connection pool with its own limits
+    per_server = cfg.inventory_connections_per_server
+    return InventoryClient(
+        cfg.inventory_url,
+        http_client,
+        client_factory=partial(
+            create_http_client, cfg, max_connections=per_server, max_keepalive_connections=max(1, per_server // 4)
         ),
+        max_connections_per_server=per_server,
     )
+
+
+async def base_dependencies(cfg: Config) -> FixDependencies:
+    deps = FixDependencies()
+    deps.add(SN.config, cfg)
+    deps.add(SN.http_client, create_http_client(cfg))
     engine = deps.add(
         SN.async_engine,
         create_async_engine(
@@ -141,19 +157,23 @@ async def application_dependencies(cfg: Config) -> FixDependencies:
         password=cfg.args.redis_password,
     )
     arq_redis = deps.add(SN.arq_redis, await create_pool(arq_settings))
-    deps.add(SN.readonly_redis, create_redis(cfg.redis_readonly_url, cfg))
+    readonly_redis = deps.add(SN.readonly_redis, create_redis(cfg.redis_readonly_url, cfg))
     readwrite_redis = deps.add(SN.readwrite_redis, create_redis(cfg.redis_readwrite_url, cfg))
+    # one subscription for the events of all websockets of this process
+    deps.add(SN.websocket_event_hub, WebsocketEventHub(readonly_redis))
     temp_store_redis = deps.add(SN.temp_store_redis, create_redis(cfg.redis_temp_store_url, cfg))
     domain_event_subscriber = deps.add(
         SN.domain_event_subscriber,
         DomainEventSubscriber(readwrite_redis, cfg, "fixbackend"),
     )
     cloud_account_repo = deps.add(SN.cloud_account_repo, CloudAccountRepository(session_maker))
-    next_run_repo = deps.add(SN.next_run_repo, NextRunRepository(session_maker))
+    next_run_repo = deps.add(
+        SN.next_run_repo, NextRunRepository(session_maker, spread_runs=cfg.dispatcher_spread_next_runs)
+    )
     metering_repo = deps.add(SN.metering_repo, MeteringRepository(session_maker))
     deps.add(SN.collect_queue, RedisCollectQueue(arq_redis))
     graph_db_access = deps.add(SN.graph_db_access, GraphDatabaseAccessManager(cfg, session_maker))
-    inventory_client = deps.add(SN.inventory_client, InventoryClient(cfg.inventory_url, http_client))
+    inventory_client = deps.add(SN.inventory_client, create_inventory_client(cfg, http_client))
     inventory_service = deps.add(
         SN.inventory,
         InventoryService(
@@ -176,8 +196,9 @@ async def application_dependencies(cfg: Config) -> FixDependencies:
     )
     domain_event_publisher = deps.add(SN.domain_event_sender, DomainEventPublisherImpl(fixbackend_events))
     subscription_repo = deps.add(SN.subscription_repo, SubscriptionRepository(session_maker))
-    user_repo = deps.add(SN.user_repo, UserRepository(session_maker))
-    role_repo = deps.add(SN.role_repository, RoleRepository(session_maker))
+    user_cache = deps.add(SN.user_cache, UserCache(readwrite_redis))
+    user_repo = deps.add(SN.user_repo, UserRepository(session_maker, user_cache))
+    role_repo = deps.add(SN.role_repository, RoleRepository(session_maker, user_cache=user_cache))
 
     workspace_repo = deps.add(
         SN.workspace_repo,
@@ -192,6 +213,7 @@ async def application_dependencies(cfg: Config) -> FixDependencies:
             ),
             subscription_repo,
             role_repo,
+            redis=readwrite_redis,
         ),
     )
     billing_entry_service = deps.add(
@@ -307,7 +329,9 @@ async def application_dependencies(cfg: Config) -> FixDependencies:
             invitation_repository=invitation_repo,
         ),
     )
-    jwt_strategy = deps.add(SN.jwt_strategy, FixJWTStrategy(cert_store, lifetime_seconds=cfg.session_ttl))
+    jwt_strategy = deps.add(
+        SN.jwt_strategy, FixJWTStrategy(cert_store, lifetime_seconds=cfg.session_ttl, user_cache=user_cache)
+    )
     deps.add(
         SN.api_token_service,
         ApiTokenService(session_maker, jwt_strategy, user_repo, workspace_repo, deps.async_process_pool),
@@ -350,7 +374,9 @@ async def dispatcher_dependencies(cfg: Config) -> FixDependencies:
     )
     temp_store_redis = deps.add(SN.temp_store_redis, create_redis(cfg.redis_temp_store_url, cfg))
     cloud_account_repo = deps.add(SN.cloud_account_repo, CloudAccountRepository(session_maker))
-    next_run_repo = deps.add(SN.next_run_repo, NextRunRepository(session_maker))
+    next_run_repo = deps.add(
+        SN.next_run_repo, NextRunRepository(session_maker, spread_runs=cfg.dispatcher_spread_next_runs)
+    )
     metering_repo = deps.add(SN.metering_repo, MeteringRepository(session_maker))
     collect_queue = deps.add(SN.collect_queue, RedisCollectQueue(arq_redis))
     graph_db_access = deps.add(SN.graph_db_access, GraphDatabaseAccessManager(cfg, session_maker))
@@ -365,7 +391,9 @@ async def dispatcher_dependencies(cfg: Config) -> FixDependencies:
     )
     domain_event_publisher = deps.add(SN.domain_event_sender, DomainEventPublisherImpl(fixbackend_events))
     subscription_repo = deps.add(SN.subscription_repo, SubscriptionRepository(session_maker))
-    role_repo = deps.add(SN.role_repository, RoleRepository(session_maker))
+    # changes to users and roles evict the users cached by the app
+    user_cache = deps.add(SN.user_cache, UserCache(readwrite_redis))
+    role_repo = deps.add(SN.role_repository, RoleRepository(session_maker, user_cache=user_cache))
 
     workspace_repo = deps.add(
         SN.workspace_repo,
@@ -380,6 +408,7 @@ async def dispatcher_dependencies(cfg: Config) -> FixDependencies:
             ),
             subscription_repo,
             role_repo,
+            redis=readwrite_redis,
         ),
     )
 
@@ -388,8 +417,8 @@ async def dispatcher_dependencies(cfg: Config) -> FixDependencies:
         channel="cloud_accounts",
         publisher_name="cloud_account_service",
     )
-    user_repo = deps.add(SN.user_repo, UserRepository(session_maker))
-    inventory_client = deps.add(SN.inventory_client, InventoryClient(cfg.inventory_url, http_client))
+    user_repo = deps.add(SN.user_repo, UserRepository(session_maker, user_cache))
+    inventory_client = deps.add(SN.inventory_client, create_inventory_client(cfg, http_client))
     # in dispatching we do not want to handle domain events: leave it to the app
     inventory_service = deps.add(
         SN.inventory,
@@ -512,8 +541,10 @@ async def billing_dependencies(cfg: Config) -> FixDependencies:
     domain_event_publisher = deps.add(SN.domain_event_sender, DomainEventPublisherImpl(fixbackend_events))
     metering_repo = deps.add(SN.metering_repo, MeteringRepository(session_maker))
     subscription_repo = deps.add(SN.subscription_repo, SubscriptionRepository(session_maker))
-    role_repo = deps.add(SN.role_repository, RoleRepository(session_maker))
-    user_repo = deps.add(SN.user_repo, UserRepository(session_maker))
+    # changes to users and roles evict the users cached by the app
+    user_cache = deps.add(SN.user_cache, UserCache(readwrite_redis))
+    role_repo = deps.add(SN.role_repository, RoleRepository(session_maker, user_cache=user_cache))
+    user_repo = deps.add(SN.user_repo, UserRepository(session_maker, user_cache))
     workspace_repo = deps.add(
         SN.workspace_repo,
         WorkspaceRepository(
@@ -527,6 +558,7 @@ async def billing_dependencies(cfg: Config) -> FixDependencies:
             ),
             subscription_repo,
             role_repo,
+            redis=readwrite_redis,
         ),
     )
     cloud_account_repo = deps.add(SN.cloud_account_repo, CloudAccountRepository(session_maker))
@@ -577,10 +609,11 @@ async def support_dependencies(cfg: Config) -> FixDependencies:
     deps = await base_dependencies(cfg)
     session_maker = deps.session_maker
     deps.add(SN.role_repository, RoleRepository(session_maker))
-    user_repo = deps.add(SN.user_repo, UserRepository(session_maker))
 
     graph_db_access = deps.add(SN.graph_db_access, GraphDatabaseAccessManager(cfg, session_maker))
     readwrite_redis = deps.add(SN.readwrite_redis, create_redis(cfg.redis_readwrite_url, cfg))
+    user_cache = deps.add(SN.user_cache, UserCache(readwrite_redis))
+    user_repo = deps.add(SN.user_repo, UserRepository(session_maker, user_cache))
     fixbackend_events = deps.add(
         SN.domain_event_redis_stream_publisher,
         RedisStreamPublisher(
@@ -592,7 +625,7 @@ async def support_dependencies(cfg: Config) -> FixDependencies:
     )
     domain_event_publisher = deps.add(SN.domain_event_sender, DomainEventPublisherImpl(fixbackend_events))
     subscription_repo = deps.add(SN.subscription_repo, SubscriptionRepository(session_maker))
-    role_repo = deps.add(SN.role_repository, RoleRepository(session_maker))
+    role_repo = deps.add(SN.role_repository, RoleRepository(session_maker, user_cache=user_cache))
     workspace_repo = deps.add(
         SN.workspace_repo,
         WorkspaceRepository(
@@ -606,6 +639,7 @@ async def support_dependencies(cfg: Config) -> FixDependencies:
             ),
             subscription_repo,
             role_repo,
+            redis=readwrite_redis,
         ),
     )
     ca_cert_path = str(cfg.ca_cert) if cfg.ca_cert else None
@@ -621,7 +655,7 @@ async def support_dependencies(cfg: Config) -> FixDependencies:
     )
     cloud_account_repo = deps.add(SN.cloud_account_repo, CloudAccountRepository(session_maker))
     http_client = deps.http_client
-    inventory_client = deps.add(SN.inventory_client, InventoryClient(cfg.inventory_url, http_client))
+    inventory_client = deps.add(SN.inventory_client, create_inventory_client(cfg, http_client))
     inventory_service = deps.add(
         SN.inventory,
         InventoryService(
@@ -684,9 +718,9 @@ async def support_dependencies(cfg: Config) -> FixDependencies:
             invitation_repository=invitation_repo,
         ),
     )
-    deps.add(SN.jwt_strategy, FixJWTStrategy(cert_store, lifetime_seconds=cfg.session_ttl))
+    deps.add(SN.jwt_strategy, FixJWTStrategy(cert_store, lifetime_seconds=cfg.session_ttl, user_cache=user_cache))
 
-    deps.add(SN.next_run_repo, NextRunRepository(session_maker))
+    deps.add(SN.next_run_repo, NextRunRepository(session_maker, spread_runs=cfg.dispatcher_spread_next_runs))
 
     return deps
 
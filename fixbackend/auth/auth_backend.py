@@ -22,6 +22,7 @@ from fastapi_users.manager import BaseUserManager
 from fixcloudutils.util import utc
 
 from fixbackend import fix_jwt
+from fixbackend.auth.auth_cache import UserCache, VerifiedTokenCache
 from fixbackend.auth.models import User
 from fixbackend.auth.transport import CookieTransport
 from fixbackend.certificates.cert_store import CertificateStore
@@ -37,22 +38,30 @@ class FixJWTStrategy(Strategy[User, UserId]):
         lifetime_seconds: Optional[int],
         token_audience: Optional[List[str]] = None,
         algorithm: str = "RS256",
+        user_cache: Optional[UserCache] = None,
     ):
         self.certstore = certstore
         self.lifetime_seconds = lifetime_seconds
         self.token_audience = token_audience or ["fastapi-users:auth"]
         self.algorithm = algorithm
+        # the same token is used for many requests: verify the signature only once
+        self.verified_tokens = VerifiedTokenCache()
+        self.user_cache = user_cache
 
     async def decode_token(self, token: str) -> Optional[Dict[str, Any]]:
-        public_keys = await self.certstore.public_keys()
-        return fix_jwt.decode_token(token, self.token_audience, public_keys)
+        if (cached := self.verified_tokens.get(token)) is not None:
+            return cached
+        public_keys = await self.certstore.public_keys_by_kid()
+        data = fix_jwt.decode_token_by_kid(token, self.token_audience, public_keys)
+        if data is not None:
+            self.verified_tokens.put(token, data)
+        return data
 
     async def read_token(self, token: Optional[str], user_manager: BaseUserManager[User, UserId]) -> Optional[User]:
         if token is None:
             return None
 
-        public_keys = await self.certstore.public_keys()
-        data = fix_jwt.decode_token(token, self.token_audience, public_keys)
+        data = await self.decode_token(token)
         if data is None:
             return None
 
@@ -62,7 +71,10 @@ class FixJWTStrategy(Strategy[User, UserId]):
 
         try:
             parsed_id = user_manager.parse_id(user_id)
-            user = await user_manager.get(parsed_id)
+            if self.user_cache is None:
+                user = await user_manager.get(parsed_id)
+            else:
+                user = await self.user_cache.get(parsed_id, user_manager.get)
             if amt := user.auth_min_time:
                 data_at = data.get("at")
                 if data_at is None or (data_at / 1000) < amt.timestamp():
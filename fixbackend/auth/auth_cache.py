@@ -0,0 +1,149 @@
+#  Copyright (c) 2024. Some Engineering
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import hashlib
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, Generic, Optional, Tuple, TypeVar
+
+from fixcloudutils.redis.pub_sub import RedisPubSubListener, RedisPubSubPublisher
+from fixcloudutils.service import Service
+from fixcloudutils.types import Json
+from prometheus_client import Counter
+
+from fixbackend.auth.models import User
+from fixbackend.ids import UserId
+from fixbackend.types import Redis
+
+log = logging.getLogger(__name__)
+K = TypeVar("K")
+V = TypeVar("V")
+AuthCacheHits = Counter("auth_cache", "Lookups in the authentication caches", ["cache", "result"])
+
+
+class ExpiringLruCache(Generic[K, V]):
+    """
+    Bounded LRU cache, where every entry has its own deadline (epoch seconds).
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self.entries: OrderedDict[K, Tuple[V, float]] = OrderedDict()
+
+    def get(self, key: K) -> Optional[V]:
+        if (entry := self.entries.get(key)) is None:
+            return None
+        value, deadline = entry
+        if deadline <= time.time():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def put(self, key: K, value: V, deadline: float) -> None:
+        self.entries[key] = (value, deadline)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def pop(self, key: K) -> None:
+        self.entries.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class VerifiedTokenCache:
+    """
+    Maps the digest of a token with a verified signature to its claims.
+    An entry expires with the token, but is held no longer than max_age,
+    so that a token signed with a retired key is not accepted for too long.
+    """
+
+    def __init__(self, *, max_size: int = 10_000, max_age: timedelta = timedelta(minutes=5)) -> None:
+        self.max_age = max_age
+        self.tokens: ExpiringLruCache[bytes, Dict[str, Any]] = ExpiringLruCache(max_size)
+
+    @staticmethod
+    def _digest(token: str) -> bytes:
+        return hashlib.sha256(token.encode("utf-8")).digest()
+
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        claims = self.tokens.get(self._digest(token))
+        AuthCacheHits.labels("token", "miss" if claims is None else "hit").inc()
+        return claims
+
+    def put(self, token: str, claims: Dict[str, Any]) -> None:
+        deadline = time.time() + self.max_age.total_seconds()
+        if isinstance(exp := claims.get("exp"), (int, float)):
+            deadline = min(deadline, exp)
+        self.tokens.put(self._digest(token), claims, deadline)
+
+
+class UserCache(Service):
+    """
+    Short-lived in-memory cache of users, used to authenticate requests without a database round trip.
+    Users are not stored in redis, since the model contains secrets.
+    Whenever a user changes, the entry is evicted on all instances via redis pub/sub.
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        *,
+        ttl: timedelta = timedelta(seconds=30),
+        max_size: int = 10_000,
+        channel: str = "user_cache",
+    ) -> None:
+        self.ttl = ttl
+        self.users: ExpiringLruCache[UserId, User] = ExpiringLruCache(max_size)
+        # incremented with every eviction: a user loaded during an eviction is not cached
+        self.generation = 0
+        self.publisher = RedisPubSubPublisher(redis, channel, f"user_cache-{uuid.uuid4()}")
+        self.listener = RedisPubSubListener(redis, channel, self._handle_message)
+
+    async def start(self) -> None:
+        await self.publisher.start()
+        await self.listener.start()
+
+    async def stop(self) -> None:
+        await self.listener.stop()
+        await self.publisher.stop()
+
+    async def get(self, user_id: UserId, load: Callable[[UserId], Awaitable[User]]) -> User:
+        if (user := self.users.get(user_id)) is not None:
+            AuthCacheHits.labels("user", "hit").inc()
+            return user
+        AuthCacheHits.labels("user", "miss").inc()
+        generation = self.generation
+        user = await load(user_id)
+        if generation == self.generation:
+            self.users.put(user_id, user, time.time() + self.ttl.total_seconds())
+        return user
+
+    async def evict(self, user_id: UserId) -> None:
+        self._evict_local(user_id)
+        await self.publisher.publish("evict", {"user_id": str(user_id)})
+
+    def _evict_local(self, user_id: UserId) -> None:
+        self.generation += 1
+        self.users.pop(user_id)
+
+    async def _handle_message(self, uid: str, at: datetime, publisher: str, kind: str, data: Json) -> None:
+        if kind == "evict" and (user_id := data.get("user_id")):
+            self._evict_local(UserId(uuid.UUID(user_id)))
+        else:
+            log.warning(f"Unknown message: {kind} {data}")
@@ -23,6 +23,7 @@ from fastapi_users_db_sqlalchemy.generics import GUID
 from sqlalchemy import func, select, delete
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from fixbackend.auth.auth_cache import UserCache
 from fixbackend.auth.models import OAuthAccount, User, orm
 from fixbackend.db import AsyncSessionMakerDependency
 from fixbackend.ids import UserId
@@ -35,8 +36,14 @@ class UserRepository(BaseUserDatabase[User, UserId]):
     def __init__(
         self,
         session_maker: AsyncSessionMaker,
+        user_cache: Optional[UserCache] = None,
     ) -> None:
         self.session_maker = session_maker
+        self.user_cache = user_cache
+
+    async def _evict_cached(self, user_id: UserId) -> None:
+        if self.user_cache is not None:
+            await self.user_cache.evict(user_id)
 
     @asynccontextmanager
     async def user_db(
@@ -129,6 +136,8 @@ class UserRepository(BaseUserDatabase[User, UserId]):
             if auth_min_time:
                 orm_user.auth_min_time = auth_min_time
             await db.session.commit()
+        if auth_min_time:
+            await self._evict_cached(uid)
 
     async def update(self, user: User, update_dict: Dict[str, Any]) -> User:
         """Update a user."""
@@ -145,7 +154,9 @@ class UserRepository(BaseUserDatabase[User, UserId]):
             db.session.add(orm_user)
             await db.session.commit()
             await db.session.refresh(orm_user)
-            return orm_user.to_model()
+            updated = orm_user.to_model()
+        await self._evict_cached(user.id)
+        return updated
 
     async def delete(self, user: User) -> None:
         """Delete a user."""
@@ -153,6 +164,7 @@ class UserRepository(BaseUserDatabase[User, UserId]):
         async with self.user_db() as db:
             await db.session.execute(delete(orm.User).where(orm.User.id == user.id))  # type: ignore
             await db.session.commit()
+        await self._evict_cached(user.id)
 
     async def add_oauth_account(self, user: User, create_dict: Dict[str, Any]) -> User:
         """Create an OAuth account and add it to the user."""
@@ -182,8 +194,10 @@ class UserRepository(BaseUserDatabase[User, UserId]):
             db.session.add(orm_user)
             await db.session.commit()
             await db.session.refresh(orm_user)
+            updated = orm_user.to_model()
 
-            return orm_user.to_model()
+        await self._evict_cached(user.id)
+        return updated
 
     async def update_oauth_account(
         self,
@@ -204,8 +218,10 @@ class UserRepository(BaseUserDatabase[User, UserId]):
             await db.session.refresh(orm_user)
             if orm_user is None:
                 raise ValueError(f"User {user.id} not found")
+            updated = orm_user.to_model()
 
-            return orm_user.to_model()
+        await self._evict_cached(user.id)
+        return updated
 
     async def remove_oauth_account(self, account_id: UUID) -> None:
         """Remove an OAuth account from a user."""
@@ -213,8 +229,10 @@ class UserRepository(BaseUserDatabase[User, UserId]):
             orm_oauth_account = await db.session.get(orm.OAuthAccount, account_id)
             if orm_oauth_account is None:
                 return None
+            user_id = UserId(orm_oauth_account.user_id)
             await db.session.delete(orm_oauth_account)
             await db.session.commit()
+        await self._evict_cached(user_id)
 
     async def recreate_otp_secret(
         self, user_id: UserId, otp_secret: str, is_mfa_active: bool, hashes: List[str]
@@ -233,6 +251,7 @@ class UserRepository(BaseUserDatabase[User, UserId]):
                 recovery_code = orm.UserMFARecoveryCode(user_id=user_id, code_hash=code_hash)
                 db.session.add(recovery_code)
             await db.session.commit()
+        await self._evict_cached(user_id)
 
     async def delete_recovery_code(self, user_id: UserId, code: str, pw_help: PasswordHelperProtocol) -> bool:
         """Delete a specific recovery code for a user and return whether it existed."""
@@ -0,0 +1,99 @@
+#  Copyright (c) 2024. Some Engineering
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import json
+import logging
+from typing import Any, Awaitable, Callable, List, Optional, Set, Tuple
+
+from fixcloudutils.redis.event_stream import Json, MessageContext, RedisStreamListener
+from fixcloudutils.util import parse_utc_str, utc
+from prometheus_client import Histogram
+
+log = logging.getLogger(__name__)
+BatchSize = Histogram(
+    "redis_stream_batch_size",
+    "Number of messages processed in one batch",
+    ["stream", "group"],
+    buckets=(1, 5, 10, 50, 100, 500, 1000),
+)
+
+BatchProcessor = Callable[[List[Tuple[Json, MessageContext]]], Awaitable[None]]
+
+
+class BatchFailed(Exception):
+    """
+    Raised by a batch processor, when some messages of the batch could not be processed.
+    All other messages of the batch have been processed and are not processed again.
+    """
+
+    def __init__(self, unprocessed: Set[str], message: str) -> None:
+        super().__init__(message)
+        self.unprocessed = unprocessed  # ids of the messages that have not been processed
+
+
+class BatchRedisStreamListener(RedisStreamListener):
+    """
+    Hands all messages, that are read with one poll, to the batch processor at once.
+    If processing the batch fails, every message that has not been processed is processed on its own
+    with the message processor, which includes retries and moving failing messages to the dead letter queue.
+    The batch processor reports the unprocessed messages by raising BatchFailed - any other error replays all messages.
+    All messages are acknowledged after they have been processed.
+    """
+
+    def __init__(self, *args: Any, batch_processor: BatchProcessor, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.batch_processor = batch_processor
+
+    @staticmethod
+    def _parse_message(message: Json) -> Optional[Tuple[Json, MessageContext]]:
+        try:
+            context = MessageContext(
+                id=message["id"],
+                kind=message["kind"],
+                publisher=message["publisher"],
+                sent_at=parse_utc_str(message["at"]),
+                received_at=utc(),
+            )
+            return json.loads(message["data"]), context
+        except Exception as ex:
+            log.warning(f"Invalid message format: {message}: {ex}. Ignore.")
+            return None
+
+    async def _handle_stream_messages(self, messages: List[Any]) -> None:
+        ids = []
+        try:
+            batch = []
+            for _, stream_messages in messages:
+                for uid, data in stream_messages:
+                    ids.append(uid)
+                    if parsed := self._parse_message(data):
+                        batch.append(parsed)
+            if not batch:
+                return
+            BatchSize.labels(self.stream, self.group).observe(len(batch))
+            try:
+                await self.batch_processor(batch)
+            except Exception as ex:
+                unprocessed = ex.unprocessed if isinstance(ex, BatchFailed) else {ctx.id for _, ctx in batch}
+                log.warning(
+                    f"Failed to process {len(unprocessed)} of {len(batch)} messages in batch: {ex}. "
+                    "Process them one by one."
+                )
+                for _, stream_messages in messages:
+                    for _, data in stream_messages:
+                        if data.get("id") in unprocessed:
+                            await self._handle_single_message(data)
+        finally:
+            if ids:
+                # acknowledge all processed messages
+                await self.redis.xack(self.stream, self.group, *ids)  # type: ignore
@@ -14,7 +14,7 @@
 import asyncio
 import logging
 from asyncio import Task, TaskGroup
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Any, Optional, AsyncIterator, List, Tuple
 
 import prometheus_client
@@ -26,6 +26,7 @@ from fixbackend.billing.models import BillingEntry
 from fixbackend.billing.service import BillingEntryService
 from fixbackend.config import Config
 from fixbackend.ids import BillingId
+from fixbackend.metering.metering_repository import utc_day
 from fixbackend.subscription.aws_marketplace import AwsMarketplaceHandler
 from fixbackend.subscription.models import SubscriptionMethod, AwsMarketplaceSubscription
 from fixbackend.subscription.stripe_subscription import StripeService
@@ -67,6 +68,8 @@ class BillingJob(Service):
         try:
             now = utc()
             parallel_requests = 16
+            log.info("Rebuild the daily metering rollup of the last days")
+            await self.reconcile_metering_rollup(now)
             log.info("Create overdue billing entries")
             await self.create_overdue_billing_entries(now, parallel_requests)
             log.info("Report usages to AWS Marketplace")
@@ -79,6 +82,11 @@ class BillingJob(Service):
         finally:
             kill_running_process()
 
+    async def reconcile_metering_rollup(self, now: datetime, days: timedelta = timedelta(days=2)) -> None:
+        # Collects that have been metered without updating the rollup (e.g. during a deployment) are
+        # only visible to the billing after the days they belong to have been rebuilt.
+        await self.billing_entry_service.metering_repository.rebuild_rollup(utc_day(now - days))
+
     async def push_metrics(self) -> None:
         if gateway := self.config.push_gateway_url:
             await asyncio.to_thread(
@@ -45,7 +45,7 @@ from fixbackend.domain_events.publisher import DomainEventPublisher
 from fixbackend.errors import NotAllowed
 from fixbackend.ids import ProductTier, BillingPeriod
 from fixbackend.ids import UserId, WorkspaceId
-from fixbackend.metering.metering_repository import MeteringRepository
+from fixbackend.metering.metering_repository import BillableMinResources, MeteringRepository
 from fixbackend.subscription.models import AwsMarketplaceSubscription, StripeSubscription, SubscriptionMethod
 from fixbackend.subscription.subscription_repository import SubscriptionRepository
 from fixbackend.utils import start_of_next_period
@@ -260,7 +260,7 @@ class BillingEntryService:
                         workspace.id,
                         start=last_charged,
                         end=billing_time,
-                        min_resources_collected=100,
+                        min_resources_collected=BillableMinResources,
                         min_nr_of_collects=3,
                     )
                 ]
@@ -12,10 +12,11 @@
 #  You should have received a copy of the GNU Affero General Public License
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import hashlib
 import os
 from datetime import datetime, timedelta
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Tuple
 
 from aiofiles import open as aopen
 from async_lru import alru_cache
@@ -36,6 +37,12 @@ class CertKeyPair:
     private_key: RSAPrivateKey
 
 
+def key_id(key: RSAPublicKey) -> str:
+    return hashlib.sha256(key.public_bytes(serialization.Encoding.PEM, serialization.PublicFormat.PKCS1)).hexdigest()[
+        0:8
+    ]
+
+
 @alru_cache(maxsize=100, ttl=60)
 async def load_cert_key_pair(cert_path: Path, key_path: Path) -> CertKeyPair:
     # blocking, but will be cached by the OS on the second call
@@ -92,6 +99,8 @@ class CertificateStore:
         self.signing_key_1_path = config.signing_key_1
         self.signing_cert_2_path = config.signing_cert_2
         self.signing_key_2_path = config.signing_key_2
+        # public keys by key id of the last loaded signing certificates
+        self.kid_index: Tuple[List[CertKeyPair], Dict[str, RSAPublicKey]] = ([], {})
 
     async def get_host_cert_key_pair(self) -> CertKeyPair:
         assert self.host_cert_path is not None
@@ -123,5 +132,17 @@ class CertificateStore:
         return cert_key_pairs[0].private_key
 
     async def public_keys(self) -> List[RSAPublicKey]:
+        return list((await self.public_keys_by_kid()).values())
+
+    async def public_keys_by_kid(self) -> Dict[str, RSAPublicKey]:
+        """
+        Returns the public keys of the signing certificates by key id, ordered by expiration date, newest first.
+        The index is only computed again, if the signing certificates have been loaded again.
+        """
         cert_key_pairs = await self.get_signing_cert_key_pair()
-        return [ckp.private_key.public_key() for ckp in cert_key_pairs]
+        indexed, index = self.kid_index
+        if len(indexed) != len(cert_key_pairs) or any(a is not b for a, b in zip(indexed, cert_key_pairs)):
+            public_keys = [ckp.private_key.public_key() for ckp in cert_key_pairs]
+            index = {key_id(key): key for key in public_keys}
+            self.kid_index = (cert_key_pairs, index)
+        return index
@@ -197,3 +197,19 @@ class CloudAccount:
 
     def enabled_for_scanning(self) -> bool:
         return self.state.scan if isinstance(self.state, CloudAccountStates.Configured) else False
+
+
+@frozen(kw_only=True)
+class CloudAccountScanResult:
+    """
+    The result of a scan of one cloud account.
+    A failed scan increases the failed scan count of the account, a successful scan resets it.
+    """
+
+    id: FixCloudAccountId
+    started_at: datetime
+    duration_seconds: int
+    resources_scanned: int
+    resources_errors: int
+    task_id: Optional[TaskId]
+    failed: bool
@@ -17,7 +17,7 @@ from datetime import datetime
 from typing import Optional
 
 from fastapi_users_db_sqlalchemy.generics import GUID
-from sqlalchemy import Boolean, ForeignKey, Integer, String, UniqueConstraint
+from sqlalchemy import Boolean, ForeignKey, Index, Integer, String, UniqueConstraint
 from sqlalchemy.orm import Mapped, mapped_column
 
 from fixbackend.base_model import Base
@@ -73,7 +73,11 @@ class CloudAccount(Base):
     last_task_id: Mapped[Optional[TaskId]] = mapped_column(String(length=64), nullable=True)
     last_degraded_scan_started_at: Mapped[Optional[datetime]] = mapped_column(UTCDateTime, nullable=True)
 
-    __table_args__ = (UniqueConstraint("tenant_id", "account_id"),)
+    __table_args__ = (
+        UniqueConstraint("tenant_id", "account_id"),
+        # select degraded accounts due for a ping
+        Index("ix_cloud_account_state_last_degraded_scan", "state", "last_degraded_scan_started_at"),
+    )
     __mapper_args__ = {"version_id_col": version_id}  # for optimistic locking
 
     def to_model(self, next_scan: Optional[datetime]) -> models.CloudAccount:
@@ -11,11 +11,13 @@
 #
 #  You should have received a copy of the GNU Affero General Public License
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from collections import defaultdict
 from datetime import datetime, timedelta
-from typing import Annotated, Callable, List, Optional
+from typing import Annotated, Callable, Dict, List, Optional, Sequence, Tuple
 
 from fastapi import Depends
-from sqlalchemy import func, select, or_
+from fastapi_users_db_sqlalchemy.generics import GUID
+from sqlalchemy import Boolean, Integer, Select, String, case, column, func, select, or_, update, values
 from sqlalchemy.orm.exc import StaleDataError
 from sqlalchemy.ext.asyncio import AsyncSession
 from fixcloudutils.util import utc
@@ -25,6 +27,7 @@ from fixbackend.cloud_accounts.models import (
     AzureCloudAccess,
     CloudAccess,
     CloudAccount,
+    CloudAccountScanResult,
     CloudAccountState,
     CloudAccountStates,
     GcpCloudAccess,
@@ -42,6 +45,7 @@ from fixbackend.ids import (
     GcpServiceAccountKeyId,
     WorkspaceId,
 )
+from fixbackend.sqlalechemy_extensions import UTCDateTime
 from fixbackend.types import AsyncSessionMaker
 from fixbackend.dispatcher.next_run_repository import NextTenantRun
 
@@ -253,6 +257,25 @@ class CloudAccountRepository:
             accounts = results.scalars().all()
             return [acc.to_model(next_scan) for acc in accounts]
 
+    async def list_by_workspace_ids(
+        self, workspace_ids: Sequence[WorkspaceId], ready_for_collection: Optional[bool] = None
+    ) -> Dict[WorkspaceId, List[CloudAccount]]:
+        """Get the cloud accounts of all given tenants with one query."""
+        async with self.session_maker() as session:
+            statement = (
+                select(orm.CloudAccount, NextTenantRun.at)
+                .outerjoin(NextTenantRun, orm.CloudAccount.tenant_id == NextTenantRun.tenant_id)
+                .where(orm.CloudAccount.tenant_id.in_(workspace_ids))
+            )
+            if ready_for_collection is not None and ready_for_collection:
+                statement = statement.where(orm.CloudAccount.state == CloudAccountStates.Configured.state_name).where(
+                    orm.CloudAccount.enabled.is_(True)
+                )
+            result: Dict[WorkspaceId, List[CloudAccount]] = {workspace_id: [] for workspace_id in workspace_ids}
+            for acc, next_scan in (await session.execute(statement)).all():
+                result[acc.tenant_id].append(acc.to_model(next_scan))
+            return result
+
     async def count_by_workspace_id(
         self, workspace_id: WorkspaceId, ready_for_collection: bool = False, non_deleted: bool = False
     ) -> int:
@@ -308,25 +331,109 @@ class CloudAccountRepository:
             accounts = results.scalars().all()
             return [acc.to_model(None) for acc in accounts]
 
-    async def list_degraded_for_ping(self, workspace: WorkspaceId, last_ping_before: datetime) -> List[CloudAccount]:
-        async with self.session_maker() as session:
-
-            statement = (
-                select(orm.CloudAccount)
-                .where(orm.CloudAccount.enabled.is_(True))
-                .where(orm.CloudAccount.state == CloudAccountStates.Degraded.state_name)
-                .where(
-                    or_(
-                        orm.CloudAccount.last_degraded_scan_started_at == None,  # noqa
-                        orm.CloudAccount.last_degraded_scan_started_at < last_ping_before,
-                    )
+    @staticmethod
+    def _degraded_for_ping(last_ping_before: datetime) -> Select[Tuple[orm.CloudAccount]]:
+        return (
+            select(orm.CloudAccount)
+            .where(orm.CloudAccount.state == CloudAccountStates.Degraded.state_name)
+            .where(orm.CloudAccount.enabled.is_(True))
+            .where(
+                or_(
+                    orm.CloudAccount.last_degraded_scan_started_at == None,  # noqa
+                    orm.CloudAccount.last_degraded_scan_started_at < last_ping_before,
                 )
             )
+        )
 
+    async def list_degraded_for_ping(self, workspace: WorkspaceId, last_ping_before: datetime) -> List[CloudAccount]:
+        async with self.session_maker() as session:
+            statement = self._degraded_for_ping(last_ping_before).where(orm.CloudAccount.tenant_id == workspace)
             results = await session.execute(statement)
             accounts = results.scalars().all()
             return [acc.to_model(None) for acc in accounts]
 
+    async def list_degraded_for_ping_grouped(
+        self, last_ping_before: datetime, limit: int
+    ) -> Dict[WorkspaceId, List[CloudAccount]]:
+        """
+        Get the degraded accounts of all tenants, that have not been pinged since the given time, grouped by tenant.
+        Accounts that have not been pinged for the longest time come first.
+        """
+        async with self.session_maker() as session:
+            statement = (
+                self._degraded_for_ping(last_ping_before)
+                .order_by(orm.CloudAccount.last_degraded_scan_started_at.asc().nulls_first())
+                .limit(limit)
+            )
+            result: Dict[WorkspaceId, List[CloudAccount]] = defaultdict(list)
+            for acc in (await session.execute(statement)).scalars().all():
+                result[acc.tenant_id].append(acc.to_model(None))
+            return dict(result)
+
+    async def mark_degraded_pinged(self, ids: Sequence[FixCloudAccountId], at: datetime) -> int:
+        """Set the last ping time of all given degraded accounts with one update. Returns the number of accounts."""
+        if not ids:
+            return 0
+        async with self.session_maker() as session:
+            statement = (
+                update(orm.CloudAccount)
+                .where(orm.CloudAccount.id.in_(ids))
+                .where(orm.CloudAccount.state == CloudAccountStates.Degraded.state_name)
+                # a bulk update bypasses the orm: maintain the optimistic locking version manually
+                .values(last_degraded_scan_started_at=at, version_id=orm.CloudAccount.version_id + 1)
+                .execution_options(synchronize_session=False)
+            )
+            result = await session.execute(statement)
+            await session.commit()
+            return result.rowcount
+
+    async def update_scan_results(self, results: Sequence[CloudAccountScanResult]) -> List[CloudAccount]:
+        """
+        Apply the scan results of all given accounts with one set based update in one transaction.
+        Returns the updated accounts (without next_scan).
+        """
+        if not results:
+            return []
+        scan_result = values(
+            column("id", GUID),
+            column("started_at", UTCDateTime),
+            column("duration_seconds", Integer),
+            column("resources_scanned", Integer),
+            column("resources_errors", Integer),
+            column("task_id", String),
+            column("failed", Boolean),
+            name="scan_result",
+        ).data(
+            [
+                (r.id, r.started_at, r.duration_seconds, r.resources_scanned, r.resources_errors, r.task_id, r.failed)
+                for r in results
+            ]
+        )
+        statement = (
+            update(orm.CloudAccount)
+            .where(orm.CloudAccount.id == scan_result.c.id)
+            .values(
+                last_scan_started_at=scan_result.c.started_at,
+                last_scan_duration_seconds=scan_result.c.duration_seconds,
+                last_scan_resources_scanned=scan_result.c.resources_scanned,
+                last_scan_resources_errors=scan_result.c.resources_errors,
+                last_task_id=scan_result.c.task_id,
+                failed_scan_count=case(
+                    (scan_result.c.failed, orm.CloudAccount.failed_scan_count + 1),
+                    else_=0,
+                ),
+                updated_at=utc(),
+                # a bulk update bypasses the orm: maintain the optimistic locking version manually
+                version_id=orm.CloudAccount.version_id + 1,
+            )
+            .returning(orm.CloudAccount)
+            .execution_options(synchronize_session=False)
+        )
+        async with self.session_maker() as session:
+            updated = [acc.to_model(None) for acc in (await session.execute(statement)).scalars().all()]
+            await session.commit()
+            return updated
+
 
 def get_cloud_account_repository(session_maker: AsyncSessionMakerDependency) -> CloudAccountRepository:
     return CloudAccountRepository(session_maker)
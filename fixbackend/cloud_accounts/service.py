@@ -43,6 +43,7 @@ from fixbackend.cloud_accounts.models import (
     AzureCloudAccess,
     CloudAccess,
     CloudAccount,
+    CloudAccountScanResult,
     CloudAccountState,
     CloudAccountStates,
     GcpCloudAccess,
@@ -356,14 +357,32 @@ class CloudAccountService(Service):
             msg.pop("tenant_id", None)
             await self.pubsub_publisher.publish(kind=e.kind, message=msg, channel=f"tenant-events::{e.tenant_id}")
 
-        def compute_failed_scan_count(collect_info: CloudAccountCollectInfo, acc: CloudAccount, failed: bool) -> int:
-            if failed:
-                return acc.failed_scan_count + 1
-
-            if collect_info.scanned_resources <= self.config.account_failed_resource_count:
-                return acc.failed_scan_count + 1
+        def scan_result(
+            account_id: FixCloudAccountId, collect_info: CloudAccountCollectInfo, failed: bool
+        ) -> CloudAccountScanResult:
+            return CloudAccountScanResult(
+                id=account_id,
+                started_at=collect_info.started_at,
+                duration_seconds=collect_info.duration_seconds,
+                resources_scanned=collect_info.scanned_resources,
+                resources_errors=len(collect_info.errors),
+                task_id=collect_info.task_id,
+                # too few resources are considered a failed scan
+                failed=failed or collect_info.scanned_resources <= self.config.account_failed_resource_count,
+            )
 
-            return 0
+        async def update_scan_results(results: List[CloudAccountScanResult]) -> None:
+            # all accounts are updated at once, degradation is decided based on the updated rows
+            for updated in await self.cloud_account_repository.update_scan_results(results):
+                set_fix_cloud_account_id(updated.id)
+                set_cloud_account_id(updated.account_id)
+                degraded = isinstance(updated.state, CloudAccountStates.Degraded)
+                if updated.failed_scan_count > 3 and not degraded:
+                    await self.__degrade_account(
+                        updated.id, "Too many consecutive failed scans", DegradationReason.other
+                    )
+                if updated.failed_scan_count == 0 and degraded:
+                    await self.__undegrade_account(updated.id)
 
         async with asyncio.timeout(10):
             match context.kind:
@@ -376,31 +395,12 @@ class CloudAccountService(Service):
                     first_account_collect = any(account.last_scan_started_at is None for account in collected_accounts)
 
                     set_workspace_id(event.tenant_id)
-                    for account_id, collect_info in (event.cloud_accounts | event.cloud_accounts_failed).items():
-                        set_fix_cloud_account_id(account_id)
-                        set_cloud_account_id(collect_info.account_id)
-
-                        updated = await self.cloud_account_repository.update(
-                            account_id,
-                            lambda acc: evolve(
-                                acc,
-                                last_scan_duration_seconds=collect_info.duration_seconds,
-                                last_scan_resources_scanned=collect_info.scanned_resources,
-                                last_scan_started_at=collect_info.started_at,
-                                next_scan=event.next_run,
-                                failed_scan_count=compute_failed_scan_count(collect_info, acc, failed=False),
-                                last_task_id=collect_info.task_id,
-                                last_scan_resources_errors=len(collect_info.errors),
-                            ),
-                        )
-
-                        if updated.failed_scan_count > 3:
-                            await self.__degrade_account(
-                                updated.id, "Too many consecutive failed scans", DegradationReason.other
-                            )
-
-                        if updated.failed_scan_count == 0:
-                            await self.__undegrade_account(updated.id)
+                    await update_scan_results(
+                        [
+                            scan_result(account_id, collect_info, failed=False)
+                            for account_id, collect_info in (event.cloud_accounts | event.cloud_accounts_failed).items()
+                        ]
+                    )
 
                     await send_pub_sub_message(event)
                     user_id = await self.analytics_event_sender.user_id_from_workspace(event.tenant_id)
@@ -431,28 +431,12 @@ class CloudAccountService(Service):
                 case TenantAccountsCollectFailed.kind:
                     failed_event = TenantAccountsCollectFailed.from_json(message)
                     set_workspace_id(failed_event.tenant_id)
-                    for account_id, collect_info in failed_event.cloud_accounts.items():
-                        set_fix_cloud_account_id(account_id)
-                        set_cloud_account_id(collect_info.account_id)
-
-                        updated = await self.cloud_account_repository.update(
-                            account_id,
-                            lambda acc: evolve(
-                                acc,
-                                last_scan_duration_seconds=collect_info.duration_seconds,
-                                last_scan_resources_scanned=collect_info.scanned_resources,
-                                last_scan_started_at=collect_info.started_at,
-                                next_scan=failed_event.next_run,
-                                failed_scan_count=compute_failed_scan_count(collect_info, acc, failed=True),
-                                last_task_id=collect_info.task_id,
-                                last_scan_resources_errors=len(collect_info.errors),
-                            ),
-                        )
-
-                        if updated.failed_scan_count > 3:
-                            await self.__degrade_account(
-                                updated.id, "Too many consecutive failed scans", DegradationReason.other
-                            )
+                    await update_scan_results(
+                        [
+                            scan_result(account_id, collect_info, failed=True)
+                            for account_id, collect_info in failed_event.cloud_accounts.items()
+                        ]
+                    )
 
                 case CloudAccountDiscovered.kind:
                     discovered_event = CloudAccountDiscovered.from_json(message)
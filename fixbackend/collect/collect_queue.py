@@ -14,6 +14,7 @@
 import logging
 from abc import ABC, abstractmethod
 from datetime import timedelta
+from time import time
 from typing import Dict, Optional, ClassVar, List
 from uuid import UUID
 
@@ -141,6 +142,13 @@ class CollectQueue(ABC):
         :return: None
         """
 
+    @abstractmethod
+    async def queue_depth(self) -> int:
+        """
+        Number of jobs in the queue, that are ready to be picked up by a worker.
+        Deferred jobs are not counted.
+        """
+
 
 class RedisCollectQueue(CollectQueue):
     def __init__(self, arq: ArqRedis) -> None:
@@ -205,3 +213,7 @@ class RedisCollectQueue(CollectQueue):
             # this will either return none or throw an exception (reraised from the worker)
             log.debug("Waiting for collect job to finish.")
             await job.result()
+
+    async def queue_depth(self) -> int:
+        # arq stores all jobs in a sorted set scored by the time in ms, when the job should be started
+        return await self.arq.zcount(self.arq.default_queue_name, "-inf", int(time() * 1000))
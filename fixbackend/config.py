@@ -52,7 +52,9 @@ class Config(BaseSettings):
     static_assets: Optional[Path]
     session_ttl: int
     available_db_server: List[str]
+    db_server_weights: List[str]
     inventory_url: str
+    inventory_connections_per_server: int
     cf_template_url: str
     args: Namespace
     aws_access_key_id: str
@@ -91,6 +93,11 @@ class Config(BaseSettings):
     azure_client_secret: str
     account_failed_resource_count: int
     degraded_accounts_ping_interval_hours: int
+    dispatcher_schedule_concurrency: int
+    dispatcher_spread_next_runs: bool
+    dispatcher_max_collect_queue_depth: int
+    domain_event_lanes: int
+    domain_event_max_in_flight: int
     auth_rate_limit_per_minute: int
 
     def frontend_cdn_origin(self) -> str:
@@ -145,7 +152,19 @@ def parse_args(argv: Optional[Sequence[str]] = None) -> Namespace:
     parser.add_argument(
         "--available-db-server", nargs="+", default=os.environ.get("AVAILABLE_DB_SERVER", "").split(",")
     )
+    parser.add_argument(
+        "--db-server-weights",
+        nargs="*",
+        default=[w for w in os.environ.get("DB_SERVER_WEIGHTS", "").split(",") if w],
+        help="Relative weight of db servers for the placement of new tenants: server=weight. Defaults to 1.",
+    )
     parser.add_argument("--inventory-url", default=os.environ.get("INVENTORY_URL", "http://localhost:8980"))
+    parser.add_argument(
+        "--inventory-connections-per-server",
+        type=int,
+        default=int(os.environ.get("INVENTORY_CONNECTIONS_PER_SERVER", "64")),
+        help="Maximum number of concurrent inventory requests per graph db server.",
+    )
     parser.add_argument(
         "--cf-template-url",
         default=os.environ.get("CF_TEMPLATE_URL", "https://fixpublic.s3.amazonaws.com/aws/fix-role-dev-eu.yaml"),
@@ -210,6 +229,32 @@ def parse_args(argv: Optional[Sequence[str]] = None) -> Namespace:
     parser.add_argument("--azure-client-secret", default=os.environ.get("AZURE_APP_CLIENT_SECRET", ""))
     parser.add_argument("--account-failed-resource-count", default=1)
     parser.add_argument("--degraded-accounts-ping-interval-hours", default=24)
+    parser.add_argument("--dispatcher-schedule-concurrency", type=int, default=20)
+    parser.add_argument(
+        "--dispatcher-spread-next-runs",
+        action="store_true",
+        default=os.environ.get("DISPATCHER_SPREAD_NEXT_RUNS", "false").lower() == "true",
+        help="Spread the next runs of all workspaces over the scan interval",
+    )
+    parser.add_argument(
+        "--domain-event-lanes",
+        type=int,
+        default=int(os.environ.get("DOMAIN_EVENT_LANES", "0")),
+        help="Process domain events of different tenants concurrently in this many lanes. "
+        "Events of different tenants are not processed in stream order. 0 (default) processes sequentially.",
+    )
+    parser.add_argument(
+        "--domain-event-max-in-flight",
+        type=int,
+        default=int(os.environ.get("DOMAIN_EVENT_MAX_IN_FLIGHT", "100")),
+        help="Maximum number of received but not yet processed domain events.",
+    )
+    parser.add_argument(
+        "--dispatcher-max-collect-queue-depth",
+        type=int,
+        default=int(os.environ.get("DISPATCHER_MAX_COLLECT_QUEUE_DEPTH", "0")),
+        help="Defer scheduling of due workspaces while more collect jobs are waiting. 0 means no limit.",
+    )
     parser.add_argument("--auth-rate-limit-per-minute", default=4)
     return parser.parse_known_args(argv if argv is not None else sys.argv[1:])[0]
 
@@ -13,9 +13,10 @@
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from datetime import timedelta
-from typing import Any, Dict
+from typing import Any, Dict, List
 
-from fastapi import APIRouter, HTTPException, Request, Response, status
+from attrs import asdict
+from fastapi import APIRouter, HTTPException, Query, Request, Response, status
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
 from fixcloudutils.util import utc
@@ -40,6 +41,21 @@ def workspaces_router(dependencies: FixDependencies, templates: Jinja2Templates)
     graph_db_access = dependencies.service(ServiceNames.graph_db_access, GraphDatabaseAccessManager)
     domain_event_sender = dependencies.service(ServiceNames.domain_event_sender, DomainEventPublisherImpl)
 
+    @router.get("/graph_db/rebalance", name="workspace:plan_graph_db_rebalance")
+    async def plan_graph_db_rebalance(
+        weight: List[str] = Query(
+            default=[],
+            description="Changed server weights in the format server=weight. "
+            "Add a server with a new entry, drain a server with weight 0.",
+        )
+    ) -> Dict[str, Any]:
+        # dry run: nothing is moved
+        try:
+            plan = await graph_db_access.plan_rebalance(graph_db_access.server_weights(weight))
+        except ValueError as ex:
+            raise HTTPException(status_code=400, detail=str(ex))
+        return asdict(plan)
+
     @router.get("/{workspace_id}", response_class=HTMLResponse, name="workspace:get")
     async def get_workspace(request: Request, workspace_id: WorkspaceId) -> Response:
         workspace = await workspace_repo.get_workspace(workspace_id)
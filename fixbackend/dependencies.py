@@ -72,6 +72,7 @@ class ServiceNames:
     async_process_pool = "async_process_pool"
     password_helper = "password_helper"
     jwt_strategy = "jwt_strategy"
+    user_cache = "user_cache"
     user_manager = "user_manager"
     auth_email_sender = "auth_email_sender"
     api_token_service = "api_token_service"
@@ -82,6 +83,7 @@ class ServiceNames:
     azure_subscription_service = "azure_subscription_service"
     trial_end_service = "trial_end_service"
     free_tier_cleanup_service = "free_tier_cleanup_service"
+    websocket_event_hub = "websocket_event_hub"
 
 
 class FixDependencies(Dependencies):
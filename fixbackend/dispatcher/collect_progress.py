@@ -61,7 +61,7 @@ class AccountCollectProgress:
         return json_converter.dumps(self)
 
     @staticmethod
-    def from_json_str(value: bytes | str) -> "AccountCollectProgress":
+    def from_json_str(value: bytes | str, result: Optional[bytes | str] = None) -> "AccountCollectProgress":
 
         # delete me after deploying this to production
         dict_value = json.loads(value)
@@ -88,4 +88,12 @@ class AccountCollectProgress:
 
         init_resource_errors()
 
-        return json_converter.loads(value, AccountCollectProgress)
+        progress = json_converter.loads(value, AccountCollectProgress)
+        # the result of a job is stored separately (null: the result is part of a legacy progress entry)
+        if result is not None and json.loads(result) is not None:
+            progress = evolve(progress, collection_done=json_converter.loads(result, CollectionResult))  # type: ignore
+        return progress
+
+
+def collection_result_to_json_str(result: CollectionResult) -> str:
+    return json_converter.dumps(result)
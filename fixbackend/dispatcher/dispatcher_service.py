@@ -13,19 +13,23 @@
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import asyncio
 import json
 import logging
 import uuid
+from collections import defaultdict
 from datetime import datetime, timedelta
-from typing import Any, Dict, Optional, cast, List
+from textwrap import dedent
+from typing import Any, Dict, Optional, Set, cast, List, Tuple
 from uuid import UUID
 
-from attr import evolve
 from fixcloudutils.asyncio.periodic import Periodic
-from fixcloudutils.redis.event_stream import Json, MessageContext, RedisStreamListener
+from fixcloudutils.redis.event_stream import Json, MessageContext
 from fixcloudutils.service import Service
 from fixcloudutils.util import parse_utc_str, utc
+from prometheus_client import Counter, Gauge, Histogram
 
+from fixbackend.batch_stream_listener import BatchFailed, BatchRedisStreamListener
 from fixbackend.cloud_accounts.azure_subscription_repo import AzureSubscriptionCredentialsRepository
 from fixbackend.cloud_accounts.gcp_service_account_repo import GcpServiceAccountKeyRepository
 from fixbackend.cloud_accounts.models import (
@@ -45,7 +49,13 @@ from fixbackend.collect.collect_queue import (
     PostCollectAccountInfo,
 )
 from fixbackend.config import Config
-from fixbackend.dispatcher.collect_progress import AccountCollectProgress, CollectionFailure, CollectionSuccess
+from fixbackend.dispatcher.collect_progress import (
+    AccountCollectProgress,
+    CollectionFailure,
+    CollectionResult,
+    CollectionSuccess,
+    collection_result_to_json_str,
+)
 from fixbackend.dispatcher.next_run_repository import NextRunRepository
 from fixbackend.domain_events.events import (
     CloudAccountConfigured,
@@ -57,23 +67,107 @@ from fixbackend.domain_events.events import (
 )
 from fixbackend.domain_events.publisher import DomainEventPublisher
 from fixbackend.domain_events.subscriber import DomainEventSubscriber
+from fixbackend.graph_db.models import GraphDatabaseAccess
 from fixbackend.graph_db.service import GraphDatabaseAccessManager
 from fixbackend.ids import CloudAccountId, FixCloudAccountId, ProductTier, TaskId, WorkspaceId, AwsARN, CloudNames
 from fixbackend.logging_context import set_workspace_id, set_fix_cloud_account_id, set_cloud_account_id
 from fixbackend.metering import MeteringRecord
 from fixbackend.metering.metering_repository import MeteringRepository
 from fixbackend.types import Redis
+from fixbackend.utils import batch
+from fixbackend.workspaces.models import Workspace
 from fixbackend.workspaces.repository import WorkspaceRepository
 
 log = logging.getLogger(__name__)
-
-
-CollectState = Dict[FixCloudAccountId, AccountCollectProgress]
+ScheduleLag = Histogram(
+    "dispatcher_schedule_lag_seconds",
+    "Time between the planned next run of a workspace and the time it is scheduled",
+    buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600),
+)
+ScheduleDuration = Histogram(
+    "dispatcher_schedule_duration_seconds",
+    "Time it takes to schedule all due workspaces",
+    buckets=(0.1, 0.5, 1, 5, 15, 30, 60, 120, 300),
+)
+ScheduleDueWorkspaces = Gauge("dispatcher_schedule_due_workspaces", "Number of due workspaces of the last schedule run")
+DegradedPingsPlanned = Counter("dispatcher_degraded_pings_planned", "Number of planned pings of degraded accounts")
+ScheduleDeferredWorkspaces = Gauge(
+    "dispatcher_schedule_deferred_workspaces", "Number of due workspaces deferred due to a full collect queue"
+)
 
 
 class CollectAccountProgress:
-    def __init__(self, redis: Redis) -> None:
+    """
+    Tracks the collect progress of all accounts of a workspace in redis.
+    - progress hash: cloud account id -> AccountCollectProgress (without result)
+    - jobs hash: job id -> cloud account id
+    - done hash: cloud account id -> CollectionResult
+    The number of pending jobs is the difference of the progress and done hash lengths.
+    Marking jobs as done and computing the number of pending jobs is a single atomic script call,
+    so the completion check does not depend on the number of accounts in the workspace.
+    Progress entries written by older versions hold the result of the job (collection_done).
+    Such entries are migrated on first touch: they are marked in the done hash with a null result.
+    """
+
+    def __init__(self, redis: Redis, expiration: timedelta = timedelta(hours=4)) -> None:
         self.redis = redis
+        # cleanup after 4 hours just to be sure
+        self.expiration = expiration
+        # KEYS: progress, done, migrated - ARGV[1]: expiration in seconds
+        migrate_legacy_progress = dedent(
+            """
+            local function migrate_legacy_progress()
+                if redis.call('EXISTS', KEYS[3]) == 1 then
+                    return
+                end
+                local entries = redis.call('HGETALL', KEYS[1])
+                for i = 1, #entries, 2 do
+                    local ok, progress = pcall(cjson.decode, entries[i + 1])
+                    if ok and type(progress.collection_done) == 'table' then
+                        redis.call('HSETNX', KEYS[2], entries[i], 'null')
+                    end
+                end
+                if redis.call('EXISTS', KEYS[2]) == 1 then
+                    redis.call('EXPIRE', KEYS[2], ARGV[1])
+                end
+                redis.call('SET', KEYS[3], '1', 'EX', ARGV[1])
+            end
+            """
+        )
+        self.mark_jobs_done_script = redis.register_script(
+            migrate_legacy_progress
+            + dedent(
+                """
+                migrate_legacy_progress()
+                local progress_key = KEYS[1]
+                local done_key = KEYS[2]
+                local jobs_key = KEYS[4]
+                local unknown = {}
+                for i = 2, #ARGV, 2 do
+                    local account_id = redis.call('HGET', jobs_key, ARGV[i])
+                    if account_id and redis.call('HEXISTS', progress_key, account_id) == 1 then
+                        redis.call('HSET', done_key, account_id, ARGV[i + 1])
+                    else
+                        table.insert(unknown, ARGV[i])
+                    end
+                end
+                if redis.call('EXISTS', done_key) == 1 then
+                    redis.call('EXPIRE', done_key, ARGV[1])
+                end
+                local pending = redis.call('HLEN', progress_key) - redis.call('HLEN', done_key)
+                return {pending, unknown}
+                """
+            )
+        )
+        self.pending_jobs_script = redis.register_script(
+            migrate_legacy_progress
+            + dedent(
+                """
+                migrate_legacy_progress()
+                return redis.call('HLEN', KEYS[1]) - redis.call('HLEN', KEYS[2])
+                """
+            )
+        )
 
     def _collect_progress_hash_key(self, workspace_id: WorkspaceId) -> str:
         return f"dispatching:collect_jobs_in_progress:{workspace_id}"
@@ -81,6 +175,12 @@ class CollectAccountProgress:
     def _jobs_hash_key(self, workspace_id: WorkspaceId) -> str:
         return f"dispatching:collect_jobs_in_progress:{workspace_id}:jobs"
 
+    def _done_hash_key(self, workspace_id: WorkspaceId) -> str:
+        return f"dispatching:collect_jobs_in_progress:{workspace_id}:done"
+
+    def _migrated_key(self, workspace_id: WorkspaceId) -> str:
+        return f"dispatching:collect_jobs_in_progress:{workspace_id}:migrated"
+
     def _jobs_to_workspace_key(self, job_id: str) -> str:
         return f"dispatching:collect_jobs_in_progress:jobs_to_tenant:{job_id}"
 
@@ -109,116 +209,93 @@ class CollectAccountProgress:
         # store account_collect_progress
         async with self.redis.pipeline(transaction=True) as pipe:
             await pipe.hset(name=self._collect_progress_hash_key(workspace_id), key=str(cloud_account_id), value=value)
+            # a new job of this account is pending
+            await pipe.hdel(self._done_hash_key(workspace_id), str(cloud_account_id))
             # store job_id -> cloud_account_id mapping
             await pipe.hset(name=self._jobs_hash_key(workspace_id), key=str(job_id), value=str(cloud_account_id))
 
             # store job_id -> workspace_id mapping
             await pipe.set(name=self._jobs_to_workspace_key(str(job_id)), value=str(workspace_id))
-            # cleanup after 4 hours just to be sure
-            expiration = timedelta(hours=4)
 
-            await pipe.expire(name=self._collect_progress_hash_key(workspace_id), time=expiration)
-            await pipe.expire(name=self._jobs_hash_key(workspace_id), time=expiration)
-            await pipe.expire(name=self._jobs_to_workspace_key(str(job_id)), time=expiration)
+            await pipe.expire(name=self._collect_progress_hash_key(workspace_id), time=self.expiration)
+            await pipe.expire(name=self._jobs_hash_key(workspace_id), time=self.expiration)
+            await pipe.expire(name=self._jobs_to_workspace_key(str(job_id)), time=self.expiration)
 
             await pipe.execute()
 
     async def get_tenant_collect_state(
         self, workspace_id: WorkspaceId
     ) -> Dict[FixCloudAccountId, AccountCollectProgress]:
-        key = self._collect_progress_hash_key(workspace_id)
-        hash = cast(Dict[str, str], (await self.redis.hgetall(key)))  # type: ignore
-        return {FixCloudAccountId(UUID(k)): AccountCollectProgress.from_json_str(v) for k, v in hash.items()}
+        async with self.redis.pipeline(transaction=False) as pipe:
+            await pipe.hgetall(self._collect_progress_hash_key(workspace_id))
+            await pipe.hgetall(self._done_hash_key(workspace_id))
+            progress, done = cast(Tuple[Dict[str, str], Dict[str, str]], await pipe.execute())
+        return {
+            FixCloudAccountId(UUID(k)): AccountCollectProgress.from_json_str(v, done.get(k))
+            for k, v in progress.items()
+        }
 
     async def get_account_collect_state(
         self, workspace_id: WorkspaceId, account_id: FixCloudAccountId
     ) -> Optional[AccountCollectProgress]:
-        hash_key = self._collect_progress_hash_key(workspace_id)
-        account_progress_str: Optional[str] = await self.redis.hget(hash_key, str(account_id))
+        async with self.redis.pipeline(transaction=False) as pipe:
+            await pipe.hget(self._collect_progress_hash_key(workspace_id), str(account_id))
+            await pipe.hget(self._done_hash_key(workspace_id), str(account_id))
+            account_progress_str, done = await pipe.execute()
         if account_progress_str is None:
             return None
-        return AccountCollectProgress.from_json_str(account_progress_str)
-
-    async def get_account_collect_state_by_job_id(
-        self, workspace_id: WorkspaceId, job_id: str
-    ) -> Optional[AccountCollectProgress]:
-        hash_key = self._jobs_hash_key(workspace_id)
-        fix_cloud_account_id_str: Optional[str] = await self.redis.hget(hash_key, job_id)
-        if fix_cloud_account_id_str is None:
-            log.warning(f"Could not find cloud account id for job id {job_id}")
-            return None
-        fix_cloud_account_id = FixCloudAccountId(UUID(fix_cloud_account_id_str))
-        set_fix_cloud_account_id(fix_cloud_account_id)
-        account = await self.get_account_collect_state(workspace_id, fix_cloud_account_id)
-        if account is None:
-            log.warning(f"Could not find account for cloud account id {fix_cloud_account_id}")
-        return account
+        return AccountCollectProgress.from_json_str(account_progress_str, done)
 
     async def account_collection_ongoing(self, workspace_id: WorkspaceId, cloud_account_id: FixCloudAccountId) -> bool:
-        collect_state = await self.get_account_collect_state(workspace_id, cloud_account_id)
-        if collect_state is None:
-            return False
-        return True
-
-    async def mark_account_as_collected(
-        self,
-        workspace_id: WorkspaceId,
-        cloud_account_id: FixCloudAccountId,
-        nr_of_resources_collected: int,
-        scan_duration_seconds: int,
-        task_id: TaskId,
-        error_messages: List[str],
-    ) -> CollectState:
-        hash_key = self._collect_progress_hash_key(workspace_id)
-
-        collect_state = await self.get_tenant_collect_state(workspace_id)
-
-        if cloud_account_id not in collect_state:
-            raise Exception(f"Could not find collect job context for accound id {cloud_account_id}")
-        collect_progress_done = collect_state[cloud_account_id].done(
-            scanned_resources=nr_of_resources_collected,
-            scan_duration=scan_duration_seconds,
-            task_id=task_id,
-            resource_errors=error_messages,
+        return await self.redis.hexists(self._collect_progress_hash_key(workspace_id), str(cloud_account_id))
+
+    async def workspace_ids_from_job_ids(self, job_ids: List[str]) -> Dict[str, WorkspaceId]:
+        if not job_ids:
+            return {}
+        workspace_ids: List[Optional[str]] = await self.redis.mget([self._jobs_to_workspace_key(j) for j in job_ids])
+        return {job_id: WorkspaceId(UUID(ws)) for job_id, ws in zip(job_ids, workspace_ids) if ws is not None}
+
+    async def mark_jobs_done(self, workspace_id: WorkspaceId, results: Dict[str, CollectionResult]) -> int:
+        """
+        Store the result of all given jobs of one workspace.
+        Returns the number of jobs of this workspace that are still pending.
+        """
+        args: List[Any] = [int(self.expiration.total_seconds())]
+        for job_id, result in results.items():
+            args.extend([job_id, collection_result_to_json_str(result)])
+        pending, unknown = await self.mark_jobs_done_script(
+            keys=[
+                self._collect_progress_hash_key(workspace_id),
+                self._done_hash_key(workspace_id),
+                self._migrated_key(workspace_id),
+                self._jobs_hash_key(workspace_id),
+            ],
+            args=args,
         )
-        await self.redis.hset(hash_key, key=str(cloud_account_id), value=collect_progress_done.to_json_str())
-        return collect_state | {cloud_account_id: collect_progress_done}
-
-    async def workspace_id_from_job_id(self, job_id: str) -> Optional[WorkspaceId]:
-        workspace_id_str: Optional[str] = await self.redis.get(self._jobs_to_workspace_key(job_id))
-        if workspace_id_str is None:
-            logging.warning(f"Could not find workspace id for job id {job_id}")
-            return None
-
-        return WorkspaceId(UUID(workspace_id_str))
-
-    async def mark_job_as_failed(
-        self,
-        job_id: str,
-        duration: int,
-        task_id: Optional[TaskId],
-        error: str,
-    ) -> None:
-        workspace_id = await self.workspace_id_from_job_id(job_id)
-        if workspace_id is None:
-            return
-        set_workspace_id(workspace_id)
-        hash_key = self._collect_progress_hash_key(workspace_id)
-
-        cloud_account_state = await self.get_account_collect_state_by_job_id(workspace_id, job_id)
-        if cloud_account_state is None:
-            logging.warning(f"Could not find cloud account state for job id {job_id}")
-            return
-
-        failed = cloud_account_state.failed(error, duration, task_id)
-        await self.redis.hset(hash_key, key=str(failed.cloud_account_id), value=failed.to_json_str())
+        for job_id in unknown:
+            log.warning(f"Could not find cloud account for job id {job_id}")
+        return cast(int, pending)
+
+    async def pending_jobs(self, workspace_id: WorkspaceId) -> int:
+        pending = await self.pending_jobs_script(
+            keys=[
+                self._collect_progress_hash_key(workspace_id),
+                self._done_hash_key(workspace_id),
+                self._migrated_key(workspace_id),
+            ],
+            args=[int(self.expiration.total_seconds())],
+        )
+        return cast(int, pending)
 
     async def delete_tenant_collect_state(self, workspace_id: WorkspaceId) -> None:
-        await self.redis.delete(self._collect_progress_hash_key(workspace_id))
-        all_job_ids = await self.redis.hgetall(self._jobs_hash_key(workspace_id))
-        for job_id in all_job_ids.keys():
-            await self.redis.delete(self._jobs_to_workspace_key(job_id))
-        await self.redis.delete(self._jobs_hash_key(workspace_id))
+        job_ids = await self.redis.hkeys(self._jobs_hash_key(workspace_id))
+        await self.redis.unlink(
+            self._collect_progress_hash_key(workspace_id),
+            self._done_hash_key(workspace_id),
+            self._jobs_hash_key(workspace_id),
+            self._migrated_key(workspace_id),
+            *[self._jobs_to_workspace_key(job_id) for job_id in job_ids],
+        )
 
 
 class DispatcherService(Service):
@@ -247,18 +324,27 @@ class DispatcherService(Service):
         self.access_manager = access_manager
         self.workspace_repository = workspace_repository
         self.periodic = Periodic("schedule_next_runs", self.schedule_next_runs, timedelta(minutes=1))
-        self.collect_result_listener = RedisStreamListener(
+        self.collect_result_listener = BatchRedisStreamListener(
             readwrite_redis,
             "collect-events",
             group="dispatching",
             listener="dispatching",
             message_processor=self.process_collect_done_message,
+            batch_processor=self.process_collect_done_messages,
             consider_failed_after=timedelta(minutes=5),
-            batch_size=1,
+            batch_size=500,
         )
         self.domain_event_sender = domain_event_sender
         self.collect_progress = CollectAccountProgress(temp_store_redis)
         self.degraded_acc_ping_interval = timedelta(hours=config.degraded_accounts_ping_interval_hours)
+        # number of workspaces that are scheduled concurrently
+        self.schedule_concurrency = config.dispatcher_schedule_concurrency
+        # number of due workspaces whose data is loaded from the database at once
+        self.schedule_batch_size = 500
+        # do not schedule more workspaces, if the collect queue has more jobs waiting (0 means no limit)
+        self.max_collect_queue_depth = config.dispatcher_max_collect_queue_depth
+        # maximum number of degraded accounts pinged per schedule run
+        self.degraded_ping_limit = 1000
 
         domain_event_subscriber.subscribe(WorkspaceCreated, self.process_workspace_created, "dispatcher")
         domain_event_subscriber.subscribe(CloudAccountConfigured, self.process_aws_account_configured, "dispatcher")
@@ -272,15 +358,47 @@ class DispatcherService(Service):
         await self.collect_result_listener.stop()
 
     async def process_collect_done_message(self, message: Json, context: MessageContext) -> None:
-        match context.kind:
-            case "post-collect-done":
-                await self.process_post_collect_done_message(message, context)
-            case "collect-done":
-                await self.collect_job_finished(message)
-            case "job-failed":
-                await self.collect_job_finished(message, failed=True)
-            case _:
-                log.info(f"Collect messages: will ignore messages of kind {context.kind}")
+        await self.process_collect_done_messages([(message, context)])
+
+    async def process_collect_done_messages(self, messages: List[Tuple[Json, MessageContext]]) -> None:
+        # consecutive finished collect jobs are handled as one batch, all other messages in order
+        finished: List[Tuple[Json, MessageContext]] = []
+        # once a message could not be processed, all following messages are left to be processed in order
+        unprocessed: Set[str] = set()
+
+        async def handle_finished() -> None:
+            try:
+                failed_jobs = await self.collect_jobs_finished([(m, c.kind == "job-failed") for m, c in finished])
+                unprocessed.update(c.id for m, c in finished if m.get("job_id") in failed_jobs)
+            except Exception as ex:
+                log.exception(f"Could not handle {len(finished)} finished collect jobs: {ex}")
+                unprocessed.update(c.id for _, c in finished)
+            finished.clear()
+
+        for message, context in messages:
+            if unprocessed:
+                unprocessed.add(context.id)
+                continue
+            match context.kind:
+                case "collect-done" | "job-failed":
+                    finished.append((message, context))
+                case "post-collect-done":
+                    if finished:
+                        await handle_finished()
+                        if unprocessed:
+                            unprocessed.add(context.id)
+                            continue
+                    try:
+                        await self.process_post_collect_done_message(message, context)
+                    except Exception as ex:
+                        log.exception(f"Could not handle post collect done message: {ex}")
+                        unprocessed.add(context.id)
+                case _:
+                    log.info(f"Collect messages: will ignore messages of kind {context.kind}")
+        if finished:
+            await handle_finished()
+        if unprocessed:
+            raise BatchFailed(unprocessed, f"{len(unprocessed)} collect messages could not be processed")
 
     async def complete_collect_job(self, workspace_id: WorkspaceId) -> None:
         async def send_domain_event(collect_state: Dict[FixCloudAccountId, AccountCollectProgress]) -> None:
@@ -338,9 +456,7 @@ class DispatcherService(Service):
 
         workspace_id = WorkspaceId(uuid.UUID(tenant_id))
 
-        tenant_collect_state = await self.collect_progress.get_tenant_collect_state(workspace_id)
-
-        if not all(job.is_done() for job in tenant_collect_state.values()):
+        if await self.collect_progress.pending_jobs(workspace_id) > 0:
             log.error("Post collect job finished, but not all collect jobs are done. This is a bug!")
             return
 
@@ -350,84 +466,100 @@ class DispatcherService(Service):
 
         await self.complete_collect_job(workspace_id)
 
-    async def collect_job_finished(self, message: Json, failed: bool = False) -> None:
-        job_id = message["job_id"]
-
-        async def handle_error(error: str) -> None:
-            task_id = message.get("task_id")
-            duration = message.get("duration") or 0
-            await self.collect_progress.mark_job_as_failed(job_id, duration, task_id, error)
-            log.warning(f"Collect job finished with an error: error={error} job_id={job_id}")
-
-        async def handle_success() -> None:
-            task_id = message["task_id"]
-            workspace_id = WorkspaceId(uuid.UUID(message["tenant_id"]))
-            account_info: Dict[str, Any] = message["account_info"]
-            messages = message["messages"]
-            started_at = parse_utc_str(message["started_at"])
-            duration = message["duration"]
-            set_workspace_id(workspace_id)
-            log.info(
-                f"Collect job finished: job_id={job_id}, task_id={task_id}, workspace_id={workspace_id}. "
-                f"Took {duration}. Messages: {messages}"
-            )
-            if workspace := await self.workspace_repository.get_workspace(workspace_id):
-                tier = workspace.current_product_tier()
+    async def collect_jobs_finished(self, finished: List[Tuple[Json, bool]]) -> Set[str]:
+        """
+        Handle a batch of finished collect jobs: (message, failed).
+        The metering records of all jobs are written at once.
+        The progress of all jobs of a workspace is updated and evaluated once.
+        Returns the ids of all jobs, whose workspace progress could not be handled.
+        """
+
+        def job_error(message: Json, failed: bool) -> Optional[str]:
+            error: Optional[str] = message.get("error")
+            return (error or "received job failed message") if failed else error
+
+        workspace_by_job = await self.collect_progress.workspace_ids_from_job_ids([m["job_id"] for m, _ in finished])
+        # product tiers of all workspaces with successful jobs
+        success_ids = {WorkspaceId(uuid.UUID(m["tenant_id"])) for m, failed in finished if not job_error(m, failed)}
+        workspaces = await self.workspace_repository.list_workspaces_by_ids(list(success_ids)) if success_ids else {}
+
+        records: List[MeteringRecord] = []
+        results: Dict[WorkspaceId, Dict[str, CollectionResult]] = defaultdict(dict)
+        for message, failed in finished:
+            job_id = message["job_id"]
+            if error := job_error(message, failed):
+                log.warning(f"Collect job finished with an error: error={error} job_id={job_id}")
+                result: CollectionResult = CollectionFailure(
+                    message.get("duration") or 0, message.get("task_id"), error
+                )
             else:
-                log.warning(f"Could not find security tier workspace with id {workspace_id}, will use free as default")
-                tier = ProductTier.Free
-            records = [
-                MeteringRecord(
-                    id=uuid.uuid4(),
-                    workspace_id=workspace_id,
-                    cloud=account_details["cloud"],
-                    account_id=CloudAccountId(account_id),
-                    account_name=account_details["name"],
-                    timestamp=utc(),
-                    job_id=job_id,
-                    task_id=task_id,
-                    nr_of_resources_collected=sum(account_details["summary"].values()),
-                    nr_of_error_messages=len(messages),
-                    started_at=started_at,
-                    duration=duration,
-                    product_tier=tier,
+                task_id = message["task_id"]
+                workspace_id = WorkspaceId(uuid.UUID(message["tenant_id"]))
+                account_info: Dict[str, Any] = message["account_info"]
+                messages = message["messages"]
+                started_at = parse_utc_str(message["started_at"])
+                duration = message["duration"]
+                log.info(
+                    f"Collect job finished: job_id={job_id}, task_id={task_id}, workspace_id={workspace_id}. "
+                    f"Took {duration}. Messages: {messages}"
                 )
-                for account_id, account_details in account_info.items()
-            ]
-            await self.metering_repo.add(records)
-            account_progress = await self.collect_progress.get_account_collect_state_by_job_id(workspace_id, job_id)
-            if account_progress is None:
-                log.error(f"Could not find context for job_id {job_id}")
-                return
-            set_fix_cloud_account_id(account_progress.cloud_account_id)
-            await self.collect_progress.mark_account_as_collected(
-                workspace_id,
-                account_progress.cloud_account_id,
-                sum(r.nr_of_resources_collected for r in records),
-                duration,
-                TaskId(task_id),
-                messages,
-            )
+                if workspace := workspaces.get(workspace_id):
+                    tier = workspace.current_product_tier()
+                else:
+                    log.warning(
+                        f"Could not find security tier workspace with id {workspace_id}, will use free as default"
+                    )
+                    tier = ProductTier.Free
+                job_records = [
+                    MeteringRecord(
+                        id=uuid.uuid4(),
+                        workspace_id=workspace_id,
+                        cloud=account_details["cloud"],
+                        account_id=CloudAccountId(account_id),
+                        account_name=account_details["name"],
+                        timestamp=utc(),
+                        job_id=job_id,
+                        task_id=task_id,
+                        nr_of_resources_collected=sum(account_details["summary"].values()),
+                        nr_of_error_messages=len(messages),
+                        started_at=started_at,
+                        duration=duration,
+                        product_tier=tier,
+                    )
+                    for account_id, account_details in account_info.items()
+                ]
+                records.extend(job_records)
+                result = CollectionSuccess(
+                    sum(r.nr_of_resources_collected for r in job_records), duration, TaskId(task_id), messages
+                )
+            if (job_workspace_id := workspace_by_job.get(job_id)) is None:
+                log.warning(f"Could not find workspace id for job id {job_id}")
+                continue
+            results[job_workspace_id][job_id] = result
 
-        error: Optional[str] = message.get("error")
-        if failed:
-            error = error or "received job failed message"
-        if error:
-            await handle_error(error)
-        else:
-            await handle_success()
+        if records:
+            await self.metering_repo.add(records)
 
-        workspace_id = await self.collect_progress.workspace_id_from_job_id(job_id)
-        if workspace_id is None:
-            log.warning(f"Could not find workspace id for job id {job_id}")
+        failed_jobs: Set[str] = set()
+        for workspace_id, job_results in results.items():
+            set_workspace_id(workspace_id)
+            try:
+                pending = await self.collect_progress.mark_jobs_done(workspace_id, job_results)
+                await self.collect_jobs_progressed(workspace_id, pending)
+            except Exception as ex:
+                # the jobs of the other workspaces are handled independently
+                log.exception(f"Could not handle finished collect jobs of workspace {workspace_id}: {ex}")
+                failed_jobs.update(job_results)
+        return failed_jobs
+
+    async def collect_jobs_progressed(self, workspace_id: WorkspaceId, pending: int) -> None:
+        if pending > 0:
+            log.info(f"One of multiple jobs finished. Waiting for the remaining {pending} jobs.")
             return
 
+        # all jobs are done: the complete state is only read once
         tenant_collect_state = await self.collect_progress.get_tenant_collect_state(workspace_id)
 
-        if not all(job.is_done() for job in tenant_collect_state.values()):
-            log.info("One of multiple jobs finished. Waiting for the remaining jobs.")
-            return
-
         if all([isinstance(progress.collection_done, CollectionFailure) for progress in tenant_collect_state.values()]):
             log.info("Allcollect jobs failed, completing collect run")
             await self.complete_collect_job(workspace_id)
@@ -458,7 +590,7 @@ class DispatcherService(Service):
         set_workspace_id(workspace_id)
         # store an entry in the next_run table
         product_tier = await self.workspace_repository.get_product_tier(workspace_id)
-        next_run_at = self.next_run_repo.next_run_for(product_tier)
+        next_run_at = self.next_run_repo.next_run_for(product_tier, workspace_id=workspace_id)
         await self.next_run_repo.create(workspace_id, next_run_at)
 
     async def process_aws_account_configured(self, event: CloudAccountConfigured) -> None:
@@ -489,6 +621,7 @@ class DispatcherService(Service):
         defer_by: Optional[timedelta] = None,
         retry_failed_for: Optional[timedelta] = None,
         privileged_account_id: Optional[CloudAccountId] = None,
+        db: Optional[GraphDatabaseAccess] = None,
         **kwargs: Any,
     ) -> None:
         set_cloud_account_id(account.account_id)
@@ -544,7 +677,7 @@ class DispatcherService(Service):
                     return None
 
         if (ai := await account_information()) and (
-            db := await self.access_manager.get_database_access(account.workspace_id)
+            db := db or await self.access_manager.get_database_access(account.workspace_id)
         ):
             job_id = uuid.uuid4()
             log.info(
@@ -564,45 +697,128 @@ class DispatcherService(Service):
 
     async def schedule_next_runs(self) -> None:
         now = utc()
-
+        semaphore = asyncio.Semaphore(self.schedule_concurrency)
         azure_graph_scheduled = False
-        async for workspace_id, at in self.next_run_repo.older_than(now):
-            set_workspace_id(workspace_id)
-            healthy_accounts = await self.cloud_account_repo.list_by_workspace_id(
-                workspace_id, ready_for_collection=True
-            )
-            degraded_accounts = await self.cloud_account_repo.list_degraded_for_ping(
-                workspace_id, now - self.degraded_acc_ping_interval
-            )
-            accounts = healthy_accounts + degraded_accounts
-            product_tier = await self.workspace_repository.get_product_tier(workspace_id)
-            log.info(f"scheduling next run for workspace {workspace_id}, {len(accounts)} accounts")
-            priveleged_account_id = next((acc.account_id for acc in accounts if acc.privileged), None)
-            for account in accounts:
-                reason = "regular_collect"
-
-                if isinstance(account.state, CloudAccountStates.Degraded):
-                    reason = "degraded_account_ping"
-
-                if account.cloud == CloudNames.Azure and not azure_graph_scheduled:
-                    azure_graph_scheduled = True
-                    await self.trigger_collect(
-                        account,
-                        reason=reason,
-                        collect_microsoft_graph=True,
-                        privileged_account_id=priveleged_account_id,
-                    )
-                else:
-                    await self.trigger_collect(account, reason=reason, privileged_account_id=priveleged_account_id)
 
-            for account in degraded_accounts:
-                await self.cloud_account_repo.update(
-                    account.id, lambda acc: evolve(acc, last_degraded_scan_started_at=now)
+        async def schedule_workspace(
+            workspace_id: WorkspaceId,
+            at: datetime,
+            workspace: Optional[Workspace],
+            accounts: List[CloudAccount],
+            db: Optional[GraphDatabaseAccess],
+        ) -> None:
+            nonlocal azure_graph_scheduled
+            async with semaphore:
+                set_workspace_id(workspace_id)
+                ScheduleLag.observe((utc() - at).total_seconds())
+                if workspace is None:
+                    # otherwise the workspace stays due and is picked up by every schedule run
+                    log.warning(f"Workspace {workspace_id} does not exist. Delete its next run.")
+                    await self.next_run_repo.delete(workspace_id)
+                    return
+                try:
+                    product_tier = workspace.current_product_tier()
+                    log.info(f"scheduling next run for workspace {workspace_id}, {len(accounts)} accounts")
+                    priveleged_account_id = next((acc.account_id for acc in accounts if acc.privileged), None)
+                    # accounts of the same workspace are triggered in order
+                    for account in accounts:
+                        reason = "regular_collect"
+                        if account.cloud == CloudNames.Azure and not azure_graph_scheduled:
+                            azure_graph_scheduled = True
+                            await self.trigger_collect(
+                                account,
+                                reason=reason,
+                                collect_microsoft_graph=True,
+                                privileged_account_id=priveleged_account_id,
+                                db=db,
+                            )
+                        else:
+                            await self.trigger_collect(
+                                account, reason=reason, privileged_account_id=priveleged_account_id, db=db
+                            )
+
+                    next_run_at = await self.next_run_repo.update_next_run_for(workspace_id, product_tier, last_run=at)
+                    log.info(f"next run for workspace {workspace_id} will be at {next_run_at}")
+                except Exception as ex:
+                    # do not stop scheduling all other workspaces
+                    log.exception(f"Could not schedule next run for workspace {workspace_id}: {ex}")
+
+        async def trigger_failed(account: CloudAccount) -> None:
+            async with semaphore:
+                await self.trigger_collect(account, reason="failed_account_scan")
+
+        with ScheduleDuration.time():
+            due = [(workspace_id, at) async for workspace_id, at in self.next_run_repo.older_than(now)]
+            # the longest waiting workspaces first: they are scheduled, even if the rest has to be deferred
+            due.sort(key=lambda d: d[1])
+            ScheduleDueWorkspaces.set(len(due))
+            ScheduleDeferredWorkspaces.set(0)
+            for idx, due_batch in enumerate(batch(due, self.schedule_batch_size)):
+                if self.max_collect_queue_depth > 0:
+                    depth = await self.collect_queue.queue_depth()
+                    if depth > self.max_collect_queue_depth:
+                        # the workspaces stay due and are picked up in one of the next schedule runs
+                        deferred = len(due) - idx * self.schedule_batch_size
+                        log.info(f"Collect queue depth {depth} exceeds the limit. Defer {deferred} workspaces.")
+                        ScheduleDeferredWorkspaces.set(deferred)
+                        break
+                # load the data of all workspaces in the batch with a few set based queries
+                workspace_ids = [workspace_id for workspace_id, _ in due_batch]
+                accounts, workspaces, dbs = await asyncio.gather(
+                    self.cloud_account_repo.list_by_workspace_ids(workspace_ids, ready_for_collection=True),
+                    self.workspace_repository.list_workspaces_by_ids(workspace_ids),
+                    self.access_manager.get_database_access_many(workspace_ids),
+                )
+                await asyncio.gather(
+                    *[
+                        schedule_workspace(wid, at, workspaces.get(wid), accounts[wid], dbs.get(wid))
+                        for wid, at in due_batch
+                    ]
                 )
 
-            next_run_at = await self.next_run_repo.update_next_run_for(workspace_id, product_tier, last_run=at)
-            log.info(f"next run for workspace {workspace_id} will be at {next_run_at}")
+            failed_accounts = await self.cloud_account_repo.list_non_hourly_failed_scans_accounts(now)
+            await asyncio.gather(*[trigger_failed(account) for account in failed_accounts])
 
-        failed_accounts = await self.cloud_account_repo.list_non_hourly_failed_scans_accounts(now)
-        for account in failed_accounts:
-            await self.trigger_collect(account, reason="failed_account_scan")
+        await self.ping_degraded_accounts(now)
+
+    async def ping_degraded_accounts(self, now: datetime) -> int:
+        """
+        Plan the pings of all degraded accounts, that have not been pinged within the ping interval.
+        The accounts of all workspaces are selected with one query and marked as pinged with one update.
+        Returns the number of planned pings.
+        """
+        degraded = await self.cloud_account_repo.list_degraded_for_ping_grouped(
+            now - self.degraded_acc_ping_interval, limit=self.degraded_ping_limit
+        )
+        if not degraded:
+            return 0
+        workspace_ids = list(degraded.keys())
+        healthy, dbs = await asyncio.gather(
+            self.cloud_account_repo.list_by_workspace_ids(workspace_ids, ready_for_collection=True),
+            self.access_manager.get_database_access_many(workspace_ids),
+        )
+        semaphore = asyncio.Semaphore(self.schedule_concurrency)
+
+        async def ping_workspace(workspace_id: WorkspaceId, accounts: List[CloudAccount]) -> None:
+            async with semaphore:
+                set_workspace_id(workspace_id)
+                privileged = next((a.account_id for a in healthy[workspace_id] + accounts if a.privileged), None)
+                for account in accounts:
+                    try:
+                        await self.trigger_collect(
+                            account,
+                            reason="degraded_account_ping",
+                            privileged_account_id=privileged,
+                            db=dbs.get(workspace_id),
+                        )
+                    except Exception as ex:
+                        log.exception(f"Could not ping degraded account {account.id}: {ex}")
+
+        await asyncio.gather(*[ping_workspace(wid, accounts) for wid, accounts in degraded.items()])
+        # all selected accounts count as pinged: failing accounts are retried in the next ping interval
+        planned = await self.cloud_account_repo.mark_degraded_pinged(
+            [account.id for accounts in degraded.values() for account in accounts], now
+        )
+        DegradedPingsPlanned.inc(planned)
+        log.info(f"Planned {planned} pings of degraded accounts in {len(degraded)} workspaces.")
+        return planned
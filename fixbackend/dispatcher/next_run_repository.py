@@ -11,7 +11,8 @@
 #
 #  You should have received a copy of the GNU Affero General Public License
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
-from datetime import datetime
+import hashlib
+from datetime import datetime, timedelta, timezone
 from typing import AsyncIterator, Tuple, Optional
 
 from fastapi_users_db_sqlalchemy.generics import GUID
@@ -25,6 +26,43 @@ from fixbackend.ids import WorkspaceId, ProductTier
 from fixbackend.sqlalechemy_extensions import UTCDateTime
 from fixbackend.types import AsyncSessionMaker
 
+Epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def schedule_offset(workspace_id: WorkspaceId, interval: timedelta) -> timedelta:
+    """
+    Deterministic offset of the given workspace inside the given interval.
+    The workspace id is hashed, since the lower bits of a uuid1 are the same for all ids created on one host.
+    """
+    seconds = int(interval.total_seconds())
+    if seconds <= 0:
+        return timedelta(0)
+    digest = hashlib.sha256(workspace_id.bytes).digest()
+    return timedelta(seconds=int.from_bytes(digest[:8], "big") % seconds)
+
+
+def compute_next_run(
+    interval: timedelta, now: datetime, last_run: Optional[datetime] = None, offset: Optional[timedelta] = None
+) -> datetime:
+    """
+    Compute the next run after now.
+    Without offset, the next run is aligned to last_run + n * interval.
+    With offset, the next run is the first slot epoch + offset + n * interval after now (or last_run if in the future).
+    Every workspace with a different offset gets a different slot, which spreads all runs over the interval.
+    """
+    if offset is None:
+        initial_time = last_run or now
+        diff = now - initial_time
+        if diff.total_seconds() > 0:  # if the last run is in the past, make sure the next run is in the future
+            periods = (diff // interval) + 1
+            return initial_time + (interval * periods)
+        else:  # next run is already in the future. compute offset.
+            return initial_time + interval
+    else:
+        reference = last_run if last_run is not None and last_run > now else now
+        periods = ((reference - Epoch - offset) // interval) + 1
+        return Epoch + offset + interval * periods
+
 
 class NextTenantRun(Base):
     __tablename__ = "next_tenant_run"
@@ -34,8 +72,10 @@ class NextTenantRun(Base):
 
 
 class NextRunRepository:
-    def __init__(self, session_maker: AsyncSessionMaker) -> None:
+    def __init__(self, session_maker: AsyncSessionMaker, *, spread_runs: bool = False) -> None:
         self.session_maker = session_maker
+        # spread the runs of all workspaces over the scan interval, instead of aligning them to the last run
+        self.spread_runs = spread_runs
 
     async def create(self, workspace_id: WorkspaceId, next_run: datetime) -> None:
         async with self.session_maker() as session:
@@ -51,23 +91,20 @@ class NextRunRepository:
             else:
                 return None
 
-    def next_run_for(self, product_tier: ProductTier, last_run: Optional[datetime] = None) -> datetime:
-        now = utc()
-        settings = ProductTierSettings[product_tier]
-        delta = settings.scan_interval
-        initial_time = last_run or now
-        diff = now - initial_time
-        if diff.total_seconds() > 0:  # if the last run is in the past, make sure the next run is in the future
-            periods = (diff // delta) + 1
-            result = initial_time + (delta * periods)
-        else:  # next run is already in the future. compute offset.
-            result = initial_time + delta
-        return result
+    def next_run_for(
+        self,
+        product_tier: ProductTier,
+        last_run: Optional[datetime] = None,
+        workspace_id: Optional[WorkspaceId] = None,
+    ) -> datetime:
+        delta = ProductTierSettings[product_tier].scan_interval
+        offset = schedule_offset(workspace_id, delta) if self.spread_runs and workspace_id is not None else None
+        return compute_next_run(delta, utc(), last_run, offset)
 
     async def update_next_run_for(
         self, tenant: WorkspaceId, product_tier: ProductTier, last_run: Optional[datetime] = None
     ) -> datetime:
-        result = self.next_run_for(product_tier, last_run)
+        result = self.next_run_for(product_tier, last_run, tenant)
         await self.update_next_run_at(tenant, result)
         return result
 
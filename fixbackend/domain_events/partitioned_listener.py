@@ -0,0 +1,152 @@
+#  Copyright (c) 2024. Some Engineering
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import asyncio
+import json
+import logging
+import zlib
+from datetime import timedelta
+from typing import Any, List, Optional, Set, Tuple
+
+from fixcloudutils.asyncio import stop_running_task
+from fixcloudutils.redis.event_stream import RedisStreamListener
+from fixcloudutils.util import parse_utc_str, utc
+from prometheus_client import Gauge, Histogram
+from redis.typing import StreamIdT
+
+log = logging.getLogger(__name__)
+LaneLag = Histogram(
+    "domain_event_lane_lag_seconds",
+    "Time between publishing a domain event and the start of its processing",
+    ["group", "lane"],
+    buckets=(0.01, 0.1, 0.5, 1, 5, 15, 60, 300),
+)
+LaneDepth = Gauge("domain_event_lane_depth", "Number of domain events waiting in a lane", ["group", "lane"])
+InFlight = Gauge("domain_event_in_flight", "Number of received but not yet acknowledged domain events", ["group"])
+
+# message id, message
+LaneEntry = Tuple[StreamIdT, Any]
+
+
+def partition_key(message: Any) -> str:
+    """
+    The events of one tenant are processed in order, so the tenant (or workspace) id is used as partition key.
+    Events without tenant are partitioned by user or, as last resort, by message id.
+    """
+    try:
+        data = json.loads(message["data"])
+        for prop in ("tenant_id", "workspace_id", "user_id"):
+            if value := data.get(prop):
+                return str(value)
+    except Exception:
+        pass
+    return str(message.get("id", ""))
+
+
+class PartitionedRedisStreamListener(RedisStreamListener):
+    """
+    Processes the messages of a redis stream in a fixed number of lanes.
+    Every message is routed to a lane by its partition key: messages of the same partition are processed in order,
+    messages of different lanes are processed concurrently. A slow message only delays the messages of its lane.
+    The order of messages with different partition keys is not preserved: handlers must not rely on it.
+    Every message is acknowledged after it has been processed. Reading from the stream is paused,
+    as long as max_in_flight messages are received but not acknowledged.
+    """
+
+    def __init__(self, *args: Any, lanes: int, max_in_flight: int, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        assert lanes > 0 and max_in_flight > 0, "lanes and max_in_flight need to be positive"
+        self.lanes: List[asyncio.Queue[LaneEntry]] = [asyncio.Queue() for _ in range(lanes)]
+        self.in_flight = asyncio.Semaphore(max_in_flight)
+        # ids of all received but not acknowledged messages: pending messages are not claimed twice
+        self.in_flight_ids: Set[StreamIdT] = set()
+        self.lane_tasks: List[asyncio.Task[Any]] = []
+
+    def lane_of(self, message: Any) -> int:
+        return zlib.crc32(partition_key(message).encode("utf-8")) % len(self.lanes)
+
+    async def _handle_stream_messages(self, messages: List[Any]) -> None:
+        for _, stream_messages in messages:
+            for uid, data in stream_messages:
+                if uid in self.in_flight_ids:
+                    continue
+                await self.in_flight.acquire()
+                self.in_flight_ids.add(uid)
+                lane = self.lane_of(data)
+                self.lanes[lane].put_nowait((uid, data))
+                LaneDepth.labels(self.group, lane).inc()
+                InFlight.labels(self.group).inc()
+
+    async def _handle_pending_messages(
+        self,
+        listener_name: Optional[str] = None,
+        min_idle_time: Optional[timedelta] = None,
+        ignore_delivery_count: bool = False,
+    ) -> None:
+        # Claimed messages stay pending until their lane has processed them.
+        # Messages in flight are not claimed again, since every claim counts as another delivery.
+        # Every pending message is looked at once: the pending list is walked from the last seen id onwards.
+        min_idle = int(min_idle_time.total_seconds() * 1000) if min_idle_time is not None else None
+        start = "-"
+        while True:
+            pending = await self.redis.xpending_range(
+                self.stream, self.group, start, "+", count=self.batch_size, consumername=listener_name, idle=min_idle
+            )
+            if not pending:
+                break
+            last_id = pending[-1]["message_id"]
+            start = "(" + (last_id.decode("utf-8") if isinstance(last_id, bytes) else str(last_id))
+            message_ids = [
+                pm["message_id"]
+                for pm in pending
+                if pm["message_id"] not in self.in_flight_ids and (pm["times_delivered"] < 10 or ignore_delivery_count)
+            ]
+            if not message_ids:
+                continue
+            try:
+                messages = await self.redis.xclaim(  # type: ignore
+                    self.stream, self.group, self.listener, min_idle or 0, message_ids
+                )
+            except Exception as e:
+                log.warning(f"Failed to claim pending messages: {e}. Wait for next cycle.", exc_info=True)
+                break
+            await self._handle_stream_messages([(self.stream, messages)])
+
+    async def _process_lane(self, lane: int) -> None:
+        queue = self.lanes[lane]
+        while True:
+            uid, data = await queue.get()
+            LaneDepth.labels(self.group, lane).dec()
+            try:
+                if sent_at := data.get("at"):
+                    LaneLag.labels(self.group, lane).observe((utc() - parse_utc_str(sent_at)).total_seconds())
+                # handles the message including retries and dead letter queue
+                await self._handle_single_message(data)
+                await self.redis.xack(self.stream, self.group, uid)  # type: ignore
+            except Exception as ex:
+                # not acknowledged: the message is claimed again after consider_failed_after
+                log.error(f"Failed to process message {uid!r} in lane {lane}: {ex}", exc_info=True)
+            finally:
+                self.in_flight_ids.discard(uid)
+                self.in_flight.release()
+                InFlight.labels(self.group).dec()
+
+    async def start(self) -> Any:
+        self.lane_tasks = [asyncio.create_task(self._process_lane(lane)) for lane in range(len(self.lanes))]
+        await super().start()
+
+    async def stop(self) -> Any:
+        await super().stop()
+        # messages in lanes are not acknowledged and are processed again after restart
+        await asyncio.gather(*[stop_running_task(task) for task in self.lane_tasks])
+        self.lane_tasks = []
@@ -27,6 +27,7 @@ from fixcloudutils.util import utc
 from fixbackend.config import Config
 from fixbackend.domain_events import DomainEventsStreamName
 from fixbackend.domain_events.events import Event
+from fixbackend.domain_events.partitioned_listener import PartitionedRedisStreamListener
 from fixbackend.types import Redis
 
 Kind = str
@@ -79,15 +80,25 @@ class DomainEventSubscriber(Service):
     def __init__(self, redis: Redis, config: Config, component: str) -> None:
         self.redis = redis
         self.subscribers: Dict[Kind, HandlerDescriptor[Any]] = {}
-        self.listener = RedisStreamListener(
-            redis,
-            DomainEventsStreamName,
+        listener_args: Dict[str, Any] = dict(
             group=f"fixbackend-domain-events-subscriber-{component}",
             listener=config.instance_id,
             message_processor=self.process_domain_event,
             consider_failed_after=timedelta(minutes=5),
             backoff=defaultdict(lambda: NoBackoff),  # no backoff for the whole message but for each handler
         )
+        self.listener: RedisStreamListener
+        if config.domain_event_lanes > 0:
+            # events of different tenants are processed concurrently, events of the same tenant in order
+            self.listener = PartitionedRedisStreamListener(
+                redis,
+                DomainEventsStreamName,
+                lanes=config.domain_event_lanes,
+                max_in_flight=config.domain_event_max_in_flight,
+                **listener_args,
+            )
+        else:
+            self.listener = RedisStreamListener(redis, DomainEventsStreamName, **listener_args)
 
     async def start(self) -> None:
         log.info("Starting domain event subscriber")
@@ -27,3 +27,7 @@ class NotAllowed(ClientError):
 
 class WrongState(ClientError):
     pass
+
+
+class ResourceGone(ClientError):
+    pass
@@ -1,35 +1,23 @@
-from datetime import datetime
 from typing import Annotated
 
 from fastapi import WebSocket, Depends
-from fixcloudutils.redis.pub_sub import RedisPubSubListener
-from fixcloudutils.types import Json
-from fixcloudutils.util import utc_str
 
-from fixbackend.dependencies import FixDependency
+from fixbackend.dependencies import FixDependency, ServiceNames
+from fixbackend.events.websocket_event_hub import WebsocketEventHub
 from fixbackend.ids import WorkspaceId
-from fixbackend.types import Redis
 
 
 class WebsocketEventHandler:
-    def __init__(self, readonly_redis: Redis) -> None:
-        self.readonly_redis = readonly_redis
+    def __init__(self, event_hub: WebsocketEventHub) -> None:
+        self.event_hub = event_hub
 
     async def handle_websocket(self, workspace_id: WorkspaceId, websocket: WebSocket) -> None:
-        async def redis_message_handler(id: str, at: datetime, publisher: str, kind: str, data: Json) -> None:
-            await websocket.send_json(
-                {"type": "event", "id": id, "at": utc_str(at), "publisher": publisher, "kind": kind, "data": data}
-            )
-
         async def ignore_incoming_messages(websocket: WebSocket) -> None:
             while True:
                 await websocket.receive()
 
-        async with RedisPubSubListener(
-            redis=self.readonly_redis,
-            channel=f"tenant-events::{workspace_id}",
-            handler=redis_message_handler,
-        ):
+        # events are delivered by the event hub of this process, while the websocket is connected
+        async with self.event_hub.connect(workspace_id, websocket):
             try:
                 await ignore_incoming_messages(websocket)
             except Exception:
@@ -37,7 +25,7 @@ class WebsocketEventHandler:
 
 
 def get_websocket_event_handler(fix: FixDependency) -> WebsocketEventHandler:
-    return WebsocketEventHandler(fix.readonly_redis)
+    return WebsocketEventHandler(fix.service(ServiceNames.websocket_event_hub, WebsocketEventHub))
 
 
 WebsockedtEventHandlerDependency = Annotated[WebsocketEventHandler, Depends(get_websocket_event_handler)]
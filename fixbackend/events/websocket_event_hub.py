@@ -0,0 +1,155 @@
+#  Copyright (c) 2024. Some Engineering
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import asyncio
+import json
+import logging
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from datetime import timedelta
+from typing import Any, AsyncIterator, Deque, Dict, Optional, Set
+
+from fastapi import WebSocket
+from fixcloudutils.asyncio import stop_running_task
+from fixcloudutils.service import Service
+from fixcloudutils.util import parse_utc_str, utc_str
+from prometheus_client import Counter, Gauge
+
+from fixbackend.ids import WorkspaceId
+from fixbackend.types import Redis
+
+log = logging.getLogger(__name__)
+WebsocketConnections = Gauge("websocket_connections", "Number of connected websockets")
+WebsocketQueueSize = Gauge("websocket_event_queue_size", "Number of events waiting to be sent to websockets")
+WebsocketEventsDropped = Counter("websocket_events_dropped", "Events dropped, since the websocket is too slow")
+
+
+class WebsocketQueue:
+    """
+    Bounded queue of serialized events of one websocket.
+    If the websocket can not keep up, the oldest event in the queue is dropped.
+    """
+
+    def __init__(self, websocket: WebSocket, max_size: int) -> None:
+        self.websocket = websocket
+        self.max_size = max_size
+        self.messages: Deque[str] = deque()
+        self.available = asyncio.Event()
+
+    def offer(self, message: str) -> None:
+        if len(self.messages) >= self.max_size:
+            self.messages.popleft()
+            WebsocketEventsDropped.inc()
+            WebsocketQueueSize.dec()
+        self.messages.append(message)
+        WebsocketQueueSize.inc()
+        self.available.set()
+
+    async def send_messages(self) -> None:
+        while True:
+            await self.available.wait()
+            while self.messages:
+                message = self.messages.popleft()
+                WebsocketQueueSize.dec()
+                await self.websocket.send_text(message)
+            self.available.clear()
+
+    def clear(self) -> None:
+        WebsocketQueueSize.dec(len(self.messages))
+        self.messages.clear()
+
+
+class WebsocketEventHub(Service):
+    """
+    Delivers the events of all workspaces to the websockets connected to this process.
+    There is only one pattern subscription on the event channels of all workspaces per process.
+    Every event is serialized once and dispatched to the queues of all websockets of the workspace.
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        *,
+        channel_prefix: str = "tenant-events::",
+        max_queue_size: int = 100,
+        reconnect_delay: timedelta = timedelta(seconds=1),
+    ) -> None:
+        self.redis = redis
+        self.channel_prefix = channel_prefix
+        self.max_queue_size = max_queue_size
+        self.reconnect_delay = reconnect_delay
+        # channel name -> queues of all connected websockets of the workspace
+        self.websockets: Dict[str, Set[WebsocketQueue]] = defaultdict(set)
+        self.reader: Optional[asyncio.Task[Any]] = None
+
+    async def start(self) -> None:
+        self.reader = asyncio.create_task(self._read_messages())
+
+    async def stop(self) -> None:
+        await stop_running_task(self.reader)
+        self.reader = None
+
+    @asynccontextmanager
+    async def connect(self, workspace_id: WorkspaceId, websocket: WebSocket) -> AsyncIterator[None]:
+        channel = f"{self.channel_prefix}{workspace_id}"
+        queue = WebsocketQueue(websocket, self.max_queue_size)
+        self.websockets[channel].add(queue)
+        WebsocketConnections.inc()
+        sender = asyncio.create_task(queue.send_messages())
+        try:
+            yield None
+        finally:
+            if (queues := self.websockets.get(channel)) is not None:
+                queues.discard(queue)
+                if not queues:
+                    del self.websockets[channel]
+            WebsocketConnections.dec()
+            queue.clear()
+            await stop_running_task(sender)
+
+    async def _read_messages(self) -> None:
+        while True:
+            pubsub = self.redis.pubsub()
+            try:
+                await pubsub.psubscribe(f"{self.channel_prefix}*")
+                while True:
+                    # timeout: waiting time for a message to be received in seconds
+                    msg = await pubsub.get_message(ignore_subscribe_messages=True, timeout=30)
+                    if msg is not None:
+                        self.dispatch(msg["channel"], msg["data"])
+            except Exception as ex:
+                log.warning(f"Could not read websocket events: {ex}. Reconnect.")
+                await asyncio.sleep(self.reconnect_delay.total_seconds())
+            finally:
+                await pubsub.aclose()  # type: ignore
+
+    def dispatch(self, channel: str, data: str) -> None:
+        # events of workspaces without connected websockets are not decoded
+        if not (queues := self.websockets.get(channel)):
+            return
+        try:
+            js = json.loads(data)
+            event = {
+                "type": "event",
+                "id": js["id"],
+                "at": utc_str(parse_utc_str(js["at"])),
+                "publisher": js["publisher"],
+                "kind": js["kind"],
+                "data": js["data"],
+            }
+            message = json.dumps(event, separators=(",", ":"), ensure_ascii=False)
+        except Exception as ex:
+            log.error(f"Invalid event received on {channel}: {ex}. Ignore.")
+            return
+        for queue in queues:
+            queue.offer(message)
@@ -13,18 +13,14 @@
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-import hashlib
-from typing import Any, Dict, List, Optional
-from cryptography.hazmat.primitives import serialization
+from typing import Any, Dict, List, Mapping, Optional
 from cryptography.hazmat.primitives.asymmetric import rsa
 import jwt
-from fixbackend.certificates.cert_store import CertificateStore
+from fixbackend.certificates.cert_store import CertificateStore, key_id as public_key_id
 
 
 def kid(key: rsa.RSAPublicKey) -> str:
-    return hashlib.sha256(key.public_bytes(serialization.Encoding.PEM, serialization.PublicFormat.PKCS1)).hexdigest()[
-        0:8
-    ]
+    return public_key_id(key)
 
 
 ALGORITHM = "RS256"
@@ -44,6 +40,13 @@ def encode_token(
 
 
 def decode_token(token: str, audience: List[str], public_keys: List[rsa.RSAPublicKey]) -> Optional[Dict[str, Any]]:
+    # poor man JWKS
+    return decode_token_by_kid(token, audience, {kid(key): key for key in public_keys})
+
+
+def decode_token_by_kid(
+    token: str, audience: List[str], available_keys: Mapping[str, rsa.RSAPublicKey]
+) -> Optional[Dict[str, Any]]:
     # try to decode the token without verifying the signature to get the key id
     try:
         unverified = jwt.api_jwt.decode_complete(token, options={"verify_signature": False})
@@ -53,11 +56,6 @@ def decode_token(token: str, audience: List[str], public_keys: List[rsa.RSAPubli
     header = unverified["header"]
     key_id = header.get("kid")
 
-    public_key = None
-
-    # poor man JWKS
-    available_keys = {kid(key): key for key in public_keys}
-
     if not (key_id in available_keys):
         return None
 
@@ -80,6 +78,4 @@ class JwtService:
         return encode_token(payload, audience, newest_key)
 
     async def decode(self, token: str, audience: List[str]) -> Optional[Dict[str, Any]]:
-        key_pair = await self.cert_store.get_signing_cert_key_pair()
-        public_keys = [key.private_key.public_key() for key in key_pair]
-        return decode_token(token, audience, public_keys)
+        return decode_token_by_kid(token, audience, await self.cert_store.public_keys_by_kid())
@@ -0,0 +1,162 @@
+#  Copyright (c) 2024. Some Engineering
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import hashlib
+import math
+from bisect import bisect_right
+from typing import Dict, Iterator, List, Mapping, Optional, Tuple
+
+from attrs import evolve, frozen
+
+from fixbackend.ids import WorkspaceId
+
+
+@frozen
+class ServerLoad:
+    tenants: int = 0
+    resources: int = 0
+
+    def add(self, resources: int) -> "ServerLoad":
+        return evolve(self, tenants=self.tenants + 1, resources=self.resources + resources)
+
+
+@frozen
+class TenantMove:
+    workspace_id: WorkspaceId
+    source: str
+    target: str
+    resources: int
+
+
+@frozen
+class RebalancePlan:
+    moves: List[TenantMove]
+    loads_before: Dict[str, ServerLoad]
+    loads_after: Dict[str, ServerLoad]
+
+
+def ring_hash(key: str) -> int:
+    return int.from_bytes(hashlib.sha256(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    Consistent hash ring with virtual nodes.
+    Every server owns a number of virtual nodes proportional to its weight.
+    Adding or removing a server only moves the keys owned by the virtual nodes of this server.
+    """
+
+    def __init__(self, weights: Mapping[str, float], *, virtual_nodes: int = 100) -> None:
+        self.weights = {server: weight for server, weight in weights.items() if weight > 0}
+        if not self.weights:
+            raise ValueError("The ring needs at least one server with a positive weight")
+        nodes: List[Tuple[int, str]] = []
+        for server, weight in self.weights.items():
+            for num in range(max(1, round(virtual_nodes * weight))):
+                nodes.append((ring_hash(f"{server}#{num}"), server))
+        nodes.sort()
+        self.hashes = [h for h, _ in nodes]
+        self.servers = [s for _, s in nodes]
+
+    def candidates(self, key: str) -> Iterator[str]:
+        """All servers in ring order, starting with the owner of the given key."""
+        start = bisect_right(self.hashes, ring_hash(key))
+        seen = set()
+        for idx in range(len(self.servers)):
+            server = self.servers[(start + idx) % len(self.servers)]
+            if server not in seen:
+                seen.add(server)
+                yield server
+                if len(seen) == len(self.weights):
+                    return
+
+    def server_for(self, key: str) -> str:
+        return next(self.candidates(key))
+
+
+class PlacementEngine:
+    """
+    Places tenants on servers with consistent hashing and bounded loads:
+    a tenant is placed on the first server in ring order, that stays below its share of the total load,
+    regarding the number of tenants and the number of resources. The share is defined by the server weight.
+    The load factor defines how much a server may exceed its share.
+    """
+
+    def __init__(self, ring: HashRing, *, load_factor: float = 1.25) -> None:
+        self.ring = ring
+        self.load_factor = load_factor
+        self.total_weight = sum(ring.weights.values())
+
+    def fits(self, server: str, load: ServerLoad, totals: ServerLoad) -> bool:
+        """True, if the given load of the server does not exceed its share of the total load."""
+        share = self.ring.weights[server] / self.total_weight
+        if load.tenants > math.ceil(self.load_factor * totals.tenants * share):
+            return False
+        # a server can always hold one tenant, even if it is larger than the share of the server
+        if load.tenants > 1 and load.resources > math.ceil(self.load_factor * totals.resources * share):
+            return False
+        return True
+
+    def place(
+        self,
+        workspace_id: WorkspaceId,
+        loads: Mapping[str, ServerLoad],
+        resources: int = 0,
+        *,
+        totals: Optional[ServerLoad] = None,
+        preferred: Optional[str] = None,
+    ) -> str:
+        """
+        Select the server for the given tenant.
+        :param loads: the current load of all servers.
+        :param resources: the number of resources of the tenant.
+        :param totals: the total load to compute the share of a server. Defaults to the loads including this tenant.
+        :param preferred: the server to use, if it has capacity left (e.g. the current server of the tenant).
+        """
+        if totals is None:
+            totals = ServerLoad(
+                sum(load.tenants for server, load in loads.items() if server in self.ring.weights),
+                sum(load.resources for server, load in loads.items() if server in self.ring.weights),
+            ).add(resources)
+        if preferred is not None and preferred in self.ring.weights:
+            if self.fits(preferred, loads.get(preferred, ServerLoad()).add(resources), totals):
+                return preferred
+        for server in self.ring.candidates(str(workspace_id)):
+            if self.fits(server, loads.get(server, ServerLoad()).add(resources), totals):
+                return server
+        # all servers are above their share
+        if preferred is not None and preferred in self.ring.weights:
+            return preferred
+        return self.ring.server_for(str(workspace_id))
+
+    def plan(self, assignments: Mapping[WorkspaceId, str], resources: Mapping[WorkspaceId, int]) -> RebalancePlan:
+        """
+        Dry run: compute the placement of all tenants with the servers of this engine.
+        A tenant stays on its current server, as long as the server is part of the ring and has capacity left.
+        Tenants are placed by size, the largest first, so mostly small tenants are moved.
+        Returns all tenants that would move and the loads before and after the move.
+        """
+        loads_before: Dict[str, ServerLoad] = {}
+        for workspace_id, server in assignments.items():
+            loads_before[server] = loads_before.get(server, ServerLoad()).add(resources.get(workspace_id, 0))
+        totals = ServerLoad(len(assignments), sum(resources.get(wid, 0) for wid in assignments))
+        loads_after: Dict[str, ServerLoad] = {server: ServerLoad() for server in self.ring.weights}
+        moves: List[TenantMove] = []
+        for workspace_id in sorted(assignments, key=lambda wid: (-resources.get(wid, 0), str(wid))):
+            tenant_resources = resources.get(workspace_id, 0)
+            source = assignments[workspace_id]
+            target = self.place(workspace_id, loads_after, tenant_resources, totals=totals, preferred=source)
+            loads_after[target] = loads_after[target].add(tenant_resources)
+            if source != target:
+                moves.append(TenantMove(workspace_id, source, target, tenant_resources))
+        return RebalancePlan(moves, loads_before, loads_after)
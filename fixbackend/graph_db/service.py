@@ -19,22 +19,26 @@
 #
 #  You should have received a copy of the GNU Affero General Public License
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
-import hashlib
 import logging
 import secrets
 import string
-from typing import Optional
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
 
 from fastapi_users_db_sqlalchemy.generics import GUID
 from fixcloudutils.service import Service
-from sqlalchemy import String
+from fixcloudutils.util import utc
+from sqlalchemy import String, func, select
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Mapped, mapped_column
 
 from fixbackend.base_model import Base
 from fixbackend.config import Config
 from fixbackend.graph_db.models import GraphDatabaseAccess
+from fixbackend.graph_db.placement import HashRing, PlacementEngine, RebalancePlan, ServerLoad
 from fixbackend.ids import WorkspaceId
+from fixbackend.metering.metering_repository import MeteringRepository
 from fixbackend.types import AsyncSessionMaker
 
 log = logging.getLogger(__name__)
@@ -60,9 +64,23 @@ class GraphDatabaseAccessEntity(Base):
 
 
 class GraphDatabaseAccessManager(Service):
-    def __init__(self, config: Config, session_maker: AsyncSessionMaker) -> None:
+    """
+    Creates and looks up the graph database access of workspaces.
+    The access of a workspace does not change once it is created: lookups are served from an in-process LRU cache.
+    The access contains the database password: it is never cached outside of this process.
+    """
+
+    def __init__(self, config: Config, session_maker: AsyncSessionMaker, *, cache_size: int = 10_000) -> None:
         self.config = config
         self.session_maker = session_maker
+        self.cache_size = cache_size
+        self.cache: OrderedDict[WorkspaceId, GraphDatabaseAccess] = OrderedDict()
+        # the resources of a tenant are taken from the collects in this time frame
+        self.resources_window = timedelta(days=2)
+        # the server loads are computed from metering: reuse them for this time frame
+        self.loads_ttl = timedelta(minutes=10)
+        self._placement: Optional[PlacementEngine] = None
+        self._loads: Optional[Tuple[datetime, Dict[str, ServerLoad]]] = None
 
     async def create_database_access(
         self, workspace_id: WorkspaceId, *, session: Optional[AsyncSession] = None
@@ -76,15 +94,22 @@ class GraphDatabaseAccessManager(Service):
         """
 
         log.info(f"Create new database access for tenant {workspace_id}")
+        if session is not None:
+            server = await self._database_for(workspace_id, session)
+        else:
+            async with self.session_maker() as s:
+                server = await self._database_for(workspace_id, s)
         db_access_entity = GraphDatabaseAccessEntity(
             tenant_id=workspace_id,
-            server=self._database_for(workspace_id),
+            server=server,
             username=str(workspace_id),
             password=self._generate_password(PasswordLength),
             database=f"db-{workspace_id}",  # name needs to start with a letter!
         )
         db_access = db_access_entity.access()
 
+        # the transaction of the given session might not be committed yet: do not cache the access here
+        self.evict(workspace_id)
         if session is not None:
             session.add(db_access_entity)
         else:
@@ -94,17 +119,122 @@ class GraphDatabaseAccessManager(Service):
         return db_access
 
     async def get_database_access(self, workspace_id: WorkspaceId) -> Optional[GraphDatabaseAccess]:
-        async with self.session_maker() as session:
-            if entity := await session.get(GraphDatabaseAccessEntity, workspace_id):
-                return entity.access()
-            return None
-
-    def _database_for(self, workspace_id: WorkspaceId) -> str:
-        # use consistent hashing to select a server from the list of available servers
-        hashed_key = int(hashlib.sha256(str(workspace_id).encode()).hexdigest(), 16)
-        if not self.config.available_db_server or self.config.available_db_server == [""]:
+        if access := self._from_cache(workspace_id):
+            return access
+        return (await self.get_database_access_many([workspace_id])).get(workspace_id)
+
+    async def get_database_access_many(
+        self, workspace_ids: Sequence[WorkspaceId]
+    ) -> Dict[WorkspaceId, GraphDatabaseAccess]:
+        """
+        Get the database access of all given tenants. Tenants without access are not included.
+        Accesses that are not cached are loaded with one database round trip.
+        """
+        result: Dict[WorkspaceId, GraphDatabaseAccess] = {}
+        missing: List[WorkspaceId] = []
+        for workspace_id in dict.fromkeys(workspace_ids):
+            if access := self._from_cache(workspace_id):
+                result[workspace_id] = access
+            else:
+                missing.append(workspace_id)
+        if missing:
+            async with self.session_maker() as session:
+                statement = select(GraphDatabaseAccessEntity).where(GraphDatabaseAccessEntity.tenant_id.in_(missing))
+                loaded = [entity.access() for entity in (await session.execute(statement)).scalars()]
+            for access in loaded:
+                result[access.workspace_id] = self._to_cache(access)
+            # tenants without access are not cached: the access might be created later
+        return result
+
+    def evict(self, workspace_id: WorkspaceId) -> None:
+        """
+        Remove the access of the given tenant from the cache of this instance.
+        Needs to be called, when the database access is changed or deleted.
+        """
+        self.cache.pop(workspace_id, None)
+
+    def _from_cache(self, workspace_id: WorkspaceId) -> Optional[GraphDatabaseAccess]:
+        if access := self.cache.get(workspace_id):
+            self.cache.move_to_end(workspace_id)
+        return access
+
+    def _to_cache(self, access: GraphDatabaseAccess) -> GraphDatabaseAccess:
+        self.cache[access.workspace_id] = access
+        self.cache.move_to_end(access.workspace_id)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return access
+
+    def server_weights(self, changes: Sequence[str] = ()) -> Dict[str, float]:
+        """
+        Weights of all available servers.
+        :param changes: changed weights in the format server=weight. Unknown servers are added.
+        """
+        servers = [server for server in self.config.available_db_server if server]
+        if not servers:
             raise RuntimeError("No available_db_server defined in the config")
-        return self.config.available_db_server[hashed_key % len(self.config.available_db_server)]
+        weights = {server: 1.0 for server in servers}
+        for entry in self.config.db_server_weights:
+            server, _, weight = entry.rpartition("=")
+            if server in weights:
+                weights[server] = float(weight)
+            else:
+                log.warning(f"Weight defined for unknown db server {server}. Ignore.")
+        for entry in changes:
+            server, _, weight = entry.rpartition("=")
+            weights[server] = float(weight)
+        return weights
+
+    @property
+    def placement(self) -> PlacementEngine:
+        if self._placement is None:
+            self._placement = PlacementEngine(HashRing(self.server_weights()))
+        return self._placement
+
+    async def server_loads(self, session: AsyncSession) -> Dict[str, ServerLoad]:
+        """Number of tenants and resources of all servers."""
+        resources = MeteringRepository.latest_resources(utc() - self.resources_window).subquery()
+        statement = (
+            select(
+                GraphDatabaseAccessEntity.server,
+                func.count(GraphDatabaseAccessEntity.tenant_id),
+                func.coalesce(func.sum(resources.c.resources), 0),
+            )
+            .outerjoin(resources, resources.c.tenant_id == GraphDatabaseAccessEntity.tenant_id)
+            .group_by(GraphDatabaseAccessEntity.server)
+        )
+        return {
+            server: ServerLoad(tenants, int(resource_count))
+            for server, tenants, resource_count in (await session.execute(statement)).all()
+        }
+
+    async def plan_rebalance(self, weights: Mapping[str, float], *, load_factor: float = 1.25) -> RebalancePlan:
+        """
+        Dry run: compute which tenants would move, if the servers had the given weights.
+        Add a server by adding it to the weights, drain a server by removing it or setting its weight to 0.
+        Nothing is changed.
+        """
+        async with self.session_maker() as session:
+            statement = select(GraphDatabaseAccessEntity.tenant_id, GraphDatabaseAccessEntity.server)
+            assignments = {tenant_id: server for tenant_id, server in (await session.execute(statement)).all()}
+            resources_query = MeteringRepository.latest_resources(utc() - self.resources_window)
+            resources = {wid: int(count) for wid, count in (await session.execute(resources_query)).all()}
+        engine = PlacementEngine(HashRing(weights), load_factor=load_factor)
+        return engine.plan(assignments, resources)
+
+    async def _current_loads(self, session: AsyncSession) -> Dict[str, ServerLoad]:
+        now = utc()
+        if self._loads is None or self._loads[0] + self.loads_ttl < now:
+            self._loads = (now, await self.server_loads(session))
+        return self._loads[1]
+
+    async def _database_for(self, workspace_id: WorkspaceId, session: AsyncSession) -> str:
+        # consistent hashing with bounded loads: servers with more than their share of tenants or resources are skipped
+        loads = await self._current_loads(session)
+        server = self.placement.place(workspace_id, loads)
+        # new tenants have no resources yet: count the tenant until the loads are computed again
+        loads[server] = loads.get(server, ServerLoad()).add(0)
+        return server
 
     def _generate_password(self, length: int) -> str:
         alphabet = string.ascii_letters + string.digits + string.punctuation
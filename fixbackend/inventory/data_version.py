@@ -0,0 +1,47 @@
+#  Copyright (c) 2024. Some Engineering
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import uuid
+from typing import Optional
+
+from fixbackend.ids import WorkspaceId
+from fixbackend.types import Redis
+
+
+class WorkspaceDataVersion:
+    """
+    Version of the data of a workspace in the inventory.
+    The version is advanced, whenever the data changes: the workspace has been collected, or it has been configured.
+    Everything derived from the data of a workspace can be identified by this version.
+    A version is a random token: a lost key creates a new version and never reuses a former one.
+    """
+
+    def __init__(self, redis: Redis) -> None:
+        self.redis = redis
+
+    def key(self, workspace_id: WorkspaceId) -> str:
+        return f"inventory:data_version:{workspace_id}"
+
+    async def current(self, workspace_id: WorkspaceId) -> str:
+        version: Optional[str] = await self.redis.get(self.key(workspace_id))
+        if version is None:
+            # only one of concurrent callers can create the version
+            await self.redis.set(self.key(workspace_id), uuid.uuid4().hex, nx=True)
+            version = await self.redis.get(self.key(workspace_id))
+        assert version is not None, "data version must exist"
+        return version
+
+    async def advance(self, workspace_id: WorkspaceId) -> str:
+        version = uuid.uuid4().hex
+        await self.redis.set(self.key(workspace_id), version)
+        return version
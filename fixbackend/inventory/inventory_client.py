@@ -19,8 +19,12 @@
 #
 #  You should have received a copy of the GNU Affero General Public License
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import asyncio
 import json
 import logging
+import re
+import shlex
+import time
 from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 from typing import (
@@ -39,13 +43,16 @@ from typing import (
     Any,
     AsyncGenerator,
     AsyncContextManager,
+    Sequence,
 )
 
+from attrs import frozen
 from fixcloudutils.service import Service
 from fixcloudutils.types import Json, JsonElement
 from fixcloudutils.util import utc_str
-from httpx import AsyncClient, Response, ReadTimeout, ConnectError
+from httpx import AsyncClient, Response, ReadTimeout, ConnectError, PoolTimeout, TransportError
 from httpx._types import QueryParamTypes
+from prometheus_client import Counter, Gauge, Histogram
 
 from fixbackend.errors import ClientError
 from fixbackend.graph_db.models import GraphDatabaseAccess
@@ -53,14 +60,76 @@ from fixbackend.ids import CloudAccountId, NodeId, SecurityCheckId
 from fixbackend.inventory.inventory_schemas import CompletePathRequest, HistoryChange
 
 T = TypeVar("T")
-ContextHeaders = {"Total-Count", "Result-Count"}
+ContextHeaders = {"Total-Count", "Result-Count", "Next-Cursor"}
 MediaTypeText = "text/plain"
 MediaTypeJson = "application/json"
 MediaTypeNdJson = "application/ndjson"
 ExpectMediaTypeNdJson = {"application/x-ndjson", MediaTypeNdJson}
+MediaTypeMultipartMixed = "multipart/mixed"
 DefaultGraph = "fix"
 DefaultSection = "reported"
+JsonDecoder = Callable[[str], Any]
 log = logging.getLogger(__name__)
+GraphDbRequestDuration = Histogram(
+    "inventory_graph_db_request_duration",
+    "Time to execute an inventory request (until the response is consumed) per graph db server",
+    ["server"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+GraphDbRequestErrors = Counter(
+    "inventory_graph_db_request_errors", "Failed or rejected inventory requests per graph db server", ["server", "kind"]
+)
+GraphDbPoolUtilisation = Gauge(
+    "inventory_graph_db_pool_utilisation", "Ratio of used connections of the pool of a graph db server", ["server"]
+)
+GraphDbPoolWaiting = Gauge(
+    "inventory_graph_db_pool_waiting", "Number of requests waiting for a connection to a graph db server", ["server"]
+)
+GraphDbCircuitOpen = Gauge(
+    "inventory_graph_db_circuit_open", "1 if requests to a graph db server are rejected, otherwise 0", ["server"]
+)
+
+
+def json_decoder(*backends: str) -> JsonDecoder:
+    """
+    Return the json decode function of the first installed backend.
+    Supported backends are orjson, msgspec and json (stdlib, always available).
+    """
+    for backend in backends or ("orjson", "msgspec"):
+        try:
+            if backend == "orjson":
+                import orjson
+
+                return orjson.loads  # type: ignore
+            elif backend == "msgspec":
+                import msgspec
+
+                return msgspec.json.decode  # type: ignore
+            elif backend == "json":
+                return json.loads
+        except ImportError:
+            log.debug(f"Json backend {backend} is not installed.")
+    return json.loads
+
+
+def multipart_bodies(response: Response) -> List[bytes]:
+    """
+    Split the content of a multipart response into the bodies of all parts.
+    Every part consists of a delimiter line, the part headers, an empty line and the body.
+    """
+    _, _, boundary = response.headers.get("content-type", "").partition("boundary=")
+    boundary = boundary.split(";")[0].strip().strip('"')
+    delimiter = re.compile(rb"(?:\r\n)?--" + re.escape(boundary.encode("utf-8")) + rb"(?:--)?[ \t]*(?:\r\n|$)")
+    bodies: List[bytes] = []
+    for part in delimiter.split(response.content):
+        if not part.strip():  # preamble, epilogue or the gap between a closed part and the next one
+            continue
+        if part.startswith(b"\r\n"):  # no part headers
+            bodies.append(part[2:])
+        else:
+            _, _, body = part.partition(b"\r\n\r\n")
+            bodies.append(body)
+    return bodies
 
 
 class InventoryException(ClientError):
@@ -85,6 +154,170 @@ class InventoryRequestTookTooLong(InventoryException):
     pass
 
 
+@frozen
+class TimeseriesQuery:
+    name: str
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+    group: Optional[Set[str]] = None
+    filter_group: Optional[List[str]] = None
+    granularity: Optional[int | timedelta] = None
+    aggregation: Optional[str] = None
+
+    def body(self) -> Json:
+        body: Json = {}
+        if self.start:
+            body["start"] = utc_str(self.start)
+        if self.end:
+            body["end"] = utc_str(self.end)
+        if self.group is not None:
+            body["group"] = list(self.group)
+        if self.filter_group is not None:
+            body["filter"] = self.filter_group
+        if self.granularity:
+            granularity = self.granularity
+            body["granularity"] = granularity if isinstance(granularity, int) else f"{granularity.total_seconds()}s"
+        if self.aggregation:
+            body["aggregation"] = self.aggregation
+        return body
+
+    def command(self) -> str:
+        # the timeseries command takes the same parameters as the body of the timeseries endpoint
+        args = ["timeseries get --name", shlex.quote(self.name)]
+        for name, value in self.body().items():
+            values = value if isinstance(value, list) else [value]
+            args.extend([f"--{name}", *(shlex.quote(str(v)) for v in values)])
+        return " ".join(args)
+
+
+class CircuitBreaker:
+    """
+    Tracks the health of a graph db server.
+    The circuit opens after `failure_threshold` consecutive failures and rejects all requests.
+    After `reset_timeout` a single probe request is let through (half open), all other requests are still rejected:
+    a successful probe closes the circuit, a failed probe opens it again.
+    If the probe does not report back within `reset_timeout`, the next request is used as probe.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: timedelta = timedelta(seconds=30)) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probe_started_at: Optional[float] = None
+
+    @property
+    def state(self) -> Literal["closed", "open", "half_open"]:
+        if self.opened_at is None:
+            return "closed"
+        elif time.monotonic() - self.opened_at < self.reset_timeout.total_seconds():
+            return "open"
+        else:
+            return "half_open"
+
+    def allow(self) -> bool:
+        """
+        True, if a request may be sent to the server.
+        In the half open state, the first request is allowed and becomes the probe.
+        """
+        state = self.state
+        if state != "half_open":
+            return state == "closed"
+        now = time.monotonic()
+        if self.probe_started_at is not None and now - self.probe_started_at < self.reset_timeout.total_seconds():
+            return False
+        self.probe_started_at = now
+        return True
+
+    def success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self.probe_started_at = None
+
+    def failure(self) -> None:
+        self.failures += 1
+        self.probe_started_at = None
+        if self.failures >= self.failure_threshold:
+            # also restarts the timeout, if a request in the half open state has failed
+            self.opened_at = time.monotonic()
+
+    def unknown(self) -> None:
+        # the request does not tell anything about the health of the server: the next request might be the probe
+        self.probe_started_at = None
+
+
+class ServerPool:
+    """
+    Connections to one graph db server.
+    At most `max_connections` requests are executed at the same time, at most `max_waiting` requests wait for a
+    connection. Requests are rejected with GraphDatabaseNotAvailable, if the server is saturated or the circuit is open.
+    """
+
+    def __init__(
+        self, server: str, client: AsyncClient, max_connections: int, max_waiting: int, breaker: CircuitBreaker
+    ) -> None:
+        self.server = server
+        self.client = client
+        self.max_connections = max_connections
+        self.max_waiting = max_waiting
+        self.breaker = breaker
+        self.semaphore = asyncio.Semaphore(max_connections)
+        self.in_use = 0
+        self.waiting = 0
+
+    @staticmethod
+    def is_failure(ex: Exception) -> bool:
+        # client errors are no indication of an unhealthy server.
+        # Read timeouts are reported as client error (408): a long-running query does not open the circuit.
+        if isinstance(ex, ReadTimeout):
+            return False
+        return isinstance(ex, TransportError) or (isinstance(ex, InventoryException) and ex.status in (502, 503, 504))
+
+    def _reject(self, kind: str, message: str) -> GraphDatabaseNotAvailable:
+        GraphDbRequestErrors.labels(self.server, kind).inc()
+        return GraphDatabaseNotAvailable(503, f"Graph database server {self.server} {message}")
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[AsyncClient]:
+        if self.semaphore.locked() and self.waiting >= self.max_waiting:
+            raise self._reject("saturated", "is saturated")
+        if not self.breaker.allow():
+            raise self._reject("circuit_open", "is not available")
+        self.waiting += 1
+        GraphDbPoolWaiting.labels(self.server).set(self.waiting)
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.waiting -= 1
+            GraphDbPoolWaiting.labels(self.server).set(self.waiting)
+        self.in_use += 1
+        GraphDbPoolUtilisation.labels(self.server).set(self.in_use / self.max_connections)
+        start = time.perf_counter()
+        try:
+            yield self.client
+        except Exception as ex:
+            if self.is_failure(ex):
+                GraphDbRequestErrors.labels(self.server, "failed").inc()
+                self.breaker.failure()
+            elif isinstance(ex, ReadTimeout):
+                self.breaker.unknown()
+            else:
+                self.breaker.success()
+            raise
+        except BaseException:
+            # e.g. cancelled
+            self.breaker.unknown()
+            raise
+        else:
+            self.breaker.success()
+        finally:
+            GraphDbRequestDuration.labels(self.server).observe(time.perf_counter() - start)
+            GraphDbCircuitOpen.labels(self.server).set(1 if self.breaker.state == "open" else 0)
+            self.in_use -= 1
+            GraphDbPoolUtilisation.labels(self.server).set(self.in_use / self.max_connections)
+            self.semaphore.release()
+
+
 class AsyncIteratorWithContext(Generic[T]):
     def __init__(self, response: Response, fn: Optional[Callable[[str], T]] = None) -> None:
         self.response = response
@@ -99,11 +332,72 @@ class AsyncIteratorWithContext(Generic[T]):
         line = await self.it.__anext__()
         return self.fn(line)
 
+    def aiter_lines(self) -> AsyncIterator[str]:
+        """
+        Iterate the raw lines of the ndjson response, without decoding any element.
+        """
+        return self.it
+
+    def aiter_bytes(self) -> AsyncIterator[bytes]:
+        """
+        Iterate the raw bytes of the ndjson response in chunks as received, without decoding any element.
+        Use this instead of iterating this object, if the elements are only forwarded.
+        """
+        return self.response.aiter_bytes()
+
 
 class InventoryClient(Service):
-    def __init__(self, inventory_url: str, client: AsyncClient) -> None:
+    def __init__(
+        self,
+        inventory_url: str,
+        client: AsyncClient,
+        *,
+        decoder: Optional[JsonDecoder] = None,
+        client_factory: Optional[Callable[[], AsyncClient]] = None,
+        max_connections_per_server: int = 64,
+        max_waiting_per_server: int = 256,
+        failure_threshold: int = 5,
+        reset_timeout: timedelta = timedelta(seconds=30),
+    ) -> None:
         self.inventory_url = inventory_url
         self.client = client
+        # every graph db server gets its own connection pool, so a slow server can not exhaust the pool of others.
+        # Without a factory, all servers share the connections of the client, but are still limited independently.
+        self.client_factory = client_factory
+        self.max_connections_per_server = max_connections_per_server
+        self.max_waiting_per_server = max_waiting_per_server
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.server_pools: Dict[str, ServerPool] = {}
+        # decoder used for every element of a streamed ndjson response
+        self.decoder = decoder or json_decoder()
+
+    async def stop(self) -> None:
+        pools, self.server_pools = self.server_pools, {}
+        if self.client_factory is not None:
+            for pool in pools.values():
+                await pool.client.aclose()
+
+    def _server_pool(self, server: str) -> ServerPool:
+        if (pool := self.server_pools.get(server)) is None:
+            pool = ServerPool(
+                server,
+                self.client_factory() if self.client_factory else self.client,
+                self.max_connections_per_server,
+                self.max_waiting_per_server,
+                CircuitBreaker(self.failure_threshold, self.reset_timeout),
+            )
+            self.server_pools[server] = pool
+        return pool
+
+    @asynccontextmanager
+    async def _connection(self, headers: Optional[Dict[str, str]]) -> AsyncIterator[AsyncClient]:
+        # requests are routed by the inventory to the graph db server defined in the header
+        if headers is None or (server := headers.get("FixGraphDbServer")) is None:
+            yield self.client
+        else:
+            async with self._server_pool(server).connection() as client:
+                yield client
 
     async def _check_response(
         self,
@@ -140,11 +434,17 @@ class InventoryClient(Service):
         read_content: bool = False,
     ) -> Response:
         try:
-            response = await self.client.request(
-                method, self.inventory_url + path, params=params, headers=headers, content=content, json=json
-            )
-            if read_content:
-                await response.aread()
+            async with self._connection(headers) as client:
+                response = await client.request(
+                    method, self.inventory_url + path, params=params, headers=headers, content=content, json=json
+                )
+                if read_content:
+                    await response.aread()
+                await self._check_response(response, expected_media_types, allowed_error_codes)
+                return response
+        except PoolTimeout as e:
+            log.warning(f"No connection to inventory available: {e}")
+            raise GraphDatabaseNotAvailable(503, f"No connection to inventory available: {e}") from e
         except ConnectError as e:
             log.exception(f"Can not connect to inventory: {e}")
             raise InventoryException(502, f"Can not connect to inventory: {e}") from e
@@ -152,9 +452,6 @@ class InventoryClient(Service):
             log.warning(f"Request took too long: {e}")
             # If the request takes longer than the defined timeout, we define this as client error (4xx)
             raise InventoryRequestTookTooLong(408, f"Request took too long: {e}") from e
-        else:
-            await self._check_response(response, expected_media_types, allowed_error_codes)
-            return response
 
     @asynccontextmanager
     async def _stream(
@@ -170,12 +467,15 @@ class InventoryClient(Service):
         allowed_error_codes: Optional[Set[int]] = None,
     ) -> AsyncGenerator[AsyncIteratorWithContext[Json], None]:
         try:
-            async with self.client.stream(
-                method, self.inventory_url + path, params=params, headers=headers, content=content, json=json
-            ) as response:
-                await self._check_response(response, expected_media_types, allowed_error_codes)
-                yield AsyncIteratorWithContext(response)
-
+            async with self._connection(headers) as client:
+                async with client.stream(
+                    method, self.inventory_url + path, params=params, headers=headers, content=content, json=json
+                ) as response:
+                    await self._check_response(response, expected_media_types, allowed_error_codes)
+                    yield AsyncIteratorWithContext(response, self.decoder)
+        except PoolTimeout as e:
+            log.warning(f"No connection to inventory available: {e}")
+            raise GraphDatabaseNotAvailable(503, f"No connection to inventory available: {e}") from e
         except ConnectError as e:
             log.exception(f"Can not connect to inventory: {e}")
             raise InventoryException(502, f"Can not connect to inventory: {e}") from e
@@ -207,6 +507,33 @@ class InventoryClient(Service):
             expected_media_types=ExpectMediaTypeNdJson,
         )
 
+    async def execute_many(
+        self, access: GraphDatabaseAccess, commands: Sequence[str], *, env: Optional[Dict[str, str]] = None
+    ) -> List[List[JsonElement]]:
+        """
+        Execute a batch of commands with a single request and return the result of every command in order.
+        The commands are chained with `;`: the inventory executes them one after the other
+        and answers with one part per command in a multipart/mixed response.
+        """
+        log.info(f"Execute {len(commands)} commands: {commands}")
+        if not commands:
+            return []
+        response = await self._request(
+            "POST",
+            "/cli/execute",
+            content="; ".join(commands),
+            params=env,
+            headers=self.__headers(access, accept=MediaTypeNdJson, content_type=MediaTypeText),
+            expected_media_types={MediaTypeMultipartMixed, *ExpectMediaTypeNdJson},
+            read_content=True,
+        )
+        media_type, *_ = response.headers.get("content-type", "").split(";")
+        # a single command is answered with a plain ndjson response
+        bodies = multipart_bodies(response) if media_type == MediaTypeMultipartMixed else [response.content]
+        if len(bodies) != len(commands):
+            raise InventoryException(500, f"Expected {len(commands)} results, but got {len(bodies)}")
+        return [[self.decoder(line) for line in body.decode("utf-8").splitlines() if line] for body in bodies]
+
     def search(
         self,
         access: GraphDatabaseAccess,
@@ -511,28 +838,25 @@ class InventoryClient(Service):
             f"group: {group}, filter: {filter_group}, granularity: {granularity}"
         )
         headers = self.__headers(access, accept=MediaTypeNdJson, content_type=MediaTypeJson)
-        body: Json = {}
-        if start:
-            body["start"] = utc_str(start)
-        if end:
-            body["end"] = utc_str(end)
-        if group is not None:
-            body["group"] = list(group)
-        if filter_group is not None:
-            body["filter"] = filter_group
-        if granularity:
-            value = granularity if isinstance(granularity, int) else f"{granularity.total_seconds()}s"
-            body["granularity"] = value
-        if aggregation:
-            body["aggregation"] = aggregation
+        query = TimeseriesQuery(name, start, end, group, filter_group, granularity, aggregation)
         return self._stream(
             "POST",
             f"/timeseries/{name}",
-            json=body,
+            json=query.body(),
             headers=headers,
             expected_media_types=ExpectMediaTypeNdJson,
         )
 
+    async def timeseries_many(
+        self, access: GraphDatabaseAccess, queries: Sequence[TimeseriesQuery]
+    ) -> List[List[Json]]:
+        """
+        Get the data of a batch of timeseries queries with a single request.
+        Returns the result of every query in the order of the queries.
+        """
+        log.info(f"Get {len(queries)} timeseries: {', '.join(q.name for q in queries)}")
+        return await self.execute_many(access, [q.command() for q in queries])  # type: ignore
+
     async def update_node(
         self,
         access: GraphDatabaseAccess,
@@ -555,6 +879,13 @@ class InventoryClient(Service):
         )
         return cast(Json, response.json())
 
+    async def version(self, access: GraphDatabaseAccess) -> str:
+        # version of the inventory: built-in checks and benchmarks can only change with a new version
+        response = await self._request(
+            "GET", "/system/version", headers=self.__headers(access, accept=MediaTypeText), read_content=True
+        )
+        return response.text.strip()
+
     async def config(self, access: GraphDatabaseAccess, config_id: str) -> Json:
         response = await self._request(
             "GET",
@@ -565,6 +896,16 @@ class InventoryClient(Service):
         )
         return response.json()  # type: ignore
 
+    async def config_ids(self, access: GraphDatabaseAccess) -> List[str]:
+        response = await self._request(
+            "GET",
+            "/configs",
+            headers=self.__headers(access, accept=MediaTypeJson),
+            expected_media_types=MediaTypeJson,
+            read_content=True,
+        )
+        return cast(List[str], response.json())
+
     async def update_config(
         self, access: GraphDatabaseAccess, config_id: str, update: Json, *, patch: bool = False
     ) -> Json:
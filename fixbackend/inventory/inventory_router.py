@@ -11,17 +11,19 @@
 #
 #  You should have received a copy of the GNU Affero General Public License
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import hashlib
 import logging
 from datetime import datetime, timedelta
-from typing import Annotated, List, Literal, Optional, AsyncIterator, Dict, Union
+from typing import Annotated, Any, Callable, List, Literal, Optional, AsyncIterator, Dict, Tuple, Union
 
-from fastapi import APIRouter, Body, Depends, Form, Path, Query, Request
+from fastapi import APIRouter, Body, Depends, Form, HTTPException, Path, Query, Request
 from fastapi.responses import JSONResponse, Response
 from fixcloudutils.types import Json, JsonElement
 
 from fixbackend.dependencies import FixDependencies, FixDependency, ServiceNames
 from fixbackend.graph_db.models import GraphDatabaseAccess
 from fixbackend.ids import NodeId, ProductTier, SecurityCheckId
+from fixbackend.inventory.inventory_client import AsyncIteratorWithContext
 from fixbackend.inventory.inventory_service import InventoryService
 from fixbackend.inventory.inventory_schemas import (
     CompletePathRequest,
@@ -40,11 +42,19 @@ from fixbackend.inventory.inventory_schemas import (
     KindUsage,
     KindUsageRequest,
 )
-from fixbackend.streaming_response import streaming_response, StreamOnSuccessResponse
+from fixbackend.streaming_response import (
+    streaming_response,
+    StreamOnSuccessResponse,
+    passthrough_response,
+    StreamChunk,
+)
 from fixbackend.workspaces.dependencies import UserWorkspaceDependency
+from fixbackend.workspaces.models import Workspace
 from fixcloudutils.util import utc
 
 log = logging.getLogger(__name__)
+# streamed results are sent to the client in chunks of this size
+StreamChunkSize = 64 * 1024
 
 
 async def get_current_graph_db(fix: FixDependency, workspace: UserWorkspaceDependency) -> GraphDatabaseAccess:
@@ -58,12 +68,47 @@ async def get_current_graph_db(fix: FixDependency, workspace: UserWorkspaceDepen
 CurrentGraphDbDependency = Annotated[GraphDatabaseAccess, Depends(get_current_graph_db)]
 
 
+def inventory_streaming_response(
+    accept: str,
+) -> Tuple[Callable[[AsyncIteratorWithContext[Any]], AsyncIterator[StreamChunk]], str]:
+    # json and ndjson results of the inventory are forwarded as is: no need to decode and encode every element
+    if passthrough := passthrough_response(accept):
+        passthrough_fn, media_type = passthrough
+        return lambda result: passthrough_fn(result.aiter_bytes()), media_type
+    return streaming_response(accept)
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    # If-None-Match is either * or a list of (weak) entity tags
+    tags = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return "*" in tags or etag in tags
+
+
+async def request_etag(request: Request, workspace: Workspace, data_version: str) -> str:
+    sha = hashlib.sha256(f"{data_version}:{workspace.current_product_tier()}:{request.url.path}".encode())
+    sha.update(str(sorted(request.query_params.multi_items())).encode())
+    sha.update(await request.body())
+    return f'"{sha.hexdigest()[:32]}"'
+
+
 def inventory_router(fix: FixDependencies) -> APIRouter:
     router = APIRouter(prefix="/{workspace_id}/inventory")
 
     def inventory() -> InventoryService:
         return fix.service(ServiceNames.inventory, InventoryService)
 
+    async def conditional_request(request: Request, response: Response, workspace: UserWorkspaceDependency) -> None:
+        # The response only changes with the data version of the workspace and the request parameters.
+        # A client that already has the current response gets a 304, without any call to the inventory.
+        etag = await request_etag(request, workspace, await inventory().data_version.current(workspace.id))
+        if (if_none_match := request.headers.get("if-none-match")) and etag_matches(if_none_match, etag):
+            raise HTTPException(status_code=304, headers={"ETag": etag})
+        response.headers["ETag"] = etag
+        # the client has to revalidate the response before using it
+        response.headers["Cache-Control"] = "private, no-cache"
+
+    ConditionalRequest = Depends(conditional_request)
+
     @router.get("/report/config", tags=["report-management"])
     async def report_config(graph_db: CurrentGraphDbDependency) -> ReportConfig:
         return await inventory().report_config(graph_db)
@@ -94,13 +139,11 @@ def inventory_router(fix: FixDependencies) -> APIRouter:
 
     @router.put("/report/benchmark/{benchmark_name}", tags=["report-management"])
     async def put_benchmark(benchmark_name: str, graph_db: CurrentGraphDbDependency, body: Json = Body()) -> Json:
-        return await inventory().client.call_json(graph_db, "put", f"/report/benchmark/{benchmark_name}", body=body)
+        return await inventory().put_benchmark(graph_db, benchmark_name, body)
 
     @router.delete("/report/benchmark/{benchmark_name}", tags=["report-management"])
     async def delete_benchmark(benchmark_name: str, graph_db: CurrentGraphDbDependency) -> Response:
-        await inventory().client.call_json(
-            graph_db, "delete", f"/report/benchmark/{benchmark_name}", expect_result=False
-        )
+        await inventory().delete_benchmark(graph_db, benchmark_name)
         return Response(status_code=204)
 
     @router.get("/report/checks", tags=["report-management"])
@@ -129,11 +172,11 @@ def inventory_router(fix: FixDependencies) -> APIRouter:
 
     @router.put("/report/check/{check_id}", tags=["report-management"])
     async def put_check(check_id: str, graph_db: CurrentGraphDbDependency, body: Json = Body()) -> Json:
-        return await inventory().client.call_json(graph_db, "put", f"/report/check/{check_id}", body=body)
+        return await inventory().put_check(graph_db, check_id, body)
 
     @router.delete("/report/check/{check_id}", tags=["report-management"])
     async def delete_check(check_id: str, graph_db: CurrentGraphDbDependency) -> Response:
-        await inventory().client.call_json(graph_db, "delete", f"/report/check/{check_id}", expect_result=False)
+        await inventory().delete_check(graph_db, check_id)
         return Response(status_code=204)
 
     @router.get("/report/benchmark/{benchmark_name}/result", tags=["report"])
@@ -146,18 +189,18 @@ def inventory_router(fix: FixDependencies) -> APIRouter:
         only_failing: bool = Query(False),
     ) -> StreamOnSuccessResponse:
         log.info(f"Show benchmark {benchmark_name} for tenant {graph_db.workspace_id}")
-        fn, media_type = streaming_response(request.headers.get("accept", "application/json"))
+        fn, media_type = inventory_streaming_response(request.headers.get("accept", "application/json"))
 
-        async def stream() -> AsyncIterator[str]:
+        async def stream() -> AsyncIterator[StreamChunk]:
             async with inventory().benchmark(
                 graph_db, benchmark_name, accounts=accounts, severity=severity, only_failing=only_failing
             ) as result:
                 async for elem in fn(result):
                     yield elem
 
-        return StreamOnSuccessResponse(stream(), media_type=media_type)
+        return StreamOnSuccessResponse(stream(), media_type=media_type, chunk_size=StreamChunkSize)
 
-    @router.get("/report-summary", tags=["report"])
+    @router.get("/report-summary", tags=["report"], dependencies=[ConditionalRequest])
     async def summary(graph_db: CurrentGraphDbDependency, workspace: UserWorkspaceDependency) -> ReportSummary:
         now = utc()
         duration = timedelta(days=7)
@@ -165,7 +208,7 @@ def inventory_router(fix: FixDependencies) -> APIRouter:
             duration = timedelta(days=31)
         return await inventory().summary(graph_db, workspace, now, duration)
 
-    @router.get("/model", tags=["inventory"])
+    @router.get("/model", tags=["inventory"], dependencies=[ConditionalRequest])
     async def model(
         graph_db: CurrentGraphDbDependency,
         kind: Optional[List[str]] = Query(default=None, description="Kinds to return."),
@@ -178,7 +221,7 @@ def inventory_router(fix: FixDependencies) -> APIRouter:
         with_metadata: Union[bool, List[str]] = Query(default=True, description="Include property kinds."),
         flat: bool = Query(default=True, description="Return a flat list of kinds."),
     ) -> List[Json]:
-        return await inventory().client.model(
+        return await inventory().model(
             graph_db,
             result_format="simple",
             kind=kind,
@@ -192,7 +235,7 @@ def inventory_router(fix: FixDependencies) -> APIRouter:
             flat=flat,
         )
 
-    @router.get("/search/start", tags=["search"])
+    @router.get("/search/start", tags=["search"], dependencies=[ConditionalRequest])
     async def search_start(graph_db: CurrentGraphDbDependency) -> SearchStartData:
         return await inventory().search_start_data(graph_db)
 
@@ -206,16 +249,16 @@ def inventory_router(fix: FixDependencies) -> APIRouter:
         limit: int = Query(default=10, ge=0, le=50),
         count: bool = Query(default=False),
     ) -> StreamOnSuccessResponse:
-        fn, media_type = streaming_response(request.headers.get("accept", "application/json"))
+        fn, media_type = inventory_streaming_response(request.headers.get("accept", "application/json"))
 
-        async def stream() -> AsyncIterator[str]:
+        async def stream() -> AsyncIterator[StreamChunk]:
             async with inventory().client.possible_values(
                 graph_db, query=query, prop_or_predicate=prop, detail="attributes", skip=skip, limit=limit, count=count
             ) as result:
                 async for elem in fn(result):
                     yield elem
 
-        return StreamOnSuccessResponse(stream(), media_type=media_type)
+        return StreamOnSuccessResponse(stream(), media_type=media_type, chunk_size=StreamChunkSize)
 
     @router.post("/property/values", tags=["search"])
     async def property_values(
@@ -227,16 +270,16 @@ def inventory_router(fix: FixDependencies) -> APIRouter:
         limit: int = Query(default=10, ge=0, le=50),
         count: bool = Query(default=False),
     ) -> StreamOnSuccessResponse:
-        fn, media_type = streaming_response(request.headers.get("accept", "application/json"))
+        fn, media_type = inventory_streaming_response(request.headers.get("accept", "application/json"))
 
-        async def stream() -> AsyncIterator[str]:
+        async def stream() -> AsyncIterator[StreamChunk]:
             async with inventory().client.possible_values(
                 graph_db, query=query, prop_or_predicate=prop, detail="values", skip=skip, limit=limit, count=count
             ) as result:
                 async for elem in fn(result):
                     yield elem
 
-        return StreamOnSuccessResponse(stream(), media_type=media_type)
+        return StreamOnSuccessResponse(stream(), media_type=media_type, chunk_size=StreamChunkSize)
 
     @router.post("/property/path/complete", tags=["search"])
     async def complete_property_path(
@@ -254,14 +297,14 @@ def inventory_router(fix: FixDependencies) -> APIRouter:
     async def aggregate(
         graph_db: CurrentGraphDbDependency, request: Request, query: AggregateRequest = Body()
     ) -> StreamOnSuccessResponse:
-        fn, media_type = streaming_response(request.headers.get("accept", "application/json"))
+        fn, media_type = inventory_streaming_response(request.headers.get("accept", "application/json"))
 
-        async def stream() -> AsyncIterator[str]:
+        async def stream() -> AsyncIterator[StreamChunk]:
             async with inventory().client.aggregate(graph_db, query.query) as result:
                 async for elem in fn(result):
                     yield elem
 
-        return StreamOnSuccessResponse(stream(), media_type=media_type)
+        return StreamOnSuccessResponse(stream(), media_type=media_type, chunk_size=StreamChunkSize)
 
     @router.post(
         "/search",
@@ -271,22 +314,22 @@ def inventory_router(fix: FixDependencies) -> APIRouter:
     async def search(
         graph_db: CurrentGraphDbDependency, request: Request, query: SearchListGraphRequest = Body()
     ) -> StreamOnSuccessResponse:
-        fn, media_type = streaming_response(request.headers.get("accept", "application/json"))
+        fn, media_type = inventory_streaming_response(request.headers.get("accept", "application/json"))
 
-        async def stream() -> AsyncIterator[str]:
+        async def stream() -> AsyncIterator[StreamChunk]:
             async with inventory().client.search(graph_db, query.query, with_edges=query.with_edges) as result:
                 async for elem in fn(result):
                     yield elem
 
-        return StreamOnSuccessResponse(stream(), media_type=media_type)
+        return StreamOnSuccessResponse(stream(), media_type=media_type, chunk_size=StreamChunkSize)
 
     @router.post("/history/timeline", description="History timeline", tags=["search"])
     async def history_timeline(
         graph_db: CurrentGraphDbDependency, request: Request, body: HistoryTimelineRequest = Body()
     ) -> StreamOnSuccessResponse:
-        fn, media_type = streaming_response(request.headers.get("accept", "application/json"))
+        fn, media_type = inventory_streaming_response(request.headers.get("accept", "application/json"))
 
-        async def stream() -> AsyncIterator[str]:
+        async def stream() -> AsyncIterator[StreamChunk]:
             async with inventory().client.history_timeline(
                 access=graph_db,
                 query=body.query,
@@ -298,7 +341,7 @@ def inventory_router(fix: FixDependencies) -> APIRouter:
                 async for elem in fn(result):
                     yield elem
 
-        return StreamOnSuccessResponse(stream(), media_type=media_type)
+        return StreamOnSuccessResponse(stream(), media_type=media_type, chunk_size=StreamChunkSize)
 
     @router.post(
         "/search/table",
@@ -311,11 +354,11 @@ def inventory_router(fix: FixDependencies) -> APIRouter:
         graph_db: CurrentGraphDbDependency, request: Request, query: SearchTableRequest = Body()
     ) -> StreamOnSuccessResponse:
         accept = request.headers.get("accept", "application/json")
-        fn, media_type = streaming_response(accept)
+        fn, media_type = inventory_streaming_response(accept)
         result_format: Literal["table", "csv"] = "csv" if accept == "text/csv" else "table"
         extra_headers = {}
 
-        async def stream() -> AsyncIterator[str]:
+        async def stream() -> AsyncIterator[StreamChunk]:
             async with inventory().search_table(graph_db, query, result_format=result_format) as result:
                 extra_headers.update(result.context)
                 if accept == "text/csv":
@@ -323,7 +366,9 @@ def inventory_router(fix: FixDependencies) -> APIRouter:
                 async for elem in fn(result):
                     yield elem
 
-        return StreamOnSuccessResponse(stream(), media_type=media_type, headers=extra_headers)
+        return StreamOnSuccessResponse(
+            stream(), media_type=media_type, headers=extra_headers, chunk_size=StreamChunkSize
+        )
 
     @router.get("/node/{node_id}", tags=["search"])
     async def get_node(graph_db: CurrentGraphDbDependency, node_id: NodeId = Path()) -> Json:
@@ -343,14 +388,14 @@ def inventory_router(fix: FixDependencies) -> APIRouter:
     async def get_node_neighborhood(
         graph_db: CurrentGraphDbDependency, request: Request, node_id: NodeId = Path()
     ) -> StreamOnSuccessResponse:
-        fn, media_type = streaming_response(request.headers.get("accept", "application/json"))
+        fn, media_type = inventory_streaming_response(request.headers.get("accept", "application/json"))
 
-        async def stream() -> AsyncIterator[str]:
+        async def stream() -> AsyncIterator[StreamChunk]:
             async with inventory().neighborhood(graph_db, node_id) as result:
                 async for elem in fn(result):
                     yield elem
 
-        return StreamOnSuccessResponse(stream(), media_type=media_type)
+        return StreamOnSuccessResponse(stream(), media_type=media_type, chunk_size=StreamChunkSize)
 
     @router.get("/node/{node_id}/history", tags=["search"])
     async def get_node_history(
@@ -362,9 +407,9 @@ def inventory_router(fix: FixDependencies) -> APIRouter:
         changes: Optional[List[HistoryChange]] = Query(default=None),
         limit: int = Query(default=20, ge=1),
     ) -> StreamOnSuccessResponse:
-        fn, media_type = streaming_response(request.headers.get("accept", "application/json"))
+        fn, media_type = inventory_streaming_response(request.headers.get("accept", "application/json"))
 
-        async def stream() -> AsyncIterator[str]:
+        async def stream() -> AsyncIterator[StreamChunk]:
             async with inventory().client.search_history(
                 graph_db,
                 query=f'id("{node_id}") sort /changed_at desc limit {limit}',
@@ -375,9 +420,9 @@ def inventory_router(fix: FixDependencies) -> APIRouter:
                 async for elem in fn(result):
                     yield elem
 
-        return StreamOnSuccessResponse(stream(), media_type=media_type)
+        return StreamOnSuccessResponse(stream(), media_type=media_type, chunk_size=StreamChunkSize)
 
-    @router.get("/workspace-info", tags=["report"])
+    @router.get("/workspace-info", tags=["report"], dependencies=[ConditionalRequest])
     async def workspace_info(
         graph_db: CurrentGraphDbDependency, workspace: UserWorkspaceDependency
     ) -> InventorySummaryRead:
@@ -401,7 +446,7 @@ def inventory_router(fix: FixDependencies) -> APIRouter:
             buckets_size_bytes_progress=info.buckets_size_bytes_progress,
         )
 
-    @router.post("/timeseries", tags=["timeseries"])
+    @router.post("/timeseries", tags=["timeseries"], dependencies=[ConditionalRequest])
     async def timeseries(graph_db: CurrentGraphDbDependency, ts: TimeseriesRequest) -> Scatters:
         return await inventory().timeseries_scattered(
             graph_db,
@@ -414,7 +459,7 @@ def inventory_router(fix: FixDependencies) -> APIRouter:
             aggregation=ts.aggregation,
         )
 
-    @router.post("/descendant/summary", tags=["search"])
+    @router.post("/descendant/summary", tags=["search"], dependencies=[ConditionalRequest])
     async def descendant_summary_account(
         graph_db: CurrentGraphDbDependency, request: KindUsageRequest
     ) -> Dict[str, KindUsage]:
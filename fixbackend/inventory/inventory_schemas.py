@@ -230,6 +230,16 @@ class SearchTableRequest(SearchRequest):
         default=False,
         description="If the default values should be included. Only has an effect when properties_to_show are defined.",
     )
+    snapshot: bool = Field(
+        default=False,
+        description="Paginate with a cursor: the sorted result is stored in a short-lived snapshot, "
+        "that serves all following pages. The cursor of the next page is returned in the Next-Cursor header.",
+    )
+    cursor: Optional[str] = Field(
+        default=None,
+        description="The cursor of the page to return, as returned in the Next-Cursor header of the previous page. "
+        "skip is ignored, if a cursor is defined.",
+    )
 
 
 class ReportConfig(BaseModel):
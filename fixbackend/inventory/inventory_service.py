@@ -21,9 +21,11 @@
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 from __future__ import annotations
 import asyncio
+import hashlib
 import json
 import logging
 from collections import defaultdict
+from contextlib import asynccontextmanager
 from datetime import timedelta, datetime
 from itertools import islice
 from typing import (
@@ -40,6 +42,7 @@ from typing import (
     Mapping,
     Union,
     AsyncContextManager,
+    AsyncIterator,
 )
 
 from arq import func
@@ -50,7 +53,9 @@ from fixcloudutils.redis.cache import RedisCache
 from fixcloudutils.redis.worker_queue import WorkDispatcher, WorkerInstance
 from fixcloudutils.service import Service
 from fixcloudutils.types import Json, JsonElement
-from fixcloudutils.util import value_in_path, utc_str, parse_utc_str, value_in_path_get
+from fixcloudutils.util import value_in_path, utc_str, parse_utc_str, value_in_path_get, utc
+from httpx import Response
+from prometheus_client import Counter
 
 from fixbackend.cloud_accounts.repository import CloudAccountRepository
 from fixbackend.config import ProductTierSettings, Trial
@@ -64,15 +69,18 @@ from fixbackend.domain_events.events import (
     CloudAccountActiveToggled,
 )
 from fixbackend.domain_events.subscriber import DomainEventSubscriber
+from fixbackend.errors import ClientError, ResourceGone
 from fixbackend.graph_db.models import GraphDatabaseAccess
 from fixbackend.graph_db.service import GraphDatabaseAccessManager
 from fixbackend.ids import BenchmarkId, CloudAccountId, NodeId, ProductTier, SecurityCheckId, ReportSeverity
 from fixbackend.ids import TaskId, WorkspaceId
+from fixbackend.inventory.data_version import WorkspaceDataVersion
 from fixbackend.inventory.inventory_client import (
     InventoryClient,
     AsyncIteratorWithContext,
     InventoryException,
     NoSuchGraph,
+    TimeseriesQuery,
 )
 from fixbackend.inventory.inventory_schemas import (
     AccountSummary,
@@ -86,16 +94,21 @@ from fixbackend.inventory.inventory_schemas import (
     SearchCloudResource,
     TimeSeries,
     ReportConfig,
-    Scatter,
     Scatters,
     SearchTableRequest,
     KindUsage,
 )
+from fixbackend.inventory.report_definitions import DefinitionKind, ReportDefinitionCache
+from fixbackend.inventory.report_summary_store import ReportSummaryStore, SummaryParams
+from fixbackend.inventory.search_snapshot import SearchCursor, SearchSnapshotStore
+from fixbackend.inventory.timeseries import ColumnarScatters, Point
 from fixbackend.logging_context import set_cloud_account_id, set_fix_cloud_account_id, set_workspace_id
+from fixbackend.single_flight import SingleFlight
 from fixbackend.types import Redis
 from fixbackend.workspaces.models import Workspace
 
 log = logging.getLogger(__name__)
+SearchSnapshotPages = Counter("inventory_search_snapshot_pages", "Pages of search tables by source", ["source"])
 
 # alias names for better readability
 BenchmarkById = Dict[BenchmarkId, BenchmarkSummary]
@@ -199,13 +212,23 @@ class InventoryService(Service):
         self.db_access_manager = db_access_manager
         self.cloud_account_repository = cloud_account_repository
         self.cache = RedisCache(redis, "inventory", ttl_memory=timedelta(minutes=5), ttl_redis=timedelta(minutes=30))
+        # make sure concurrent requests for the same cached value compute it only once
+        self.single_flight = SingleFlight(self.cache, redis, shared_errors=[InventoryException])
+        self.data_version = WorkspaceDataVersion(redis)
+        self.summary_store = ReportSummaryStore(redis, self.data_version)
+        self.search_snapshots = SearchSnapshotStore(redis)
+        # check and benchmark definitions: built-in ones are shared by all workspaces
+        self.definitions = ReportDefinitionCache(client, redis, self.single_flight)
         worker_queue_name = "arq:inventory_service_queue"
         self.dispatcher = WorkDispatcher(redis_settings, worker_queue_name)
         # noinspection PyTypeChecker
         self.worker = WorkerInstance(
             redis_settings=redis_settings,
             queue_name=worker_queue_name,
-            functions=[func(self._update_cloud_account_name_again, name="update_cloud_account_name_again")],
+            functions=[
+                func(self._update_cloud_account_name_again, name="update_cloud_account_name_again"),
+                func(self._update_summary_snapshots, name="update_summary_snapshots"),
+            ],
         )
         self.update_name_again_after = timedelta(hours=1)
         self.start_workers = start_workers
@@ -221,6 +244,7 @@ class InventoryService(Service):
     async def start(self) -> Any:
         if self.start_workers:
             await self.cache.start()
+            await self.definitions.start()
             await self.worker.start()
             await self.dispatcher.start()
 
@@ -228,6 +252,7 @@ class InventoryService(Service):
         if self.start_workers:
             await self.dispatcher.stop()
             await self.worker.stop()
+            await self.definitions.stop()
             await self.cache.stop()
 
     async def _process_account_deleted(self, event: CloudAccountDeleted) -> None:
@@ -241,7 +266,30 @@ class InventoryService(Service):
 
     async def _process_tenant_collected(self, event: TenantAccountsCollected) -> None:
         log.info(f"Tenant: {event.tenant_id} was collected - invalidate caches.")
-        await self.evict_cache(event.tenant_id)
+        # the data version is advanced, once the summary snapshots of the new data are stored
+        await self.evict_cache(event.tenant_id, advance_version=False)
+        # search snapshots of former collects are not used for new searches
+        task_ids = sorted({str(info.task_id) for info in event.cloud_accounts.values() if info.task_id})
+        collect = ",".join(task_ids) if task_ids else utc_str(utc())
+        await self.search_snapshots.collected(event.tenant_id, hashlib.sha256(collect.encode()).hexdigest()[:16])
+        # compute the report summary in the background, so it does not need to be computed on read
+        await self.dispatcher.enqueue("update_summary_snapshots", event.tenant_id)
+
+    async def _update_summary_snapshots(self, ctx: Dict[str, str], workspace_id: WorkspaceId) -> None:
+        try:
+            if (params := await self.summary_store.requested(workspace_id)) and (
+                db := await self.db_access_manager.get_database_access(workspace_id)
+            ):
+                now = utc()
+                for param in params:
+                    try:
+                        summary = await self._compute_summary(db, param, now)
+                        await self.summary_store.put(workspace_id, param, summary)
+                    except InventoryException as ex:
+                        log.info(f"Could not compute report summary for workspace {workspace_id}: {ex}")
+        finally:
+            # the snapshots reflect the new data: responses cached by clients with the former version are outdated
+            await self.data_version.advance(workspace_id)
 
     async def _process_account_name_changed(self, event: CloudAccountNameChanged) -> None:
         # update the name now
@@ -264,7 +312,8 @@ class InventoryService(Service):
             if accounts and (account := accounts[0]) and (node_id := account.get("id")):
                 await self.client.update_node(db, NodeId(node_id), {"name": name}, force=True)
                 # account name has changed: invalidate the cache for the tenant
-                await self.evict_cache(event.tenant_id)
+                await self.evict_cache(event.tenant_id, advance_version=False)
+                await self.dispatcher.enqueue("update_summary_snapshots", event.tenant_id)
                 return True
             else:
                 log.info(f"Cloud account not found in inventory. Ignore. {event}.")
@@ -303,10 +352,15 @@ class InventoryService(Service):
             await self.client.update_config(
                 db, "fix.report.config", {"report_config": {"ignore_accounts": disabled}}, patch=True
             )
+            await self.evict_cache(event.tenant_id)
 
-    async def evict_cache(self, workspace_id: WorkspaceId) -> None:
-        # evict the cache for the tenant in the cluster
+    async def evict_cache(self, workspace_id: WorkspaceId, *, advance_version: bool = True) -> None:
+        # the data of the workspace has changed: evict the cache for the tenant in the cluster
         await self.cache.evict(str(workspace_id))
+        # summary snapshots are computed on the next read or by the next collect
+        await self.summary_store.delete(workspace_id)
+        if advance_version:
+            await self.data_version.advance(workspace_id)
 
     async def checks(
         self,
@@ -318,19 +372,14 @@ class InventoryService(Service):
         check_ids: Optional[List[SecurityCheckId]] = None,
         ids_only: Optional[bool] = None,
     ) -> List[Json]:
-        async def fetch_checks(*_: Any) -> List[Json]:
-            return await self.client.checks(
-                db,
-                provider=provider,
-                service=service,
-                category=category,
-                kind=kind,
-                check_ids=check_ids,
-                ids_only=ids_only,
-            )
-
-        return await self.cache.call(fetch_checks, key=str(db.workspace_id))(
-            provider, service, category, kind, check_ids, ids_only  # parameters passed as cache key
+        return await self.definitions.checks(
+            db,
+            provider=provider,
+            service=service,
+            category=category,
+            kind=kind,
+            check_ids=check_ids,
+            ids_only=ids_only,
         )
 
     async def benchmarks(
@@ -341,23 +390,38 @@ class InventoryService(Service):
         with_checks: Optional[bool] = None,
         ids_only: Optional[bool] = None,
     ) -> List[Json]:
-        async def fetch_benchmarks(*_: Any) -> List[Json]:
-            return await self.client.benchmarks(
-                db, benchmarks=benchmarks, short=short, with_checks=with_checks, ids_only=ids_only
-            )
-
-        return await self.cache.call(fetch_benchmarks, key=str(db.workspace_id))(
-            benchmarks, short, with_checks, ids_only  # parameters passed as cache key
+        return await self.definitions.benchmarks(
+            db, benchmarks=benchmarks, short=short, with_checks=with_checks, ids_only=ids_only
         )
 
     async def report_info(self, db: GraphDatabaseAccess) -> Json:
-        async def compute_report_info() -> Json:
-            benchmark_ids, check_ids = await asyncio.gather(
-                self.client.benchmarks(db, ids_only=True), self.client.checks(db, ids_only=True)
-            )
-            return dict(benchmarks=benchmark_ids, checks=check_ids)
+        benchmark_ids, check_ids = await asyncio.gather(
+            self.definitions.benchmarks(db, ids_only=True), self.definitions.checks(db, ids_only=True)
+        )
+        return dict(benchmarks=benchmark_ids, checks=check_ids)
 
-        return await self.cache.call(compute_report_info, key=str(db.workspace_id))()
+    async def put_check(self, db: GraphDatabaseAccess, check_id: str, check: Json) -> Json:
+        result = await self.client.call_json(db, "put", f"/report/check/{check_id}", body=check)
+        await self._definition_changed(db.workspace_id, "check", check_id)
+        return result
+
+    async def delete_check(self, db: GraphDatabaseAccess, check_id: str) -> None:
+        await self.client.call_json(db, "delete", f"/report/check/{check_id}", expect_result=False)
+        await self._definition_changed(db.workspace_id, "check", check_id)
+
+    async def put_benchmark(self, db: GraphDatabaseAccess, benchmark_id: str, benchmark: Json) -> Json:
+        result = await self.client.call_json(db, "put", f"/report/benchmark/{benchmark_id}", body=benchmark)
+        await self._definition_changed(db.workspace_id, "benchmark", benchmark_id)
+        return result
+
+    async def delete_benchmark(self, db: GraphDatabaseAccess, benchmark_id: str) -> None:
+        await self.client.call_json(db, "delete", f"/report/benchmark/{benchmark_id}", expect_result=False)
+        await self._definition_changed(db.workspace_id, "benchmark", benchmark_id)
+
+    async def _definition_changed(self, workspace_id: WorkspaceId, kind: DefinitionKind, definition_id: str) -> None:
+        await self.definitions.changed(workspace_id, kind, definition_id)
+        # the custom definitions of the workspace are cached with all other data of the workspace
+        await self.evict_cache(workspace_id)
 
     async def report_config(self, db: GraphDatabaseAccess) -> ReportConfig:
         js = await self.client.config(db, "fix.report.config")
@@ -369,6 +433,7 @@ class InventoryService(Service):
         js = config.model_dump()
         update = dict(ignore_benchmarks=js.pop("ignore_benchmarks", None), report_config=js)
         await self.client.update_config(db, "fix.report.config", update)
+        await self.evict_cache(db.workspace_id)
 
     def benchmark(
         self,
@@ -389,12 +454,9 @@ class InventoryService(Service):
 
         return self.client.execute_single(db, report + " | dump")  # type: ignore
 
-    def search_table(
-        self,
-        db: GraphDatabaseAccess,
-        request: SearchTableRequest,
-        result_format: Literal["table", "csv"] = "table",
-    ) -> AsyncContextManager[AsyncIteratorWithContext[JsonElement]]:
+    @staticmethod
+    def _search_table_command(request: SearchTableRequest, result_format: Literal["table", "csv"]) -> Tuple[str, str]:
+        # returns the search command and the list command of the table
         if history := request.history:
             cmd = "history"
             for change in history.all_changes():
@@ -413,9 +475,77 @@ class InventoryService(Service):
             fmt_option += " --with-defaults"
         if request.properties_to_show:
             fmt_option += " " + (", ".join(f"{path} as {name}" for path, name in request.properties_to_show.items()))
-        cmd += f" | limit {request.skip}, {request.limit} | list {fmt_option}"
+        return cmd, f"list {fmt_option}"
+
+    def search_table(
+        self,
+        db: GraphDatabaseAccess,
+        request: SearchTableRequest,
+        result_format: Literal["table", "csv"] = "table",
+    ) -> AsyncContextManager[AsyncIteratorWithContext[JsonElement]]:
+        if request.snapshot or request.cursor:
+            return self._search_table_snapshot(db, request, result_format)
+        search, list_cmd = self._search_table_command(request, result_format)
+        cmd = f"{search} | limit {request.skip}, {request.limit} | {list_cmd}"
         return self.client.execute_single(db, cmd, env={"count": json.dumps(request.count)})
 
+    @asynccontextmanager
+    async def _search_table_snapshot(
+        self, db: GraphDatabaseAccess, request: SearchTableRequest, result_format: Literal["table", "csv"]
+    ) -> AsyncIterator[AsyncIteratorWithContext[JsonElement]]:
+        search, list_cmd = self._search_table_command(request, result_format)
+        query = hashlib.sha256(f"{search} | {list_cmd}".encode()).hexdigest()[:32]
+        if request.cursor:
+            cursor = SearchCursor.decode(request.cursor)
+            if cursor.query != query:
+                raise ClientError("The cursor does not belong to this search.")
+            collect, skip = cursor.collect, cursor.skip
+        else:
+            collect, skip = await self.search_snapshots.last_collect(db.workspace_id), request.skip
+        store = self.search_snapshots
+        source = "snapshot"
+        page = await store.page(db.workspace_id, query, collect, skip, request.limit)
+        if page is None and request.cursor:
+            # the rows of a new snapshot can differ: the client has to start the search again
+            raise ResourceGone("The search snapshot of this cursor has expired. Start the search without cursor.")
+        elif page is None:  # no snapshot: create it from the latest collected data
+
+            async def create_search_snapshot(query: str, collect: str, count: bool, period: int) -> bool:
+                # one row more than the snapshot can hold, to detect an incomplete snapshot
+                cmd = f"{search} | limit 0, {store.max_rows + 1} | {list_cmd}"
+                async with self.client.execute_single(db, cmd, env={"count": json.dumps(count)}) as result:
+                    total = int(tc) if (tc := result.context.get("Total-Count")) else None
+                    await store.put(db.workspace_id, query, collect, result.aiter_lines(), total)
+                return True
+
+            source = "created"
+            # Concurrent requests of the same search create the snapshot only once.
+            # The outcome is cached: the ttl period allows to recreate an expired snapshot.
+            # A snapshot evicted within the period is not recreated: the page is queried directly.
+            period = int(utc().timestamp() // store.ttl.total_seconds())
+            await self.single_flight.call(create_search_snapshot, key=str(db.workspace_id))(
+                query, collect, request.count, period
+            )
+            page = await store.page(db.workspace_id, query, collect, skip, request.limit)
+
+        next_cursor = SearchCursor(query, collect, skip + request.limit).encode()
+        if page is not None and (page.complete or skip + request.limit <= page.rows):
+            SearchSnapshotPages.labels(source).inc()
+            context = {"Result-Count": str(len(page.lines))}
+            if request.count and page.total is not None:
+                context["Total-Count"] = str(page.total)
+            if skip + request.limit < page.rows or not page.complete:
+                context["Next-Cursor"] = next_cursor
+            yield AsyncIteratorWithContext(Response(200, headers=context, content=page.content()))
+        else:
+            # the page exceeds the rows of an incomplete snapshot: query the page directly
+            SearchSnapshotPages.labels("query").inc()
+            cmd = f"{search} | limit {skip}, {request.limit} | {list_cmd}"
+            async with self.client.execute_single(db, cmd, env={"count": json.dumps(request.count)}) as result:
+                if int(result.context.get("Result-Count", request.limit)) >= request.limit:
+                    result.context["Next-Cursor"] = next_cursor
+                yield result
+
     async def search_start_data(self, db: GraphDatabaseAccess) -> SearchStartData:
         async def compute_search_start_data() -> SearchStartData:
             async def cloud_resource(search_filter: str, id_prop: str, name_prop: str) -> List[SearchCloudResource]:
@@ -448,7 +578,39 @@ class InventoryService(Service):
 
             return SearchStartData(accounts=accounts, regions=regions, kinds=kinds, severity=ReportSeverityList)
 
-        return await self.cache.call(compute_search_start_data, key=str(db.workspace_id))()
+        return await self.single_flight.call(compute_search_start_data, key=str(db.workspace_id))()
+
+    async def model(
+        self,
+        db: GraphDatabaseAccess,
+        *,
+        result_format: Optional[str] = None,
+        flat: bool = False,
+        with_bases: bool = False,
+        with_property_kinds: bool = False,
+        kind: Optional[List[str]] = None,
+        kind_filter: Optional[List[str]] = None,
+        aggregate_roots_only: bool = False,
+        with_properties: bool = True,
+        with_relatives: bool = True,
+        with_metadata: Union[bool, List[str]] = True,
+    ) -> List[Json]:
+        # the model only changes, when the workspace is collected
+        async def compute_model(**params: Any) -> List[Json]:
+            return await self.client.model(db, **params)
+
+        return await self.single_flight.call(compute_model, key=str(db.workspace_id))(
+            result_format=result_format,
+            flat=flat,
+            with_bases=with_bases,
+            with_property_kinds=with_property_kinds,
+            kind=kind,
+            kind_filter=kind_filter,
+            aggregate_roots_only=aggregate_roots_only,
+            with_properties=with_properties,
+            with_relatives=with_relatives,
+            with_metadata=with_metadata,
+        )
 
     async def resource(self, db: GraphDatabaseAccess, resource_id: NodeId) -> Json:
         resource = await self.client.resource(db, id=resource_id)
@@ -456,7 +618,7 @@ class InventoryService(Service):
         ignored_checks = value_in_path(resource, ["metadata", "security_ignore"])
         if isinstance(ignored_checks, list):
             check_ids.extend(ignored_checks)
-        checks = await self.client.checks(db, check_ids=check_ids) if check_ids else []
+        checks = await self.checks(db, check_ids=check_ids) if check_ids else []
         checks = sorted(checks, key=lambda x: ReportSeverityPriority[x.get("severity", "info")], reverse=True)
         return dict(resource=resource, checks=checks)
 
@@ -480,243 +642,249 @@ class InventoryService(Service):
     async def summary(
         self, db: GraphDatabaseAccess, workspace: Workspace, now: datetime, duration: timedelta
     ) -> ReportSummary:
-        is_free = workspace.current_product_tier() == ProductTier.Free
+        params = (workspace.current_product_tier() == ProductTier.Free, duration)
+        # serve the summary computed after the last collect run
+        if snapshot := await self.summary_store.get(db.workspace_id, params):
+            return snapshot
+        # the data can change while the summary is computed: the summary is stored only for an unchanged version
+        version = await self.data_version.current(db.workspace_id)
 
-        async def compute_summary() -> ReportSummary:
+        # the parameters are passed as arguments, so they are part of the cache key
+        async def compute_summary(is_free: bool, duration: timedelta) -> ReportSummary:
+            return await self._compute_summary(db, (is_free, duration), now)
 
-            # get all account for the given time period
-            accounts_in_time_period: List[Json] = []
-            async with self.client.search(
-                db, f"search is(account) and /metadata.exported_at>={utc_str(now-duration)} and /metadata.score!=null"
-            ) as result:
-                async for entry in result:
-                    accounts_in_time_period.append(entry)
-
-            severity_resource_counter: Dict[ReportSeverity, int] = defaultdict(int)
-            accounts_by_id: Dict[CloudAccountId, AccountSummary] = {}
-
-            benchmark_account_summaries: Dict[BenchmarkId, Dict[CloudAccountId, BenchmarkAccountSummary]] = defaultdict(
-                dict
+        try:
+            summary = await self.single_flight.call(compute_summary, key=str(db.workspace_id))(*params)
+            await self.summary_store.put(db.workspace_id, params, summary, version=version)
+            return summary
+        except InventoryException as ex:
+            # in case no account is collected yet -> no graph, this is expected.
+            if not isinstance(ex, NoSuchGraph):
+                log.info(f"Inventory not available yet: {ex}. Returning empty summary.")
+            empty = CheckSummary(
+                available_resources=0,
+                failed_resources_by_severity={},
+            )
+            return ReportSummary(
+                check_summary=empty,
+                overall_score=0,
+                accounts=[],
+                benchmarks=[],
+                changed_vulnerable=NoVulnerabilitiesChanged,
+                changed_compliant=NoVulnerabilitiesChanged,
+                top_checks=[],
             )
 
-            def populate_info(accounts: List[Json]) -> None:
-                for entry in accounts:
-                    # process the benchmark info
-                    account_id = CloudAccountId(entry["reported"]["id"])
-                    metadata = entry["metadata"]
+    async def _compute_summary(self, db: GraphDatabaseAccess, params: SummaryParams, now: datetime) -> ReportSummary:
+        is_free, duration = params
 
-                    # Process all benchmark results of this account
-                    # "benchmark": {"aws_cis_1_5": { "failed": { ... }, "score": 83 }}
-                    for benchmark_id, info in metadata.get("benchmark", {}).items():
-                        failed_checks: Dict[ReportSeverity, int] = {}
-                        failed_resource_checks: Dict[ReportSeverity, int] = {}
+        # get all account for the given time period
+        accounts_in_time_period: List[Json] = []
+        async with self.client.search(
+            db, f"search is(account) and /metadata.exported_at>={utc_str(now-duration)} and /metadata.score!=null"
+        ) as result:
+            async for entry in result:
+                accounts_in_time_period.append(entry)
 
-                        if not isinstance(info, dict):
-                            continue
+        severity_resource_counter: Dict[ReportSeverity, int] = defaultdict(int)
+        accounts_by_id: Dict[CloudAccountId, AccountSummary] = {}
 
-                        # "failed": { "high": { "checks": 6, "resources": 14 }, "low": { "checks": 4, "resources": 7 }}
-                        for severity, severity_info in info.get("failed", {}).items():
+        benchmark_account_summaries: Dict[BenchmarkId, Dict[CloudAccountId, BenchmarkAccountSummary]] = defaultdict(
+            dict
+        )
 
-                            checks = severity_info["checks"]
-                            failed_checks[severity] = checks
-                            failed_resource_checks[severity] = severity_info["resources"]
+        def populate_info(accounts: List[Json]) -> None:
+            for entry in accounts:
+                # process the benchmark info
+                account_id = CloudAccountId(entry["reported"]["id"])
+                metadata = entry["metadata"]
 
-                        benchmark_account_summaries[BenchmarkId(benchmark_id)][account_id] = BenchmarkAccountSummary(
-                            score=info.get("score", 100),
-                            failed_checks=failed_checks if failed_checks else None,
-                            failed_resource_checks=failed_resource_checks if failed_resource_checks else None,
-                        )
+                # Process all benchmark results of this account
+                # "benchmark": {"aws_cis_1_5": { "failed": { ... }, "score": 83 }}
+                for benchmark_id, info in metadata.get("benchmark", {}).items():
+                    failed_checks: Dict[ReportSeverity, int] = {}
+                    failed_resource_checks: Dict[ReportSeverity, int] = {}
 
-                    # fill in the accounts
-                    exported_at = None
-                    if exp := metadata.get("exported_at"):
-                        exported_at = parse_utc_str(exp)
+                    if not isinstance(info, dict):
+                        continue
 
-                    failed_by_severity = {}
                     # "failed": { "high": { "checks": 6, "resources": 14 }, "low": { "checks": 4, "resources": 7 }}
-                    for severity, info in metadata.get("failed", {}).items():
-                        failed_resources = info["resources"]
-                        failed_by_severity[severity] = failed_resources
-                        severity_resource_counter[severity] += failed_resources
-                    summary = AccountSummary(
-                        id=account_id,
-                        name=entry["reported"]["name"],
-                        cloud=entry["ancestors"]["cloud"]["reported"]["name"],
-                        resource_count=metadata.get("descendant_count", 0),
-                        failed_resources_by_severity=failed_by_severity,
-                        score=round(metadata.get("score", 100)),
-                        exported_at=exported_at,
-                    )
-                    accounts_by_id[account_id] = summary
-
-            populate_info(accounts_in_time_period)
-
-            async def issues_since(
-                duration: timedelta, change: Literal["node_vulnerable", "node_compliant"]
-            ) -> VulnerabilitiesChanged:
-                accounts_by_severity: Dict[ReportSeverity, Set[CloudAccountId]] = defaultdict(set)
-                resource_count_by_severity: Dict[ReportSeverity, int] = defaultdict(int)
-                resource_count_by_kind: Dict[str, int] = defaultdict(int)
-                async with self.client.execute_single(
-                    db,
-                    f"history --change node_vulnerable --change node_compliant "
-                    f"--after {duration.total_seconds()}s | aggregate "
-                    f"/ancestors.account.reported.id as account_id, "
-                    f"/diff.{change}[*].severity as severity,"
-                    f"kind as kind"
-                    ": sum(1) as count | dump",
-                ) as result:
-                    async for elem in result:
-                        assert isinstance(elem, dict), f"Expected Json object but got {elem}"
-                        severity = elem["group"]["severity"]
-                        if severity is None:  # safeguard for history entries in old format
-                            continue
-                        if isinstance(acc_id := elem["group"]["account_id"], str):
-                            accounts_by_severity[severity].add(CloudAccountId(acc_id))
-                        resource_count_by_severity[severity] += elem["count"]
-                        resource_count_by_kind[elem["group"]["kind"]] += elem["count"]
-                # reduce the count by kind dict to the top 3
-                reduced = dict(sorted(resource_count_by_kind.items(), key=lambda item: item[1], reverse=True)[:3])
-                # reduce the list of accounts to the top 3
-                top_accounts = list(
-                    islice(dict_values_by(accounts_by_severity, lambda x: ReportSeverityPriority[x]), 3)
-                )
-                return VulnerabilitiesChanged(
-                    since=duration,
-                    accounts_selection=top_accounts,
-                    resource_count_by_severity=resource_count_by_severity,
-                    resource_count_by_kind_selection=reduced,
-                )
+                    for severity, severity_info in info.get("failed", {}).items():
+
+                        checks = severity_info["checks"]
+                        failed_checks[severity] = checks
+                        failed_resource_checks[severity] = severity_info["resources"]
 
-            async def benchmark_summary(
-                bench_account_summaries: Dict[BenchmarkId, Dict[CloudAccountId, BenchmarkAccountSummary]]
-            ) -> Tuple[BenchmarkById, Dict[SecurityCheckId, Set[BenchmarkId]]]:
-                summaries: BenchmarkById = {}
-                benchmark_by_check_id: Dict[SecurityCheckId, Set[BenchmarkId]] = defaultdict(set)
-                benchmarks = await self.client.benchmarks(db, short=True, with_checks=True)
-                for b in benchmarks:
-                    benchmark_id = BenchmarkId(b["id"])
-                    summary = BenchmarkSummary(
-                        id=benchmark_id,
-                        title=b["title"],
-                        framework=b["framework"],
-                        version=b["version"],
-                        clouds=b["clouds"],
-                        description=b["description"],
-                        nr_of_checks=len(b["report_checks"]),
-                        account_summary=bench_account_summaries.get(benchmark_id, {}),
+                    benchmark_account_summaries[BenchmarkId(benchmark_id)][account_id] = BenchmarkAccountSummary(
+                        score=info.get("score", 100),
+                        failed_checks=failed_checks if failed_checks else None,
+                        failed_resource_checks=failed_resource_checks if failed_resource_checks else None,
                     )
-                    summaries[summary.id] = summary
-                    for check in b["report_checks"]:
-                        check_id = SecurityCheckId(check["id"])
-                        benchmark_by_check_id[check_id].add(benchmark_id)
-                return summaries, benchmark_by_check_id
-
-            async def timeseries_infected() -> TimeSeries:
-                start = now - timedelta(days=62 if is_free else 14)
-                granularity = timedelta(days=7 if is_free else 1)
-                groups = {"severity"}
-                async with self.client.timeseries(
-                    db, "infected_resources", start=start, end=now, granularity=granularity, group=groups
-                ) as result:
-                    data = [entry async for entry in result]
-                return TimeSeries(name="infected_resources", start=start, end=now, granularity=granularity, data=data)
-
-            async def top_issues(
-                benchmark_by_check_id: Dict[SecurityCheckId, Set[BenchmarkId]],
-                benchmarks: Dict[BenchmarkId, BenchmarkSummary],
-                num: int,
-            ) -> List[Json]:
-                query = (
-                    "aggregate(/security.issues[*].check, /security.issues[*].severity: sum(1) as count): "
-                    "/security.has_issues==true"
+
+                # fill in the accounts
+                exported_at = None
+                if exp := metadata.get("exported_at"):
+                    exported_at = parse_utc_str(exp)
+
+                failed_by_severity = {}
+                # "failed": { "high": { "checks": 6, "resources": 14 }, "low": { "checks": 4, "resources": 7 }}
+                for severity, info in metadata.get("failed", {}).items():
+                    failed_resources = info["resources"]
+                    failed_by_severity[severity] = failed_resources
+                    severity_resource_counter[severity] += failed_resources
+                summary = AccountSummary(
+                    id=account_id,
+                    name=entry["reported"]["name"],
+                    cloud=entry["ancestors"]["cloud"]["reported"]["name"],
+                    resource_count=metadata.get("descendant_count", 0),
+                    failed_resources_by_severity=failed_by_severity,
+                    score=round(metadata.get("score", 100)),
+                    exported_at=exported_at,
                 )
-                async with self.client.aggregate(db, query) as ctx:
-                    all_failing = sorted(
-                        [e async for e in ctx],
-                        key=lambda x: (ReportSeverityPriority[x["group"]["severity"]], x["count"]),
-                        reverse=True,
-                    )
-                top = list(islice((a["group"]["check"] for a in all_failing), num))
-                checks = await self.client.checks(db, check_ids=top)
-                for check in checks:
-                    check["benchmarks"] = [
-                        {"id": bs.id, "title": bs.title}
-                        for b in benchmark_by_check_id[check["id"]]
-                        if (bs := benchmarks.get(b))
-                    ]
-                return sorted(checks, key=lambda x: ReportSeverityPriority[x.get("severity", "info")], reverse=True)
-
-            def overall_score(
-                accounts: Dict[CloudAccountId, AccountSummary], now: datetime, duration: timedelta
-            ) -> int:
-                # The overall score is the average of all account scores
-                scores = []
-                for account in accounts.values():
-                    if not account.exported_at or account.exported_at > now - duration:
-                        scores.append(account.score)
-                total_score = sum(scores)
-                total_accounts = len(accounts)
-                return total_score // total_accounts if total_accounts > 0 else 100
-
-            (
-                (benchmarks, benchmark_by_check_id),
-                vulnerable_changed,
-                compliant_changed,
-                infected_resources_ts,
-            ) = await asyncio.gather(
-                benchmark_summary(benchmark_account_summaries),
-                issues_since(duration, "node_vulnerable"),
-                issues_since(duration, "node_compliant"),
-                timeseries_infected(),
-            )
+                accounts_by_id[account_id] = summary
 
-            # get issues for the top 5 issue_ids
-            tops = await top_issues(benchmark_by_check_id, benchmarks, num=5)
+        populate_info(accounts_in_time_period)
 
-            # sort top changed account by score
-            vulnerable_changed.accounts_selection.sort(
-                key=lambda x: accounts_by_id[x].score if x in accounts_by_id else 100
-            )
-            compliant_changed.accounts_selection.sort(
-                key=lambda x: accounts_by_id[x].score if x in accounts_by_id else 100
+        async def issues_since(
+            duration: timedelta, change: Literal["node_vulnerable", "node_compliant"]
+        ) -> VulnerabilitiesChanged:
+            accounts_by_severity: Dict[ReportSeverity, Set[CloudAccountId]] = defaultdict(set)
+            resource_count_by_severity: Dict[ReportSeverity, int] = defaultdict(int)
+            resource_count_by_kind: Dict[str, int] = defaultdict(int)
+            async with self.client.execute_single(
+                db,
+                f"history --change node_vulnerable --change node_compliant "
+                f"--after {duration.total_seconds()}s | aggregate "
+                f"/ancestors.account.reported.id as account_id, "
+                f"/diff.{change}[*].severity as severity,"
+                f"kind as kind"
+                ": sum(1) as count | dump",
+            ) as result:
+                async for elem in result:
+                    assert isinstance(elem, dict), f"Expected Json object but got {elem}"
+                    severity = elem["group"]["severity"]
+                    if severity is None:  # safeguard for history entries in old format
+                        continue
+                    if isinstance(acc_id := elem["group"]["account_id"], str):
+                        accounts_by_severity[severity].add(CloudAccountId(acc_id))
+                    resource_count_by_severity[severity] += elem["count"]
+                    resource_count_by_kind[elem["group"]["kind"]] += elem["count"]
+            # reduce the count by kind dict to the top 3
+            reduced = dict(sorted(resource_count_by_kind.items(), key=lambda item: item[1], reverse=True)[:3])
+            # reduce the list of accounts to the top 3
+            top_accounts = list(islice(dict_values_by(accounts_by_severity, lambda x: ReportSeverityPriority[x]), 3))
+            return VulnerabilitiesChanged(
+                since=duration,
+                accounts_selection=top_accounts,
+                resource_count_by_severity=resource_count_by_severity,
+                resource_count_by_kind_selection=reduced,
             )
 
-            return ReportSummary(
-                check_summary=CheckSummary(
-                    available_resources=sum(v.resource_count for v in accounts_by_id.values()),
-                    failed_resources_by_severity=severity_resource_counter,
-                ),
-                overall_score=overall_score(accounts_by_id, now, duration),
-                accounts=sorted(list(accounts_by_id.values()), key=lambda x: x.score),
-                benchmarks=list(benchmarks.values()),
-                changed_vulnerable=vulnerable_changed,
-                changed_compliant=compliant_changed,
-                top_checks=tops,
-                vulnerable_resources=infected_resources_ts,
+        async def benchmark_summary(
+            bench_account_summaries: Dict[BenchmarkId, Dict[CloudAccountId, BenchmarkAccountSummary]]
+        ) -> Tuple[BenchmarkById, Dict[SecurityCheckId, Set[BenchmarkId]]]:
+            summaries: BenchmarkById = {}
+            benchmark_by_check_id: Dict[SecurityCheckId, Set[BenchmarkId]] = defaultdict(set)
+            benchmarks = await self.benchmarks(db, short=True, with_checks=True)
+            for b in benchmarks:
+                benchmark_id = BenchmarkId(b["id"])
+                summary = BenchmarkSummary(
+                    id=benchmark_id,
+                    title=b["title"],
+                    framework=b["framework"],
+                    version=b["version"],
+                    clouds=b["clouds"],
+                    description=b["description"],
+                    nr_of_checks=len(b["report_checks"]),
+                    account_summary=bench_account_summaries.get(benchmark_id, {}),
+                )
+                summaries[summary.id] = summary
+                for check in b["report_checks"]:
+                    check_id = SecurityCheckId(check["id"])
+                    benchmark_by_check_id[check_id].add(benchmark_id)
+            return summaries, benchmark_by_check_id
+
+        async def timeseries_infected() -> TimeSeries:
+            start = now - timedelta(days=62 if is_free else 14)
+            granularity = timedelta(days=7 if is_free else 1)
+            groups = {"severity"}
+            async with self.client.timeseries(
+                db, "infected_resources", start=start, end=now, granularity=granularity, group=groups
+            ) as result:
+                data = [entry async for entry in result]
+            return TimeSeries(name="infected_resources", start=start, end=now, granularity=granularity, data=data)
+
+        async def top_issues(
+            benchmark_by_check_id: Dict[SecurityCheckId, Set[BenchmarkId]],
+            benchmarks: Dict[BenchmarkId, BenchmarkSummary],
+            num: int,
+        ) -> List[Json]:
+            query = (
+                "aggregate(/security.issues[*].check, /security.issues[*].severity: sum(1) as count): "
+                "/security.has_issues==true"
             )
+            async with self.client.aggregate(db, query) as ctx:
+                all_failing = sorted(
+                    [e async for e in ctx],
+                    key=lambda x: (ReportSeverityPriority[x["group"]["severity"]], x["count"]),
+                    reverse=True,
+                )
+            top = list(islice((a["group"]["check"] for a in all_failing), num))
+            checks = await self.checks(db, check_ids=top)
+            for check in checks:
+                check["benchmarks"] = [
+                    {"id": bs.id, "title": bs.title}
+                    for b in benchmark_by_check_id[check["id"]]
+                    if (bs := benchmarks.get(b))
+                ]
+            return sorted(checks, key=lambda x: ReportSeverityPriority[x.get("severity", "info")], reverse=True)
+
+        def overall_score(accounts: Dict[CloudAccountId, AccountSummary], now: datetime, duration: timedelta) -> int:
+            # The overall score is the average of all account scores
+            scores = []
+            for account in accounts.values():
+                if not account.exported_at or account.exported_at > now - duration:
+                    scores.append(account.score)
+            total_score = sum(scores)
+            total_accounts = len(accounts)
+            return total_score // total_accounts if total_accounts > 0 else 100
+
+        (
+            (benchmarks, benchmark_by_check_id),
+            vulnerable_changed,
+            compliant_changed,
+            infected_resources_ts,
+        ) = await asyncio.gather(
+            benchmark_summary(benchmark_account_summaries),
+            issues_since(duration, "node_vulnerable"),
+            issues_since(duration, "node_compliant"),
+            timeseries_infected(),
+        )
 
-        try:
-            return await self.cache.call(compute_summary, key=str(db.workspace_id))()
-        except InventoryException as ex:
-            # in case no account is collected yet -> no graph, this is expected.
-            if not isinstance(ex, NoSuchGraph):
-                log.info(f"Inventory not available yet: {ex}. Returning empty summary.")
-            empty = CheckSummary(
-                available_resources=0,
-                failed_resources_by_severity={},
-            )
-            return ReportSummary(
-                check_summary=empty,
-                overall_score=0,
-                accounts=[],
-                benchmarks=[],
-                changed_vulnerable=NoVulnerabilitiesChanged,
-                changed_compliant=NoVulnerabilitiesChanged,
-                top_checks=[],
-            )
+        # get issues for the top 5 issue_ids
+        tops = await top_issues(benchmark_by_check_id, benchmarks, num=5)
 
-    async def timeseries_scattered(
+        # sort top changed account by score
+        vulnerable_changed.accounts_selection.sort(
+            key=lambda x: accounts_by_id[x].score if x in accounts_by_id else 100
+        )
+        compliant_changed.accounts_selection.sort(key=lambda x: accounts_by_id[x].score if x in accounts_by_id else 100)
+
+        return ReportSummary(
+            check_summary=CheckSummary(
+                available_resources=sum(v.resource_count for v in accounts_by_id.values()),
+                failed_resources_by_severity=severity_resource_counter,
+            ),
+            overall_score=overall_score(accounts_by_id, now, duration),
+            accounts=sorted(list(accounts_by_id.values()), key=lambda x: x.score),
+            benchmarks=list(benchmarks.values()),
+            changed_vulnerable=vulnerable_changed,
+            changed_compliant=compliant_changed,
+            top_checks=tops,
+            vulnerable_resources=infected_resources_ts,
+        )
+
+    async def timeseries_columnar(
         self,
         access: GraphDatabaseAccess,
         name: str,
@@ -727,9 +895,8 @@ class InventoryService(Service):
         group: Optional[Set[str]] = None,
         filter_group: Optional[List[str]] = None,
         aggregation: Optional[str] = None,
-    ) -> Scatters:
-        scatters: Dict[str, Scatter] = {}
-        ats: Set[datetime] = set()
+    ) -> ColumnarScatters:
+        points: List[Point] = []
         async with self.client.timeseries(
             access,
             name,
@@ -742,23 +909,33 @@ class InventoryService(Service):
         ) as cursor:
             async for entry in cursor:
                 if (at_str := entry.get("at")) and (v := entry.get("v")):
-                    at = parse_utc_str(str(at_str))
-                    groups: Json = entry.get("group") or {}
-                    group_name = "::".join(f"{k}={v}" for k, v in sorted(groups.items())) if groups else "all"
-                    ats.add(at)
-                    points = {at: v}
-                    scatter = Scatter(group_name=group_name, group=groups, values=points)
-                    if existing := scatters.get(scatter.group_name):
-                        existing.values.update(scatter.values)
-                    else:
-                        scatters[scatter.group_name] = scatter
-        return Scatters(
+                    points.append((entry.get("group") or {}, parse_utc_str(str(at_str)), v))
+        # sort by scatter, biggest first
+        return ColumnarScatters.of(start, end, granularity, points).sorted_by_avg()
+
+    async def timeseries_scattered(
+        self,
+        access: GraphDatabaseAccess,
+        name: str,
+        *,
+        start: datetime,
+        end: datetime,
+        granularity: timedelta,
+        group: Optional[Set[str]] = None,
+        filter_group: Optional[List[str]] = None,
+        aggregation: Optional[str] = None,
+    ) -> Scatters:
+        columnar = await self.timeseries_columnar(
+            access,
+            name,
             start=start,
             end=end,
             granularity=granularity,
-            ats=sorted(ats),
-            groups=sorted(scatters.values(), key=lambda x: x.avg, reverse=True),  # sort by scatter, biggest first
+            group=group,
+            filter_group=filter_group,
+            aggregation=aggregation,
         )
+        return columnar.to_scatters()
 
     async def __aggregate_roots(self, db: GraphDatabaseAccess) -> Dict[str, Json]:
         if self.__cached_aggregate_roots is not None:
@@ -787,30 +964,47 @@ class InventoryService(Service):
                     value_in_path(acc, "reported.id"): value_in_path(acc, "reported.name") async for acc in response
                 }
 
-            async def progress(
+            def progress_query(
                 metric: str,
-                not_exist: int,
-                group: Optional[Set[str]] = None,
-                aggregation: Optional[str] = None,
+                aggregation: str,
                 filter_group: Optional[List[str]] = None,
-            ) -> Tuple[int, int]:
-                async with self.client.timeseries(
-                    dba,
+            ) -> TimeseriesQuery:
+                return TimeseriesQuery(
                     metric,
                     start=now - duration,
                     end=now,
                     granularity=duration,
-                    group=group,
+                    group=set(),
                     filter_group=filter_group,
                     aggregation=aggregation,
-                ) as response:
-                    entries = [round(r["v"]) async for r in response]
-                    if len(entries) == 0:  # timeseries haven't been created yet
-                        return not_exist, 0
-                    elif len(entries) == 1:  # the timeseries does not exist longer than the current period
-                        return entries[0], 0
-                    else:
-                        return entries[1], entries[1] - entries[0]
+                )
+
+            def progress(response: List[Json], not_exist: int) -> Tuple[int, int]:
+                entries = [round(r["v"]) for r in response]
+                if len(entries) == 0:  # timeseries haven't been created yet
+                    return not_exist, 0
+                elif len(entries) == 1:  # the timeseries does not exist longer than the current period
+                    return entries[0], 0
+                else:
+                    return entries[1], entries[1] - entries[0]
+
+            async def all_progress() -> List[Tuple[int, int]]:
+                # (query, value if the timeseries does not exist)
+                progress_queries = [
+                    (progress_query("account_score", "avg"), 100),
+                    (progress_query("instances_total", "sum", filter_group=["status==running"]), 0),
+                    (progress_query("cores_total", "sum"), 0),
+                    (progress_query("memory_bytes", "sum"), 0),
+                    (progress_query("volumes_total", "sum"), 0),
+                    (progress_query("volume_bytes", "sum"), 0),
+                    (progress_query("databases_total", "sum"), 0),
+                    (progress_query("databases_bytes", "sum"), 0),
+                    (progress_query("buckets_objects_total", "sum"), 0),
+                    (progress_query("buckets_size_bytes", "sum"), 0),
+                ]
+                # fetch all timeseries with one request
+                results = await self.client.timeseries_many(dba, [q for q, _ in progress_queries])
+                return [progress(result, not_exist) for result, (_, not_exist) in zip(results, progress_queries)]
 
             async def resources_per_account_timeline() -> Scatters:
                 scatters = await self.timeseries_scattered(
@@ -842,55 +1036,12 @@ class InventoryService(Service):
                         changes.get("node_deleted", 0),
                     )
 
-            async def overall_score() -> Tuple[int, int]:
-                current, diff = await progress("account_score", 100, group=set(), aggregation="avg")
-                return current, diff
-
-            # noinspection PyTypeChecker
-            (
-                scatters,
-                score_progress,
-                resource_changes,
-                instances_progress,
-                cores_progress,
-                memory_progress,
-                volumes_progress,
-                volume_bytes_progress,
-                databases_progress,
-                databases_bytes_progress,
-                buckets_objects_progress,
-                buckets_size_bytes_progress,
-            ) = await asyncio.gather(
-                resources_per_account_timeline(),
-                overall_score(),
-                nr_of_changes(),
-                progress("instances_total", 0, group=set(), aggregation="sum", filter_group=["status==running"]),
-                progress("cores_total", 0, group=set(), aggregation="sum"),
-                progress("memory_bytes", 0, group=set(), aggregation="sum"),
-                progress("volumes_total", 0, group=set(), aggregation="sum"),
-                progress("volume_bytes", 0, group=set(), aggregation="sum"),
-                progress("databases_total", 0, group=set(), aggregation="sum"),
-                progress("databases_bytes", 0, group=set(), aggregation="sum"),
-                progress("buckets_objects_total", 0, group=set(), aggregation="sum"),
-                progress("buckets_size_bytes", 0, group=set(), aggregation="sum"),
-            )
-
-            return InventorySummary(
-                scatters,  # type: ignore
-                score_progress,  # type: ignore
-                resource_changes,  # type: ignore
-                instances_progress,  # type: ignore
-                cores_progress,  # type: ignore
-                memory_progress,  # type: ignore
-                volumes_progress,  # type: ignore
-                volume_bytes_progress,  # type: ignore
-                databases_progress,  # type: ignore
-                databases_bytes_progress,  # type: ignore
-                buckets_objects_progress,  # type: ignore
-                buckets_size_bytes_progress,  # type: ignore
+            scatters, resource_changes, progresses = await asyncio.gather(
+                resources_per_account_timeline(), nr_of_changes(), all_progress()
             )
+            return InventorySummary(scatters, progresses[0], resource_changes, *progresses[1:])
 
-        return await self.cache.call(compute_inventory_info, key=str(dba.workspace_id))(duration)
+        return await self.single_flight.call(compute_inventory_info, key=str(dba.workspace_id))(duration)
 
     async def descendant_summary(
         self,
@@ -939,7 +1090,7 @@ class InventoryService(Service):
                             account_summary.regions[region_id][descendant_kind] += count
             return {k: v.plain() for k, v in account_usage.items()}
 
-        summary = await self.cache.call(account_region_summary, key=str(dba.workspace_id))()
+        summary = await self.single_flight.call(account_region_summary, key=str(dba.workspace_id))()
         if cloud_ids:
             summary = {k: v for k, v in summary.items() if v.cloud_id in cloud_ids}
         if account_ids:
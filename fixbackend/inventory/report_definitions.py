@@ -0,0 +1,230 @@
+#  Copyright (c) 2024. Some Engineering
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from __future__ import annotations
+
+import logging
+import time
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Literal, Optional, Set, Tuple
+
+from attrs import frozen
+from fixcloudutils.redis.cache import RedisCache
+from fixcloudutils.service import Service
+from fixcloudutils.types import Json
+
+from fixbackend.graph_db.models import GraphDatabaseAccess
+from fixbackend.ids import SecurityCheckId, WorkspaceId
+from fixbackend.inventory.inventory_client import InventoryClient, InventoryException
+from fixbackend.single_flight import SingleFlight
+from fixbackend.types import Redis
+
+log = logging.getLogger(__name__)
+DefinitionKind = Literal["check", "benchmark"]
+# the inventory stores custom definitions as config entries with these prefixes
+CustomConfigPrefix: Dict[DefinitionKind, str] = {"check": "fix.report.check.", "benchmark": "fix.report.benchmark."}
+# member of the custom set: the custom definitions of the workspace have been discovered
+DiscoveredMember = "discovered"
+# custom id: the workspace has custom definitions with unknown ids
+UnknownId = "*"
+
+
+@frozen
+class Definitions:
+    items: List[Json]
+    by_id: Dict[str, Json]
+
+    @staticmethod
+    def of(items: List[Json]) -> Definitions:
+        valid = [i for i in items if isinstance(i, dict) and "id" in i]
+        return Definitions(valid, {i["id"]: i for i in valid})
+
+    def layered(self, custom_ids: Set[str], custom: List[Json]) -> Definitions:
+        # custom definitions replace built-in definitions with the same id. Deleted custom definitions are removed.
+        replaced = {c["id"]: c for c in custom}
+        items = [replaced.pop(i["id"], i) for i in self.items if i["id"] not in custom_ids or i["id"] in replaced]
+        return Definitions.of(items + list(replaced.values()))
+
+
+class ReportDefinitionCache(Service):
+    """
+    Two tier cache for the definitions of checks and benchmarks.
+    Built-in definitions are the same for all workspaces and are only loaded once per inventory version.
+    Custom definitions of a workspace (created via put_check/put_benchmark) are loaded per workspace
+    and layered on top of the built-in definitions.
+    Custom definitions created before they were tracked are discovered once per workspace via its config entries.
+    Only a workspace without any custom definition may load the shared built-in definitions.
+    A workspace with custom definitions of unknown ids always loads all of its definitions on its own.
+    Lookups are served from an in-memory index.
+    """
+
+    def __init__(
+        self,
+        client: InventoryClient,
+        redis: Redis,
+        workspace_tier: SingleFlight,
+        *,
+        version_ttl: timedelta = timedelta(minutes=5),
+        ttl: timedelta = timedelta(days=1),
+        max_indexes: int = 64,
+    ) -> None:
+        self.client = client
+        self.redis = redis
+        self.version_ttl = version_ttl
+        self.cache = RedisCache(redis, "report_definitions", ttl_memory=ttl / 2, ttl_redis=ttl)
+        self.builtin_tier = SingleFlight(self.cache, redis, shared_errors=[InventoryException])
+        self.workspace_tier = workspace_tier
+        self.version: Optional[Tuple[str, float]] = None
+        # in-memory index of loaded definitions: (version, variant) -> definitions
+        self.indexes: OrderedDict[Tuple[str, str], Definitions] = OrderedDict()
+        self.max_indexes = max_indexes
+
+    async def start(self) -> Any:
+        await self.cache.start()
+
+    async def stop(self) -> Any:
+        await self.cache.stop()
+
+    @staticmethod
+    def _custom_key(workspace_id: WorkspaceId) -> str:
+        return f"report_definitions:custom:{workspace_id}"
+
+    async def changed(self, workspace_id: WorkspaceId, kind: DefinitionKind, definition_id: str) -> None:
+        # called when a custom definition is created, updated or deleted
+        await self.redis.sadd(self._custom_key(workspace_id), f"{kind}:{definition_id}")
+
+    async def _custom_ids(self, db: GraphDatabaseAccess, kind: DefinitionKind) -> Set[str]:
+        key = self._custom_key(db.workspace_id)
+        members: Set[str] = await self.redis.smembers(key)
+        if DiscoveredMember not in members:
+            try:
+                config_ids = await self.client.config_ids(db)
+            except InventoryException as ex:
+                log.warning(f"Could not discover custom report definitions: {ex}. Do not use shared definitions.")
+                return {UnknownId}
+            discovered = {
+                f"{k}:{UnknownId}"
+                for k, prefix in CustomConfigPrefix.items()
+                if any(c.startswith(prefix) for c in config_ids)
+            }
+            await self.redis.sadd(key, DiscoveredMember, *discovered)
+            members |= discovered
+        prefix = f"{kind}:"
+        return {m.removeprefix(prefix) for m in members if m.startswith(prefix)}
+
+    async def _inventory_version(self, db: GraphDatabaseAccess) -> str:
+        now = time.monotonic()
+        if self.version is None or self.version[1] < now:
+            version = await self.client.version(db)
+            if self.version is not None and self.version[0] != version:
+                log.info(f"Inventory version changed: {self.version[0]} -> {version}. Reload report definitions.")
+                self.indexes.clear()
+            self.version = (version, now + self.version_ttl.total_seconds())
+        return self.version[0]
+
+    async def _definitions(
+        self,
+        db: GraphDatabaseAccess,
+        kind: DefinitionKind,
+        variant: str,
+        fetch_all: Callable[[], Awaitable[List[Json]]],
+        fetch_custom: Callable[[List[str]], Awaitable[List[Json]]],
+    ) -> Definitions:
+        version = await self._inventory_version(db)
+        custom_ids = await self._custom_ids(db, kind)
+        builtin_key = (version, variant)
+        if (builtin := self.indexes.get(builtin_key)) is not None:
+            self.indexes.move_to_end(builtin_key)
+        elif not custom_ids:
+            # the definitions of a workspace without custom definitions are the built-in ones
+
+            async def load_builtin_definitions(*_: Any) -> List[Json]:
+                return await fetch_all()
+
+            builtin = Definitions.of(await self.builtin_tier.call(load_builtin_definitions, version)(variant))
+            self.indexes[builtin_key] = builtin
+            if len(self.indexes) > self.max_indexes:
+                self.indexes.popitem(last=False)
+        if not custom_ids and builtin is not None:
+            return builtin
+        # the ids of the custom definitions are not known: the built-in definitions can not be used
+        base = builtin if UnknownId not in custom_ids else None
+
+        async def load_custom_definitions(*_: Any) -> List[Json]:
+            # built-in definitions are not known yet: load all definitions of this workspace
+            return await fetch_custom(sorted(custom_ids)) if base is not None else await fetch_all()
+
+        custom = await self.workspace_tier.call(load_custom_definitions, str(db.workspace_id))(
+            variant, base is not None, sorted(custom_ids)
+        )
+        return base.layered(custom_ids, custom) if base is not None else Definitions.of(custom)
+
+    async def checks(
+        self,
+        db: GraphDatabaseAccess,
+        *,
+        provider: Optional[str] = None,
+        service: Optional[str] = None,
+        category: Optional[str] = None,
+        kind: Optional[str] = None,
+        check_ids: Optional[List[SecurityCheckId]] = None,
+        ids_only: Optional[bool] = None,
+    ) -> List[Json]:
+        if check_ids is not None and len(check_ids) == 0:
+            return []
+        definitions = await self._definitions(
+            db,
+            "check",
+            "checks",
+            lambda: self.client.checks(db),
+            lambda ids: self.client.checks(db, check_ids=[SecurityCheckId(i) for i in ids]),
+        )
+        if check_ids:
+            checks = [c for cid in dict.fromkeys(check_ids) if (c := definitions.by_id.get(cid)) is not None]
+        else:
+            checks = definitions.items
+        result = [
+            c
+            for c in checks
+            if (provider is None or c.get("provider") == provider)
+            and (service is None or c.get("service") == service)
+            and (category is None or category in (c.get("categories") or []))
+            and (kind is None or c.get("result_kind") == kind)
+        ]
+        return [c["id"] for c in result] if ids_only else [dict(c) for c in result]
+
+    async def benchmarks(
+        self,
+        db: GraphDatabaseAccess,
+        *,
+        benchmarks: Optional[List[str]] = None,
+        short: Optional[bool] = None,
+        with_checks: Optional[bool] = None,
+        ids_only: Optional[bool] = None,
+    ) -> List[Json]:
+        if benchmarks is not None and len(benchmarks) == 0:
+            return []
+        # the inventory renders benchmarks differently, depending on short and with_checks
+        definitions = await self._definitions(
+            db,
+            "benchmark",
+            f"benchmarks:{short}:{with_checks}",
+            lambda: self.client.benchmarks(db, short=short, with_checks=with_checks),
+            lambda ids: self.client.benchmarks(db, benchmarks=ids, short=short, with_checks=with_checks),
+        )
+        if benchmarks:
+            result = [b for bid in dict.fromkeys(benchmarks) if (b := definitions.by_id.get(bid)) is not None]
+        else:
+            result = definitions.items
+        return [b["id"] for b in result] if ids_only else [dict(b) for b in result]
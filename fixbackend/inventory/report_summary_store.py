@@ -0,0 +1,116 @@
+#  Copyright (c) 2024. Some Engineering
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import logging
+from datetime import timedelta
+from typing import List, Optional, Tuple, Set
+
+from fixbackend.ids import WorkspaceId
+from fixbackend.inventory.data_version import WorkspaceDataVersion
+from fixbackend.inventory.inventory_schemas import ReportSummary
+from fixbackend.types import Redis
+
+log = logging.getLogger(__name__)
+
+# (is_free, duration) - the parameters that define a report summary of a workspace
+SummaryParams = Tuple[bool, timedelta]
+
+
+class ReportSummaryStore:
+    """
+    Stores precomputed report summaries per workspace and summary parameters.
+    Summaries are computed after a workspace has been collected, so reading a summary is a single redis GET.
+    The parameters of every requested summary are remembered, so the next collect can compute them upfront.
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        data_version: WorkspaceDataVersion,
+        *,
+        snapshot_ttl: timedelta = timedelta(days=1),
+        requested_ttl: timedelta = timedelta(days=31),
+    ) -> None:
+        self.redis = redis
+        self.data_version = data_version
+        # a snapshot is replaced with every collect. Outdated snapshots are not served.
+        self.snapshot_ttl = snapshot_ttl
+        # parameters of summaries, that have not been requested in this time frame, are not computed upfront
+        self.requested_ttl = requested_ttl
+        # KEYS: data version, snapshot. ARGV: expected data version, summary, ttl in seconds
+        self.put_if_version_script = redis.register_script(
+            """
+            if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+                return 0
+            end
+            redis.call('SET', KEYS[2], ARGV[2], 'EX', ARGV[3])
+            return 1
+            """
+        )
+
+    def _snapshot_key(self, workspace_id: WorkspaceId, params: SummaryParams) -> str:
+        return f"inventory:report_summary:{workspace_id}:{self._params_str(params)}"
+
+    def _requested_key(self, workspace_id: WorkspaceId) -> str:
+        return f"inventory:report_summary:{workspace_id}:requested"
+
+    @staticmethod
+    def _params_str(params: SummaryParams) -> str:
+        is_free, duration = params
+        return f"{'free' if is_free else 'paid'}:{int(duration.total_seconds())}"
+
+    @staticmethod
+    def _parse_params(value: str) -> SummaryParams:
+        tier, seconds = value.split(":", maxsplit=1)
+        return tier == "free", timedelta(seconds=int(seconds))
+
+    async def get(self, workspace_id: WorkspaceId, params: SummaryParams) -> Optional[ReportSummary]:
+        # get the snapshot and remember that this summary has been requested in one round trip
+        async with self.redis.pipeline(transaction=False) as pipe:
+            await pipe.get(self._snapshot_key(workspace_id, params))
+            await pipe.sadd(self._requested_key(workspace_id), self._params_str(params))
+            await pipe.expire(self._requested_key(workspace_id), self.requested_ttl)
+            snapshot, *_ = await pipe.execute()
+        if snapshot is None:
+            return None
+        try:
+            return ReportSummary.model_validate_json(snapshot)
+        except Exception as ex:
+            # can happen, if the schema has changed: compute it again
+            log.warning(f"Can not read report summary snapshot of workspace {workspace_id}: {ex}")
+            return None
+
+    async def put(
+        self, workspace_id: WorkspaceId, params: SummaryParams, summary: ReportSummary, *, version: Optional[str] = None
+    ) -> bool:
+        """
+        Store the summary. If the data version the summary was computed from is given,
+        the summary is only stored, if the data of the workspace has not changed in the meantime.
+        """
+        key = self._snapshot_key(workspace_id, params)
+        if version is None:
+            await self.redis.set(key, summary.model_dump_json(), ex=self.snapshot_ttl)
+            return True
+        keys = [self.data_version.key(workspace_id), key]
+        args: List[str | int] = [version, summary.model_dump_json(), int(self.snapshot_ttl.total_seconds())]
+        stored: int = await self.put_if_version_script(keys=keys, args=args)
+        return stored == 1
+
+    async def delete(self, workspace_id: WorkspaceId) -> None:
+        # the data or configuration of the workspace has changed: no snapshot of it may be served
+        if keys := [self._snapshot_key(workspace_id, params) for params in await self.requested(workspace_id)]:
+            await self.redis.delete(*keys)
+
+    async def requested(self, workspace_id: WorkspaceId) -> List[SummaryParams]:
+        values: Set[str] = await self.redis.smembers(self._requested_key(workspace_id))
+        return [self._parse_params(v) for v in sorted(values)]
@@ -0,0 +1,192 @@
+#  Copyright (c) 2024. Some Engineering
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from __future__ import annotations
+
+import base64
+import json
+import logging
+import zlib
+from datetime import timedelta
+from typing import AsyncIterator, List, Optional
+
+from attrs import frozen
+from fixcloudutils.util import utc
+
+from fixbackend.errors import ClientError
+from fixbackend.ids import WorkspaceId
+from fixbackend.types import Redis
+
+log = logging.getLogger(__name__)
+
+
+@frozen
+class SearchCursor:
+    """
+    Opaque cursor of a page in a search result snapshot.
+    query: hash of the search command, collect: the collect the snapshot is based on, skip: first row of the page.
+    """
+
+    query: str
+    collect: str
+    skip: int
+
+    def encode(self) -> str:
+        return base64.urlsafe_b64encode(json.dumps([self.query, self.collect, self.skip]).encode()).decode()
+
+    @staticmethod
+    def decode(value: str) -> SearchCursor:
+        try:
+            query, collect, skip = json.loads(base64.urlsafe_b64decode(value.encode()))
+            assert isinstance(query, str) and isinstance(collect, str) and isinstance(skip, int) and skip >= 0
+            return SearchCursor(query, collect, skip)
+        except Exception as ex:
+            raise ClientError(f"Invalid cursor: {value}") from ex
+
+
+@frozen
+class SnapshotPage:
+    header: Optional[str]  # the header line of the result, e.g. the columns of the table
+    lines: List[str]  # the lines of all rows of the page
+    rows: int  # number of rows in the snapshot
+    complete: bool  # false, if the result has more rows than the snapshot can hold
+    total: Optional[int]  # total number of rows of the result, if known
+
+    def content(self) -> bytes:
+        return "\n".join([self.header, *self.lines] if self.header else self.lines).encode()
+
+
+class SearchSnapshotStore:
+    """
+    Stores the sorted result of a search in a short-lived snapshot, so that all pages are served without
+    executing the search again. The raw result lines are stored compressed in chunks of rows in a redis hash.
+    A page only loads the chunks it needs.
+    A snapshot is keyed by the hash of the search command and the last collect of the workspace:
+    a new collect creates new snapshots, while cursors of a former snapshot can be used until it expires.
+    The number of rows and bytes of one snapshot, as well as the number of snapshots per workspace are bounded.
+    """
+
+    def __init__(
+        self,
+        redis: Redis,
+        *,
+        ttl: timedelta = timedelta(minutes=10),
+        max_rows: int = 100_000,
+        max_bytes: int = 16 * 1024 * 1024,
+        max_snapshots: int = 5,
+        chunk_rows: int = 500,
+        collect_ttl: timedelta = timedelta(days=31),
+    ) -> None:
+        self.redis = redis
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_snapshots = max_snapshots
+        self.chunk_rows = chunk_rows
+        self.collect_ttl = collect_ttl
+
+    def _snapshot_key(self, workspace_id: WorkspaceId, query: str, collect: str) -> str:
+        return f"inventory:search_snapshot:{workspace_id}:{query}:{collect}"
+
+    def _snapshots_key(self, workspace_id: WorkspaceId) -> str:
+        return f"inventory:search_snapshot:{workspace_id}:snapshots"
+
+    def _collect_key(self, workspace_id: WorkspaceId) -> str:
+        return f"inventory:search_snapshot:{workspace_id}:collect"
+
+    async def collected(self, workspace_id: WorkspaceId, collect: str) -> None:
+        await self.redis.set(self._collect_key(workspace_id), collect, ex=self.collect_ttl)
+
+    async def last_collect(self, workspace_id: WorkspaceId) -> str:
+        collect: Optional[str] = await self.redis.get(self._collect_key(workspace_id))
+        return collect or "none"
+
+    async def put(
+        self,
+        workspace_id: WorkspaceId,
+        query: str,
+        collect: str,
+        lines: AsyncIterator[str],
+        total: Optional[int] = None,
+    ) -> None:
+        """
+        Store the header line and all row lines of a search result.
+        The lines should contain one row more than max_rows, to detect, that the result is not complete.
+        """
+        key = self._snapshot_key(workspace_id, query, collect)
+        header: Optional[str] = None
+        chunks: List[str] = []
+        chunk: List[str] = []
+        rows = 0
+        size = 0
+        complete = True
+        async for line in lines:
+            if header is None:
+                header = line
+                continue
+            if rows >= self.max_rows or size >= self.max_bytes:
+                complete = False
+                break
+            chunk.append(line)
+            rows += 1
+            if len(chunk) == self.chunk_rows:
+                chunks.append(self._compress(chunk))
+                size += len(chunks[-1])
+                chunk = []
+        if chunk:
+            chunks.append(self._compress(chunk))
+        meta = json.dumps({"rows": rows, "complete": complete, "total": rows if complete else total})
+        now = utc().timestamp()
+        async with self.redis.pipeline(transaction=False) as pipe:
+            await pipe.delete(key)
+            await pipe.hset(
+                key, mapping={"meta": meta, "header": header or "", **{str(i): c for i, c in enumerate(chunks)}}
+            )
+            await pipe.expire(key, self.ttl)
+            await pipe.zadd(self._snapshots_key(workspace_id), {f"{query}:{collect}": now})
+            await pipe.zremrangebyscore(self._snapshots_key(workspace_id), "-inf", now - self.ttl.total_seconds())
+            await pipe.expire(self._snapshots_key(workspace_id), self.ttl)
+            await pipe.execute()
+        # only the most recent snapshots of a workspace are kept
+        if evicted := await self.redis.zrange(self._snapshots_key(workspace_id), 0, -self.max_snapshots - 1):
+            log.info(f"Evict {len(evicted)} search snapshots of workspace {workspace_id}")
+            async with self.redis.pipeline(transaction=False) as pipe:
+                await pipe.zrem(self._snapshots_key(workspace_id), *evicted)
+                await pipe.delete(*[f"inventory:search_snapshot:{workspace_id}:{snapshot}" for snapshot in evicted])
+                await pipe.execute()
+
+    @staticmethod
+    def _compress(lines: List[str]) -> str:
+        # redis responses are decoded as text
+        return base64.b64encode(zlib.compress("\n".join(lines).encode())).decode()
+
+    @staticmethod
+    def _decompress(chunk: str) -> List[str]:
+        return zlib.decompress(base64.b64decode(chunk)).decode().split("\n")
+
+    async def page(
+        self, workspace_id: WorkspaceId, query: str, collect: str, skip: int, limit: int
+    ) -> Optional[SnapshotPage]:
+        """
+        Return the header and the rows of the page from the snapshot, or None, if the snapshot does not exist.
+        """
+        first, last = skip // self.chunk_rows, (skip + limit - 1) // self.chunk_rows
+        fields = ["meta", "header", *[str(i) for i in range(first, last + 1)]]
+        meta, header, *chunks = await self.redis.hmget(self._snapshot_key(workspace_id, query, collect), fields)
+        if meta is None:
+            return None
+        js = json.loads(meta)
+        rows = [line for c in chunks if c is not None for line in self._decompress(c)]
+        offset = skip - first * self.chunk_rows  # position of the page in the loaded chunks
+        page = rows[offset : offset + limit]  # noqa: E203
+        return SnapshotPage(header or None, page, js["rows"], js["complete"], js["total"])
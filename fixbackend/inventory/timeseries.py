@@ -0,0 +1,135 @@
+#  Copyright (c) 2024. Some Engineering
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from __future__ import annotations
+
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from attrs import define, field
+
+from fixbackend.inventory.inventory_schemas import Scatter, Scatters
+
+# a numpy array of float values
+Values = np.ndarray[Any, np.dtype[np.float64]]
+# (group, at, value) - one point of a grouped timeseries
+Point = Tuple[Dict[str, Optional[str]], datetime, float]
+
+
+def group_name_of(group: Dict[str, Optional[str]]) -> str:
+    return "::".join(f"{k}={v}" for k, v in sorted(group.items())) if group else "all"
+
+
+@define
+class ColumnarScatters:
+    """
+    Columnar representation of a grouped timeseries.
+    The timestamps are maintained only once, all values are stored in one dense matrix of groups x timestamps.
+    A missing value is represented as NaN, so aggregations only consider existing values.
+    """
+
+    start: datetime
+    end: datetime
+    granularity: timedelta
+    ats: List[datetime]
+    groups: List[Dict[str, Optional[str]]]
+    values: Values  # shape: (len(groups), len(ats))
+    attributes: List[Dict[str, Any]] = field()
+
+    @attributes.default
+    def _default_attributes(self) -> List[Dict[str, Any]]:
+        return [{} for _ in self.groups]
+
+    @staticmethod
+    def of(start: datetime, end: datetime, granularity: timedelta, points: Iterable[Point]) -> ColumnarScatters:
+        group_idx: Dict[str, int] = {}
+        # the group name is only computed for unseen group items, not for every point
+        items_idx: Dict[Tuple[Tuple[str, Optional[str]], ...], int] = {}
+        groups: List[Dict[str, Optional[str]]] = []
+        at_idx: Dict[datetime, int] = {}
+        rows: List[int] = []
+        cols: List[int] = []
+        vals: List[float] = []
+        for group, at, value in points:
+            if (gi := items_idx.get(items := tuple(group.items()))) is None:
+                if (gi := group_idx.get(name := group_name_of(group))) is None:
+                    gi = group_idx[name] = len(groups)
+                    groups.append(group)
+                items_idx[items] = gi
+            if (ti := at_idx.get(at)) is None:
+                ti = at_idx[at] = len(at_idx)
+            rows.append(gi)
+            cols.append(ti)
+            vals.append(value)
+        # timestamps are sorted once, the column of every point is remapped to the sorted position
+        unsorted = list(at_idx)
+        order = np.argsort(np.array([at.timestamp() for at in unsorted], dtype=np.float64), kind="stable")
+        position = np.empty(len(order), dtype=np.intp)
+        position[order] = np.arange(len(order))
+        values = np.full((len(groups), len(unsorted)), np.nan, dtype=np.float64)
+        # a later point of the same group and timestamp overrides an earlier one
+        values[np.array(rows, dtype=np.intp), position[np.array(cols, dtype=np.intp)]] = np.array(vals, np.float64)
+        return ColumnarScatters(start, end, granularity, [unsorted[i] for i in order], groups, values)
+
+    @property
+    def group_names(self) -> List[str]:
+        return [group_name_of(g) for g in self.groups]
+
+    def count(self) -> np.ndarray[Any, np.dtype[np.int64]]:
+        # number of existing values per group
+        count: np.ndarray[Any, np.dtype[np.int64]] = np.count_nonzero(~np.isnan(self.values), axis=1)
+        return count
+
+    def sum(self) -> Values:
+        return np.nansum(self.values, axis=1)
+
+    def avg(self) -> Values:
+        # average over existing values per group. A group without values has an average of 0.
+        count = self.count()
+        avg: Values = np.divide(self.sum(), count, out=np.zeros(len(self.groups), dtype=np.float64), where=count > 0)
+        return avg
+
+    def fill_missing(self, value: float = 0) -> Values:
+        filled: Values = np.nan_to_num(self.values, nan=value)
+        return filled
+
+    def _select(self, idx: np.ndarray[Any, np.dtype[np.intp]]) -> ColumnarScatters:
+        return ColumnarScatters(
+            self.start,
+            self.end,
+            self.granularity,
+            self.ats,
+            [self.groups[i] for i in idx],
+            self.values[idx],
+            [self.attributes[i] for i in idx],
+        )
+
+    def sorted_by_avg(self) -> ColumnarScatters:
+        # biggest first, groups with the same average keep their order
+        return self._select(np.argsort(-self.avg(), kind="stable"))
+
+    def top_k(self, k: int) -> ColumnarScatters:
+        # the k groups with the biggest average, biggest first
+        avg = self.avg()
+        if k >= len(avg):
+            return self.sorted_by_avg()
+        top = np.argpartition(-avg, k - 1)[:k] if k > 0 else np.array([], dtype=np.intp)
+        return self._select(top[np.argsort(-avg[top], kind="stable")])
+
+    def to_scatters(self) -> Scatters:
+        scatters = []
+        for group, name, row, attrs in zip(self.groups, self.group_names, self.values.tolist(), self.attributes):
+            values = {at: v for at, v in zip(self.ats, row) if v == v}  # NaN is the only value not equal to itself
+            scatters.append(Scatter(group_name=name, group=group, values=values, attributes=attrs))
+        return Scatters(start=self.start, end=self.end, granularity=self.granularity, ats=self.ats, groups=scatters)
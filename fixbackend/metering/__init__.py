@@ -40,6 +40,6 @@ class MeteringRecord:
 @frozen
 class MeteringSummary:
     account_id: str
-    account_name: str
+    account_name: Optional[str]
     count: int
     product_tier: ProductTier
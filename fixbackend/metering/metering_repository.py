@@ -13,12 +13,15 @@
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 from __future__ import annotations
 
-from datetime import datetime
-from typing import AsyncIterator, Optional, List
+from collections import defaultdict
+from datetime import datetime, date, timedelta, timezone, time
+from typing import Any, AsyncIterator, Dict, Optional, List, Set, Tuple
 from uuid import UUID
 
 from fastapi_users_db_sqlalchemy.generics import GUID
-from sqlalchemy import select, INT, String, func
+from sqlalchemy import Select, select, INT, String, Date, func, insert, delete, cast, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Mapped, mapped_column
 
 from fixbackend.base_model import Base
@@ -27,6 +30,9 @@ from fixbackend.metering import MeteringRecord, MeteringSummary
 from fixbackend.sqlalechemy_extensions import UTCDateTime
 from fixbackend.types import AsyncSessionMaker
 
+# Collects with less resources are not billed. The rollup maintains a separate counter for this threshold.
+BillableMinResources = 100
+
 
 class MeteringRecordEntity(Base):
     __tablename__ = "metering"
@@ -46,8 +52,8 @@ class MeteringRecordEntity(Base):
     tier: Mapped[str] = mapped_column(String(64), nullable=False)
 
     @staticmethod
-    def from_model(model: MeteringRecord) -> MeteringRecordEntity:
-        return MeteringRecordEntity(
+    def values_from_model(model: MeteringRecord) -> Dict[str, Any]:
+        return dict(
             id=model.id,
             tenant_id=model.workspace_id,
             timestamp=model.timestamp,
@@ -63,6 +69,10 @@ class MeteringRecordEntity(Base):
             tier=model.product_tier.value,
         )
 
+    @staticmethod
+    def from_model(model: MeteringRecord) -> MeteringRecordEntity:
+        return MeteringRecordEntity(**MeteringRecordEntity.values_from_model(model))
+
     def to_model(self) -> MeteringRecord:
         return MeteringRecord(
             id=self.id,
@@ -81,6 +91,36 @@ class MeteringRecordEntity(Base):
         )
 
 
+class MeteringDailyEntity(Base):
+    """
+    Number of collects per tenant, account and product tier for every day (UTC).
+    Maintained on every insert into the metering table. The days before billing are rebuilt from the metering table,
+    see rebuild_rollup. An empty string is used for missing account ids and names.
+    """
+
+    __tablename__ = "metering_daily"
+
+    tenant_id: Mapped[WorkspaceId] = mapped_column(GUID, primary_key=True)
+    day: Mapped[date] = mapped_column(Date, primary_key=True)
+    account_id: Mapped[str] = mapped_column(String(256), primary_key=True)
+    account_name: Mapped[str] = mapped_column(String(256), primary_key=True)
+    tier: Mapped[str] = mapped_column(String(64), primary_key=True)
+    nr_of_collects: Mapped[int] = mapped_column(INT, nullable=False)
+    nr_of_billable_collects: Mapped[int] = mapped_column(INT, nullable=False)
+
+
+# (account_id, account_name, tier) -> number of collects
+SummaryRows = Dict[Tuple[str, Optional[str], str], int]
+
+
+def utc_day(at: datetime) -> date:
+    return at.astimezone(timezone.utc).date()
+
+
+def start_of_day(day: date) -> datetime:
+    return datetime.combine(day, time(0), tzinfo=timezone.utc)
+
+
 class MeteringRepository:
     def __init__(self, session_maker: AsyncSessionMaker) -> None:
         self.session_maker = session_maker
@@ -88,9 +128,54 @@ class MeteringRepository:
     async def add(self, records: List[MeteringRecord]) -> None:
         if len(records) == 0:
             return
+        # tenant, day, account_id, account_name, tier -> (collects, billable collects)
+        rollup: Dict[Tuple[WorkspaceId, date, str, str, str], List[int]] = defaultdict(lambda: [0, 0])
+        for record in records:
+            key = (
+                record.workspace_id,
+                utc_day(record.timestamp),
+                record.account_id or "",
+                record.account_name or "",
+                record.product_tier.value,
+            )
+            counter = rollup[key]
+            counter[0] += 1
+            counter[1] += 1 if record.nr_of_resources_collected >= BillableMinResources else 0
+        rollup_rows = [
+            dict(
+                tenant_id=tenant_id,
+                day=day,
+                account_id=account_id,
+                account_name=account_name,
+                tier=tier,
+                nr_of_collects=collects,
+                nr_of_billable_collects=billable,
+            )
+            # sorted: concurrent upserts lock the rows in the same order
+            for (tenant_id, day, account_id, account_name, tier), (collects, billable) in sorted(rollup.items())
+        ]
+        upsert = pg_insert(MeteringDailyEntity)
+        upsert = upsert.on_conflict_do_update(
+            index_elements=[
+                MeteringDailyEntity.tenant_id,
+                MeteringDailyEntity.day,
+                MeteringDailyEntity.account_id,
+                MeteringDailyEntity.account_name,
+                MeteringDailyEntity.tier,
+            ],
+            set_=dict(
+                nr_of_collects=MeteringDailyEntity.nr_of_collects + upsert.excluded.nr_of_collects,
+                nr_of_billable_collects=MeteringDailyEntity.nr_of_billable_collects
+                + upsert.excluded.nr_of_billable_collects,
+            ),
+        )
         async with self.session_maker() as session:
-            for record in records:
-                session.add(MeteringRecordEntity.from_model(record))
+            # Metering records and rollup are written in the same transaction.
+            # A list of parameters is sent as multi-row INSERT ... VALUES statements.
+            await session.execute(
+                insert(MeteringRecordEntity), [MeteringRecordEntity.values_from_model(r) for r in records]
+            )
+            await session.execute(upsert, rollup_rows)
             await session.commit()
 
     async def collect_summary(
@@ -101,37 +186,189 @@ class MeteringRepository:
         end: Optional[datetime] = None,
         min_resources_collected: int = 0,
         min_nr_of_collects: int = 0,
+        from_rollup: bool = True,
     ) -> AsyncIterator[MeteringSummary]:
+        """
+        Summary of all collects of a workspace per account in the given time range (start and end inclusive).
+        All days that are completely covered by the time range are read from the daily rollup.
+        Only the collects of the partially covered days at the edges are read from the metering table.
+        The rollup can only be used, if min_resources_collected is 0 or BillableMinResources.
+        """
+        async with self.session_maker() as session:
+            if from_rollup and min_resources_collected in (0, BillableMinResources):
+                rows = await self._summary_rows_rollup(session, workspace_id, start, end, min_resources_collected)
+            else:
+                rows = await self._summary_rows_raw(session, workspace_id, start, end, min_resources_collected)
+
+        # account_id, account_name -> (number of collects, tiers)
+        accounts: Dict[Tuple[str, Optional[str]], Tuple[int, Set[ProductTier]]] = {}
+        for (account_id, account_name, tier), count in rows.items():
+            existing, tiers = accounts.get((account_id, account_name), (0, set()))
+            accounts[(account_id, account_name)] = (existing + count, tiers | {ProductTier.from_str(tier)})
+        for (account_id, account_name), (count, tiers) in sorted(accounts.items(), key=lambda a: a[0][0]):
+            if count >= min_nr_of_collects:
+                yield MeteringSummary(
+                    account_id=account_id,
+                    account_name=account_name,
+                    count=count,
+                    product_tier=max(tiers, default=ProductTier.Free),
+                )
+
+    async def _summary_rows_raw(
+        self,
+        session: AsyncSession,
+        workspace_id: WorkspaceId,
+        start: Optional[datetime],
+        end: Optional[datetime],
+        min_resources_collected: int,
+        *,
+        end_exclusive: bool = False,
+    ) -> SummaryRows:
         query = (
             select(
                 MeteringRecordEntity.account_id,
                 MeteringRecordEntity.account_name,
+                MeteringRecordEntity.tier,
                 func.count().label("num_records"),
-                func.aggregate_strings(func.distinct(MeteringRecordEntity.tier), ",").label("tiers"),
             )
             .where(
                 (MeteringRecordEntity.tenant_id == workspace_id)
                 & (MeteringRecordEntity.nr_of_resources_collected >= min_resources_collected)
             )
-            .group_by(MeteringRecordEntity.account_id, MeteringRecordEntity.account_name)
+            .group_by(MeteringRecordEntity.account_id, MeteringRecordEntity.account_name, MeteringRecordEntity.tier)
         )
         if start is not None:
             query = query.where(MeteringRecordEntity.timestamp >= start)
         if end is not None:
-            query = query.where(MeteringRecordEntity.timestamp <= end)
+            query = query.where(
+                MeteringRecordEntity.timestamp < end if end_exclusive else MeteringRecordEntity.timestamp <= end
+            )
+        # missing account ids are reported as empty string, like in the rollup
+        rows: SummaryRows = defaultdict(int)
+        for account_id, account_name, tier, count in (await session.execute(query)).all():
+            rows[(account_id or "", account_name or None, tier)] += count
+        return rows
+
+    async def _summary_rows_rollup(
+        self,
+        session: AsyncSession,
+        workspace_id: WorkspaceId,
+        start: Optional[datetime],
+        end: Optional[datetime],
+        min_resources_collected: int,
+    ) -> SummaryRows:
+        # complete days: [first_day, last_day)
+        first_day: Optional[date] = None
+        if start is not None:
+            first_day = utc_day(start) if start == start_of_day(utc_day(start)) else utc_day(start) + timedelta(days=1)
+        last_day = None if end is None else utc_day(end)
+        if first_day is not None and last_day is not None and first_day >= last_day:
+            # no complete day in the time range
+            return await self._summary_rows_raw(session, workspace_id, start, end, min_resources_collected)
+
+        counter = (
+            MeteringDailyEntity.nr_of_billable_collects
+            if min_resources_collected == BillableMinResources
+            else MeteringDailyEntity.nr_of_collects
+        )
+        query = (
+            select(
+                MeteringDailyEntity.account_id,
+                MeteringDailyEntity.account_name,
+                MeteringDailyEntity.tier,
+                func.sum(counter).label("num_records"),
+            )
+            .where(MeteringDailyEntity.tenant_id == workspace_id)
+            .group_by(MeteringDailyEntity.account_id, MeteringDailyEntity.account_name, MeteringDailyEntity.tier)
+        )
+        if first_day is not None:
+            query = query.where(MeteringDailyEntity.day >= first_day)
+        if last_day is not None:
+            query = query.where(MeteringDailyEntity.day < last_day)
+        rows: SummaryRows = defaultdict(int)
+        for account_id, account_name, tier, count in (await session.execute(query)).all():
+            if count > 0:
+                rows[(account_id, account_name or None, tier)] += count
+
+        # partially covered days at the edges
+        edges: List[SummaryRows] = []
+        if start is not None and first_day is not None and start < start_of_day(first_day):
+            edges.append(
+                await self._summary_rows_raw(
+                    session, workspace_id, start, start_of_day(first_day), min_resources_collected, end_exclusive=True
+                )
+            )
+        if end is not None and last_day is not None:
+            edges.append(
+                await self._summary_rows_raw(
+                    session, workspace_id, start_of_day(last_day), end, min_resources_collected
+                )
+            )
+        for edge in edges:
+            for key, count in edge.items():
+                rows[key] += count
+        return rows
+
+    async def rebuild_rollup(self, since: date) -> None:
+        """
+        Rebuild the daily rollup of all days since the given day (inclusive) from the metering table.
+        Records that have been added without maintaining the rollup (e.g. by an older version of this service
+        during a deployment) are counted after the rebuild.
+        """
+        day = cast(func.timezone("UTC", MeteringRecordEntity.timestamp), Date)
+        account_id = func.coalesce(MeteringRecordEntity.account_id, "")
+        account_name = func.coalesce(MeteringRecordEntity.account_name, "")
+        rows = (
+            select(
+                MeteringRecordEntity.tenant_id,
+                day,
+                account_id,
+                account_name,
+                MeteringRecordEntity.tier,
+                func.count(),
+                func.count().filter(MeteringRecordEntity.nr_of_resources_collected >= BillableMinResources),
+            )
+            .where(MeteringRecordEntity.timestamp >= start_of_day(since))
+            .group_by(MeteringRecordEntity.tenant_id, day, account_id, account_name, MeteringRecordEntity.tier)
+        )
         async with self.session_maker() as session:
-            async for account_id, account_name, count, tiers in await session.stream(query):
-                if count >= min_nr_of_collects:
-                    tiers = [ProductTier.from_str(t) for t in tiers.split(",")] if tiers else []
-
-                    max_tier = max(tiers, default=ProductTier.Free)
-
-                    yield MeteringSummary(
-                        account_id=account_id,
-                        account_name=account_name,
-                        count=count,
-                        product_tier=max_tier,
-                    )
+            # wait for all running inserts and block new ones, until the rebuilt days are committed
+            await session.execute(text(f"LOCK TABLE {MeteringDailyEntity.__tablename__} IN SHARE ROW EXCLUSIVE MODE"))
+            await session.execute(delete(MeteringDailyEntity).where(MeteringDailyEntity.day >= since))
+            await session.execute(
+                insert(MeteringDailyEntity).from_select(
+                    [
+                        MeteringDailyEntity.tenant_id,
+                        MeteringDailyEntity.day,
+                        MeteringDailyEntity.account_id,
+                        MeteringDailyEntity.account_name,
+                        MeteringDailyEntity.tier,
+                        MeteringDailyEntity.nr_of_collects,
+                        MeteringDailyEntity.nr_of_billable_collects,
+                    ],
+                    rows,
+                )
+            )
+            await session.commit()
+
+    @staticmethod
+    def latest_resources(since: datetime) -> Select[Tuple[WorkspaceId, int]]:
+        """
+        Number of resources per tenant: the sum of the largest collect of every account since the given time.
+        Columns: tenant_id, resources
+        """
+        per_account = (
+            select(
+                MeteringRecordEntity.tenant_id,
+                func.max(MeteringRecordEntity.nr_of_resources_collected).label("resources"),
+            )
+            .where(MeteringRecordEntity.timestamp >= since)
+            .group_by(MeteringRecordEntity.tenant_id, MeteringRecordEntity.account_id)
+            .subquery()
+        )
+        return select(per_account.c.tenant_id, func.sum(per_account.c.resources).label("resources")).group_by(
+            per_account.c.tenant_id
+        )
 
     async def list(
         self,
@@ -0,0 +1,312 @@
+#  Copyright (c) 2024. Some Engineering
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import asyncio
+import logging
+import time
+from collections import defaultdict
+from datetime import timedelta
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from attrs import frozen
+from fixcloudutils.types import Json
+from fixcloudutils.util import utc
+from httpx import HTTPError, Response
+from prometheus_client import Counter, Gauge, Histogram
+
+from fixbackend.ids import NotificationProvider, WorkspaceId
+from fixbackend.notification.model import Alert, AlertOnChannel, AlertSender, WebhookAlertSender, WebhookRequest
+from fixbackend.utils import md5
+
+log = logging.getLogger(__name__)
+AlertDeliveryQueue = Gauge("alert_delivery_queue", "Number of alerts waiting for delivery", ["provider"])
+AlertDeliveryDuration = Histogram(
+    "alert_delivery_duration",
+    "Time from receiving an alert until it is delivered",
+    ["provider"],
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120),
+)
+AlertDeliveries = Counter("alert_deliveries", "Delivery attempts of alerts", ["provider", "result"])
+ConfigLoader = Callable[[WorkspaceId, NotificationProvider], Awaitable[Optional[Json]]]
+
+
+@frozen
+class RateLimit:
+    rate: float  # requests per second
+    burst: int  # requests that can be sent at once
+
+
+# limit over all webhooks of one provider
+DefaultProviderLimit = RateLimit(20, 40)
+# limits of a single webhook, derived from the documented limits of the providers
+DefaultWebhookLimits: Dict[NotificationProvider, RateLimit] = {
+    NotificationProvider.slack: RateLimit(1, 3),
+    NotificationProvider.discord: RateLimit(0.5, 5),
+    NotificationProvider.teams: RateLimit(1, 4),
+    NotificationProvider.pagerduty: RateLimit(2, 10),
+    NotificationProvider.opsgenie: RateLimit(1, 5),
+    NotificationProvider.email: RateLimit(1, 5),
+}
+
+
+class TokenBucket:
+    def __init__(self, limit: RateLimit) -> None:
+        self.limit = limit
+        self.tokens = float(limit.burst)
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(float(self.limit.burst), self.tokens + (now - self.updated_at) * self.limit.rate)
+        self.updated_at = now
+
+    def pause(self, seconds: float) -> None:
+        # no token is handed out before the pause is over (e.g. the server has asked to retry later)
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def idle(self) -> bool:
+        now = time.monotonic()
+        self._refill(now)
+        return self.tokens >= self.limit.burst and now >= self.paused_until
+
+    async def acquire(self) -> None:
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self._refill(now)
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.limit.rate)
+
+
+def retry_after(response: Response) -> Optional[float]:
+    # Retry-After is either defined in seconds or as http date
+    if value := response.headers.get("Retry-After"):
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            try:
+                return max(0.0, float((parsedate_to_datetime(value) - utc()).total_seconds()))
+            except Exception:
+                return None
+    return None
+
+
+class AlertDelivery:
+    """
+    Delivers alerts to the configured channels of a workspace.
+    - Alerts to the same webhook are coalesced into one message, if the provider supports it.
+    - Every provider and every webhook is rate limited with a token bucket.
+    - At most `max_concurrency` requests are sent at the same time. Requests to the same webhook are sent one by one.
+    - Throttled (429) or failed requests (5xx, transport error) are retried, honouring the Retry-After header.
+      Alerts of senders without webhook (e.g. email) are retried on any error.
+    - All alerts of one call are delivered within `max_delivery_time`: no retry is started after this time,
+      and deliveries that are still running are cancelled.
+    Delivery failures are logged, but not raised, so they do not trigger the redelivery of already delivered alerts.
+    """
+
+    def __init__(
+        self,
+        senders: Dict[NotificationProvider, AlertSender],
+        config_loader: ConfigLoader,
+        *,
+        max_concurrency: int = 20,
+        max_attempts: int = 5,
+        max_retry_delay: timedelta = timedelta(seconds=60),
+        max_delivery_time: timedelta = timedelta(seconds=120),
+        provider_limit: RateLimit = DefaultProviderLimit,
+        webhook_limits: Optional[Dict[NotificationProvider, RateLimit]] = None,
+        max_buckets: int = 10_000,
+    ) -> None:
+        self.senders = senders
+        self.config_loader = config_loader
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.max_attempts = max_attempts
+        self.max_retry_delay = max_retry_delay.total_seconds()
+        self.max_delivery_time = max_delivery_time.total_seconds()
+        self.provider_buckets: Dict[NotificationProvider, TokenBucket] = defaultdict(
+            lambda: TokenBucket(provider_limit)
+        )
+        self.webhook_limits = webhook_limits or DefaultWebhookLimits
+        self.webhook_buckets: Dict[Tuple[NotificationProvider, str], TokenBucket] = {}
+        self.max_buckets = max_buckets
+
+    def _webhook_bucket(self, provider: NotificationProvider, key: str) -> TokenBucket:
+        if (bucket := self.webhook_buckets.get((provider, key))) is None:
+            if len(self.webhook_buckets) >= self.max_buckets:
+                # buckets that are full again behave like new ones and can be dropped
+                self.webhook_buckets = {k: b for k, b in self.webhook_buckets.items() if not b.idle()}
+            bucket = TokenBucket(self.webhook_limits.get(provider, DefaultProviderLimit))
+            self.webhook_buckets[(provider, key)] = bucket
+        return bucket
+
+    async def deliver(self, alerts: List[AlertOnChannel]) -> None:
+        received_at = time.perf_counter()
+        # the same alert might be received more than once: deliver it once
+        unique = {(a.alert.workspace_id, a.alert.id, a.channel): a for a in alerts}
+        by_channel: Dict[Tuple[WorkspaceId, NotificationProvider], List[Alert]] = defaultdict(list)
+        for alert_on in unique.values():
+            by_channel[(alert_on.alert.workspace_id, alert_on.channel)].append(alert_on.alert)
+
+        deadline = time.monotonic() + self.max_delivery_time
+        deliveries: List[Awaitable[None]] = []
+        for (workspace_id, provider), channel_alerts in by_channel.items():
+            if (sender := self.senders.get(provider)) is None:
+                continue
+            try:
+                config = await self.config_loader(workspace_id, provider)
+                if not config:
+                    continue
+                if isinstance(sender, WebhookAlertSender):
+                    by_webhook: Dict[str, List[WebhookRequest]] = defaultdict(list)
+                    for alert in channel_alerts:
+                        if request := sender.webhook_request(alert, config):
+                            by_webhook[md5(request.url, *sorted(request.headers.items()))].append(request)
+                    for key, requests in by_webhook.items():
+                        deliveries.append(
+                            self._deliver_requests(provider, key, sender, requests, received_at, deadline)
+                        )
+                else:
+                    key = md5(workspace_id, provider)
+                    deliveries.append(
+                        self._deliver_alerts(provider, key, sender, channel_alerts, config, received_at, deadline)
+                    )
+            except Exception as ex:
+                log.warning(f"Could not prepare {provider} notification for workspace {workspace_id}: {ex}. Give up.")
+                AlertDeliveries.labels(provider, "failed").inc(len(channel_alerts))
+        try:
+            results = await asyncio.wait_for(
+                asyncio.gather(*deliveries, return_exceptions=True), timeout=max(0.0, deadline - time.monotonic())
+            )
+            for result in results:
+                if isinstance(result, Exception):
+                    log.warning(f"Could not deliver alerts: {result}. Give up.")
+        except TimeoutError:
+            log.warning(f"Could not deliver all alerts within {self.max_delivery_time} seconds. Give up.")
+
+    def _retry(self, attempt: int, delay: float, deadline: float) -> Optional[float]:
+        # the delay until the next attempt, or None if the delivery should give up
+        delay = min(delay, self.max_retry_delay)
+        if attempt < self.max_attempts and time.monotonic() + delay < deadline:
+            return delay
+        return None
+
+    async def _deliver_requests(
+        self,
+        provider: NotificationProvider,
+        key: str,
+        sender: WebhookAlertSender,
+        requests: List[WebhookRequest],
+        received_at: float,
+        deadline: float,
+    ) -> None:
+        AlertDeliveryQueue.labels(provider).inc(len(requests))
+        try:
+            coalesced = sender.coalesce(requests)
+            AlertDeliveries.labels(provider, "coalesced").inc(len(requests) - len(coalesced))
+            bucket = self._webhook_bucket(provider, key)
+            for request in coalesced:
+                await self._send(provider, bucket, sender, request, deadline)
+            AlertDeliveryDuration.labels(provider).observe(time.perf_counter() - received_at)
+        finally:
+            AlertDeliveryQueue.labels(provider).dec(len(requests))
+
+    async def _send(
+        self,
+        provider: NotificationProvider,
+        bucket: TokenBucket,
+        sender: WebhookAlertSender,
+        request: WebhookRequest,
+        deadline: float,
+    ) -> None:
+        for attempt in range(1, self.max_attempts + 1):
+            await self.provider_buckets[provider].acquire()
+            await bucket.acquire()
+            # exponential backoff, if the server does not define when to retry
+            delay = float(2 ** (attempt - 1))
+            try:
+                async with self.semaphore:
+                    response = await request.send(sender.http_client)
+            except HTTPError as ex:
+                log.info(f"Could not send {provider} notification: {ex}.")
+            else:
+                if response.is_success:
+                    log.info(f"Send {provider} alert notification.")
+                    AlertDeliveries.labels(provider, "delivered").inc()
+                    return
+                elif response.status_code == 429 or response.is_server_error:
+                    log.info(f"Could not send {provider} notification: {response.status_code} {response.text}.")
+                    delay = retry_after(response) or delay
+                else:
+                    log.info(
+                        f"Could not send {provider} notification: {response.status_code} {response.text}. Give up."
+                    )
+                    AlertDeliveries.labels(provider, "failed").inc()
+                    return
+            if (retry_delay := self._retry(attempt, delay, deadline)) is None:
+                break
+            AlertDeliveries.labels(provider, "retried").inc()
+            bucket.pause(retry_delay)
+        log.warning(f"Could not send {provider} notification after {attempt} attempts. Give up.")
+        AlertDeliveries.labels(provider, "failed").inc()
+
+    async def _deliver_alerts(
+        self,
+        provider: NotificationProvider,
+        key: str,
+        sender: AlertSender,
+        alerts: List[Alert],
+        config: Json,
+        received_at: float,
+        deadline: float,
+    ) -> None:
+        # senders without webhook deliver every alert on their own
+        AlertDeliveryQueue.labels(provider).inc(len(alerts))
+        try:
+            bucket = self._webhook_bucket(provider, key)
+            for alert in alerts:
+                await self._send_alert(provider, bucket, sender, alert, config, deadline)
+            AlertDeliveryDuration.labels(provider).observe(time.perf_counter() - received_at)
+        finally:
+            AlertDeliveryQueue.labels(provider).dec(len(alerts))
+
+    async def _send_alert(
+        self,
+        provider: NotificationProvider,
+        bucket: TokenBucket,
+        sender: AlertSender,
+        alert: Alert,
+        config: Json,
+        deadline: float,
+    ) -> None:
+        for attempt in range(1, self.max_attempts + 1):
+            await self.provider_buckets[provider].acquire()
+            await bucket.acquire()
+            try:
+                async with self.semaphore:
+                    await sender.send_alert(alert, config)
+                AlertDeliveries.labels(provider, "delivered").inc()
+                return
+            except Exception as ex:
+                log.info(f"Could not send {provider} notification: {ex}.")
+            # the sender does not tell, if the error is temporary: exponential backoff
+            if (retry_delay := self._retry(attempt, float(2 ** (attempt - 1)), deadline)) is None:
+                break
+            AlertDeliveries.labels(provider, "retried").inc()
+            bucket.pause(retry_delay)
+        log.warning(f"Could not send {provider} notification after {attempt} attempts. Give up.")
+        AlertDeliveries.labels(provider, "failed").inc()
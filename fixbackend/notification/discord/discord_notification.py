@@ -12,23 +12,25 @@
 #  You should have received a copy of the GNU Affero General Public License
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import logging
+from typing import Optional
 
 from fixcloudutils.types import Json
-from httpx import AsyncClient
 
-from fixbackend.httpx_extensions import HttpXResponse, ServerError, SuccessResponse
 from fixbackend.notification.model import (
-    AlertSender,
     Alert,
     FailingBenchmarkChecksDetected,
+    WebhookAlertSender,
+    WebhookRequest,
 )
 
 log = logging.getLogger(__name__)
 
 
-class DiscordNotificationSender(AlertSender):
-    def __init__(self, http_client: AsyncClient) -> None:
-        self.http_client = http_client
+class DiscordNotificationSender(WebhookAlertSender):
+    name = "discord"
+    # several alerts to the same webhook are sent as one message
+    coalesce_field = "embeds"
+    max_coalesced = 10
 
     def vulnerable_resources_detected(self, alert: FailingBenchmarkChecksDetected) -> Json:
         not_ex = [
@@ -73,19 +75,12 @@ class DiscordNotificationSender(AlertSender):
             ]
         }
 
-    async def send_alert(self, alert: Alert, config: Json) -> None:
+    def webhook_request(self, alert: Alert, config: Json) -> Optional[WebhookRequest]:
         if url := config.get("webhook_url"):
             match alert:
                 case FailingBenchmarkChecksDetected() as vrd:
                     message = self.vulnerable_resources_detected(vrd)
                 case _:
                     raise ValueError(f"Unknown alert: {alert}")
-
-            match HttpXResponse.read(await self.http_client.post(url, json=message)):
-                case SuccessResponse():
-                    log.info("Send discord alert notification.")
-                case ServerError(response):
-                    log.info(f"Could not send discord notification due to server error: {response.text}. Retry.")
-                    response.raise_for_status()  # raise exception and trigger retry
-                case error:
-                    log.info(f"Could not send discord notification due to error: {error}. Give up.")
+            return WebhookRequest(url, message)
+        return None
@@ -22,7 +22,7 @@ from fixcloudutils.util import utc_str, value_in_path_get, value_in_path
 from fixbackend.auth.models import User
 from fixbackend.graph_db.service import GraphDatabaseAccessManager
 from fixbackend.inventory.inventory_service import InventoryService
-from fixbackend.inventory.inventory_schemas import Scatters
+from fixbackend.inventory.timeseries import ColumnarScatters
 from fixbackend.notification.email.email_messages import render
 from fixbackend.workspaces.models import Workspace
 
@@ -45,7 +45,7 @@ def colors(num: int) -> str:
 
 
 def create_timeline_figure(
-    scatters: Scatters,
+    scatters: ColumnarScatters,
     *,
     title: Optional[str] = None,
     x_axis: Optional[str] = None,
@@ -56,14 +56,16 @@ def create_timeline_figure(
     date_fmt = "%d.%m.%y" if scatters.granularity >= timedelta(days=1) else "%d.%m.%y %H:%M"
     x = [at.strftime(date_fmt) for at in scatters.ats]
     fig = go.Figure()
-    for idx, scatter in enumerate(scatters.groups):
+    # Assume 0 if no value is present
+    values = scatters.fill_missing(0)
+    for idx, (name, attributes) in enumerate(zip(scatters.group_names, scatters.attributes)):
         color = colors(idx)
         fig.add_trace(
             go.Scatter(
                 x=x,
-                y=scatter.get_values(scatters.ats),
+                y=values[idx],
                 mode="lines",
-                name=scatter.attributes.get("name") or scatter.group_name,
+                name=attributes.get("name") or name,
                 stackgroup="one" if stacked else None,
                 line=dict(color=color, width=2, shape="spline"),
             )
@@ -148,8 +150,8 @@ class StatusUpdateEmailCreator:
                 else:
                     return entries[1], entries[1] - entries[0]
 
-        async def resources_per_account_timeline() -> Tuple[Scatters, bytes]:
-            scatters = await self.inventory_service.timeseries_scattered(
+        async def resources_per_account_timeline() -> Tuple[ColumnarScatters, bytes]:
+            scatters = await self.inventory_service.timeseries_columnar(
                 dba,
                 "resources",
                 start=now - duration,
@@ -159,9 +161,9 @@ class StatusUpdateEmailCreator:
                 filter_group=["account_id!=null"],
                 aggregation="sum",
             )
-            for scatter in scatters.groups:
-                acc_id = scatter.group.get("account_id", "<no account name>")
-                scatter.attributes["name"] = account_names.get(acc_id, acc_id)
+            for group, attributes in zip(scatters.groups, scatters.attributes):
+                acc_id = group.get("account_id", "<no account name>")
+                attributes["name"] = account_names.get(acc_id, acc_id)
             return scatters, await self.process_pool.submit(
                 create_timeline_figure,
                 scatters,
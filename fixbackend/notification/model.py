@@ -14,20 +14,26 @@
 
 from __future__ import annotations
 
+import logging
 from abc import ABC, abstractmethod
 from collections import defaultdict
 from functools import lru_cache, partial
+from itertools import batched
 from typing import Dict, List, Optional, cast
 from uuid import UUID
 
-from attr import frozen, define
+from attr import frozen, define, field, evolve
 from cattrs import Converter
 from cattrs.strategies import configure_tagged_union, include_subclasses
 from fixcloudutils.types import Json
+from httpx import AsyncClient, Response
 from pydantic import BaseModel, Field
 
+from fixbackend.httpx_extensions import HttpXResponse, ServerError, SuccessResponse
 from fixbackend.ids import WorkspaceId, NodeId, BenchmarkName, NotificationProvider, ReportSeverity
 
+log = logging.getLogger(__name__)
+
 SeverityEmoji = defaultdict(lambda: "⚠️", {"info": "ℹ️", "low": "🌱", "medium": "⚠️", "high": "🔥", "critical": "💥"})
 
 
@@ -109,6 +115,55 @@ class AlertSender(ABC):
         pass
 
 
+@frozen
+class WebhookRequest:
+    url: str
+    json: Json
+    headers: Dict[str, str] = field(factory=dict)
+
+    async def send(self, http_client: AsyncClient) -> Response:
+        return await http_client.post(self.url, headers=self.headers, json=self.json)
+
+
+class WebhookAlertSender(AlertSender):
+    """
+    Sends an alert as single http request.
+    The request is created once per alert, so it can be coalesced, rate limited and retried without rebuilding it.
+    """
+
+    name: str = "webhook"
+    # list in the payload, that allows to merge the payloads of several alerts into one request
+    coalesce_field: Optional[str] = None
+    max_coalesced: int = 10
+
+    def __init__(self, http_client: AsyncClient) -> None:
+        self.http_client = http_client
+
+    @abstractmethod
+    def webhook_request(self, alert: Alert, config: Json) -> Optional[WebhookRequest]:
+        pass
+
+    def coalesce(self, requests: List[WebhookRequest]) -> List[WebhookRequest]:
+        # all requests are sent to the same url with the same headers
+        if (list_field := self.coalesce_field) is None:
+            return requests
+        return [
+            evolve(chunk[0], json={**chunk[0].json, list_field: [e for r in chunk for e in r.json[list_field]]})
+            for chunk in batched(requests, self.max_coalesced)
+        ]
+
+    async def send_alert(self, alert: Alert, config: Json) -> None:
+        if request := self.webhook_request(alert, config):
+            match HttpXResponse.read(await request.send(self.http_client)):
+                case SuccessResponse():
+                    log.info(f"Send {self.name} alert notification.")
+                case ServerError(response):
+                    log.info(f"Could not send {self.name} notification due to server error: {response.text}. Retry.")
+                    response.raise_for_status()  # raise exception and trigger retry
+                case error:
+                    log.info(f"Could not send {self.name} notification due to error: {error}. Give up.")
+
+
 @lru_cache()
 def converter() -> Converter:
     cv = Converter()
@@ -15,17 +15,18 @@ from collections import defaultdict
 from datetime import timedelta, datetime
 from itertools import islice
 from logging import getLogger
-from typing import List, Optional, Dict, Union, Set
+from typing import List, Optional, Dict, Union, Set, Tuple
 from urllib.parse import urlencode
 
 import cattrs
-from fixcloudutils.redis.event_stream import RedisStreamPublisher, RedisStreamListener, MessageContext
+from fixcloudutils.redis.event_stream import RedisStreamPublisher, MessageContext
 from fixcloudutils.service import Service
 from fixcloudutils.types import Json
 from fixcloudutils.util import utc, utc_str
 from httpx import AsyncClient
 
 from fixbackend.auth.user_repository import UserRepository
+from fixbackend.batch_stream_listener import BatchRedisStreamListener
 from fixbackend.config import Config
 from fixbackend.domain_events.events import (
     TenantAccountsCollected,
@@ -51,6 +52,7 @@ from fixbackend.ids import (
 from fixbackend.inventory.inventory_service import InventoryService, ReportSeverityIncluded, ReportSeverityPriority
 from fixbackend.inventory.inventory_schemas import SearchRequest, HistorySearch, HistoryChange
 from fixbackend.logging_context import set_workspace_id
+from fixbackend.notification.alert_delivery import AlertDelivery
 from fixbackend.notification.discord.discord_notification import DiscordNotificationSender
 from fixbackend.notification.email.email_messages import EmailMessage, UserJoinedWorkspaceMail
 from fixbackend.notification.email.email_notification import EmailNotificationSender
@@ -104,13 +106,16 @@ class NotificationService(Service):
         self.inventory_service = inventory_service
         self.inventory_client = inventory_service.client
         self.alert_publisher = RedisStreamPublisher(readwrite_redis, "fix_alerts", "fixbackend")
-        self.alert_listener = RedisStreamListener(
+        # a batch that is not acknowledged in this time is delivered again by another listener
+        alert_timeout = timedelta(seconds=180)
+        self.alert_listener = BatchRedisStreamListener(
             readwrite_redis,
             "fix_alerts",
             "fixbackend",
             config.instance_id,
             self._send_alert,
-            consider_failed_after=timedelta(seconds=180),
+            batch_processor=self._send_alerts,
+            consider_failed_after=alert_timeout,
             batch_size=50,
         )
         self.provider_config_repo = NotificationProviderConfigRepository(session_maker)
@@ -123,6 +128,11 @@ class NotificationService(Service):
             NotificationProvider.email: EmailNotificationSender(self.email_sender),
             NotificationProvider.opsgenie: OpsgenieNotificationSender(http_client),
         }
+        self.alert_delivery = AlertDelivery(
+            self.alert_sender,
+            self.provider_config_repo.get_messaging_config_for_workspace,
+            max_delivery_time=alert_timeout * 2 / 3,
+        )
         self.handle_events = handle_events
         self.domain_event_sender = domain_event_sender
         if handle_events:
@@ -199,7 +209,7 @@ class NotificationService(Service):
         # - all benchmark names must exist
         # - all channels must be known
         if access := await self.graphdb_access.get_database_access(alert.workspace_id):
-            benchmark_ids: Set[str] = set(await self.inventory_client.benchmarks(access, ids_only=True))  # type: ignore
+            benchmark_ids: Set[str] = set(await self.inventory_service.benchmarks(access, ids_only=True))  # type: ignore
             for benchmark, setting in alert.alerts.items():
                 if benchmark not in benchmark_ids:
                     raise ValueError(f"Benchmark {benchmark} not found")
@@ -210,37 +220,49 @@ class NotificationService(Service):
         raise ValueError(f"Workspace {alert.workspace_id} does not have GraphDbAccess?")
 
     async def _send_alert(self, message: Json, context: MessageContext) -> None:
-        if context.kind != "vulnerable_resources_detected":
-            raise ValueError(f"Unexpected message kind {context.kind}")
-        alert_on = AlertOnChannel.from_json(message)
-        alert = alert_on.alert
-        set_workspace_id(alert.workspace_id)
-        if (sender := self.alert_sender.get(alert_on.channel)) and (
-            cfg := await self.provider_config_repo.get_messaging_config_for_workspace(
-                alert.workspace_id, alert_on.channel
-            )
-        ):
-            await sender.send_alert(alert, cfg)
+        await self._send_alerts([(message, context)])
 
-    async def _load_alert(
+    async def _send_alerts(self, messages: List[Tuple[Json, MessageContext]]) -> None:
+        # invalid messages are skipped: failing the batch would deliver all valid alerts again
+        alerts = []
+        for message, context in messages:
+            if context.kind != "vulnerable_resources_detected":
+                log.warning(f"Unexpected message kind {context.kind}. Ignore.")
+                continue
+            try:
+                alerts.append(AlertOnChannel.from_json(message))
+            except Exception as ex:
+                log.warning(f"Invalid alert message {context.id}: {ex}. Ignore.")
+        await self.alert_delivery.deliver(alerts)
+
+    async def _load_alerts(
         self,
         access: GraphDatabaseAccess,
-        benchmark: BenchmarkName,
+        severities: Dict[BenchmarkName, ReportSeverity],
         task_ids: List[TaskId],
-        severity: ReportSeverity,
         after: datetime,
         before: datetime,
-    ) -> Optional[FailingBenchmarkChecksDetected]:
-        included_severities = ",".join(ReportSeverityIncluded.get(severity, ["none"]))
+    ) -> Dict[BenchmarkName, FailingBenchmarkChecksDetected]:
+        """
+        Evaluate the alerts of all given benchmarks (with their minimum severity) in a single pass:
+        one aggregation over the history, one query for examples of all top checks
+        and one lookup of all check definitions.
+        """
+        if not severities:
+            return {}
+        included: Dict[BenchmarkName, Set[str]] = {
+            benchmark: set(ReportSeverityIncluded.get(severity, ["none"])) for benchmark, severity in severities.items()
+        }
+        all_benchmarks = ",".join(sorted(severities))
+        all_severities = ",".join(sorted(set().union(*included.values())))
         tsk_ids = ",".join(task_ids)
-        issue = f"benchmarks[]=={benchmark} and severity in [{included_severities}]"
+        issue = f"benchmarks[] in [{all_benchmarks}] and severity in [{all_severities}]"
         query = (
             f"/security.has_issues==true and /security.run_id in [{tsk_ids}] and /diff.node_vulnerable[].{{{issue}}}"
         )
         aggregate = "/diff.node_vulnerable[].check, /diff.node_vulnerable[].severity, /diff.node_vulnerable[].benchmarks[] as benchmark : sum(1) as count"  # noqa: E501
-        failing_checks: Dict[SecurityCheckId, ReportSeverity] = {}
-        failing_resources_count: Dict[str, int] = defaultdict(int)
-        total_failed_checks = 0
+        failing_checks: Dict[BenchmarkName, Dict[SecurityCheckId, ReportSeverity]] = defaultdict(dict)
+        failing_resources_count: Dict[BenchmarkName, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
         change = [HistoryChange.node_vulnerable, HistoryChange.node_compliant]
         async with self.inventory_client.search_history(
             access, f"search {query} | aggregate {aggregate}", before=before, after=after, change=change
@@ -252,56 +274,80 @@ class NotificationService(Service):
                     and (check := group.get("check"))
                     and (severity := group.get("severity"))
                     and (bench := group.get("benchmark"))
-                    and bench == benchmark
+                    and severity in included.get(bench, ())
                 ):
-                    total_failed_checks += 1
-                    failing_checks[check] = severity
-                    failing_resources_count[check] = count
+                    failing_checks[bench][check] = severity
+                    failing_resources_count[bench][check] = count
+
+        if not failing_checks:
+            return {}
 
-        if total_failed_checks > 0:
-            # pick examples for the top 5 checks
-            srt = sorted(failing_checks.items(), key=lambda x: ReportSeverityPriority[x[1]], reverse=True)
-            top_checks = [k for k, _ in islice(srt, 5)]
-            # load examples for the top 5 checks
-            example_resources: Dict[str, List[VulnerableResource]] = defaultdict(list)
-            example_count = 0
-            async with self.inventory_client.execute_single(
-                access,
-                f"history --before {utc_str(before)} --after {utc_str(after)} --change node_vulnerable --change node_compliant /security.has_issues==true and /diff.node_vulnerable[].{{check in [{','.join(top_checks)}] and {issue}}} | "  # noqa
-                f"jq --no-rewrite '{{id:.id, kind:.reported.kind, name:.reported.name, cloud:.ancestors.cloud.reported.name, account:.ancestors.account.reported.name, region:.ancestors.region.reported.name, checks: [ .security.issues[] | select(.benchmarks != null and .benchmarks[] == \"{benchmark}\") | .check ]}}'",  # noqa
-            ) as result:
-                async for node in result:
-                    if isinstance(node, dict):
-                        for check in node.get("checks", []):
-                            examples = example_resources[check]
-                            if check in top_checks and len(examples) < 3:
-                                resource = cattrs.structure(node, VulnerableResource)
-                                # the ui link does not come from the inventory and needs to be computed explicitly
-                                resource.ui_link = f"{self.config.service_base_url}/inventory/resource-detail/{resource.id}?{urlencode(dict(name=resource.name))}#{access.workspace_id}"  # noqa: E501
+        # pick the top 5 checks of every benchmark
+        top_checks: Dict[BenchmarkName, List[SecurityCheckId]] = {}
+        for benchmark, failing in failing_checks.items():
+            srt = sorted(failing.items(), key=lambda x: ReportSeverityPriority[x[1]], reverse=True)
+            top_checks[benchmark] = [k for k, _ in islice(srt, 5)]
+        all_top_checks = sorted({c for checks in top_checks.values() for c in checks})
+
+        # load examples for the top checks of all benchmarks: max 3 per check and 25 per benchmark
+        example_resources: Dict[BenchmarkName, Dict[str, List[VulnerableResource]]] = defaultdict(
+            lambda: defaultdict(list)
+        )
+        example_count: Dict[BenchmarkName, int] = defaultdict(int)
+        async with self.inventory_client.execute_single(
+            access,
+            f"history --before {utc_str(before)} --after {utc_str(after)} --change node_vulnerable --change node_compliant /security.has_issues==true and /diff.node_vulnerable[].{{check in [{','.join(all_top_checks)}] and {issue}}} | "  # noqa
+            "jq --no-rewrite '{id:.id, kind:.reported.kind, name:.reported.name, cloud:.ancestors.cloud.reported.name, account:.ancestors.account.reported.name, region:.ancestors.region.reported.name, issues: [ .security.issues[] | select(.benchmarks != null) | {check:.check, benchmarks:.benchmarks} ]}'",  # noqa
+        ) as result:
+            async for node in result:
+                if isinstance(node, dict):
+                    resource: Optional[VulnerableResource] = None
+                    for node_issue in node.get("issues", []):
+                        check = node_issue.get("check")
+                        for benchmark in node_issue.get("benchmarks") or []:
+                            if benchmark not in top_checks or check not in top_checks[benchmark]:
+                                continue
+                            examples = example_resources[benchmark][check]
+                            if len(examples) < 3 and example_count[benchmark] < 25:
+                                if resource is None:
+                                    resource = cattrs.structure(node, VulnerableResource)
+                                    # the ui link does not come from the inventory and needs to be computed explicitly
+                                    resource.ui_link = f"{self.config.service_base_url}/inventory/resource-detail/{resource.id}?{urlencode(dict(name=resource.name))}#{access.workspace_id}"  # noqa: E501
                                 examples.append(resource)
-                                example_count += 1
-                                if example_count == 25:
-                                    break
-            # load definition of top checks
+                                example_count[benchmark] += 1
+
+        # load the definitions of the top checks of all benchmarks
+        check_defs: Dict[str, Tuple[str, ReportSeverity]] = {
+            cid: (title, sev)
+            for c in await self.inventory_service.checks(access, check_ids=all_top_checks)
+            if (cid := c.get("id")) and (title := c.get("title")) and (sev := c.get("severity"))
+        }
+
+        alerts: Dict[BenchmarkName, FailingBenchmarkChecksDetected] = {}
+        for benchmark, checks in top_checks.items():
             top_check_defs = [
-                FailedBenchmarkCheck(cid, title, sev, failing_resources_count[cid], example_resources[cid])
-                for c in await self.inventory_client.checks(access, check_ids=top_checks)
-                if (cid := c.get("id")) and (title := c.get("title")) and (sev := c.get("severity"))
+                FailedBenchmarkCheck(
+                    cid, *check_defs[cid], failing_resources_count[benchmark][cid], example_resources[benchmark][cid]
+                )
+                for cid in checks
+                if cid in check_defs
             ]
-            # ui link
+            # the ui link shows the changes of this benchmark only
+            bench_issue = f"benchmarks[]=={benchmark} and severity in [{','.join(sorted(included[benchmark]))}]"
+            bench_query = f"/security.has_issues==true and /security.run_id in [{tsk_ids}] and /diff.node_vulnerable[].{{{bench_issue}}}"  # noqa: E501
             ui_link = SearchRequest(
-                query=query, history=HistorySearch(after=after, before=before, changes=change)
+                query=bench_query, history=HistorySearch(after=after, before=before, changes=change)
             ).ui_link(self.config.service_base_url, access.workspace_id)
-            return FailingBenchmarkChecksDetected(
+            alerts[benchmark] = FailingBenchmarkChecksDetected(
                 id=md5(benchmark, *task_ids),
                 workspace_id=access.workspace_id,
                 benchmark=benchmark,
-                severity=top_check_defs[0].severity if top_checks else severity,
-                failed_checks_count_total=total_failed_checks,
+                severity=top_check_defs[0].severity if top_check_defs else severities[benchmark],
+                failed_checks_count_total=len(failing_checks[benchmark]),
                 examples=top_check_defs,
                 ui_link=ui_link,
             )
-        return None
+        return alerts
 
     async def alert_on_changed(self, collected: TenantAccountsCollected) -> None:
         set_workspace_id(collected.tenant_id)
@@ -316,23 +362,24 @@ class NotificationService(Service):
                 and (non_empty_alerts := cfg.non_empty_alerts())
                 and (access := await self.graphdb_access.get_database_access(collected.tenant_id))
             ):
-                for benchmark, setting in non_empty_alerts.items():
-                    if alert := await self._load_alert(
-                        access, benchmark, task_ids, setting.severity, earliest_started_at, now
-                    ):
-                        for channel in setting.channels:
-                            await self.alert_publisher.publish(
-                                "vulnerable_resources_detected", AlertOnChannel(alert, channel).to_json()
-                            )
-                        await self.domain_event_sender.publish(
-                            FailingBenchmarkChecksAlertSend(
-                                collected.tenant_id,
-                                benchmark,
-                                alert.severity,
-                                alert.failed_checks_count_total,
-                                setting.channels,
-                            )
+                # evaluate all benchmarks at once, then emit all alerts
+                severities = {benchmark: setting.severity for benchmark, setting in non_empty_alerts.items()}
+                alerts = await self._load_alerts(access, severities, task_ids, earliest_started_at, now)
+                for benchmark, alert in alerts.items():
+                    setting = non_empty_alerts[benchmark]
+                    for channel in setting.channels:
+                        await self.alert_publisher.publish(
+                            "vulnerable_resources_detected", AlertOnChannel(alert, channel).to_json()
+                        )
+                    await self.domain_event_sender.publish(
+                        FailingBenchmarkChecksAlertSend(
+                            collected.tenant_id,
+                            benchmark,
+                            alert.severity,
+                            alert.failed_checks_count_total,
+                            setting.channels,
                         )
+                    )
 
     async def send_test_alert(self, workspace_id: WorkspaceId, provider: NotificationProvider) -> None:
         if access := await self.graphdb_access.get_database_access(workspace_id):
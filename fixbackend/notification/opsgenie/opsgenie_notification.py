@@ -13,15 +13,15 @@
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import logging
 from collections import defaultdict
+from typing import Optional
 
 from fixcloudutils.types import Json
-from httpx import AsyncClient
 
-from fixbackend.httpx_extensions import HttpXResponse, ServerError, SuccessResponse
 from fixbackend.notification.model import (
-    AlertSender,
     Alert,
     FailingBenchmarkChecksDetected,
+    WebhookAlertSender,
+    WebhookRequest,
 )
 
 log = logging.getLogger(__name__)
@@ -32,9 +32,8 @@ SeverityToOpsgeniePriority = defaultdict(
 )
 
 
-class OpsgenieNotificationSender(AlertSender):
-    def __init__(self, http_client: AsyncClient) -> None:
-        self.http_client = http_client
+class OpsgenieNotificationSender(WebhookAlertSender):
+    name = "opsgenie"
 
     def vulnerable_resources_detected(self, alert: FailingBenchmarkChecksDetected) -> Json:
         return {
@@ -50,23 +49,14 @@ class OpsgenieNotificationSender(AlertSender):
             "source": "Fix",
         }
 
-    async def send_alert(self, alert: Alert, config: Json) -> None:
+    def webhook_request(self, alert: Alert, config: Json) -> Optional[WebhookRequest]:
         if api_key := config.get("api_key"):
             match alert:
                 case FailingBenchmarkChecksDetected() as vrd:
                     message = self.vulnerable_resources_detected(vrd)
                 case _:
                     raise ValueError(f"Unknown alert: {alert}")
-
-            match HttpXResponse.read(
-                await self.http_client.post(
-                    "https://api.opsgenie.com/v2/alerts", headers={"Authorization": f"GenieKey {api_key}"}, json=message
-                )
-            ):
-                case SuccessResponse():
-                    log.info("Send opsgenie alert notification.")
-                case ServerError(response):
-                    log.info(f"Could not send opsgenie notification due to server error: {response.text}. Retry.")
-                    response.raise_for_status()  # raise exception and trigger retry
-                case error:
-                    log.info(f"Could not send opsgenie notification due to error: {error}. Give up.")
+            return WebhookRequest(
+                "https://api.opsgenie.com/v2/alerts", message, headers={"Authorization": f"GenieKey {api_key}"}
+            )
+        return None
@@ -13,16 +13,16 @@
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import logging
 from collections import defaultdict
+from typing import Optional
 
 from fixcloudutils.types import Json
 from fixcloudutils.util import utc_str
-from httpx import AsyncClient
 
-from fixbackend.httpx_extensions import HttpXResponse, ServerError, SuccessResponse
 from fixbackend.notification.model import (
-    AlertSender,
     Alert,
     FailingBenchmarkChecksDetected,
+    WebhookAlertSender,
+    WebhookRequest,
 )
 
 log = logging.getLogger(__name__)
@@ -39,9 +39,8 @@ SeverityToPagerDutySeverity = defaultdict(
 )
 
 
-class PagerDutyNotificationSender(AlertSender):
-    def __init__(self, http_client: AsyncClient) -> None:
-        self.http_client = http_client
+class PagerDutyNotificationSender(WebhookAlertSender):
+    name = "pagerduty"
 
     def vulnerable_resources_detected(self, alert: FailingBenchmarkChecksDetected, integration_key: str) -> Json:
         return {
@@ -71,21 +70,12 @@ class PagerDutyNotificationSender(AlertSender):
             },
         }
 
-    async def send_alert(self, alert: Alert, config: Json) -> None:
+    def webhook_request(self, alert: Alert, config: Json) -> Optional[WebhookRequest]:
         if integration_key := config.get("integration_key"):
             match alert:
                 case FailingBenchmarkChecksDetected() as vrd:
                     message = self.vulnerable_resources_detected(vrd, integration_key)
                 case _:
                     raise ValueError(f"Unknown alert: {alert}")
-
-            match HttpXResponse.read(
-                await self.http_client.post("https://events.pagerduty.com/v2/enqueue", json=message)
-            ):
-                case SuccessResponse():
-                    log.info("Send pagerduty alert notification.")
-                case ServerError(response):
-                    log.info(f"Could not send pagerduty notification due to server error: {response.text}. Retry.")
-                    response.raise_for_status()  # raise exception and trigger retry
-                case error:
-                    log.info(f"Could not send pagerduty notification due to error: {error}. Give up.")
+            return WebhookRequest("https://events.pagerduty.com/v2/enqueue", message)
+        return None
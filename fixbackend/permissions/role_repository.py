@@ -20,6 +20,7 @@ from fastapi import Depends
 
 from fastapi_users_db_sqlalchemy.generics import GUID
 from sqlalchemy.ext.asyncio import AsyncSession
+from fixbackend.auth.auth_cache import UserCache
 from fixbackend.dependencies import FixDependency, ServiceNames
 from fixbackend.ids import UserRoleId, UserId, WorkspaceId
 from sqlalchemy import Integer, ForeignKey, UniqueConstraint, select, update
@@ -27,6 +28,7 @@ from sqlalchemy.orm import Mapped, mapped_column
 
 from fixbackend.permissions.models import WorkspacePermissions, UserRole, Roles, roles_to_permissions
 from fixbackend.base_model import Base
+from fixbackend.sqlalechemy_extensions import after_commit
 
 from fixbackend.types import AsyncSessionMaker
 
@@ -61,13 +63,23 @@ class UserRoleAssignmentEntity(Base):
 class RoleRepository:
 
     def __init__(
-        self, session_maker: AsyncSessionMaker, permissions_dict: Dict[Roles, WorkspacePermissions] | None = None
+        self,
+        session_maker: AsyncSessionMaker,
+        permissions_dict: Dict[Roles, WorkspacePermissions] | None = None,
+        *,
+        user_cache: Optional[UserCache] = None,
     ) -> None:
         self.session_maker = session_maker
+        # roles are part of the cached user
+        self.user_cache = user_cache
         if permissions_dict is None:
             permissions_dict = roles_to_permissions
         self.roles_to_permissions = permissions_dict
 
+    async def _evict_cached(self, user_id: UserId) -> None:
+        if self.user_cache is not None:
+            await self.user_cache.evict(user_id)
+
     async def list_roles(self, user_id: UserId) -> List[UserRole]:
         async with self.session_maker() as session:
             query = select(UserRoleAssignmentEntity).filter(UserRoleAssignmentEntity.user_id == user_id)
@@ -87,7 +99,7 @@ class RoleRepository:
         roles: Roles,
         *,
         session: Optional[AsyncSession] = None,
-        replace_existing: bool = False
+        replace_existing: bool = False,
     ) -> UserRole:
 
         async def do_tx(session: AsyncSession) -> UserRole:
@@ -124,10 +136,14 @@ class RoleRepository:
                 return model
 
         if session:
-            return await do_tx(session)
+            result = await do_tx(session)
+            # the transaction of the caller might be committed later: evict again after the commit
+            after_commit(session, lambda: self._evict_cached(user_id))
         else:
             async with self.session_maker() as session:
-                return await do_tx(session)
+                result = await do_tx(session)
+        await self._evict_cached(user_id)
+        return result
 
     async def remove_roles(
         self, user_id: UserId, workspace_id: WorkspaceId, roles: Roles, *, session: Optional[AsyncSession] = None
@@ -155,10 +171,13 @@ class RoleRepository:
                 await session.commit()
 
         if session:
-            return await do_tx(session)
+            await do_tx(session)
+            # the transaction of the caller might be committed later: evict again after the commit
+            after_commit(session, lambda: self._evict_cached(user_id))
         else:
             async with self.session_maker() as session:
-                return await do_tx(session)
+                await do_tx(session)
+        await self._evict_cached(user_id)
 
 
 def get_role_repository(fix: FixDependency) -> RoleRepository:
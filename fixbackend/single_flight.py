@@ -0,0 +1,200 @@
+#  Copyright (c) 2024. Some Engineering
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import asyncio
+import hashlib
+import logging
+import pickle
+from datetime import timedelta
+from functools import wraps
+from inspect import isclass
+from typing import Any, Awaitable, Callable, Dict, Tuple, Type, TypeVar, ParamSpec, Sequence, get_type_hints
+
+from attrs import frozen
+from cattrs.preconf.json import make_converter
+from fixcloudutils.redis.cache import RedisCache
+from fixcloudutils.types import JsonElement
+from prometheus_client import Counter
+from pydantic import BaseModel
+from redis.asyncio.client import PubSub
+
+from fixbackend.types import Redis
+
+log = logging.getLogger(__name__)
+P = ParamSpec("P")
+T = TypeVar("T")
+SingleFlightCalls = Counter("single_flight", "Coalesced cache computations", ["cache", "stage"])
+
+json_converter = make_converter()
+# all fields of a model are shared, also the ones that are excluded from its json representation
+json_converter.register_unstructure_hook(
+    BaseModel, lambda v: {name: json_converter.unstructure(getattr(v, name)) for name in type(v).model_fields}
+)
+json_converter.register_unstructure_hook(timedelta, lambda v: v.total_seconds())
+json_converter.register_structure_hook_func(
+    lambda t: isclass(t) and issubclass(t, BaseModel), lambda v, t: t.model_validate(v)
+)
+
+
+class SingleFlightFailed(Exception):
+    """
+    The computation of another instance has failed with an error that can not be recreated here.
+    """
+
+
+@frozen
+class SharedFailure:
+    # error of the computation of another instance: name of the exception class, its args and simple attributes
+    error: str
+    args: Tuple[JsonElement, ...]
+    attributes: Dict[str, JsonElement]
+
+
+class SingleFlight:
+    """
+    Makes sure, that a cached value is only computed once, even if it is requested concurrently.
+    In process: concurrent callers with the same key, function and arguments await the same computation.
+    In the cluster: the computation of a value that is not cached is guarded by a redis lock.
+    All other instances are notified via redis pub/sub, when the lock holder is done, and use its result.
+    The result is shared as json, so the return type of the computed function has to be annotated.
+    A failed computation is shared as well: the waiting instances raise the same error, if the error type
+    is one of the shared errors, otherwise SingleFlightFailed.
+    """
+
+    def __init__(
+        self,
+        cache: RedisCache,
+        redis: Redis,
+        *,
+        lock_timeout: timedelta = timedelta(minutes=2),
+        result_ttl: timedelta = timedelta(seconds=30),
+        shared_errors: Sequence[Type[Exception]] = (),
+    ) -> None:
+        self.cache = cache
+        self.redis = redis
+        self.lock_timeout = lock_timeout
+        self.result_ttl = result_ttl
+        self.shared_errors = shared_errors
+        self.in_flight: Dict[Tuple[str, str], asyncio.Task[Any]] = {}
+
+    def call(self, fn: Callable[P, Awaitable[T]], key: str) -> Callable[P, Awaitable[T]]:
+        result_type = get_type_hints(fn)["return"]
+
+        async def coalesced(*args: P.args, **kwargs: P.kwargs) -> T:
+            flight_key = (key, self._fn_key(fn.__name__, *args, **kwargs))
+            if (running := self.in_flight.get(flight_key)) is None:
+                computation = self.cache.call(self._cluster_wide(fn, key, flight_key[1], result_type), key)
+                running = asyncio.create_task(computation(*args, **kwargs))  # type: ignore
+                self.in_flight[flight_key] = running
+                running.add_done_callback(lambda _: self.in_flight.pop(flight_key, None))
+                SingleFlightCalls.labels(self.cache.key, "call").inc()
+            else:
+                SingleFlightCalls.labels(self.cache.key, "in_process").inc()
+            # the computation should not be cancelled, if one of the waiting callers is cancelled
+            return await asyncio.shield(running)
+
+        return coalesced
+
+    def _cluster_wide(
+        self, fn: Callable[P, Awaitable[T]], key: str, fn_key: str, result_type: Any
+    ) -> Callable[P, Awaitable[T]]:
+        # This function is only called by the cache, if the value is neither available locally nor in redis.
+        # It has to have the same name as the original function, so it is cached under the same key.
+        lock_key = f"single_flight:{self.cache.key}:{key}:{fn_key}"
+        result_key = f"{lock_key}:result"
+        done_channel = f"{lock_key}:done"
+
+        async def compute(*args: P.args, **kwargs: P.kwargs) -> T:
+            # a result of a former computation must not be used by the waiting instances
+            await self.redis.delete(result_key)
+            # make the outcome available to all waiting instances, before the lock is released
+            try:
+                result = await fn(*args, **kwargs)
+            except Exception as ex:
+                await share({"failure": json_converter.unstructure(self._failure(ex), SharedFailure)})
+                raise
+            await share({"result": json_converter.unstructure(result, result_type)})
+            return result
+
+        async def share(outcome: Dict[str, Any]) -> None:
+            await self.redis.set(result_key, json_converter.dumps(outcome), ex=self.result_ttl)
+
+        async def shared_result() -> Tuple[bool, Any]:
+            if (computed := await self.redis.get(result_key)) is None:
+                return False, None
+            shared = json_converter.loads(computed, Dict[str, Any])
+            if "failure" in shared:
+                raise self._error(json_converter.structure(shared["failure"], SharedFailure))
+            return True, json_converter.structure(shared["result"], result_type)
+
+        @wraps(fn)
+        async def locked(*args: P.args, **kwargs: P.kwargs) -> T:
+            while True:
+                lock = self.redis.lock(lock_key, timeout=self.lock_timeout.total_seconds(), thread_local=False)
+                if await lock.acquire(blocking=False):
+                    try:
+                        return await compute(*args, **kwargs)
+                    finally:
+                        try:
+                            await lock.release()
+                        except Exception as ex:  # the lock might have expired in the meantime
+                            log.info(f"Could not release single flight lock: {ex}")
+                        await self.redis.publish(done_channel, "done")
+                # another instance computes the value: wait until it is done and use its result
+                SingleFlightCalls.labels(self.cache.key, "cluster").inc()
+                async with self.redis.pubsub() as pubsub:
+                    await pubsub.subscribe(done_channel)
+                    # the lock holder publishes after the lock is released: no notification is missed
+                    if await lock.locked():
+                        await self._wait_for_message(pubsub)
+                available, result = await shared_result()
+                if available:
+                    return result  # type: ignore
+                # the lock holder did not share a result (e.g. the lock expired): compute it here
+
+        return locked
+
+    async def _wait_for_message(self, pubsub: PubSub) -> None:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.lock_timeout.total_seconds()
+        while (remaining := deadline - loop.time()) > 0:
+            if await pubsub.get_message(ignore_subscribe_messages=True, timeout=remaining) is not None:
+                return
+
+    def _failure(self, ex: Exception) -> SharedFailure:
+        simple = (str, int, float, bool, type(None))
+        return SharedFailure(
+            error=type(ex).__qualname__,
+            args=tuple(a if isinstance(a, simple) else str(a) for a in ex.args),
+            attributes={k: v for k, v in vars(ex).items() if isinstance(v, simple)},
+        )
+
+    def _error(self, failure: SharedFailure) -> Exception:
+        def with_subclasses(clazz: Type[Exception]) -> Sequence[Type[Exception]]:
+            return [clazz, *(s for sub in clazz.__subclasses__() for s in with_subclasses(sub))]
+
+        # only errors of known types are recreated
+        known = {c.__qualname__: c for shared in self.shared_errors for c in with_subclasses(shared)}
+        if (error_type := known.get(failure.error)) is None:
+            return SingleFlightFailed(f"{failure.error}: {', '.join(str(a) for a in failure.args)}")
+        error = error_type.__new__(error_type)
+        error.args = failure.args
+        error.__dict__.update(failure.attributes)
+        return error
+
+    @staticmethod
+    def _fn_key(fn_name: str, *args: Any, **kwargs: Any) -> str:
+        # pickle is only used to derive a stable hash of the arguments
+        sha = hashlib.sha256(fn_name.encode("utf-8"))
+        sha.update(pickle.dumps((args, kwargs)))
+        return sha.hexdigest()
@@ -11,8 +11,10 @@
 #
 #  You should have received a copy of the GNU Affero General Public License
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import asyncio
+import logging
 from datetime import datetime, timezone
-from typing import Optional, Any, Type, Dict
+from typing import Optional, Any, Type, Dict, Callable, Coroutine, Set
 
 import cattrs
 import sqlalchemy as sa
@@ -21,10 +23,14 @@ from fixcloudutils.types import JsonElement
 from prometheus_client import Histogram, Gauge
 from pydantic import BaseModel
 from sqlalchemy import Connection, event, ClauseElement
-from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy.orm import Session
 from fastapi_users_db_sqlalchemy import GUID as FastApiUsersGUID  # type: ignore
 
 GUID = FastApiUsersGUID
+log = logging.getLogger(__name__)
+# tasks started after a commit: a reference is held until they are done
+_after_commit_tasks: Set[asyncio.Task[Any]] = set()
 
 
 class UTCDateTime(sa.types.TypeDecorator[sa.types.DateTime]):
@@ -131,3 +137,24 @@ class EngineMetrics:
         event.listen(engine.sync_engine, "checkout", cls.checkout)
         event.listen(engine.sync_engine, "checkin", cls.checkin)
         return engine
+
+
+def after_commit(session: AsyncSession, fn: Callable[[], Coroutine[Any, Any, Any]]) -> None:
+    """
+    Call the given function, once the current transaction of the session is committed.
+    Use this to evict cached values, when the change is done in a transaction owned by the caller:
+    the cached value must not be evicted before the change is visible to other sessions.
+    """
+    loop = asyncio.get_running_loop()
+
+    def done(task: asyncio.Task[Any]) -> None:
+        _after_commit_tasks.discard(task)
+        if not task.cancelled() and (ex := task.exception()) is not None:
+            log.warning(f"Function called after commit failed: {ex}")
+
+    def committed(_: Session) -> None:
+        task: asyncio.Task[Any] = loop.create_task(fn())
+        _after_commit_tasks.add(task)
+        task.add_done_callback(done)
+
+    event.listen(session.sync_session, "after_commit", committed, once=True)
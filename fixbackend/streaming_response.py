@@ -20,8 +20,9 @@
 #  You should have received a copy of the GNU Affero General Public License
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import json
+import re
 import typing
-from typing import AsyncIterator, Callable, Tuple
+from typing import AsyncIterator, Callable, Optional, Tuple, Union
 
 from fastapi.responses import StreamingResponse
 from fixcloudutils.types import JsonElement
@@ -31,6 +32,10 @@ from starlette.types import Send
 
 from fixbackend.errors import NotAllowed, ResourceNotFound, WrongState, ClientError
 
+LineBreaks = re.compile(b"\n+")
+# content of a streaming response: either text or already encoded bytes
+StreamChunk = Union[str, bytes]
+
 
 async def json_serializer(input_iterator: AsyncIterator[JsonElement]) -> AsyncIterator[str]:
     yield "["
@@ -52,6 +57,28 @@ async def csv_serializer(input_iterator: AsyncIterator[JsonElement]) -> AsyncIte
         yield str(item) + "\n"
 
 
+async def json_passthrough(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    # turn ndjson chunks into a json array: line breaks between elements become commas
+    yield b"["
+    has_element = False
+    separator = False
+    async for chunk in chunks:
+        body = chunk.strip(b"\n")
+        separator = separator or chunk.startswith(b"\n")
+        if body:
+            if separator and has_element:
+                yield b","
+            yield LineBreaks.sub(b",", body)
+            has_element = True
+            separator = chunk.endswith(b"\n")
+    yield b"]"
+
+
+async def ndjson_passthrough(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    async for chunk in chunks:
+        yield chunk
+
+
 def streaming_response(accept: str) -> Tuple[Callable[[AsyncIterator[JsonElement]], AsyncIterator[str]], str]:
     if accept in ["application/x-ndjson", "application/ndjson"]:
         return ndjson_serializer, "application/ndjson"
@@ -63,6 +90,21 @@ def streaming_response(accept: str) -> Tuple[Callable[[AsyncIterator[JsonElement
         return json_serializer, "application/json"
 
 
+def passthrough_response(
+    accept: str,
+) -> Optional[Tuple[Callable[[AsyncIterator[bytes]], AsyncIterator[bytes]], str]]:
+    """
+    Serializer for the raw bytes of a ndjson stream, that are forwarded without decoding and encoding every element.
+    Returns None, if the accepted media type requires a transformation of the elements.
+    """
+    if accept in ["application/x-ndjson", "application/ndjson"]:
+        return ndjson_passthrough, "application/ndjson"
+    elif accept == "text/csv":
+        return None
+    else:
+        return json_passthrough, "application/json"
+
+
 class StreamOnSuccessResponse(StreamingResponse):
     def __init__(
         self,
@@ -71,22 +113,42 @@ class StreamOnSuccessResponse(StreamingResponse):
         headers: typing.Mapping[str, str] | None = None,
         media_type: str | None = None,
         background: BackgroundTask | None = None,
+        *,
+        chunk_size: Optional[int] = None,
     ) -> None:
         super().__init__(content, status_code, headers, media_type, background)
         self.additional_headers = headers
+        # if defined, chunks of the content are coalesced and sent with at least this size (except the last one)
+        self.chunk_size = chunk_size
 
     async def stream_response(self, send: Send) -> None:
         first = True
+        buffer = bytearray()
+
+        async def send_body(body: bytes | memoryview) -> None:
+            nonlocal first
+            if first:  # send response code and headers only when the first element is ready
+                first = False
+                if self.additional_headers:
+                    self.init_headers(self.additional_headers)
+                await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            await send({"type": "http.response.body", "body": body, "more_body": True})
+
         try:
             async for chunk in self.body_iterator:
-                if first:  # send response code and headers only when the first element is ready
-                    first = False
-                    if self.additional_headers:
-                        self.init_headers(self.additional_headers)
-                    await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
                 if not isinstance(chunk, (bytes, memoryview)):  # see super for details
                     chunk = chunk.encode(self.charset)
-                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+                if self.chunk_size is None:
+                    await send_body(chunk)
+                elif not buffer and len(chunk) >= self.chunk_size:
+                    await send_body(chunk)
+                else:
+                    buffer += chunk
+                    if len(buffer) >= self.chunk_size:
+                        await send_body(bytes(buffer))
+                        buffer.clear()
+            if buffer:
+                await send_body(bytes(buffer))
             if first:
                 if self.additional_headers:
                     self.init_headers(self.additional_headers)
@@ -43,7 +43,7 @@ async def get_optional_user_workspace(
         return "Unauthorized"
 
     set_workspace_id(workspace_id)
-    workspace = await workspace_repository.get_workspace(workspace_id)
+    workspace = await workspace_repository.get_workspace_cached(workspace_id)
     if workspace is None:
         return "WorkspaceNotFound"
 
@@ -15,11 +15,13 @@
 import calendar
 import uuid
 from logging import getLogger
-from typing import Annotated, Optional, Sequence
+from typing import Annotated, Dict, Optional, Sequence
 
 from attrs import evolve
 from fastapi import Depends
+from fixcloudutils.redis.cache import RedisCache
 from fixcloudutils.redis.pub_sub import RedisPubSubPublisher
+from fixcloudutils.service import Service
 from sqlalchemy import or_, select, and_
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -35,8 +37,9 @@ from fixbackend.domain_events.publisher import DomainEventPublisher
 from fixbackend.errors import NotAllowed, ResourceNotFound, WrongState
 from fixbackend.graph_db.service import GraphDatabaseAccessManager
 from fixbackend.ids import ExternalId, SubscriptionId, WorkspaceId, UserId, ProductTier
+from fixbackend.sqlalechemy_extensions import after_commit
 from fixbackend.subscription.subscription_repository import SubscriptionRepository
-from fixbackend.types import AsyncSessionMaker
+from fixbackend.types import AsyncSessionMaker, Redis
 from fixbackend.workspaces.models import Workspace, orm
 from datetime import datetime, timedelta, timezone
 from fixcloudutils.util import utc
@@ -44,7 +47,7 @@ from fixcloudutils.util import utc
 log = getLogger(__name__)
 
 
-class WorkspaceRepository:
+class WorkspaceRepository(Service):
     def __init__(
         self,
         session_maker: AsyncSessionMaker,
@@ -53,6 +56,8 @@ class WorkspaceRepository:
         pubsub_publisher: RedisPubSubPublisher,
         subscription_repository: SubscriptionRepository,
         role_repository: RoleRepository,
+        *,
+        redis: Optional[Redis] = None,
     ) -> None:
         self.session_maker = session_maker
         self.graph_db_access_manager = graph_db_access_manager
@@ -60,6 +65,24 @@ class WorkspaceRepository:
         self.pubsub_publisher = pubsub_publisher
         self.subscription_repository = subscription_repository
         self.role_repository = role_repository
+        # workspaces are cached for access checks. Every change to a workspace evicts the cached entry.
+        self.cache = (
+            RedisCache(redis, "workspace", ttl_memory=timedelta(minutes=1), ttl_redis=timedelta(minutes=10))
+            if redis is not None
+            else None
+        )
+
+    async def start(self) -> None:
+        if self.cache is not None:
+            await self.cache.start()
+
+    async def stop(self) -> None:
+        if self.cache is not None:
+            await self.cache.stop()
+
+    async def _evict_cached(self, workspace_id: WorkspaceId) -> None:
+        if self.cache is not None:
+            await self.cache.evict(str(workspace_id))
 
     async def create_workspace(self, name: str, slug: str, owner: User) -> Workspace:
         async with self.session_maker() as session:
@@ -114,6 +137,19 @@ class WorkspaceRepository:
             async with self.session_maker() as session:
                 return await get_ws(session)
 
+    async def get_workspace_cached(self, workspace_id: WorkspaceId) -> Optional[Workspace]:
+        """
+        Same as get_workspace, but served from the cache, if available.
+        Use it for access checks on every request, not when the workspace is going to be updated.
+        """
+        if self.cache is None:
+            return await self.get_workspace(workspace_id)
+
+        async def get_workspace(wid: WorkspaceId) -> Optional[Workspace]:
+            return await self.get_workspace(wid)
+
+        return await self.cache.call(get_workspace, key=str(workspace_id))(workspace_id)
+
     async def update_workspace(self, workspace_id: WorkspaceId, name: str, generate_external_id: bool) -> Workspace:
         """Update a workspace."""
         async with self.session_maker() as session:
@@ -127,7 +163,9 @@ class WorkspaceRepository:
                 org.external_id = ExternalId(uuid.uuid4())
             await session.commit()
             await session.refresh(org)
-            return org.to_model()
+            updated = org.to_model()
+        await self._evict_cached(workspace_id)
+        return updated
 
     async def list_workspaces(self, user: User, can_assign_subscriptions: bool = False) -> Sequence[Workspace]:
         async with self.session_maker() as session:
@@ -160,6 +198,12 @@ class WorkspaceRepository:
             else:
                 return workspaces
 
+    async def list_workspaces_by_ids(self, workspace_ids: Sequence[WorkspaceId]) -> Dict[WorkspaceId, Workspace]:
+        async with self.session_maker() as session:
+            statement = select(orm.Organization).where(orm.Organization.id.in_(workspace_ids))
+            results = await session.execute(statement)
+            return {org.id: org.to_model() for org in results.unique().scalars().all()}
+
     async def list_workspaces_by_subscription_id(self, subscription_id: SubscriptionId) -> Sequence[Workspace]:
         async with self.session_maker() as session:
             statement = select(orm.Organization).where(orm.Organization.subscription_id == subscription_id)
@@ -187,10 +231,14 @@ class WorkspaceRepository:
             return workspace.to_model()
 
         if session:
-            return await do_tx(session)
+            updated = await do_tx(session)
+            # the transaction of the caller might be committed later: evict again after the commit
+            after_commit(session, lambda: self._evict_cached(workspace_id))
         else:
             async with self.session_maker() as session:
-                return await do_tx(session)
+                updated = await do_tx(session)
+        await self._evict_cached(workspace_id)
+        return updated
 
     async def add_to_workspace(self, workspace_id: WorkspaceId, user_id: UserId, role: Roles) -> None:
         async with self.session_maker() as session:
@@ -206,6 +254,7 @@ class WorkspaceRepository:
                 await session.commit()
             except IntegrityError:
                 raise WrongState("User is already a member of the workspace")
+        await self._evict_cached(workspace_id)
 
         event = UserJoinedWorkspace(workspace_id, user_id)
         await self.domain_event_sender.publish(event)
@@ -220,6 +269,7 @@ class WorkspaceRepository:
                 return None
             await session.delete(membership)
             await session.commit()
+        await self._evict_cached(workspace_id)
 
     async def get_product_tier(self, workspace_id: WorkspaceId) -> ProductTier:
         workspace = await self.get_workspace(workspace_id)
@@ -259,10 +309,14 @@ class WorkspaceRepository:
             return workspace.to_model()
 
         if session:
-            return await do_tx(session)
+            updated = await do_tx(session)
+            # the transaction of the caller might be committed later: evict again after the commit
+            after_commit(session, lambda: self._evict_cached(workspace_id))
         else:
             async with self.session_maker() as session:
-                return await do_tx(session)
+                updated = await do_tx(session)
+        await self._evict_cached(workspace_id)
+        return updated
 
     async def update_payment_on_hold(self, workspace_id: WorkspaceId, on_hold_since: Optional[datetime]) -> Workspace:
         """Set the payment on hold for a workspace."""
@@ -276,8 +330,10 @@ class WorkspaceRepository:
             workspace.payment_on_hold_since = on_hold_since
             await session.commit()
             await session.refresh(workspace)
+            updated = workspace.to_model()
 
-            return workspace.to_model()
+        await self._evict_cached(workspace_id)
+        return updated
 
     async def list_by_on_hold(self, before: datetime) -> Sequence[Workspace]:
         """List all workspaces with the payment on hold earlier the given date."""
@@ -0,0 +1,47 @@
+"""metering: daily rollup of collects per tenant, account and tier
+
+Revision ID: 7a41c9de03b5
+Revises: f5eaa189e1f2
+Create Date: 2024-10-14 08:12:31.000000+00:00
+
+"""
+
+from typing import Union
+
+import sqlalchemy as sa
+from alembic import op
+from fastapi_users_db_sqlalchemy.generics import GUID
+
+# revision identifiers, used by Alembic.
+revision: str = "7a41c9de03b5"
+down_revision: Union[str, None] = "f5eaa189e1f2"
+
+
+def upgrade() -> None:
+    op.create_table(
+        "metering_daily",
+        sa.Column("tenant_id", GUID(), nullable=False),
+        sa.Column("day", sa.Date(), nullable=False),
+        sa.Column("account_id", sa.String(length=256), nullable=False),
+        sa.Column("account_name", sa.String(length=256), nullable=False),
+        sa.Column("tier", sa.String(length=64), nullable=False),
+        sa.Column("nr_of_collects", sa.INTEGER(), nullable=False),
+        sa.Column("nr_of_billable_collects", sa.INTEGER(), nullable=False),
+        sa.PrimaryKeyConstraint("tenant_id", "day", "account_id", "account_name", "tier"),
+    )
+    # compute the rollup of all existing metering records
+    op.execute(
+        """
+        INSERT INTO metering_daily
+            (tenant_id, day, account_id, account_name, tier, nr_of_collects, nr_of_billable_collects)
+        SELECT tenant_id,
+               (timestamp AT TIME ZONE 'UTC')::date,
+               COALESCE(account_id, ''),
+               COALESCE(account_name, ''),
+               tier,
+               COUNT(*),
+               COUNT(*) FILTER (WHERE nr_of_resources_collected >= 100)
+        FROM metering
+        GROUP BY 1, 2, 3, 4, 5
+        """
+    )
@@ -0,0 +1,24 @@
+"""cloud_account: index to select degraded accounts due for a ping
+
+Revision ID: 3d5e8b1f6a90
+Revises: 7a41c9de03b5
+Create Date: 2024-10-15 10:41:07.000000+00:00
+
+"""
+
+from typing import Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = "3d5e8b1f6a90"
+down_revision: Union[str, None] = "7a41c9de03b5"
+
+
+def upgrade() -> None:
+    op.create_index(
+        "ix_cloud_account_state_last_degraded_scan",
+        "cloud_account",
+        ["state", "last_degraded_scan_started_at"],
+        unique=False,
+    )
@@ -0,0 +1,80 @@
+#  Copyright (c) 2024. Some Engineering
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import asyncio
+import time
+import uuid
+
+from fixcloudutils.util import utc
+
+from fixbackend.auth.auth_cache import ExpiringLruCache, UserCache, VerifiedTokenCache
+from fixbackend.auth.models import User
+from fixbackend.ids import UserId
+from fixbackend.types import Redis
+
+
+def test_expiring_lru_cache() -> None:
+    cache: ExpiringLruCache[str, int] = ExpiringLruCache(max_size=2)
+    cache.put("a", 1, time.time() + 60)
+    cache.put("b", 2, time.time() + 60)
+    assert cache.get("a") == 1  # a is now the most recently used entry
+    cache.put("c", 3, time.time() + 60)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    cache.put("d", 4, time.time() - 1)
+    assert cache.get("d") is None
+    # c was evicted when d was added, d was removed when read after its deadline
+    assert len(cache) == 1
+
+
+def test_verified_token_cache() -> None:
+    cache = VerifiedTokenCache()
+    cache.put("token", {"sub": "123", "exp": int(time.time()) + 60})
+    assert cache.get("token") == {"sub": "123", "exp": int(time.time()) + 60}
+    # expired tokens are not served
+    cache.put("expired", {"sub": "123", "exp": int(time.time()) - 1})
+    assert cache.get("expired") is None
+    assert cache.get("unknown") is None
+
+
+async def test_user_cache_eviction(redis: Redis) -> None:
+    user = User(
+        id=UserId(uuid.uuid4()),
+        email="foo@bar.com",
+        hashed_password="",
+        is_active=True,
+        is_superuser=False,
+        is_verified=True,
+        is_mfa_active=False,
+        otp_secret=None,
+        oauth_accounts=[],
+        roles=[],
+        created_at=utc(),
+    )
+
+    async def load(_: UserId) -> User:
+        return user
+
+    # two instances sharing the same redis
+    async with UserCache(redis) as one, UserCache(redis) as two:
+        assert await one.get(user.id, load) == user
+        assert await two.get(user.id, load) == user
+        assert len(one.users) == len(two.users) == 1
+        await one.evict(user.id)
+        assert len(one.users) == 0
+        # the eviction is propagated to the other instance
+        for _ in range(50):
+            if len(two.users) == 0:
+                break
+            await asyncio.sleep(0.05)
+        assert len(two.users) == 0
@@ -12,15 +12,18 @@
 #  You should have received a copy of the GNU Affero General Public License
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
-from typing import Optional, override, List
+from typing import Dict, Optional, override, List
 import pytest
 from cryptography.hazmat.primitives.asymmetric import rsa
 from fastapi import Request
 
+from fixbackend import fix_jwt
 from fixbackend.certificates.cert_store import CertificateStore
-from fixbackend.types import AsyncSessionMaker
+from fixbackend.ids import UserId
+from fixbackend.types import AsyncSessionMaker, Redis
 
 from fixbackend.auth.auth_backend import FixJWTStrategy
+from fixbackend.auth.auth_cache import UserCache
 from fixbackend.auth.models import User
 from fixbackend.auth.user_manager import UserManager
 from fixbackend.auth.user_repository import get_user_repository
@@ -76,6 +79,9 @@ class CertificateStoreMock(CertificateStore):
     async def public_keys(self) -> List[rsa.RSAPublicKey]:
         return self.public_keys_direct
 
+    async def public_keys_by_kid(self) -> Dict[str, rsa.RSAPublicKey]:
+        return {fix_jwt.kid(key): key for key in self.public_keys_direct}
+
 
 @pytest.mark.asyncio
 async def test_token_validation(
@@ -119,3 +125,34 @@ async def test_token_validation(
 
     # decoding invalid token returns None
     assert await strategy1.decode_token("invalid token") is None
+
+
+@pytest.mark.asyncio
+async def test_token_and_user_cache(user: User, cert_store: CertificateStore, redis: Redis) -> None:
+    user_cache = UserCache(redis)
+    strategy = FixJWTStrategy(cert_store, 3600, user_cache=user_cache)
+    loaded: List[UserId] = []
+
+    class CountingUserManager(UserManager):
+        # noinspection PyMissingConstructor
+        def __init__(self) -> None:
+            pass
+
+        async def get(self, id: UserId) -> User:
+            loaded.append(id)
+            return user
+
+    token = await strategy.write_token(user)
+    user_manager = CountingUserManager()
+    assert await strategy.read_token(token, user_manager) == user
+    assert await strategy.read_token(token, user_manager) == user
+    # the user is loaded only once, the token is verified only once
+    assert loaded == [user.id]
+    assert len(strategy.verified_tokens.tokens) == 1
+    assert await strategy.decode_token(token) is not None
+    # the kid index is reused as long as the signing certificates do not change
+    assert await cert_store.public_keys_by_kid() is await cert_store.public_keys_by_kid()
+    # evicting the user loads it again
+    await user_cache.evict(user.id)
+    assert await strategy.read_token(token, user_manager) == user
+    assert loaded == [user.id, user.id]
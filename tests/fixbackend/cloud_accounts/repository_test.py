@@ -25,6 +25,7 @@ from fixbackend.cloud_accounts.models import (
     AwsCloudAccess,
     AzureCloudAccess,
     CloudAccount,
+    CloudAccountScanResult,
     CloudAccountState,
     CloudAccountStates,
     GcpCloudAccess,
@@ -40,7 +41,9 @@ from fixbackend.ids import (
     ExternalId,
     FixCloudAccountId,
     GcpServiceAccountKeyId,
+    TaskId,
     UserCloudAccountName,
+    WorkspaceId,
 )
 from fixbackend.types import AsyncSessionMaker
 from fixbackend.workspaces.repository import WorkspaceRepository
@@ -172,6 +175,22 @@ async def test_create_aws_cloud_account(
     )
     assert len(degraded_but_too_recent) == 0
 
+    # the accounts of other workspaces are not returned
+    assert (
+        await cloud_account_repository.list_degraded_for_ping(WorkspaceId(uuid.uuid4()), now + timedelta(hours=1)) == []
+    )
+
+    # all degraded accounts due for a ping, grouped by workspace
+    grouped = await cloud_account_repository.list_degraded_for_ping_grouped(now + timedelta(hours=1), limit=10)
+    assert {wid: [a.id for a in accs] for wid, accs in grouped.items()} == {workspace_id: [degraded_to_be_pinged[0].id]}
+    assert await cloud_account_repository.list_degraded_for_ping_grouped(now + timedelta(hours=1), limit=0) == {}
+    # mark them as pinged with one update
+    ping_time = now + timedelta(hours=2)
+    assert await cloud_account_repository.mark_degraded_pinged([degraded_to_be_pinged[0].id], ping_time) == 1
+    assert await cloud_account_repository.list_degraded_for_ping_grouped(ping_time, limit=10) == {}
+    pinged = await cloud_account_repository.get(degraded_to_be_pinged[0].id)
+    assert pinged is not None and pinged.last_degraded_scan_started_at == ping_time
+
     # update
     def update_account(account: CloudAccount) -> CloudAccount:
         match account.state:
@@ -321,3 +340,74 @@ async def test_create_azure_cloud_account(
         workspace_id=workspace_id, account_id=CloudAccountId("azure-123")
     )
     assert account_by_id is not None
+
+
+@pytest.mark.asyncio
+async def test_update_scan_results(
+    async_session_maker: AsyncSessionMaker,
+    workspace_repository: WorkspaceRepository,
+    user: User,
+) -> None:
+    cloud_account_repository = CloudAccountRepository(session_maker=async_session_maker)
+    workspace = await workspace_repository.create_workspace("foo", "foo", user)
+    access = AwsCloudAccess(external_id=workspace.external_id, role_name=AwsRoleName("foo"))
+    accounts = [
+        await cloud_account_repository.create(
+            CloudAccount(
+                id=FixCloudAccountId(uuid.uuid4()),
+                account_id=CloudAccountId(f"{num}"),
+                workspace_id=workspace.id,
+                cloud=CloudNames.AWS,
+                state=CloudAccountStates.Configured(access, enabled=True, scan=True),
+                account_name=CloudAccountName("foo"),
+                account_alias=None,
+                user_account_name=None,
+                privileged=False,
+                last_scan_started_at=None,
+                last_scan_duration_seconds=0,
+                last_scan_resources_scanned=0,
+                last_scan_resources_errors=0,
+                next_scan=None,
+                created_at=utc().replace(microsecond=0),
+                updated_at=utc().replace(microsecond=0),
+                state_updated_at=utc().replace(microsecond=0),
+                cf_stack_version=0,
+                failed_scan_count=2,
+                last_task_id=None,
+                last_degraded_scan_started_at=None,
+            )
+        )
+        for num in range(3)
+    ]
+    success, failure, untouched = accounts
+    started_at = utc().replace(microsecond=0)
+
+    def result(account: CloudAccount, failed: bool) -> CloudAccountScanResult:
+        return CloudAccountScanResult(
+            id=account.id,
+            started_at=started_at,
+            duration_seconds=12,
+            resources_scanned=0 if failed else 123,
+            resources_errors=1,
+            task_id=TaskId("t1"),
+            failed=failed,
+        )
+
+    assert await cloud_account_repository.update_scan_results([]) == []
+    updated = await cloud_account_repository.update_scan_results([result(success, False), result(failure, True)])
+    assert {a.id: a.failed_scan_count for a in updated} == {success.id: 0, failure.id: 3}
+    for account in updated:
+        stored = await cloud_account_repository.get(account.id)
+        assert stored is not None
+        assert stored.last_scan_started_at == started_at
+        assert stored.last_scan_duration_seconds == 12
+        assert stored.last_scan_resources_errors == 1
+        assert stored.last_task_id == "t1"
+    assert (await cloud_account_repository.get(success.id)).last_scan_resources_scanned == 123  # type: ignore
+    assert await cloud_account_repository.get(untouched.id) == untouched
+    # the version has been increased: updates via the orm still work
+    renamed = await cloud_account_repository.update(
+        failure.id, lambda acc: evolve(acc, user_account_name=UserCloudAccountName("bla"))
+    )
+    assert renamed.user_account_name == "bla"
+    assert renamed.failed_scan_count == 3
@@ -13,6 +13,7 @@
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import pickle
 import uuid
+from datetime import timedelta
 from typing import Any, Sequence, Mapping
 from uuid import uuid4
 
@@ -77,6 +78,11 @@ async def test_redis_collect_queue(
 
     assert_json(pickle.loads(await arq_redis.get("arq:job:test")))  # type: ignore
 
+    # only jobs that can be picked up are counted
+    assert await collect_queue.queue_depth() == 1
+    await collect_queue.enqueue(graph_db_access, aws_account, job_id="deferred", defer_by=timedelta(hours=1))
+    assert await collect_queue.queue_depth() == 1
+
 
 def test_aws_account_info_json() -> None:
     external_id = ExternalId(uuid4())
@@ -205,6 +205,8 @@ def default_config() -> Config:
         static_assets=None,
         session_ttl=3600,
         available_db_server=["http://localhost:8529", "http://127.0.0.1:8529"],
+        db_server_weights=[],
+        inventory_connections_per_server=64,
         inventory_url="http://localhost:8980",
         cf_template_url="dev-eu",
         args=Namespace(dispatcher=False, mode="app", redis_password=None, aws_marketplace_metering_sqs_url=None),
@@ -244,6 +246,11 @@ def default_config() -> Config:
         azure_tenant_id="",
         account_failed_resource_count=1,
         degraded_accounts_ping_interval_hours=24,
+        dispatcher_schedule_concurrency=5,
+        dispatcher_spread_next_runs=False,
+        dispatcher_max_collect_queue_depth=0,
+        domain_event_lanes=0,
+        domain_event_max_in_flight=10,
         auth_rate_limit_per_minute=100,
     )
 
@@ -758,6 +765,18 @@ def nd_json_response(content: Sequence[JsonElement]) -> Response:
     return Response(200, content=response.encode("utf-8"), headers={"content-type": "application/x-ndjson"})
 
 
+def multipart_response(parts: Sequence[Sequence[JsonElement]], boundary: str = "cli-result") -> Response:
+    # the inventory writes every part with its own closing delimiter
+    response = ""
+    for content in parts:
+        response += f"--{boundary}\r\nContent-Type: application/x-ndjson\r\n\r\n"
+        response += "".join(json.dumps(a) + "\n" for a in content)
+        response += f"\r\n--{boundary}--\r\n"
+    return Response(
+        200, content=response.encode("utf-8"), headers={"content-type": f"multipart/mixed; boundary={boundary}"}
+    )
+
+
 @pytest.fixture
 async def request_handler_mock() -> RequestHandlerMock:
     return []
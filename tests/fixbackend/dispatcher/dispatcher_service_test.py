@@ -13,21 +13,24 @@
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import uuid
-from datetime import datetime, timezone
-from typing import Dict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict
 
 import pytest
+from arq import ArqRedis
 from fixcloudutils.redis.event_stream import MessageContext
+from fixcloudutils.types import Json
 from fixcloudutils.util import utc
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from fixbackend.auth.models import User
-from fixbackend.cloud_accounts.models import AwsCloudAccess, CloudAccount, CloudAccountStates
+from fixbackend.batch_stream_listener import BatchFailed
+from fixbackend.cloud_accounts.models import AwsCloudAccess, CloudAccount, CloudAccountState, CloudAccountStates
 from fixbackend.cloud_accounts.repository import CloudAccountRepository
 from fixbackend.collect.collect_queue import AwsAccountInformation
-from fixbackend.dispatcher.collect_progress import AccountCollectProgress
+from fixbackend.dispatcher.collect_progress import AccountCollectProgress, CollectionFailure, CollectionSuccess
 from fixbackend.dispatcher.dispatcher_service import DispatcherService
-from fixbackend.dispatcher.next_run_repository import NextTenantRun
+from fixbackend.dispatcher.next_run_repository import NextRunRepository, NextTenantRun
 from fixbackend.domain_events.events import (
     CloudAccountConfigured,
     CloudAccountCollectInfo,
@@ -45,6 +48,7 @@ from fixbackend.ids import (
     FixCloudAccountId,
     TaskId,
     UserCloudAccountName,
+    WorkspaceId,
 )
 from fixbackend.metering.metering_repository import MeteringRepository
 from fixbackend.types import Redis
@@ -420,6 +424,190 @@ async def test_receive_collect_error_message(
     assert len(domain_event_sender.events) == current_events_length + 1
 
 
+@pytest.mark.asyncio
+async def test_receive_collect_done_messages_batch(
+    dispatcher: DispatcherService,
+    metering_repository: MeteringRepository,
+    workspace: Workspace,
+    domain_event_sender: InMemoryDomainEventPublisher,
+    redis: Redis,
+) -> None:
+    current_events_length = len(domain_event_sender.events)
+    now = utc()
+    jobs = {uuid.uuid4(): FixCloudAccountId(uuid.uuid4()) for _ in range(2)}
+    for num, (job_id, cloud_account_id) in enumerate(jobs.items()):
+        await dispatcher.collect_progress.track_account_collection_progress(
+            workspace.id,
+            cloud_account_id,
+            AwsAccountInformation(
+                aws_account_id=CloudAccountId(f"{num}"),
+                aws_account_name=CloudAccountName(f"test{num}"),
+                aws_role_arn=AwsARN("arn"),
+                scrape_org_role_arn=AwsARN("scrape_arn"),
+                external_id=ExternalId(uuid.uuid4()),
+            ),
+            job_id,
+            now,
+        )
+    (done_job, done_account), (failed_job, failed_account) = jobs.items()
+    done = {
+        "job_id": str(done_job),
+        "task_id": "t1",
+        "tenant_id": str(workspace.id),
+        "account_info": {
+            "0": dict(id="0", name="test0", cloud="aws", exported_at="2023-09-29T09:00:18Z", summary={"instance": 3})
+        },
+        "messages": [],
+        "started_at": "2023-09-29T09:00:00Z",
+        "duration": 18,
+    }
+    failed = {"job_id": str(failed_job), "task_id": "t2", "duration": 12, "error": "boom"}
+    post_collect_done = {"tenant_id": str(workspace.id), "success": True}
+
+    # both jobs are handled together, the post collect message afterwards
+    await dispatcher.process_collect_done_messages(
+        [
+            (done, MessageContext("1", "collect-done", "test", utc(), utc())),
+            (failed, MessageContext("2", "job-failed", "test", utc(), utc())),
+            ({}, MessageContext("3", "unknown", "test", utc(), utc())),
+            (post_collect_done, MessageContext("4", "post-collect-done", "test", utc(), utc())),
+        ]
+    )
+
+    records = [n async for n in metering_repository.list(workspace.id)]
+    assert len(records) == 1
+    assert records[0].job_id == str(done_job)
+    assert records[0].nr_of_resources_collected == 3
+    # the collect run is completed
+    assert await dispatcher.collect_progress.account_collection_ongoing(workspace.id, done_account) is False
+    assert await dispatcher.collect_progress.account_collection_ongoing(workspace.id, failed_account) is False
+    assert len(domain_event_sender.events) == current_events_length + 1
+    collected = domain_event_sender.events[-1]
+    assert isinstance(collected, TenantAccountsCollected)
+    assert collected.cloud_accounts == {
+        done_account: CloudAccountCollectInfo(CloudAccountId("0"), 3, 18, now, TaskId("t1"), [])
+    }
+    assert collected.cloud_accounts_failed == {
+        failed_account: CloudAccountCollectInfo(CloudAccountId("1"), 0, 12, now, TaskId("t2"), ["boom"])
+    }
+
+
+@pytest.mark.asyncio
+async def test_receive_collect_done_messages_batch_failed(
+    dispatcher: DispatcherService, workspace: Workspace, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    job_id = uuid.uuid4()
+    await dispatcher.collect_progress.track_account_collection_progress(
+        workspace.id,
+        FixCloudAccountId(uuid.uuid4()),
+        AwsAccountInformation(
+            aws_account_id=CloudAccountId("0"),
+            aws_account_name=CloudAccountName("test0"),
+            aws_role_arn=AwsARN("arn"),
+            scrape_org_role_arn=AwsARN("scrape_arn"),
+            external_id=ExternalId(uuid.uuid4()),
+        ),
+        job_id,
+        utc(),
+    )
+    post_collect_handled = []
+
+    async def post_collect_done(message: Json, context: MessageContext) -> None:
+        post_collect_handled.append(context.id)
+
+    async def mark_jobs_done(*args: Any) -> int:
+        raise Exception("boom")
+
+    monkeypatch.setattr(dispatcher, "process_post_collect_done_message", post_collect_done)
+    monkeypatch.setattr(dispatcher.collect_progress, "mark_jobs_done", mark_jobs_done)
+    post_collect_message = {"tenant_id": str(workspace.id), "success": True}
+    failed = {"job_id": str(job_id), "task_id": "t1", "duration": 12, "error": "boom"}
+    with pytest.raises(BatchFailed) as ex:
+        await dispatcher.process_collect_done_messages(
+            [
+                (post_collect_message, MessageContext("1", "post-collect-done", "test", utc(), utc())),
+                (failed, MessageContext("2", "job-failed", "test", utc(), utc())),
+                (post_collect_message, MessageContext("3", "post-collect-done", "test", utc(), utc())),
+            ]
+        )
+    # only the first message has been processed, all others are processed again one by one
+    assert post_collect_handled == ["1"]
+    assert ex.value.unprocessed == {"2", "3"}
+
+
+@pytest.mark.asyncio
+async def test_collect_progress_pending_jobs(dispatcher: DispatcherService, workspace: Workspace, redis: Redis) -> None:
+    progress = dispatcher.collect_progress
+    jobs = {str(uuid.uuid4()): FixCloudAccountId(uuid.uuid4()) for _ in range(3)}
+    for num, (job_id, cloud_account_id) in enumerate(jobs.items()):
+        await progress.track_account_collection_progress(
+            workspace.id,
+            cloud_account_id,
+            AwsAccountInformation(
+                aws_account_id=CloudAccountId(f"{num}"),
+                aws_account_name=CloudAccountName(f"test{num}"),
+                aws_role_arn=AwsARN("arn"),
+                scrape_org_role_arn=AwsARN("scrape_arn"),
+                external_id=ExternalId(uuid.uuid4()),
+            ),
+            uuid.UUID(job_id),
+            utc(),
+        )
+    assert await progress.pending_jobs(workspace.id) == 3
+    first, second, third = jobs
+    success = CollectionSuccess(12, 3, TaskId("t1"), [])
+    assert await progress.mark_jobs_done(workspace.id, {first: success}) == 2
+    # marking the same job again does not change the number of pending jobs, unknown jobs are ignored
+    assert await progress.mark_jobs_done(workspace.id, {first: success, "unknown": success}) == 2
+    failure = CollectionFailure(3, None, "boom")
+    assert await progress.mark_jobs_done(workspace.id, {second: failure, third: success}) == 0
+    assert await progress.pending_jobs(workspace.id) == 0
+    state = await progress.get_tenant_collect_state(workspace.id)
+    assert {k: v.collection_done for k, v in state.items()} == {
+        jobs[first]: success,
+        jobs[second]: failure,
+        jobs[third]: success,
+    }
+    # all keys are removed
+    await progress.delete_tenant_collect_state(workspace.id)
+    assert await redis.keys("dispatching:collect_jobs_in_progress:*") == []
+
+
+@pytest.mark.asyncio
+async def test_collect_progress_legacy_entries(dispatcher: DispatcherService, workspace: Workspace) -> None:
+    progress = dispatcher.collect_progress
+    jobs = {str(uuid.uuid4()): FixCloudAccountId(uuid.uuid4()) for _ in range(2)}
+    for num, (job_id, cloud_account_id) in enumerate(jobs.items()):
+        await progress.track_account_collection_progress(
+            workspace.id,
+            cloud_account_id,
+            AwsAccountInformation(
+                aws_account_id=CloudAccountId(f"{num}"),
+                aws_account_name=CloudAccountName(f"test{num}"),
+                aws_role_arn=AwsARN("arn"),
+                scrape_org_role_arn=AwsARN("scrape_arn"),
+                external_id=ExternalId(uuid.uuid4()),
+            ),
+            uuid.UUID(job_id),
+            utc(),
+        )
+    legacy_job, job = jobs
+    # progress written by an older version: the result is part of the progress entry
+    legacy_success = CollectionSuccess(23, 5, TaskId("t0"), [])
+    legacy_state = await progress.get_account_collect_state(workspace.id, jobs[legacy_job])
+    assert legacy_state is not None
+    legacy_state = legacy_state.done(23, 5, TaskId("t0"), [])
+    await progress.redis.hset(
+        progress._collect_progress_hash_key(workspace.id), str(jobs[legacy_job]), legacy_state.to_json_str()
+    )
+    # the legacy entry is counted as done
+    assert await progress.pending_jobs(workspace.id) == 1
+    success = CollectionSuccess(12, 3, TaskId("t1"), [])
+    assert await progress.mark_jobs_done(workspace.id, {job: success}) == 0
+    state = await progress.get_tenant_collect_state(workspace.id)
+    assert {k: v.collection_done for k, v in state.items()} == {jobs[legacy_job]: legacy_success, jobs[job]: success}
+
+
 @pytest.mark.asyncio
 async def test_trigger_post_collect(
     dispatcher: DispatcherService,
@@ -510,3 +698,132 @@ async def test_trigger_post_collect(
     assert await in_progress_hash_len() == 0
     assert await jobs_mapping_hash_len() == 0
     assert await dispatcher.collect_progress.account_collection_ongoing(workspace.id, cloud_account_id) is False
+
+
+@pytest.mark.asyncio
+async def test_schedule_next_runs(
+    dispatcher: DispatcherService,
+    cloud_account_repository: CloudAccountRepository,
+    next_run_repository: NextRunRepository,
+    workspace: Workspace,
+) -> None:
+    now = utc()
+
+    def account(account_id: str, state: CloudAccountState) -> CloudAccount:
+        return CloudAccount(
+            id=FixCloudAccountId(uuid.uuid1()),
+            workspace_id=workspace.id,
+            account_name=CloudAccountName(account_id),
+            account_id=CloudAccountId(account_id),
+            cloud=CloudNames.AWS,
+            state=state,
+            account_alias=CloudAccountAlias(account_id),
+            user_account_name=UserCloudAccountName(account_id),
+            privileged=False,
+            last_scan_duration_seconds=0,
+            last_scan_resources_scanned=0,
+            last_scan_started_at=None,
+            last_scan_resources_errors=0,
+            next_scan=None,
+            created_at=now,
+            updated_at=now,
+            state_updated_at=now,
+            cf_stack_version=0,
+            failed_scan_count=0,
+            last_task_id=None,
+            last_degraded_scan_started_at=None,
+        )
+
+    access = AwsCloudAccess(workspace.external_id, AwsRoleName("test"))
+    healthy = await cloud_account_repository.create(
+        account("123", CloudAccountStates.Configured(access, enabled=True, scan=True))
+    )
+    degraded = await cloud_account_repository.create(
+        account("456", CloudAccountStates.Degraded(access, enabled=True, scan=True, error="test"))
+    )
+    # the workspace is due since one hour, another workspace does not exist
+    await next_run_repository.create(workspace.id, now - timedelta(hours=1))
+    missing_workspace = WorkspaceId(uuid.uuid1())
+    await next_run_repository.create(missing_workspace, now - timedelta(hours=1))
+
+    await dispatcher.schedule_next_runs()
+
+    # the collect of both accounts is triggered
+    for acc in [healthy, degraded]:
+        assert await dispatcher.collect_progress.account_collection_ongoing(workspace.id, acc.id) is True
+    # the ping of the degraded account is recorded
+    pinged = await cloud_account_repository.get(degraded.id)
+    assert pinged is not None and pinged.last_degraded_scan_started_at is not None
+    # the next run is in the future
+    next_run = await next_run_repository.get(workspace.id)
+    assert next_run is not None and next_run > now
+    # the next run of the workspace that does not exist is deleted
+    assert await next_run_repository.get(missing_workspace) is None
+
+
+@pytest.mark.asyncio
+async def test_schedule_next_runs_defers_on_full_queue(
+    dispatcher: DispatcherService,
+    next_run_repository: NextRunRepository,
+    workspace: Workspace,
+    arq_redis: ArqRedis,
+) -> None:
+    due = utc() - timedelta(hours=1)
+    await next_run_repository.create(workspace.id, due)
+    # two jobs are waiting in the queue
+    dispatcher.max_collect_queue_depth = 1
+    for _ in range(2):
+        await arq_redis.enqueue_job("collect")
+    await dispatcher.schedule_next_runs()
+    # the workspace is deferred
+    assert await next_run_repository.get(workspace.id) == due
+    # the queue can take more jobs
+    dispatcher.max_collect_queue_depth = 10
+    await dispatcher.schedule_next_runs()
+    next_run = await next_run_repository.get(workspace.id)
+    assert next_run is not None and next_run > utc()
+
+
+@pytest.mark.asyncio
+async def test_ping_degraded_accounts(
+    dispatcher: DispatcherService,
+    cloud_account_repository: CloudAccountRepository,
+    next_run_repository: NextRunRepository,
+    workspace: Workspace,
+) -> None:
+    now = utc()
+    access = AwsCloudAccess(workspace.external_id, AwsRoleName("test"))
+    degraded = await cloud_account_repository.create(
+        CloudAccount(
+            id=FixCloudAccountId(uuid.uuid1()),
+            workspace_id=workspace.id,
+            account_name=CloudAccountName("foo"),
+            account_id=CloudAccountId("123"),
+            cloud=CloudNames.AWS,
+            state=CloudAccountStates.Degraded(access, enabled=True, scan=True, error="test"),
+            account_alias=CloudAccountAlias("foo_alias"),
+            user_account_name=UserCloudAccountName("foo_user"),
+            privileged=False,
+            last_scan_duration_seconds=0,
+            last_scan_resources_scanned=0,
+            last_scan_started_at=None,
+            last_scan_resources_errors=0,
+            next_scan=None,
+            created_at=now,
+            updated_at=now,
+            state_updated_at=now,
+            cf_stack_version=0,
+            failed_scan_count=0,
+            last_task_id=None,
+            last_degraded_scan_started_at=None,
+        )
+    )
+    # the workspace is not due: the degraded account is pinged anyway
+    await next_run_repository.create(workspace.id, now + timedelta(hours=1))
+    assert await dispatcher.ping_degraded_accounts(now) == 1
+    assert await dispatcher.collect_progress.account_collection_ongoing(workspace.id, degraded.id) is True
+    pinged = await cloud_account_repository.get(degraded.id)
+    assert pinged is not None and pinged.last_degraded_scan_started_at == now
+    # the account is pinged again only after the ping interval
+    assert await dispatcher.ping_degraded_accounts(now + timedelta(minutes=1)) == 0
+    assert await dispatcher.ping_degraded_accounts(now + dispatcher.degraded_acc_ping_interval * 2) == 1
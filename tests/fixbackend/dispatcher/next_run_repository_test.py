@@ -13,7 +13,7 @@
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import uuid
-from datetime import timedelta, datetime
+from datetime import timedelta, datetime, timezone
 from typing import Optional
 
 import pytest
@@ -21,7 +21,7 @@ from fixcloudutils.util import utc
 from pytest import approx
 
 from fixbackend.config import ProductTierSettings
-from fixbackend.dispatcher.next_run_repository import NextRunRepository
+from fixbackend.dispatcher.next_run_repository import NextRunRepository, compute_next_run, schedule_offset
 from fixbackend.ids import WorkspaceId, ProductTier
 
 
@@ -64,3 +64,39 @@ async def test_compute_next_run(next_run_repository: NextRunRepository) -> None:
         await assert_next_is(now + 3 * delta, now + 4 * delta)
         await assert_next_is(now - 3 * delta, now + delta)
         await assert_next_is(now - 123 * delta, now + delta)
+
+
+def test_compute_spread_next_run() -> None:
+    hour = timedelta(hours=1)
+    workspaces = [WorkspaceId(uuid.uuid1()) for _ in range(100)]
+    # offsets are stable and spread over the interval, even for ids created on the same host
+    offsets = [schedule_offset(wid, hour) for wid in workspaces]
+    assert offsets == [schedule_offset(wid, hour) for wid in workspaces]
+    assert all(timedelta(0) <= offset < hour for offset in offsets)
+    assert len({offset.total_seconds() // 60 for offset in offsets}) > 30
+
+    now = datetime(2024, 1, 1, 12, 0, 0, tzinfo=timezone.utc)
+    offset = timedelta(minutes=17)
+    # the next run is the next slot of the workspace
+    assert compute_next_run(hour, now, None, offset) == now + offset
+    assert compute_next_run(hour, now + timedelta(minutes=20), None, offset) == now + hour + offset
+    # last run in the past: the next slot after now
+    assert compute_next_run(hour, now, now - 5 * hour, offset) == now + offset
+    # last run in the future: the next slot after the last run
+    assert compute_next_run(hour, now, now + offset, offset) == now + hour + offset
+    # without offset: aligned to the last run
+    assert compute_next_run(hour, now, now - timedelta(minutes=10)) == now + timedelta(minutes=50)
+
+
+@pytest.mark.asyncio
+async def test_spread_next_run(next_run_repository: NextRunRepository) -> None:
+    spread = NextRunRepository(next_run_repository.session_maker, spread_runs=True)
+    wid = WorkspaceId(uuid.uuid1())
+    delta = ProductTierSettings[ProductTier.Enterprise].scan_interval
+    offset = schedule_offset(wid, delta)
+    now = utc()
+    first = spread.next_run_for(ProductTier.Enterprise, workspace_id=wid)
+    assert now < first <= now + delta + timedelta(seconds=2)
+    # all runs of this workspace are in the same slot
+    assert (first - datetime(1970, 1, 1, tzinfo=timezone.utc) - offset) % delta == timedelta(0)
+    assert spread.next_run_for(ProductTier.Enterprise, last_run=first, workspace_id=wid) == first + delta
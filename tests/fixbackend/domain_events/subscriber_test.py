@@ -13,9 +13,10 @@
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import asyncio
+import json
 from collections import defaultdict
 from datetime import timedelta
-from typing import Optional, Dict, Awaitable, Callable
+from typing import Optional, Dict, Awaitable, Callable, List, Tuple
 from uuid import uuid4
 
 import pytest
@@ -24,6 +25,7 @@ from fixcloudutils.redis.event_stream import RedisStreamPublisher, Backoff
 from fixbackend.config import Config
 from fixbackend.domain_events import DomainEventsStreamName
 from fixbackend.domain_events.events import UserRegistered, CloudAccountConfigured
+from fixbackend.domain_events.partitioned_listener import PartitionedRedisStreamListener
 from fixbackend.domain_events.publisher_impl import DomainEventPublisherImpl
 from fixbackend.domain_events.subscriber import DomainEventSubscriber, HandlerDescriptor
 from fixbackend.ids import CloudNames, UserId, WorkspaceId, CloudAccountId, FixCloudAccountId
@@ -118,3 +120,101 @@ async def test_handler() -> None:
     assert len(counter) == 4
     for k, v in counter.items():
         assert k == v  # expect that the handler k is attempted k times
+
+
+@pytest.mark.asyncio
+async def test_partitioned_subscribe(redis: Redis, default_config: Config) -> None:
+    subscriber = DomainEventSubscriber(redis, default_config.model_copy(update=dict(domain_event_lanes=4)), "test")
+    listener = subscriber.listener
+    assert isinstance(listener, PartitionedRedisStreamListener)
+    publisher = DomainEventPublisherImpl(RedisStreamPublisher(redis, DomainEventsStreamName, "test"))
+
+    def lane(tenant: WorkspaceId) -> int:
+        return listener.lane_of({"data": json.dumps({"tenant_id": str(tenant)})})
+
+    # two tenants that are processed in different lanes
+    slow = WorkspaceId(uuid4())
+    fast = next(t for t in (WorkspaceId(uuid4()) for _ in range(100)) if lane(t) != lane(slow))
+    received: List[Tuple[WorkspaceId, str]] = []
+    release_slow = asyncio.Event()
+
+    async def handler(event: UserRegistered) -> None:
+        if event.email == "slow-1":
+            await release_slow.wait()
+        received.append((event.tenant_id, event.email))
+
+    subscriber.subscribe(UserRegistered, handler, "handler")
+    await subscriber.start()
+    try:
+        for tenant, email in [(slow, "slow-1"), (slow, "slow-2"), (fast, "fast-1"), (fast, "fast-2")]:
+            await publisher.publish(UserRegistered(user_id=UserId(uuid4()), email=email, tenant_id=tenant))
+
+        async def wait_for(num: int) -> None:
+            for _ in range(50):
+                if len(received) >= num:
+                    return
+                await asyncio.sleep(0.1)
+
+        # the slow event only blocks its own lane
+        await wait_for(2)
+        assert received == [(fast, "fast-1"), (fast, "fast-2")]
+        # the events of the slow tenant are processed in order
+        release_slow.set()
+        await wait_for(4)
+        assert received[2:] == [(slow, "slow-1"), (slow, "slow-2")]
+        # all messages are acknowledged
+        for _ in range(20):
+            if not listener.in_flight_ids:
+                break
+            await asyncio.sleep(0.05)
+        assert listener.in_flight_ids == set()
+        assert (await redis.xpending(DomainEventsStreamName, listener.group))["pending"] == 0  # type: ignore
+    finally:
+        await subscriber.stop()
+
+
+@pytest.mark.asyncio
+async def test_partitioned_subscribe_pending_messages(redis: Redis, default_config: Config) -> None:
+    subscriber = DomainEventSubscriber(redis, default_config.model_copy(update=dict(domain_event_lanes=4)), "test")
+    listener = subscriber.listener
+    assert isinstance(listener, PartitionedRedisStreamListener)
+    publisher = DomainEventPublisherImpl(RedisStreamPublisher(redis, DomainEventsStreamName, "test"))
+    tenant = WorkspaceId(uuid4())
+    for email in ["pending-1", "pending-2", "pending-3"]:
+        await publisher.publish(UserRegistered(user_id=UserId(uuid4()), email=email, tenant_id=tenant))
+    # the messages have been delivered to this listener before a restart, but were never acknowledged
+    await redis.xgroup_create(DomainEventsStreamName, listener.group, id="0", mkstream=True)
+    await redis.xreadgroup(listener.group, listener.listener, {DomainEventsStreamName: ">"})
+    received: List[str] = []
+    release = asyncio.Event()
+
+    async def handler(event: UserRegistered) -> None:
+        await release.wait()
+        received.append(event.email)
+
+    async def pending_deliveries() -> List[int]:
+        pending = await redis.xpending_range(DomainEventsStreamName, listener.group, "-", "+", 100)
+        return [pm["times_delivered"] for pm in pending]
+
+    subscriber.subscribe(UserRegistered, handler, "handler")
+    await subscriber.start()
+    try:
+        await asyncio.sleep(0.5)
+        # messages in flight are claimed only once
+        assert await pending_deliveries() == [2, 2, 2]
+        release.set()
+        for _ in range(50):
+            if len(received) >= 3 and not await pending_deliveries():
+                break
+            await asyncio.sleep(0.1)
+        assert received == ["pending-1", "pending-2", "pending-3"]
+        assert await pending_deliveries() == []
+        # the listener reads new messages
+        await publisher.publish(UserRegistered(user_id=UserId(uuid4()), email="new", tenant_id=tenant))
+        for _ in range(50):
+            if len(received) >= 4:
+                break
+            await asyncio.sleep(0.1)
+        assert received[3:] == ["new"]
+    finally:
+        await subscriber.stop()
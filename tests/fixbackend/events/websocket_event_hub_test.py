@@ -0,0 +1,80 @@
+#  Copyright (c) 2024. Some Engineering
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import asyncio
+import json
+from typing import List, cast
+
+from fastapi import WebSocket
+from fixcloudutils.redis.pub_sub import RedisPubSubPublisher
+from prometheus_client import REGISTRY
+
+from fixbackend.events.websocket_event_hub import WebsocketEventHub, WebsocketQueue
+from fixbackend.ids import WorkspaceId
+from fixbackend.types import Redis
+from fixbackend.utils import uid
+from tests.fixbackend.conftest import eventually
+
+
+class WebsocketMock:
+    def __init__(self) -> None:
+        self.messages: List[str] = []
+        self.blocked = asyncio.Event()
+        self.blocked.set()
+
+    async def send_text(self, message: str) -> None:
+        await self.blocked.wait()
+        self.messages.append(message)
+
+
+async def test_event_hub(redis: Redis) -> None:
+    workspace_id, other_workspace_id = WorkspaceId(uid()), WorkspaceId(uid())
+    sockets = [WebsocketMock() for _ in range(3)]
+    publisher = RedisPubSubPublisher(redis, "tenant-events", "test")
+    async with WebsocketEventHub(redis) as hub:
+        async with hub.connect(workspace_id, cast(WebSocket, sockets[0])):
+            async with hub.connect(workspace_id, cast(WebSocket, sockets[1])):
+                async with hub.connect(other_workspace_id, cast(WebSocket, sockets[2])):
+                    assert len(hub.websockets) == 2
+                    # wait until the hub has subscribed
+                    await eventually(lambda: hub.reader is not None and len(hub.websockets) == 2)
+                    await asyncio.sleep(0.2)
+                    await publisher.publish("test", {"foo": "bar"}, f"tenant-events::{workspace_id}")
+                    await eventually(lambda: len(sockets[0].messages) == 1 and len(sockets[1].messages) == 1)
+                    # the event is serialized once and sent to all websockets of the workspace
+                    assert sockets[0].messages[0] is sockets[1].messages[0]
+                    event = json.loads(sockets[0].messages[0])
+                    assert event["type"] == "event"
+                    assert event["kind"] == "test"
+                    assert event["data"] == {"foo": "bar"}
+                    assert sockets[2].messages == []
+        # all websockets are disconnected
+        assert hub.websockets == {}
+
+
+async def test_slow_websocket() -> None:
+    socket = WebsocketMock()
+    socket.blocked.clear()
+    queue = WebsocketQueue(cast(WebSocket, socket), max_size=3)
+    sender = asyncio.create_task(queue.send_messages())
+    dropped = REGISTRY.get_sample_value("websocket_events_dropped_total") or 0
+    queue.offer("0")
+    await asyncio.sleep(0)  # the sender takes the first message and blocks
+    for i in range(1, 6):
+        queue.offer(str(i))
+    # the oldest messages are dropped
+    assert list(queue.messages) == ["3", "4", "5"]
+    assert REGISTRY.get_sample_value("websocket_events_dropped_total") == dropped + 2
+    socket.blocked.set()
+    await eventually(lambda: socket.messages == ["0", "3", "4", "5"])
+    sender.cancel()
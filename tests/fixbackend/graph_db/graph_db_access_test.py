@@ -20,11 +20,19 @@
 #  You should have received a copy of the GNU Affero General Public License
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import uuid
+from typing import Dict
 
 import pytest
+from fixcloudutils.util import utc
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from fixbackend.graph_db.service import GraphDatabaseAccessManager
-from fixbackend.ids import WorkspaceId
+from fixbackend.config import Config
+from fixbackend.graph_db.placement import ServerLoad
+from fixbackend.graph_db.service import GraphDatabaseAccessEntity, GraphDatabaseAccessManager
+from fixbackend.ids import CloudAccountId, ProductTier, WorkspaceId
+from fixbackend.metering import MeteringRecord
+from fixbackend.metering.metering_repository import MeteringRepository
 from fixbackend.types import AsyncSessionMaker
 
 
@@ -47,3 +55,85 @@ async def test_access_manager_join_session(
         # rolling back the session should also roll back the database access
         await session.rollback()
         assert await graph_database_access_manager.get_database_access(workspace_id) is None
+
+
+@pytest.mark.asyncio
+async def test_access_manager_cached(default_config: Config, async_session_maker: AsyncSessionMaker) -> None:
+    manager = GraphDatabaseAccessManager(default_config, async_session_maker, cache_size=2)
+    ids = [WorkspaceId(uuid.uuid4()) for _ in range(3)]
+    created = {wid: await manager.create_database_access(wid) for wid in ids}
+    unknown = WorkspaceId(uuid.uuid4())
+    # load all with one query: only the last 2 are kept in memory
+    assert await manager.get_database_access_many([*ids, unknown]) == created
+    assert list(manager.cache) == ids[1:]
+    # cached entries are served without database access
+    async with async_session_maker() as session:
+        await session.execute(delete(GraphDatabaseAccessEntity).where(GraphDatabaseAccessEntity.tenant_id == ids[2]))
+        await session.commit()
+    assert await manager.get_database_access(ids[2]) == created[ids[2]]
+    assert await manager.get_database_access(unknown) is None
+    # evicted entries are loaded again
+    manager.evict(ids[2])
+    assert await manager.get_database_access(ids[2]) is None
+    assert ids[2] not in manager.cache
+
+
+@pytest.mark.asyncio
+async def test_placement(
+    graph_database_access_manager: GraphDatabaseAccessManager,
+    async_session_maker: AsyncSessionMaker,
+    metering_repository: MeteringRepository,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    manager = graph_database_access_manager
+    servers = list(manager.server_weights())
+    loads_computed = 0
+    server_loads = manager.server_loads
+
+    async def count_server_loads(session: AsyncSession) -> Dict[str, ServerLoad]:
+        nonlocal loads_computed
+        loads_computed += 1
+        return await server_loads(session)
+
+    monkeypatch.setattr(manager, "server_loads", count_server_loads)
+    manager._loads = None
+    created = [await manager.create_database_access(WorkspaceId(uuid.uuid4())) for _ in range(20)]
+    # the loads are computed once and updated with every placed tenant
+    assert loads_computed == 1
+    # new tenants are spread over all servers
+    async with async_session_maker() as session:
+        loads = await manager.server_loads(session)
+    assert set(loads) == set(servers)
+    assert sum(load.tenants for load in loads.values()) >= 20
+    assert all(load.tenants >= 5 for load in loads.values())
+    # resources of a tenant are taken from metering
+    large = created[0]
+    await metering_repository.add(
+        [
+            MeteringRecord(
+                id=uuid.uuid4(),
+                workspace_id=large.workspace_id,
+                cloud="aws",
+                account_id=CloudAccountId("123"),
+                account_name="test",
+                timestamp=utc(),
+                job_id="job",
+                task_id="task",
+                nr_of_resources_collected=count,
+                nr_of_error_messages=0,
+                started_at=utc(),
+                duration=10,
+                product_tier=ProductTier.Enterprise,
+            )
+            for count in [1000, 5000]
+        ]
+    )
+    async with async_session_maker() as session:
+        assert (await manager.server_loads(session))[large.server].resources >= 5000
+    # drain the server of the large tenant: all its tenants move
+    plan = await manager.plan_rebalance(manager.server_weights([f"{large.server}=0"]))
+    moved = {m.workspace_id: m for m in plan.moves}
+    assert moved[large.workspace_id].source == large.server
+    assert moved[large.workspace_id].resources == 5000
+    assert all(m.source == large.server for m in plan.moves)
+    assert large.server not in plan.loads_after
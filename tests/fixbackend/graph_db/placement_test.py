@@ -0,0 +1,76 @@
+#  Copyright (c) 2024. Some Engineering
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import uuid
+from collections import Counter
+from typing import Dict
+
+import pytest
+
+from fixbackend.graph_db.placement import HashRing, PlacementEngine, ServerLoad
+from fixbackend.ids import WorkspaceId
+
+tenants = [WorkspaceId(uuid.UUID(int=num)) for num in range(2000)]
+
+
+def test_hash_ring() -> None:
+    ring = HashRing({"a": 1, "b": 1, "c": 2, "drained": 0})
+    assert set(ring.weights) == {"a", "b", "c"}
+    owners = Counter(ring.server_for(str(t)) for t in tenants)
+    # c has twice the weight
+    assert 800 < owners["c"] < 1200
+    assert 350 < owners["a"] < 650
+    # candidates list every server once, starting with the owner
+    assert [list(ring.candidates(str(t)))[0] == ring.server_for(str(t)) for t in tenants[:10]] == [True] * 10
+    assert sorted(ring.candidates(str(tenants[0]))) == ["a", "b", "c"]
+    # adding a server only moves tenants to the new server
+    bigger = HashRing({"a": 1, "b": 1, "c": 2, "d": 1})
+    moved = [t for t in tenants if ring.server_for(str(t)) != bigger.server_for(str(t))]
+    assert all(bigger.server_for(str(t)) == "d" for t in moved)
+    assert 250 < len(moved) < 550
+    with pytest.raises(ValueError):
+        HashRing({"a": 0})
+
+
+def test_bounded_placement() -> None:
+    engine = PlacementEngine(HashRing({"a": 1, "b": 1}), load_factor=1.1)
+    # a is full: the tenant is placed on the next server
+    loads = {"a": ServerLoad(10, 1000), "b": ServerLoad(5, 100)}
+    assert {engine.place(t, loads) for t in tenants[:20]} == {"b"}
+    # balanced loads: the owner in the ring is used
+    loads = {"a": ServerLoad(5, 100), "b": ServerLoad(5, 100)}
+    assert [engine.place(t, loads) for t in tenants[:20]] == [engine.ring.server_for(str(t)) for t in tenants[:20]]
+
+
+def test_rebalance_plan() -> None:
+    resources = {t: 10_000 if num % 100 == 0 else 100 for num, t in enumerate(tenants)}
+    engine = PlacementEngine(HashRing({"a": 1, "b": 1, "c": 1}), load_factor=1.1)
+    loads: Dict[str, ServerLoad] = {}
+    assignments = {}
+    for t in tenants:
+        server = engine.place(t, loads, resources[t])
+        assignments[t] = server
+        loads[server] = loads.get(server, ServerLoad()).add(resources[t])
+    # no changes: nothing moves
+    assert engine.plan(assignments, resources).moves == []
+    # add a server: tenants of servers above their new share move, mostly to the new server
+    added = PlacementEngine(HashRing({"a": 1, "b": 1, "c": 1, "d": 1}), load_factor=1.1).plan(assignments, resources)
+    targets = Counter(m.target for m in added.moves)
+    assert targets.most_common(1)[0][0] == "d"
+    assert len(added.moves) < 700  # modulo placement would move 3/4 of all tenants
+    assert all(load.tenants <= 550 for load in added.loads_after.values())
+    assert added.loads_before == loads
+    # drain a server: all tenants of this server move, no other tenant moves
+    drained = PlacementEngine(HashRing({"a": 1, "b": 1}), load_factor=1.1).plan(assignments, resources)
+    assert {m.workspace_id for m in drained.moves} == {t for t, s in assignments.items() if s == "c"}
+    assert set(drained.loads_after) == {"a", "b"}
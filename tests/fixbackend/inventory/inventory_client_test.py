@@ -19,19 +19,31 @@
 #
 #  You should have received a copy of the GNU Affero General Public License
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import asyncio
 import json
+import time
 import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List
 
 import pytest
-from fixcloudutils.types import Json
+from fixcloudutils.types import Json, JsonElement
 from fixcloudutils.util import utc
-from httpx import Request, Response
+from httpx import AsyncClient, MockTransport, ReadTimeout, Request, Response
 
 from fixbackend.graph_db.models import GraphDatabaseAccess
 from fixbackend.ids import WorkspaceId, CloudAccountId, NodeId
-from fixbackend.inventory.inventory_client import InventoryClient
+from fixbackend.inventory.inventory_client import (
+    CircuitBreaker,
+    GraphDatabaseNotAvailable,
+    InventoryClient,
+    InventoryException,
+    InventoryRequestTookTooLong,
+    TimeseriesQuery,
+    json_decoder,
+)
 from fixbackend.inventory.inventory_schemas import CompletePathRequest, HistoryChange
-from tests.fixbackend.conftest import RequestHandlerMock, nd_json_response, json_response
+from tests.fixbackend.conftest import RequestHandlerMock, nd_json_response, json_response, multipart_response
 
 db_access = GraphDatabaseAccess(WorkspaceId(uuid.uuid1()), "server", "database", "username", "password")
 
@@ -43,11 +55,37 @@ def mocked_inventory_client(
     azure_virtual_machine_resource_json: Json,
     aws_ec2_model_json: Json,
 ) -> InventoryClient:
+    severity_timeseries = [
+        {"at": "2023-12-05T16:52:38Z", "group": {"severity": "critical"}, "v": 5},
+        {"at": "2023-12-05T16:52:38Z", "group": {"severity": "high"}, "v": 18.6},
+        {"at": "2023-12-05T16:52:38Z", "group": {"severity": "medium"}, "v": 47},
+        {"at": "2023-12-05T16:52:38Z", "group": {"severity": "low"}, "v": 5},
+        {"at": "2023-12-06T16:52:38Z", "group": {"severity": "critical"}, "v": 1},
+        {"at": "2023-12-06T16:52:38Z", "group": {"severity": "high"}, "v": 12},
+        {"at": "2023-12-06T16:52:38Z", "group": {"severity": "medium"}, "v": 26.92307692307692},
+        {"at": "2023-12-06T16:52:38Z", "group": {"severity": "low"}, "v": 2},
+    ]
+
+    def command_result(command: str) -> List[JsonElement]:
+        if command.startswith("json "):
+            return [str(a) for a in json.loads(command.removeprefix("json "))]
+        elif command.startswith("timeseries get --name cores_total "):
+            return [{"at": "2023-12-05T16:52:38Z", "v": 23}]
+        elif command.startswith("timeseries get --name infected_resources "):
+            return severity_timeseries  # type: ignore
+        raise AttributeError(f"Unexpected command: {command}")
+
     async def mock(request: Request) -> Response:
         content = request.content.decode("utf-8")
 
-        if request.url.path == "/cli/execute" and content == "json [1,2,3]":
+        if request.url.path == "/cli/execute" and ";" in content:
+            return multipart_response([command_result(command.strip()) for command in content.split(";")])
+        elif request.url.path == "/cli/execute" and content == "json [1,2,3]":
             return Response(200, content=b'"1"\n"2"\n"3"\n', headers={"content-type": "application/x-ndjson"})
+        elif request.url.path == "/cli/execute" and content == "json [4,5]":
+            return Response(200, content=b'"4"\n"5"\n', headers={"content-type": "application/x-ndjson"})
+        elif request.url.path == "/timeseries/cores_total":
+            return nd_json_response([{"at": "2023-12-05T16:52:38Z", "v": 23}])
         elif request.url.path == "/report/benchmarks":
             return json_response(
                 [{"clouds": ["aws"], "description": "Test AWS", "framework": "CIS", "id": "aws_test", "report_checks": [{"id": "aws_c1", "severity": "high"}, {"id": "aws_c2", "severity": "critical"}], "title": "AWS Test", "version": "0.1"},  # fmt: skip
@@ -76,18 +114,7 @@ def mocked_inventory_client(
             azure_virtual_machine_resource_json["reported"] = azure_virtual_machine_resource_json["reported"] | js
             return json_response(azure_virtual_machine_resource_json)
         elif request.url.path.startswith("/timeseries/"):
-            return nd_json_response(
-                [
-                    {"at": "2023-12-05T16:52:38Z", "group": {"severity": "critical"}, "v": 5},
-                    {"at": "2023-12-05T16:52:38Z", "group": {"severity": "high"}, "v": 18.6},
-                    {"at": "2023-12-05T16:52:38Z", "group": {"severity": "medium"}, "v": 47},
-                    {"at": "2023-12-05T16:52:38Z", "group": {"severity": "low"}, "v": 5},
-                    {"at": "2023-12-06T16:52:38Z", "group": {"severity": "critical"}, "v": 1},
-                    {"at": "2023-12-06T16:52:38Z", "group": {"severity": "high"}, "v": 12},
-                    {"at": "2023-12-06T16:52:38Z", "group": {"severity": "medium"}, "v": 26.92307692307692},
-                    {"at": "2023-12-06T16:52:38Z", "group": {"severity": "low"}, "v": 2},
-                ]
-            )
+            return nd_json_response(severity_timeseries)
         elif request.url.path == "/cli/execute":
             return Response(200, content=b"", headers={"content-type": "application/x-ndjson"})
 
@@ -103,6 +130,27 @@ async def test_execute_single(mocked_inventory_client: InventoryClient) -> None:
         assert [a async for a in result] == ["1", "2", "3"]
 
 
+async def test_execute_single_bytes(mocked_inventory_client: InventoryClient) -> None:
+    async with mocked_inventory_client.execute_single(db_access, "json [1,2,3]") as result:
+        assert b"".join([a async for a in result.aiter_bytes()]) == b'"1"\n"2"\n"3"\n'
+
+
+def test_json_decoder() -> None:
+    assert json_decoder("json") is json.loads
+    # backends that are not installed are skipped
+    assert json_decoder("not_installed", "json") is json.loads
+    assert json_decoder()('{"a": [1, 2.5, "b"]}') == {"a": [1, 2.5, "b"]}
+
+
+async def test_execute_many(mocked_inventory_client: InventoryClient, inventory_requests: List[Request]) -> None:
+    result = await mocked_inventory_client.execute_many(db_access, ["json [1,2,3]", "json [4,5]", "json [1,2,3]"])
+    assert result == [["1", "2", "3"], ["4", "5"], ["1", "2", "3"]]
+    # all commands are sent with one request
+    assert [r.content for r in inventory_requests] == [b"json [1,2,3]; json [4,5]; json [1,2,3]"]
+    # a single command is answered without multipart
+    assert await mocked_inventory_client.execute_many(db_access, ["json [4,5]"]) == [["4", "5"]]
+
+
 async def test_report_benchmarks(mocked_inventory_client: InventoryClient) -> None:
     result = await mocked_inventory_client.benchmarks(db_access, short=True, with_checks=True)
     assert len(result) == 2
@@ -158,6 +206,30 @@ async def test_timeseries(mocked_inventory_client: InventoryClient) -> None:
         assert len(result_list) == 8
 
 
+def test_timeseries_command() -> None:
+    at = datetime(2023, 12, 5, tzinfo=timezone.utc)
+    query = TimeseriesQuery(
+        "cores_total", start=at, end=at, group=set(), filter_group=["status==running"], aggregation="sum"
+    )
+    assert query.command() == (
+        "timeseries get --name cores_total --start 2023-12-05T00:00:00Z --end 2023-12-05T00:00:00Z "
+        "--group --filter status==running --aggregation sum"
+    )
+    query = TimeseriesQuery("infected_resources", group={"severity"}, granularity=timedelta(days=1))
+    assert query.command() == "timeseries get --name infected_resources --group severity --granularity 86400.0s"
+
+
+async def test_timeseries_many(mocked_inventory_client: InventoryClient, inventory_requests: List[Request]) -> None:
+    queries = [
+        TimeseriesQuery("infected_resources", start=utc(), end=utc(), granularity=timedelta(days=1)),
+        TimeseriesQuery("cores_total", start=utc(), end=utc(), group=set(), aggregation="sum"),
+    ]
+    infected, cores = await mocked_inventory_client.timeseries_many(db_access, queries)
+    assert len(infected) == 8
+    assert cores == [{"at": "2023-12-05T16:52:38Z", "v": 23}]
+    assert [r.url.path for r in inventory_requests] == ["/cli/execute"]
+
+
 async def test_search_history(mocked_inventory_client: InventoryClient) -> None:
     async with mocked_inventory_client.search_history(
         db_access, "is(account)", before=utc(), after=utc(), change=[HistoryChange.node_vulnerable]
@@ -169,3 +241,94 @@ async def test_search_history(mocked_inventory_client: InventoryClient) -> None:
 async def test_call_json(mocked_inventory_client: InventoryClient) -> None:
     response = await mocked_inventory_client.call_json(db_access, "GET", "/graph/fix/node/some_node_id")
     assert isinstance(response, dict)
+
+
+async def test_circuit_breaker() -> None:
+    calls: List[str] = []
+    healthy = {"a": False, "b": True}
+
+    async def handler(request: Request) -> Response:
+        server = request.headers["FixGraphDbServer"]
+        calls.append(server)
+        return json_response({}) if healthy[server] else Response(503, content=b"unavailable")
+
+    async with InventoryClient(
+        "http://localhost:8980",
+        AsyncClient(transport=MockTransport(handler)),
+        failure_threshold=3,
+        reset_timeout=timedelta(milliseconds=100),
+    ) as client:
+        access_a = GraphDatabaseAccess(WorkspaceId(uuid.uuid1()), "a", "db", "user", "pw")
+        access_b = GraphDatabaseAccess(WorkspaceId(uuid.uuid1()), "b", "db", "user", "pw")
+        for _ in range(3):
+            with pytest.raises(InventoryException):
+                await client.call_json(access_a, "GET", "/system/ready")
+        # the circuit of server a is open: fail fast without calling the server
+        with pytest.raises(GraphDatabaseNotAvailable):
+            await client.call_json(access_a, "GET", "/system/ready")
+        assert calls == ["a", "a", "a"]
+        # other servers are not affected
+        assert await client.call_json(access_b, "GET", "/system/ready") == {}
+        # after the reset timeout, a request is let through again and closes the circuit on success
+        await asyncio.sleep(0.15)
+        healthy["a"] = True
+        assert await client.call_json(access_a, "GET", "/system/ready") == {}
+        assert client.server_pools["a"].breaker.state == "closed"
+
+
+def test_circuit_breaker_single_probe() -> None:
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=timedelta(milliseconds=50))
+    breaker.failure()
+    breaker.failure()
+    assert not breaker.allow()
+    time.sleep(0.06)
+    # half open: only one probe is let through
+    assert breaker.state == "half_open"
+    assert breaker.allow() is True
+    assert breaker.allow() is False
+    # the failed probe opens the circuit again
+    breaker.failure()
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow() is True
+    breaker.success()
+    assert breaker.allow() and breaker.allow()
+
+
+async def test_circuit_breaker_read_timeout() -> None:
+    async def handler(request: Request) -> Response:
+        raise ReadTimeout("timeout", request=request)
+
+    async with InventoryClient(
+        "http://localhost:8980", AsyncClient(transport=MockTransport(handler)), failure_threshold=2
+    ) as client:
+        # read timeouts are no indication of an unhealthy server
+        for _ in range(3):
+            with pytest.raises(InventoryRequestTookTooLong):
+                await client.call_json(db_access, "GET", "/system/ready")
+        assert client.server_pools["server"].breaker.state == "closed"
+
+
+async def test_server_pool_saturated() -> None:
+    release = asyncio.Event()
+
+    async def handler(_: Request) -> Response:
+        await release.wait()
+        return json_response({})
+
+    async with InventoryClient(
+        "http://localhost:8980",
+        AsyncClient(transport=MockTransport(handler)),
+        max_connections_per_server=2,
+        max_waiting_per_server=1,
+    ) as client:
+        running = [asyncio.create_task(client.call_json(db_access, "GET", "/system/ready")) for _ in range(3)]
+        await asyncio.sleep(0.05)
+        pool = client.server_pools["server"]
+        assert (pool.in_use, pool.waiting) == (2, 1)
+        # neither a connection nor a place in the queue is available
+        with pytest.raises(GraphDatabaseNotAvailable):
+            await client.call_json(db_access, "GET", "/system/ready")
+        release.set()
+        assert await asyncio.gather(*running) == [{}, {}, {}]
+        assert (pool.in_use, pool.waiting) == (0, 0)
@@ -0,0 +1,92 @@
+#  Copyright (c) 2024. Some Engineering
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from typing import AsyncIterator, List
+
+import pytest
+from fastapi import FastAPI
+from httpx import AsyncClient, Request, Response
+
+from fixbackend.dependencies import FixDependencies, ServiceNames
+from fixbackend.graph_db.models import GraphDatabaseAccess
+from fixbackend.inventory.inventory_router import etag_matches, get_current_graph_db, inventory_router
+from fixbackend.inventory.inventory_service import InventoryService
+from fixbackend.workspaces.dependencies import get_user_workspace
+from fixbackend.workspaces.models import Workspace
+from tests.fixbackend.conftest import RequestHandlerMock, json_response
+
+
+@pytest.fixture
+async def client(
+    inventory_service: InventoryService, workspace: Workspace, graph_db_access: GraphDatabaseAccess
+) -> AsyncIterator[AsyncClient]:
+    app = FastAPI()
+    app.include_router(inventory_router(FixDependencies(**{ServiceNames.inventory: inventory_service})))
+    app.dependency_overrides[get_user_workspace] = lambda: workspace
+    app.dependency_overrides[get_current_graph_db] = lambda: graph_db_access
+    async with AsyncClient(app=app, base_url="http://test") as ac:
+        yield ac
+
+
+@pytest.fixture
+def model_answers(request_handler_mock: RequestHandlerMock) -> RequestHandlerMock:
+    async def model(request: Request) -> Response:
+        if request.url.path == "/graph/fix/model":
+            return json_response([{"fqn": "aws_ec2_instance"}])
+        raise AttributeError("not handled")
+
+    request_handler_mock.append(model)
+    return request_handler_mock
+
+
+def test_etag_matches() -> None:
+    assert etag_matches('"a"', '"a"')
+    assert etag_matches('"b", W/"a"', '"a"')
+    assert etag_matches("*", '"a"')
+    assert not etag_matches('"b"', '"a"')
+
+
+async def test_conditional_request(
+    client: AsyncClient,
+    workspace: Workspace,
+    inventory_service: InventoryService,
+    model_answers: RequestHandlerMock,
+    inventory_requests: List[Request],
+) -> None:
+    url = f"/{workspace.id}/inventory/model"
+    response = await client.get(url)
+    assert response.status_code == 200
+    assert response.json() == [{"fqn": "aws_ec2_instance"}]
+    etag = response.headers["ETag"]
+    assert response.headers["Cache-Control"] == "private, no-cache"
+    assert len(inventory_requests) == 1
+    # the same request with the current etag: not modified, no call to the inventory
+    response = await client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.content == b""
+    assert len(inventory_requests) == 1
+    # other parameters: other etag
+    response = await client.get(url, params={"flat": "false"}, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    # the model is cached: no call to the inventory for the same parameters
+    inventory_requests.clear()
+    assert (await client.get(url)).status_code == 200
+    assert inventory_requests == []
+    # the data of the workspace changes: new data version, new etag
+    await inventory_service.evict_cache(workspace.id)
+    response = await client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+    assert len(inventory_requests) == 1
@@ -19,15 +19,18 @@
 #
 #  You should have received a copy of the GNU Affero General Public License
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import asyncio
 import datetime
 import json
+import re
 import uuid
 from datetime import timedelta
-from typing import List
+from typing import Dict, List, Tuple
 from uuid import uuid4
 
 import pytest
-from fixcloudutils.types import Json
+from attrs import evolve
+from fixcloudutils.types import Json, JsonElement
 from httpx import Request, Response
 
 from fixbackend.auth.models import User
@@ -37,6 +40,7 @@ from fixbackend.domain_events.events import (
     WorkspaceCreated,
     ProductTierChanged,
 )
+from fixbackend.errors import ClientError, ResourceGone
 from fixbackend.graph_db.models import GraphDatabaseAccess
 from fixbackend.ids import (
     CloudAccountId,
@@ -50,8 +54,11 @@ from fixbackend.ids import (
     CloudName,
     UserId,
     ProductTier,
+    SecurityCheckId,
 )
 from fixbackend.inventory.inventory_service import InventoryService, dict_values_by
+from fixbackend.inventory.report_summary_store import SummaryParams
+from fixbackend.inventory.search_snapshot import SearchCursor
 from fixbackend.inventory.inventory_schemas import (
     BenchmarkAccountSummary,
     CheckSummary,
@@ -67,7 +74,13 @@ from fixbackend.inventory.inventory_schemas import (
 from fixbackend.utils import uid
 from fixcloudutils.util import utc
 from fixbackend.workspaces.models import Workspace
-from tests.fixbackend.conftest import RequestHandlerMock, json_response, nd_json_response, eventually
+from tests.fixbackend.conftest import (
+    RequestHandlerMock,
+    json_response,
+    nd_json_response,
+    eventually,
+    multipart_response,
+)
 
 db = GraphDatabaseAccess(WorkspaceId(uuid.uuid1()), "server", "database", "username", "password")
 
@@ -121,6 +134,10 @@ def mocked_answers(
             return nd_json_response(logs_json)
         elif request.url.path == "/cli/execute" and "<-[0:2]->" in content:
             return nd_json_response(neighborhood)
+        elif request.url.path == "/system/version":
+            return Response(200, content=b"0.1.2", headers={"content-type": "text/plain"})
+        elif request.url.path == "/configs":
+            return json_response(["fix.core", "fix.report.config"])
         elif request.url.path == "/report/checks":
             return json_response([example_check])
         elif request.url.path == "/report/benchmarks":
@@ -263,6 +280,114 @@ async def test_summary(
     assert len(summary.vulnerable_resources.data) == 8
 
 
+async def test_summary_snapshot(
+    inventory_service: InventoryService,
+    mocked_answers: RequestHandlerMock,
+    workspace: Workspace,
+    graph_db_access: GraphDatabaseAccess,
+) -> None:
+    params = (False, timedelta(days=7))
+    store = inventory_service.summary_store
+    # no snapshot available: compute the summary and store it
+    assert await store.get(workspace.id, params) is None
+    summary = await inventory_service.summary(graph_db_access, workspace, utc(), timedelta(days=7))
+    assert await store.get(workspace.id, params) == summary
+    assert await store.requested(workspace.id) == [params]
+    # the snapshot is served without accessing the inventory
+    handlers = list(mocked_answers)
+    mocked_answers.clear()
+    assert await inventory_service.summary(graph_db_access, workspace, utc(), timedelta(days=7)) == summary
+    # the snapshot is recomputed after collect for all requested parameters
+    mocked_answers.extend(handlers)
+    data_version = inventory_service.data_version
+    version = await data_version.current(workspace.id)
+    await inventory_service.evict_cache(workspace.id, advance_version=False)
+    assert await data_version.current(workspace.id) == version
+    # the data version is advanced after the snapshots are stored
+    await inventory_service._update_summary_snapshots({}, workspace.id)
+    assert await data_version.current(workspace.id) != version
+    updated = await store.get(workspace.id, params)
+    assert updated is not None
+    assert updated.accounts == summary.accounts
+    assert updated.benchmarks == summary.benchmarks
+    # a summary with different parameters is computed and stored separately
+    await inventory_service.summary(graph_db_access, workspace, utc(), timedelta(days=1))
+    assert set(await store.requested(workspace.id)) == {params, (False, timedelta(days=1))}
+    assert await store.get(workspace.id, (False, timedelta(days=1))) is not None
+    # changing the configuration of the workspace removes all snapshots
+    await inventory_service.evict_cache(workspace.id)
+    assert await store.get(workspace.id, params) is None
+    assert await store.get(workspace.id, (False, timedelta(days=1))) is None
+    # a lost version is not restarted: a new version is created
+    version = await data_version.current(workspace.id)
+    await store.redis.delete(data_version.key(workspace.id))
+    assert await data_version.current(workspace.id) not in (version, None)
+
+
+async def test_summary_snapshot_data_changed(
+    inventory_service: InventoryService,
+    mocked_answers: RequestHandlerMock,
+    workspace: Workspace,
+    graph_db_access: GraphDatabaseAccess,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    params = (False, timedelta(days=7))
+    store = inventory_service.summary_store
+    compute_summary = inventory_service._compute_summary
+
+    async def evicted_during_compute(
+        db: GraphDatabaseAccess, params: SummaryParams, now: datetime.datetime
+    ) -> ReportSummary:
+        summary = await compute_summary(db, params, now)
+        # the configuration of the workspace changes, while the summary is computed
+        await inventory_service.evict_cache(workspace.id)
+        return summary
+
+    monkeypatch.setattr(inventory_service, "_compute_summary", evicted_during_compute)
+    # the summary is returned, but not stored as snapshot
+    assert await inventory_service.summary(graph_db_access, workspace, utc(), timedelta(days=7)) is not None
+    assert await store.get(workspace.id, params) is None
+    # the next computation with an unchanged data version is stored
+    monkeypatch.setattr(inventory_service, "_compute_summary", compute_summary)
+    summary = await inventory_service.summary(graph_db_access, workspace, utc(), timedelta(days=7))
+    assert await store.get(workspace.id, params) == summary
+
+
+async def test_inventory_summary(
+    inventory_service: InventoryService, request_handler_mock: RequestHandlerMock, accounts_json: List[Json]
+) -> None:
+    def progress(command: str) -> List[JsonElement]:
+        if command.startswith("timeseries get --name account_score "):
+            return [{"at": "2024-08-06T00:00:00Z", "v": 80}, {"at": "2024-08-13T00:00:00Z", "v": 85}]
+        elif command.startswith("timeseries get --name cores_total "):
+            return [{"at": "2024-08-13T00:00:00Z", "v": 12}]
+        return []
+
+    async def mock(request: Request) -> Response:
+        content = request.content.decode("utf-8")
+        if request.url.path == "/graph/fix/search/list" and content == "is(account)":
+            return nd_json_response(accounts_json)
+        elif request.url.path == "/cli/execute" and content.startswith("history --after"):
+            return nd_json_response([{"group": {"change": "node_created"}, "count": 12}])
+        elif request.url.path == "/timeseries/resources":
+            return nd_json_response([{"at": "2024-08-12T00:00:00Z", "group": {"account_id": "123"}, "v": 5}])
+        elif request.url.path == "/cli/execute" and content.startswith("timeseries get"):
+            # all progress timeseries are fetched with one request
+            assert content.count("timeseries get") == 10
+            return multipart_response([progress(command.strip()) for command in content.split(";")])
+        else:
+            raise AttributeError(f"Unexpected request: {request.url.path} with content {content}")
+
+    request_handler_mock.append(mock)
+    summary = await inventory_service.inventory_summary(db, utc(), timedelta(days=7))
+    assert summary.score_progress == (85, 5)
+    assert summary.resource_changes == (12, 0, 0)
+    assert summary.instances_progress == (0, 0)
+    assert summary.cores_progress == (12, 0)
+    assert summary.buckets_size_bytes_progress == (0, 0)
+    assert [g.group for g in summary.resources_per_account_timeline.groups] == [{"account_id": "123"}]
+
+
 async def test_no_graph_db_access(
     inventory_service: InventoryService,
     request_handler_mock: RequestHandlerMock,
@@ -333,6 +458,87 @@ async def test_search_table(inventory_service: InventoryService, mocked_answers:
     assert result == ["name,some_int", "a,1"]
 
 
+async def test_search_table_cursor(
+    inventory_service: InventoryService, mocked_answers: RequestHandlerMock, inventory_requests: List[Request]
+) -> None:
+    header = {"columns": [{"name": "name", "kind": "string", "display": "Name", "path": "/reported.name"}]}
+    rows = [{"id": str(i), "row": {"name": f"n{i}"}} for i in range(120)]
+
+    async def table(request: Request) -> Response:
+        if request.url.path == "/cli/execute" and (
+            match := re.search(r"limit (\d+), (\d+) \| list --json-table$", request.content.decode("utf-8"))
+        ):
+            skip, limit = int(match.group(1)), int(match.group(2))
+            selected = rows[skip:][:limit]
+            response = nd_json_response([header, *selected])
+            response.headers["Result-Count"] = str(len(selected))
+            if request.url.params.get("count") == "true":
+                response.headers["Total-Count"] = str(len(rows))
+            return response
+        raise AttributeError("not handled")
+
+    async def page(request: SearchTableRequest) -> Tuple[Dict[str, str], List[str]]:
+        async with inventory_service.search_table(db, request) as result:
+            return result.context, [e["id"] async for e in result if "id" in e]  # type: ignore
+
+    mocked_answers.insert(0, table)
+    store = inventory_service.search_snapshots
+    store.max_rows = 100  # the snapshot can not hold all rows
+    store.chunk_rows = 7
+    await store.collected(db.workspace_id, "collect_1")
+    request = SearchTableRequest(query="is(instance)", snapshot=True, limit=30, count=True)
+    # the first page creates the snapshot
+    inventory_requests.clear()
+    context, ids = await page(request)
+    assert ids == [str(i) for i in range(30)]
+    assert context["Total-Count"] == "120" and context["Result-Count"] == "30"
+    assert [r.content.decode().split(" | ")[-2] for r in inventory_requests] == ["limit 0, 101"]
+    # the following pages are served from the snapshot
+    inventory_requests.clear()
+    first_cursor = context["Next-Cursor"]
+    context, ids = await page(request.model_copy(update=dict(cursor=first_cursor)))
+    assert ids == [str(i) for i in range(30, 60)]
+    context, ids = await page(request.model_copy(update=dict(cursor=context["Next-Cursor"])))
+    assert ids == [str(i) for i in range(60, 90)]
+    assert context["Total-Count"] == "120"
+    assert inventory_requests == []
+    # the next page exceeds the rows of the snapshot and is queried directly
+    context, ids = await page(request.model_copy(update=dict(cursor=context["Next-Cursor"])))
+    assert ids == [str(i) for i in range(90, 120)]
+    assert [r.content.decode().split(" | ")[-2] for r in inventory_requests] == ["limit 90, 30"]
+    context, ids = await page(request.model_copy(update=dict(cursor=context["Next-Cursor"])))
+    assert ids == [] and "Next-Cursor" not in context
+    # a new collect creates a new snapshot, the cursor of the former snapshot is still served from it
+    await store.collected(db.workspace_id, "collect_2")
+    inventory_requests.clear()
+    context, ids = await page(request)
+    assert ids == [str(i) for i in range(30)]
+    assert len(inventory_requests) == 1
+    _, ids = await page(request.model_copy(update=dict(cursor=first_cursor)))
+    assert ids == [str(i) for i in range(30, 60)]
+    assert len(inventory_requests) == 1
+    # a complete snapshot: the last page has no next cursor
+    store.max_rows = 1000
+    context, ids = await page(request.model_copy(update=dict(query="is(volume)", skip=100)))
+    assert ids == [str(i) for i in range(100, 120)]
+    assert "Next-Cursor" not in context
+    # a cursor can only be used for the search it was created for
+    with pytest.raises(ClientError):
+        await page(request.model_copy(update=dict(query="is(volume)", cursor=first_cursor)))
+    with pytest.raises(ClientError):
+        await page(request.model_copy(update=dict(cursor="invalid")))
+    # concurrent requests of the same search create the snapshot only once
+    inventory_requests.clear()
+    concurrent = request.model_copy(update=dict(query="is(bucket)"))
+    pages = await asyncio.gather(*[page(concurrent) for _ in range(5)])
+    assert all(ids == [str(i) for i in range(30)] for _, ids in pages)
+    assert len(inventory_requests) == 1
+    # the cursor of an expired snapshot is rejected, instead of serving rows of a new snapshot
+    await store.redis.delete(store._snapshot_key(db.workspace_id, SearchCursor.decode(first_cursor).query, "collect_1"))
+    with pytest.raises(ResourceGone):
+        await page(request.model_copy(update=dict(cursor=first_cursor)))
+
+
 async def test_search_start_data(inventory_service: InventoryService, mocked_answers: RequestHandlerMock) -> None:
     result = [
         SearchCloudResource(id="234", name="bla", cloud="gcp"),
@@ -482,7 +688,8 @@ async def test_benchmarks(
     for _ in range(5):
         benchmarks = await inventory_service.benchmarks(graph_db_access)
         assert len(benchmarks) == 2
-    assert len(inventory_requests) == 1  # only one request is made, 4 are served from cache
+    # only one request is made, 4 are served from cache
+    assert [r.url.path for r in inventory_requests] == ["/system/version", "/configs", "/report/benchmarks"]
 
 
 @pytest.mark.asyncio
@@ -495,7 +702,78 @@ async def test_checks(
     for _ in range(5):
         checks = await inventory_service.checks(graph_db_access)
         assert len(checks) == 1
-    assert len(inventory_requests) == 1  # only one request is made, 4 are served from cache
+    # only one request is made, 4 are served from cache
+    assert [r.url.path for r in inventory_requests] == ["/system/version", "/configs", "/report/checks"]
+
+
+@pytest.mark.asyncio
+async def test_checks_shared_by_workspaces(
+    inventory_service: InventoryService,
+    graph_db_access: GraphDatabaseAccess,
+    mocked_answers: RequestHandlerMock,
+    inventory_requests: List[Request],
+    example_check: Json,
+) -> None:
+    custom_check = {**example_check, "id": "custom", "provider": "gcp"}
+
+    async def custom_checks(request: Request) -> Response:
+        if request.url.path == "/report/check/custom":
+            return json_response(custom_check)
+        elif request.url.path == "/report/checks" and request.url.params.get("id") == "custom":
+            return json_response([custom_check])
+        raise AttributeError("not handled")
+
+    mocked_answers.insert(0, custom_checks)
+    other_db = evolve(graph_db_access, workspace_id=WorkspaceId(uid()))
+    assert [c["id"] for c in await inventory_service.checks(graph_db_access)] == ["aws_c1"]
+    # built-in definitions are shared: only the custom definitions of another workspace are discovered
+    inventory_requests.clear()
+    assert await inventory_service.checks(other_db, check_ids=[SecurityCheckId("aws_c1")]) == [example_check]
+    assert await inventory_service.checks(other_db, provider="aws", ids_only=True) == ["aws_c1"]  # type: ignore
+    assert await inventory_service.checks(other_db, provider="gcp") == []
+    assert [r.url.path for r in inventory_requests] == ["/configs"]
+    # custom definitions are layered on top of the built-in definitions of this workspace only
+    await inventory_service.put_check(other_db, "custom", custom_check)
+    inventory_requests.clear()
+    assert await inventory_service.checks(other_db, provider="gcp") == [custom_check]
+    assert [r.url.path for r in inventory_requests] == ["/report/checks"]  # only the custom checks are loaded
+    assert await inventory_service.checks(graph_db_access, provider="gcp") == []
+    assert [c["id"] for c in await inventory_service.checks(other_db)] == ["aws_c1", "custom"]
+
+
+@pytest.mark.asyncio
+async def test_checks_of_workspace_with_untracked_custom_checks(
+    inventory_service: InventoryService,
+    graph_db_access: GraphDatabaseAccess,
+    mocked_answers: RequestHandlerMock,
+    inventory_requests: List[Request],
+    example_check: Json,
+) -> None:
+    custom_db = evolve(graph_db_access, workspace_id=WorkspaceId(uid()), database="db-custom")
+    custom_check = {**example_check, "id": "custom", "provider": "gcp"}
+
+    async def custom_checks(request: Request) -> Response:
+        if request.headers.get("FixGraphDbDatabase") != "db-custom":
+            raise AttributeError("not handled")
+        elif request.url.path == "/configs":
+            # custom checks created before they were tracked
+            return json_response(["fix.core", "fix.report.check.custom"])
+        elif request.url.path == "/report/checks":
+            return json_response([example_check, custom_check])
+        raise AttributeError("not handled")
+
+    mocked_answers.insert(0, custom_checks)
+    # the workspace with custom checks does not fill the shared definitions
+    assert [c["id"] for c in await inventory_service.checks(custom_db)] == ["aws_c1", "custom"]
+    assert [c["id"] for c in await inventory_service.checks(graph_db_access)] == ["aws_c1"]
+    assert [r.url.path for r in inventory_requests] == [
+        "/system/version",
+        "/configs",
+        "/report/checks",
+        "/configs",
+        "/report/checks",
+    ]
+    assert [c["id"] for c in await inventory_service.checks(custom_db)] == ["aws_c1", "custom"]
 
 
 @pytest.mark.asyncio
@@ -0,0 +1,64 @@
+#  Copyright (c) 2024. Some Engineering
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from typing import AsyncIterator
+
+import pytest
+
+from fixbackend.errors import ClientError
+from fixbackend.ids import WorkspaceId
+from fixbackend.inventory.search_snapshot import SearchCursor, SearchSnapshotStore
+from fixbackend.types import Redis
+from fixbackend.utils import uid
+
+
+async def lines(num: int) -> AsyncIterator[str]:
+    yield "header"
+    for i in range(num):
+        yield f'"row {i}"'
+
+
+async def test_search_snapshot_store(redis: Redis) -> None:
+    workspace_id = WorkspaceId(uid())
+    store = SearchSnapshotStore(redis, max_rows=20, max_snapshots=2, chunk_rows=3)
+    assert await store.last_collect(workspace_id) == "none"
+    await store.collected(workspace_id, "c1")
+    assert await store.last_collect(workspace_id) == "c1"
+    # a snapshot of a result with more rows than the snapshot can hold
+    assert await store.page(workspace_id, "q1", "c1", 0, 5) is None
+    await store.put(workspace_id, "q1", "c1", lines(21), total=21)
+    page = await store.page(workspace_id, "q1", "c1", 4, 5)
+    assert page is not None
+    assert page.header == "header"
+    assert page.lines == [f'"row {i}"' for i in range(4, 9)]
+    assert (page.rows, page.complete, page.total) == (20, False, 21)
+    assert page.content() == b"header\n" + "\n".join(f'"row {i}"' for i in range(4, 9)).encode()
+    # a complete snapshot
+    await store.put(workspace_id, "q2", "c1", lines(4))
+    page = await store.page(workspace_id, "q2", "c1", 3, 5)
+    assert page is not None and page.lines == ['"row 3"'] and (page.rows, page.complete, page.total) == (4, True, 4)
+    # only the most recent snapshots of a workspace are kept
+    await store.put(workspace_id, "q3", "c1", lines(0))
+    assert await store.page(workspace_id, "q1", "c1", 0, 5) is None
+    assert await store.page(workspace_id, "q2", "c1", 0, 5) is not None
+    page = await store.page(workspace_id, "q3", "c1", 0, 5)
+    assert page is not None and page.lines == [] and page.total == 0
+
+
+def test_search_cursor() -> None:
+    cursor = SearchCursor("query", "collect", 100)
+    assert SearchCursor.decode(cursor.encode()) == cursor
+    with pytest.raises(ClientError):
+        SearchCursor.decode("invalid")
+    with pytest.raises(ClientError):
+        SearchCursor.decode(SearchCursor("query", "collect", -1).encode())
@@ -0,0 +1,78 @@
+#  Copyright (c) 2024. Some Engineering
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from fixbackend.inventory.timeseries import ColumnarScatters, Point
+
+t0 = datetime(2024, 1, 1, tzinfo=timezone.utc)
+t1 = t0 + timedelta(days=1)
+t2 = t0 + timedelta(days=2)
+a: Dict[str, Optional[str]] = {"account_id": "a"}
+b: Dict[str, Optional[str]] = {"account_id": "b"}
+c: Dict[str, Optional[str]] = {"account_id": "c"}
+
+
+def scatters() -> ColumnarScatters:
+    # points are not ordered by time, group c only has one value
+    points: List[Point] = [
+        (a, t2, 3.0),
+        (b, t0, 10.0),
+        (a, t0, 1.0),
+        (c, t1, 4.0),
+        (b, t1, 20.0),
+        (a, t1, 2.0),
+        (b, t2, 30.0),
+    ]
+    return ColumnarScatters.of(t0, t2, timedelta(days=1), points)
+
+
+def test_columnar_scatters() -> None:
+    s = scatters()
+    assert s.ats == [t0, t1, t2]
+    assert s.group_names == ["account_id=a", "account_id=b", "account_id=c"]
+    assert s.values.shape == (3, 3)
+    assert s.sum().tolist() == [6, 60, 4]
+    # only existing values are considered
+    assert s.count().tolist() == [3, 3, 1]
+    assert s.avg().tolist() == [2, 20, 4]
+    assert s.fill_missing(0).tolist() == [[1, 2, 3], [10, 20, 30], [0, 4, 0]]
+    assert s.sorted_by_avg().group_names == ["account_id=b", "account_id=c", "account_id=a"]
+    assert s.top_k(2).group_names == ["account_id=b", "account_id=c"]
+    assert s.top_k(5).group_names == ["account_id=b", "account_id=c", "account_id=a"]
+    assert s.top_k(0).groups == []
+    # no data
+    empty = ColumnarScatters.of(t0, t2, timedelta(days=1), [])
+    assert empty.ats == [] and empty.avg().tolist() == [] and empty.to_scatters().groups == []
+
+
+def test_columnar_to_scatters() -> None:
+    s = scatters().sorted_by_avg()
+    s.attributes[0]["name"] = "Account B"
+    result = s.to_scatters()
+    assert result.ats == [t0, t1, t2]
+    assert [g.group_name for g in result.groups] == ["account_id=b", "account_id=c", "account_id=a"]
+    # missing values are not part of the json representation
+    assert result.groups[1].values == {t1: 4.0}
+    assert result.groups[0].attributes == {"name": "Account B"}
+    assert result.groups[2].avg == 2
+    js = result.model_dump(mode="json")
+    assert js["groups"][0] == {
+        "group": {"account_id": "b"},
+        "values": {"2024-01-01T00:00:00Z": 10.0, "2024-01-02T00:00:00Z": 20.0, "2024-01-03T00:00:00Z": 30.0},
+        "attributes": {"name": "Account B"},
+    }
+    assert np.isnan(scatters().values[2, 0])
@@ -12,13 +12,15 @@
 #  You should have received a copy of the GNU Affero General Public License
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import uuid
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
+from typing import Any, List
 
 import pytest
+from attrs import evolve
 
 from fixbackend.ids import ProductTier, WorkspaceId, CloudAccountId
 from fixbackend.metering import MeteringRecord, MeteringSummary
-from fixbackend.metering.metering_repository import MeteringRepository
+from fixbackend.metering.metering_repository import MeteringRepository, MeteringRecordEntity
 
 
 def create_metering_record(workspace_id: WorkspaceId, account_id: str, product_tier: ProductTier) -> MeteringRecord:
@@ -60,3 +62,83 @@ async def test_create_load(metering_repository: MeteringRepository, metering_rec
 
     more = metering_record.nr_of_resources_collected + 1
     assert [e async for e in metering_repository.collect_summary(ws_id, min_resources_collected=more)] == []
+
+
+@pytest.mark.asyncio
+async def test_summary_from_rollup(metering_repository: MeteringRepository) -> None:
+    ws_id = WorkspaceId(uuid.uuid1())
+    day = datetime(2020, 1, 1, 0, 0, 0, tzinfo=timezone.utc)
+    records = []
+    # every 6 hours over 10 days for 2 accounts: the second account moves from Plus to Business on day 5
+    for hours in range(0, 240, 6):
+        ts = day + timedelta(hours=hours)
+        for account_id in ["1", "2"]:
+            tier = ProductTier.Business if account_id == "2" and hours >= 120 else ProductTier.Plus
+            record = create_metering_record(ws_id, account_id, tier)
+            # every 4th collect has too few resources to be billed
+            resources = 10 if hours % 24 == 0 else 1000
+            records.append(evolve(record, id=uuid.uuid1(), timestamp=ts, nr_of_resources_collected=resources))
+    await metering_repository.add(records)
+
+    async def assert_same(**kwargs: Any) -> None:
+        rollup = [e async for e in metering_repository.collect_summary(ws_id, **kwargs)]
+        raw = [e async for e in metering_repository.collect_summary(ws_id, from_rollup=False, **kwargs)]
+        assert rollup == raw
+
+    await assert_same()
+    assert [e async for e in metering_repository.collect_summary(ws_id)] == [
+        MeteringSummary("1", "test", 40, ProductTier.Plus),
+        MeteringSummary("2", "test", 40, ProductTier.Business),
+    ]
+    assert [e async for e in metering_repository.collect_summary(ws_id, min_resources_collected=100)] == [
+        MeteringSummary("1", "test", 30, ProductTier.Plus),
+        MeteringSummary("2", "test", 30, ProductTier.Business),
+    ]
+    for start, end in [
+        (day, day + timedelta(days=3)),  # complete days
+        (day + timedelta(hours=7), day + timedelta(days=4, hours=13)),  # partial days at both edges
+        (day + timedelta(hours=6), day + timedelta(hours=18)),  # no complete day
+        (day + timedelta(days=5, hours=1), None),  # open end: Business only
+        (None, day + timedelta(days=2, hours=6)),  # open start
+    ]:
+        for min_resources in [0, 100, 500]:
+            await assert_same(start=start, end=end, min_resources_collected=min_resources)
+            await assert_same(start=start, end=end, min_resources_collected=min_resources, min_nr_of_collects=5)
+
+
+@pytest.mark.asyncio
+async def test_rebuild_rollup(metering_repository: MeteringRepository) -> None:
+    ws_id = WorkspaceId(uuid.uuid1())
+    day = datetime(2020, 1, 1, 0, 0, 0, tzinfo=timezone.utc)
+    record = create_metering_record(ws_id, "1", ProductTier.Plus)
+    await metering_repository.add([evolve(record, id=uuid.uuid1(), timestamp=day + timedelta(hours=h)) for h in [1, 2]])
+    # records inserted without maintaining the rollup, e.g. by an older version during a deployment
+    legacy = [
+        MeteringRecordEntity.from_model(evolve(record, id=uuid.uuid1(), timestamp=day + timedelta(days=d, hours=3)))
+        for d in [0, 1, 1]
+    ]
+    # the account id of old records might be missing
+    legacy[2].account_id = None  # type: ignore
+    async with metering_repository.session_maker() as session:
+        session.add_all(legacy)
+        await session.commit()
+
+    async def summary(from_rollup: bool) -> List[MeteringSummary]:
+        return [
+            e
+            async for e in metering_repository.collect_summary(
+                ws_id, end=day + timedelta(days=3), from_rollup=from_rollup
+            )
+        ]
+
+    # a missing account id is reported the same way by both paths
+    assert await summary(False) == [
+        MeteringSummary("", "test", 1, ProductTier.Plus),
+        MeteringSummary("1", "test", 4, ProductTier.Plus),
+    ]
+    assert await summary(True) == [MeteringSummary("1", "test", 2, ProductTier.Plus)]
+    await metering_repository.rebuild_rollup(day.date())
+    assert await summary(True) == await summary(False)
+    # rebuilding is idempotent
+    await metering_repository.rebuild_rollup(day.date())
+    assert await summary(True) == await summary(False)
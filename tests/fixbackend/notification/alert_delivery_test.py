@@ -0,0 +1,149 @@
+#  Copyright (c) 2024. Some Engineering
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import asyncio
+import json
+import time
+from datetime import timedelta
+from typing import List, Optional
+
+from attrs import evolve
+from fixcloudutils.types import Json
+from httpx import AsyncClient, MockTransport, Request, Response
+
+from fixbackend.ids import NotificationProvider as NP, WorkspaceId
+from fixbackend.notification.alert_delivery import AlertDelivery, RateLimit, TokenBucket
+from fixbackend.notification.model import Alert, AlertOnChannel, AlertSender, FailingBenchmarkChecksDetected
+from fixbackend.notification.pagerduty.pagerduty_notification import PagerDutyNotificationSender
+from fixbackend.notification.slack.slack_notification import SlackNotificationSender
+from fixbackend.utils import uid
+
+
+async def test_token_bucket() -> None:
+    bucket = TokenBucket(RateLimit(rate=20, burst=2))
+    start = time.monotonic()
+    for _ in range(4):
+        await bucket.acquire()
+    # 2 tokens are available immediately, the next 2 are refilled within 0.1s
+    assert 0.08 < time.monotonic() - start < 0.3
+    bucket.pause(0.1)
+    assert not bucket.idle()
+    start = time.monotonic()
+    await bucket.acquire()
+    assert time.monotonic() - start >= 0.09
+
+
+async def test_deliver_alerts(alert_failing_benchmark_checks_detected: FailingBenchmarkChecksDetected) -> None:
+    requests: List[Request] = []
+    throttled = [True]
+
+    async def handler(request: Request) -> Response:
+        requests.append(request)
+        if request.url.host == "events.pagerduty.com" and throttled[0]:
+            throttled[0] = False
+            return Response(429, headers={"Retry-After": "0.1"})
+        return Response(200)
+
+    http_client = AsyncClient(transport=MockTransport(handler))
+
+    async def config_loader(workspace_id: WorkspaceId, provider: NP) -> Optional[Json]:
+        return dict(webhook_url="https://slack.com/my_webhook", integration_key="test")
+
+    delivery = AlertDelivery(
+        {NP.slack: SlackNotificationSender(http_client), NP.pagerduty: PagerDutyNotificationSender(http_client)},
+        config_loader,
+    )
+    alerts = [evolve(alert_failing_benchmark_checks_detected, id=f"alert_{num}") for num in range(3)]
+    on_channel = [AlertOnChannel(alert, channel) for alert in alerts for channel in (NP.slack, NP.pagerduty)]
+    # the same alert is delivered only once
+    on_channel.append(AlertOnChannel(alerts[0], NP.slack))
+    start = time.monotonic()
+    await delivery.deliver(on_channel)
+
+    # all slack alerts are coalesced into one message
+    slack = [r for r in requests if r.url.host == "slack.com"]
+    assert len(slack) == 1
+    assert len(json.loads(slack[0].content)["attachments"]) == 3
+    # pagerduty: one event per alert, the throttled request is retried after the defined delay
+    pagerduty = [json.loads(r.content)["dedup_key"] for r in requests if r.url.host == "events.pagerduty.com"]
+    assert sorted(pagerduty) == ["alert_0", "alert_0", "alert_1", "alert_2"]
+    assert time.monotonic() - start >= 0.1
+
+
+async def test_deliver_alerts_concurrently(
+    alert_failing_benchmark_checks_detected: FailingBenchmarkChecksDetected,
+) -> None:
+    in_flight: List[int] = [0, 0]  # current, max
+
+    async def handler(request: Request) -> Response:
+        in_flight[0] += 1
+        in_flight[1] = max(in_flight)
+        await asyncio.sleep(0.05)
+        in_flight[0] -= 1
+        return Response(200)
+
+    async def config_loader(workspace_id: WorkspaceId, provider: NP) -> Optional[Json]:
+        return dict(webhook_url=f"https://slack.com/{workspace_id}")
+
+    delivery = AlertDelivery(
+        {NP.slack: SlackNotificationSender(AsyncClient(transport=MockTransport(handler)))},
+        config_loader,
+        max_concurrency=3,
+    )
+    # 10 workspaces with different webhooks
+    alerts = [
+        AlertOnChannel(evolve(alert_failing_benchmark_checks_detected, workspace_id=WorkspaceId(uid())), NP.slack)
+        for _ in range(10)
+    ]
+    await delivery.deliver(alerts)
+    assert in_flight == [0, 3]
+
+
+async def test_deliver_alerts_retry_and_deadline(
+    alert_failing_benchmark_checks_detected: FailingBenchmarkChecksDetected,
+) -> None:
+    sent: List[Alert] = []
+
+    class FlakySender(AlertSender):
+        async def send_alert(self, alert: Alert, config: Json) -> None:
+            sent.append(alert)
+            if len(sent) == 1:
+                raise Exception("temporary failure")
+
+    async def handler(request: Request) -> Response:
+        return Response(503)
+
+    async def config_loader(workspace_id: WorkspaceId, provider: NP) -> Optional[Json]:
+        if provider == NP.teams:
+            raise Exception("config not available")
+        return dict(email="test@example.com", webhook_url="https://slack.com/my_webhook")
+
+    delivery = AlertDelivery(
+        {
+            NP.email: FlakySender(),
+            NP.slack: SlackNotificationSender(AsyncClient(transport=MockTransport(handler))),
+            NP.teams: SlackNotificationSender(AsyncClient(transport=MockTransport(handler))),
+        },
+        config_loader,
+        max_attempts=100,
+        max_delivery_time=timedelta(seconds=1.5),
+    )
+    alert = alert_failing_benchmark_checks_detected
+    start = time.monotonic()
+    await delivery.deliver(
+        [AlertOnChannel(alert, NP.email), AlertOnChannel(alert, NP.slack), AlertOnChannel(alert, NP.teams)]
+    )
+    # the failed email is retried
+    assert sent == [alert, alert]
+    # the unavailable slack webhook is retried until the deadline, the channel without config is skipped
+    assert time.monotonic() - start < 2
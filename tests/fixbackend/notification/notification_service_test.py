@@ -124,11 +124,10 @@ async def test_example_alert(notification_service: NotificationService) -> None:
     one_year_ago = now - timedelta(days=365)
     ws_id = WorkspaceId(uid())
     access = GraphDatabaseAccess(ws_id, "http://localhost:8529", "fix", "", "fix")
-    result = await notification_service._load_alert(
+    result = await notification_service._load_alerts(
         access,
-        BenchmarkName("aws_cis_2_0"),
+        {BenchmarkName("aws_cis_2_0"): ReportSeverity.high},
         [TaskId("c8b9f9a4-c420-11ee-b3d8-dad780437c54")],
-        ReportSeverity.high,
         one_year_ago,
         now,
     )
@@ -167,8 +166,12 @@ async def test_send_alert(
     async def request_handler(request: Request) -> Response:
         if request.url == "https://discord.com/webhook_example":
             return Response(204)
+        elif request.url.path == "/system/version":
+            return Response(200, content=b"0.1.2", headers={"content-type": "text/plain"})
+        elif request.url.path == "/configs":
+            return json_response(["fix.core", "fix.report.config"])
         elif request.url.path == "/report/benchmarks":
-            return json_response(["aws_cis_2_0"])
+            return json_response([dict(id="aws_cis_2_0")])
         elif request.url.path == "/report/checks":
             return json_response([example_check])
         elif request.url.path == "/graph/fix/search/history/list":
@@ -185,7 +188,7 @@ async def test_send_alert(
                         cloud="aws",
                         account="123",
                         region="eu-central-1",
-                        checks=["aws_c1"],
+                        issues=[dict(check="aws_c1", benchmarks=["aws_cis_2_0"])],
                     )
                 ]
             )
@@ -240,6 +243,13 @@ async def test_send_alert(
 
     # send alert
     await notification_service._send_alert(message, MessageContext("1", kind, "test", utc(), utc()))
+    # invalid messages are skipped without failing the batch
+    await notification_service._send_alerts(
+        [
+            (message, MessageContext("2", "unknown", "test", utc(), utc())),
+            ({"invalid": "message"}, MessageContext("3", kind, "test", utc(), utc())),
+        ]
+    )
 
 
 async def test_alert_settings(notification_service: NotificationService, workspace: Workspace) -> None:
@@ -321,3 +331,94 @@ async def test_send_degraded_message(
     assert f'<a href="https://app.fix.security/workspace-settings/accounts#{workspace.id}' in (
         email_sender.call_args[0].html or ""
     )
+
+
+@pytest.mark.asyncio
+async def test_send_alerts_of_all_benchmarks_in_one_pass(
+    notification_service: NotificationService,
+    graph_db_access: GraphDatabaseAccess,
+    mocked_answers: RequestHandlerMock,  # noqa: F811
+    domain_event_sender: InMemoryDomainEventPublisher,
+    redis_publisher_mock: RedisPubSubPublisherMock,
+    user: User,
+) -> None:
+    paths: List[str] = []
+
+    async def request_handler(request: Request) -> Response:
+        paths.append(request.url.path)
+        if request.url == "https://discord.com/webhook_example":
+            return Response(204)
+        elif request.url.path == "/system/version":
+            return Response(200, content=b"0.1.2", headers={"content-type": "text/plain"})
+        elif request.url.path == "/configs":
+            return json_response(["fix.core", "fix.report.config"])
+        elif request.url.path == "/report/benchmarks":
+            return json_response([dict(id=b) for b in ["aws_cis_2_0", "aws_well_architected", "azure_cis"]])
+        elif request.url.path == "/report/checks":
+            return json_response(
+                [
+                    dict(id="c1", title="Check 1", severity="critical"),
+                    dict(id="c2", title="Check 2", severity="medium"),
+                    dict(id="c3", title="Check 3", severity="high"),
+                ]
+            )
+        elif request.url.path == "/graph/fix/search/history/list":
+            return nd_json_response(
+                [
+                    dict(count=10, group=dict(check="c1", severity="critical", benchmark="aws_cis_2_0")),
+                    dict(count=20, group=dict(check="c2", severity="medium", benchmark="aws_cis_2_0")),
+                    dict(count=30, group=dict(check="c1", severity="critical", benchmark="aws_well_architected")),
+                    dict(count=40, group=dict(check="c3", severity="high", benchmark="aws_well_architected")),
+                    # benchmark without alert configuration
+                    dict(count=50, group=dict(check="c3", severity="high", benchmark="gcp_cis")),
+                ]
+            )
+        elif request.url.path == "/cli/execute":
+            issues = [dict(check="c1", benchmarks=["aws_cis_2_0", "aws_well_architected"])]
+            return nd_json_response([dict(id="r1", kind="aws_s3_bucket", name="my_bucket", issues=issues)])
+        else:
+            raise Exception(f"Unexpected request: {request.url}")
+
+    # setup
+    ws_id = graph_db_access.workspace_id
+    mocked_answers.insert(0, request_handler)
+    await notification_service.update_notification_provider_config(
+        ws_id, user.id, NP.discord, "test", {"webhook_url": "https://discord.com/webhook_example"}
+    )
+    alerts = {
+        BenchmarkName("aws_cis_2_0"): AlertingSetting(severity=ReportSeverity.high, channels=[NP.discord]),
+        BenchmarkName("aws_well_architected"): AlertingSetting(severity=ReportSeverity.low, channels=[NP.discord]),
+        BenchmarkName("azure_cis"): AlertingSetting(severity=ReportSeverity.low, channels=[NP.discord]),
+    }
+    await notification_service.update_alerting_for(WorkspaceAlert(workspace_id=ws_id, alerts=alerts))
+    domain_event_sender.events.clear()
+    paths.clear()
+    event = TenantAccountsCollected(
+        ws_id,
+        {FixCloudAccountId(uid()): CloudAccountCollectInfo(CloudAccountId("12345"), 123, 123, utc(), TaskId("1"), [])},
+        {},
+        None,
+    )
+
+    await notification_service.alert_on_changed(event)
+
+    # all benchmarks are evaluated with one request for history, examples and checks
+    assert sorted(paths) == ["/cli/execute", "/graph/fix/search/history/list", "/report/checks"]
+    by_benchmark = {}
+    for _, message, _ in redis_publisher_mock.messages:
+        alert = AlertOnChannel.from_json(message).alert
+        assert isinstance(alert, FailingBenchmarkChecksDetected)
+        by_benchmark[alert.benchmark] = alert
+    # azure_cis has no failing checks, medium is below the severity of aws_cis_2_0
+    assert set(by_benchmark) == {"aws_cis_2_0", "aws_well_architected"}
+    cis = by_benchmark[BenchmarkName("aws_cis_2_0")]
+    assert cis.failed_checks_count_total == 1
+    assert [(c.check_id, c.failed_resources, len(c.examples)) for c in cis.examples] == [("c1", 10, 1)]
+    well_architected = by_benchmark[BenchmarkName("aws_well_architected")]
+    assert well_architected.severity == ReportSeverity.critical
+    assert well_architected.failed_checks_count_total == 2
+    assert [(c.check_id, c.failed_resources, len(c.examples)) for c in well_architected.examples] == [
+        ("c1", 30, 1),
+        ("c3", 40, 0),
+    ]
+    assert [e.kind for e in domain_event_sender.events] == ["failing_benchmark_checks_alert_send"] * 2
@@ -13,16 +13,18 @@
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import asyncio
 import uuid
 import pytest
 
+from fixbackend.auth.auth_cache import UserCache
 from fixbackend.auth.models import User
 from fixbackend.permissions.models import Roles
 from fixbackend.permissions.role_repository import RoleRepository
-from fixbackend.ids import WorkspaceId
+from fixbackend.ids import UserId, WorkspaceId
 from fixbackend.workspaces.models import Workspace
 
-from fixbackend.types import AsyncSessionMaker
+from fixbackend.types import AsyncSessionMaker, Redis
 
 
 @pytest.mark.asyncio
@@ -73,3 +75,26 @@ async def test_role_repository(async_session_maker: AsyncSessionMaker, user: Use
         workspace.id: Roles.workspace_admin | Roles.workspace_owner,
         workspace_id_2: Roles(0),
     }
+
+
+async def test_evict_cached_user_after_commit(
+    async_session_maker: AsyncSessionMaker, user: User, workspace: Workspace, redis: Redis
+) -> None:
+    async with UserCache(redis) as user_cache:
+        role_repository = RoleRepository(async_session_maker, user_cache=user_cache)
+
+        async def load(_: UserId) -> User:
+            return user
+
+        async with async_session_maker() as session:
+            await role_repository.add_roles(user.id, workspace.id, Roles.workspace_member, session=session)
+            # a concurrent request loads the user, before the caller commits its transaction
+            await user_cache.get(user.id, load)
+            assert len(user_cache.users) == 1
+            await session.commit()
+            # the user is evicted again after the commit
+            for _ in range(50):
+                if len(user_cache.users) == 0:
+                    break
+                await asyncio.sleep(0.01)
+            assert len(user_cache.users) == 0
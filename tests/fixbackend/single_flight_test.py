@@ -0,0 +1,120 @@
+#  Copyright (c) 2024. Some Engineering
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import asyncio
+from typing import List
+
+from fixcloudutils.redis.cache import RedisCache
+
+from fixbackend.errors import ClientError
+from fixbackend.inventory.inventory_client import NoSuchGraph
+from fixbackend.inventory.inventory_schemas import SearchCloudResource
+from fixbackend.single_flight import SingleFlight, SingleFlightFailed
+from fixbackend.types import Redis
+
+
+async def test_single_flight_in_process(redis: Redis) -> None:
+    calls: List[int] = []
+    single_flight = SingleFlight(RedisCache(redis, "test"), redis)
+
+    async def compute(num: int) -> int:
+        calls.append(num)
+        await asyncio.sleep(0.1)
+        return num * 2
+
+    results = await asyncio.gather(*[single_flight.call(compute, "key")(21) for _ in range(10)])
+    assert results == [42] * 10
+    assert calls == [21]
+    assert single_flight.in_flight == {}
+    # different arguments are computed separately
+    one, two = await asyncio.gather(single_flight.call(compute, "key")(1), single_flight.call(compute, "key")(2))
+    assert (one, two) == (2, 4)
+    assert calls == [21, 1, 2]
+
+
+async def test_single_flight_cluster(redis: Redis) -> None:
+    calls: List[str] = []
+    # two instances with their own local cache, sharing the same redis
+    instances = [SingleFlight(RedisCache(redis, "test"), redis) for _ in range(2)]
+
+    async def compute(name: str) -> str:
+        calls.append(name)
+        await asyncio.sleep(0.2)
+        return f"hello {name}"
+
+    results = await asyncio.gather(*[sf.call(compute, "key")("world") for sf in instances for _ in range(5)])
+    assert results == ["hello world"] * 10
+    assert calls == ["world"]
+
+
+async def test_single_flight_error(redis: Redis) -> None:
+    single_flight = SingleFlight(RedisCache(redis, "test"), redis)
+    calls: List[int] = []
+
+    async def compute() -> int:
+        calls.append(1)
+        await asyncio.sleep(0.1)
+        raise ValueError("boom")
+
+    results = await asyncio.gather(*[single_flight.call(compute, "key")() for _ in range(3)], return_exceptions=True)
+    assert all(isinstance(r, ValueError) for r in results)
+    assert len(calls) == 1
+    # failed computations are not cached
+    assert isinstance(
+        (await asyncio.gather(single_flight.call(compute, "key")(), return_exceptions=True))[0], ValueError
+    )
+    assert len(calls) == 2
+
+
+async def test_single_flight_cluster_result_type(redis: Redis) -> None:
+    calls: List[str] = []
+    instances = [SingleFlight(RedisCache(redis, "test"), redis) for _ in range(3)]
+
+    async def compute() -> List[SearchCloudResource]:
+        calls.append("compute")
+        await asyncio.sleep(0.2)
+        return [SearchCloudResource(id="123", name="foo", cloud="aws")]
+
+    # the waiting instances get the result of the lock holder, converted to the annotated return type
+    results = await asyncio.gather(*[sf.call(compute, "key")() for sf in instances])
+    assert results == [[SearchCloudResource(id="123", name="foo", cloud="aws")]] * 3
+    assert calls == ["compute"]
+
+
+async def test_single_flight_cluster_error(redis: Redis) -> None:
+    calls: List[str] = []
+    instances = [SingleFlight(RedisCache(redis, "test"), redis, shared_errors=[ClientError]) for _ in range(3)]
+
+    async def no_graph() -> int:
+        calls.append("no_graph")
+        await asyncio.sleep(0.2)
+        raise NoSuchGraph(404, "no graph")
+
+    # the failure is propagated to the waiting instances: the computation is not repeated
+    results = await asyncio.gather(*[sf.call(no_graph, "key")() for sf in instances], return_exceptions=True)
+    assert calls == ["no_graph"]
+    for result in results:
+        assert isinstance(result, NoSuchGraph)
+        assert result.status == 404
+        assert str(result) == "no graph"
+
+    async def boom() -> int:
+        calls.append("boom")
+        await asyncio.sleep(0.2)
+        raise ValueError("boom")
+
+    # errors of unknown type are not recreated
+    results = await asyncio.gather(*[sf.call(boom, "key")() for sf in instances], return_exceptions=True)
+    assert calls == ["no_graph", "boom"]
+    assert sum(isinstance(r, ValueError) for r in results) == 1
+    assert sum(isinstance(r, SingleFlightFailed) for r in results) == 2
@@ -19,12 +19,19 @@
 #
 #  You should have received a copy of the GNU Affero General Public License
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
-from typing import AsyncIterator
+import json
+from typing import AsyncIterator, List
 
 import pytest
 from fixcloudutils.types import Json
 
-from fixbackend.streaming_response import streaming_response
+from fixbackend.errors import NotAllowed
+from fixbackend.streaming_response import (
+    streaming_response,
+    passthrough_response,
+    StreamOnSuccessResponse,
+    StreamChunk,
+)
 
 
 @pytest.mark.asyncio
@@ -42,3 +49,58 @@ async def test_streaming_json() -> None:
     fn, media_type = streaming_response("text/csv")
     assert [a async for a in fn(gen())] == ["{'a': 1}\n", "{'b': 2}\n"]
     assert media_type == "text/csv"
+
+
+@pytest.mark.asyncio
+async def test_passthrough_json() -> None:
+    async def gen() -> AsyncIterator[bytes]:
+        # chunks are not aligned with lines
+        for chunk in [b'{"a": 1}\n{"b"', b": 2}", b"\n", b'\n{"c": 3}\n']:
+            yield chunk
+
+    json_pt = passthrough_response("application/json")
+    assert json_pt is not None
+    fn, media_type = json_pt
+    assert json.loads(b"".join([a async for a in fn(gen())])) == [{"a": 1}, {"b": 2}, {"c": 3}]
+    assert media_type == "application/json"
+    ndjson_pt = passthrough_response("application/x-ndjson")
+    assert ndjson_pt is not None
+    fn, media_type = ndjson_pt
+    assert b"".join([a async for a in fn(gen())]) == b'{"a": 1}\n{"b": 2}\n\n{"c": 3}\n'
+    assert media_type == "application/ndjson"
+    # csv requires a transformation of every element
+    assert passthrough_response("text/csv") is None
+
+
+@pytest.mark.asyncio
+async def test_stream_on_success_coalesced() -> None:
+    async def gen() -> AsyncIterator[StreamChunk]:
+        for _ in range(10):
+            yield "abc"
+        yield b"d" * 20
+
+    messages: List[Json] = []
+
+    async def send(message: Json) -> None:
+        messages.append(message)
+
+    await StreamOnSuccessResponse(gen(), media_type="text/plain", chunk_size=8).stream_response(send)  # type: ignore
+    assert messages[0]["type"] == "http.response.start"
+    assert [m["body"] for m in messages[1:]] == [b"abcabcabc"] * 3 + [b"abc" + b"d" * 20, b""]
+
+
+@pytest.mark.asyncio
+async def test_stream_on_success_error() -> None:
+    async def gen() -> AsyncIterator[StreamChunk]:
+        yield "abc"
+        raise NotAllowed("not allowed")
+
+    messages: List[Json] = []
+
+    async def send(message: Json) -> None:
+        messages.append(message)
+
+    # the error happens before the first coalesced chunk is sent: the status code reflects the error
+    await StreamOnSuccessResponse(gen(), media_type="text/plain", chunk_size=8).stream_response(send)  # type: ignore
+    assert messages[0]["status"] == 403
+    assert messages[1]["body"] == b"not allowed"
@@ -12,12 +12,13 @@
 #  You should have received a copy of the GNU Affero General Public License
 #  along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import asyncio
 import datetime
 import uuid
 from attr import evolve
 
 import pytest
-from sqlalchemy import select
+from sqlalchemy import select, update
 
 from fixbackend.auth.user_repository import get_user_repository, UserRepository
 from fixbackend.auth.models import User
@@ -27,7 +28,7 @@ from fixbackend.workspaces.repository import WorkspaceRepository
 from fixbackend.permissions.role_repository import RoleRepository
 from fixbackend.workspaces.models import Workspace, orm
 from fixbackend.subscription.models import AwsMarketplaceSubscription
-from fixbackend.types import AsyncSessionMaker
+from fixbackend.types import AsyncSessionMaker, Redis
 from fixcloudutils.util import utc
 
 
@@ -83,6 +84,59 @@ async def test_get_workspace(workspace_repository: WorkspaceRepository, user: Us
     assert retrieved_organization is None
 
 
+@pytest.mark.asyncio
+async def test_get_workspace_cached(workspace_repository: WorkspaceRepository, user: User, redis: Redis) -> None:
+    repo = WorkspaceRepository(
+        workspace_repository.session_maker,
+        workspace_repository.graph_db_access_manager,
+        workspace_repository.domain_event_sender,
+        workspace_repository.pubsub_publisher,
+        workspace_repository.subscription_repository,
+        workspace_repository.role_repository,
+        redis=redis,
+    )
+    async with repo:
+        workspace = await repo.create_workspace(name="Test Organization", slug="test-organization", owner=user)
+        assert await repo.get_workspace_cached(workspace.id) == workspace
+        # change the workspace behind the back of the repository: the cached value is served
+        async with repo.session_maker() as session:
+            stmt = update(orm.Organization).where(orm.Organization.id == workspace.id).values(name="changed")
+            await session.execute(stmt)
+            await session.commit()
+        assert (await repo.get_workspace_cached(workspace.id)) == workspace
+        # every change via the repository evicts the cached value
+        await repo.update_payment_on_hold(workspace.id, utc())
+        for _ in range(50):
+            cached = await repo.get_workspace_cached(workspace.id)
+            if cached and cached.payment_on_hold_since is not None:
+                break
+            await asyncio.sleep(0.05)
+        assert cached is not None
+        assert cached.name == "changed"
+        assert cached.payment_on_hold_since is not None
+        # a change in the transaction of the caller evicts the cached value again after the commit
+        async with repo.session_maker() as tx:
+            await repo.update_product_tier(workspace.id, ProductTier.Free, session=tx)
+            for _ in range(50):
+                cached = await repo.get_workspace_cached(workspace.id)
+                if cached and cached.selected_product_tier == ProductTier.Free:
+                    break
+                await asyncio.sleep(0.05)
+            async with repo.session_maker() as session:
+                stmt = update(orm.Organization).where(orm.Organization.id == workspace.id).values(name="again")
+                await session.execute(stmt)
+                await session.commit()
+            assert (cached := await repo.get_workspace_cached(workspace.id)) and cached.name == "changed"
+            await tx.commit()
+        for _ in range(50):
+            cached = await repo.get_workspace_cached(workspace.id)
+            if cached and cached.name == "again":
+                break
+            await asyncio.sleep(0.05)
+        assert cached is not None
+        assert cached.name == "again"
+
+
 @pytest.mark.asyncio
 async def test_update_workspace(workspace_repository: WorkspaceRepository, user: User) -> None:
     # we can get an existing organization by id
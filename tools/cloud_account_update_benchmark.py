@@ -0,0 +1,151 @@
+#  Copyright (c) 2024. Some Engineering
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Measures how long it takes to store the scan results of a collect run: one update per account vs. one bulk update.
+
+Every run creates the given number of cloud accounts in an existing workspace and applies the scan results
+of one collect run to all of them. The database needs to be migrated. All created accounts are deleted afterwards.
+
+Usage: PYTHONPATH=. python tools/cloud_account_update_benchmark.py --database-url postgresql+asyncpg://fix@localhost/fix \
+         --workspace-id <id of an existing workspace>
+"""
+import argparse
+import asyncio
+import uuid
+from time import perf_counter
+from typing import List
+
+from attrs import evolve
+from fixcloudutils.util import utc
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from fixbackend.all_models import *  # noqa
+from fixbackend.cloud_accounts.models import (
+    AwsCloudAccess,
+    CloudAccount,
+    CloudAccountScanResult,
+    CloudAccountStates,
+    orm,
+)
+from fixbackend.cloud_accounts.repository import CloudAccountRepository
+from fixbackend.ids import (
+    AwsRoleName,
+    CloudAccountId,
+    CloudAccountName,
+    CloudNames,
+    ExternalId,
+    FixCloudAccountId,
+    TaskId,
+    WorkspaceId,
+)
+
+
+def accounts(workspace_id: WorkspaceId, count: int) -> List[CloudAccount]:
+    access = AwsCloudAccess(external_id=ExternalId(uuid.uuid4()), role_name=AwsRoleName("benchmark"))
+    now = utc()
+    return [
+        CloudAccount(
+            id=FixCloudAccountId(uuid.uuid4()),
+            account_id=CloudAccountId(f"{num:012d}"),
+            workspace_id=workspace_id,
+            cloud=CloudNames.AWS,
+            state=CloudAccountStates.Configured(access, enabled=True, scan=True),
+            account_name=CloudAccountName(f"benchmark-{num}"),
+            account_alias=None,
+            user_account_name=None,
+            privileged=False,
+            next_scan=None,
+            last_scan_duration_seconds=0,
+            last_scan_started_at=None,
+            last_scan_resources_scanned=0,
+            last_scan_resources_errors=0,
+            created_at=now,
+            updated_at=now,
+            state_updated_at=now,
+            cf_stack_version=0,
+            failed_scan_count=0,
+            last_task_id=None,
+            last_degraded_scan_started_at=None,
+        )
+        for num in range(count)
+    ]
+
+
+def scan_results(created: List[CloudAccount]) -> List[CloudAccountScanResult]:
+    started_at = utc()
+    return [
+        CloudAccountScanResult(
+            id=account.id,
+            started_at=started_at,
+            duration_seconds=60,
+            resources_scanned=1000,
+            resources_errors=0,
+            task_id=TaskId(str(uuid.uuid4())),
+            failed=False,
+        )
+        for account in created
+    ]
+
+
+async def run(args: argparse.Namespace) -> None:
+    engine = create_async_engine(args.database_url)
+    repo = CloudAccountRepository(async_sessionmaker(engine))
+    workspace_id = WorkspaceId(uuid.UUID(args.workspace_id))
+    print(f"{'accounts':>10}{'per account (ms)':>18}{'bulk (ms)':>12}")
+    try:
+        for count in args.accounts:
+            created = [await repo.create(account) for account in accounts(workspace_id, count)]
+            try:
+                # one update per account, as done before
+                before = perf_counter()
+                for result in scan_results(created):
+                    await repo.update(
+                        result.id,
+                        lambda acc: evolve(
+                            acc,
+                            last_scan_duration_seconds=result.duration_seconds,
+                            last_scan_resources_scanned=result.resources_scanned,
+                            last_scan_started_at=result.started_at,
+                            failed_scan_count=0,
+                            last_task_id=result.task_id,
+                            last_scan_resources_errors=result.resources_errors,
+                        ),
+                    )
+                single = perf_counter() - before
+                # all accounts with one update
+                before = perf_counter()
+                await repo.update_scan_results(scan_results(created))
+                bulk = perf_counter() - before
+                print(f"{count:>10}{single * 1000:>18.1f}{bulk * 1000:>12.1f}")
+            finally:
+                async with repo.session_maker() as session:
+                    await session.execute(
+                        delete(orm.CloudAccount).where(orm.CloudAccount.id.in_([a.id for a in created]))
+                    )
+                    await session.commit()
+    finally:
+        await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", required=True)
+    parser.add_argument("--workspace-id", required=True)
+    parser.add_argument("--accounts", type=int, nargs="+", default=[10, 100, 1000])
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#  Copyright (c) 2024. Some Engineering
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Measures the latency of the metering summary, computed from the metering table and from the daily rollup.
+
+Every run inserts the given number of metering records for a new workspace: hourly collects over 30 days
+of as many accounts as needed. The summary of this billing period, which is not aligned to full days, is computed.
+The database needs to be migrated. All created records are deleted afterwards.
+
+Usage: PYTHONPATH=. python tools/metering_benchmark.py --database-url postgresql+asyncpg://fix@localhost/fix
+"""
+import argparse
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+from time import perf_counter
+from typing import List
+
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from fixbackend.ids import CloudAccountId, ProductTier, WorkspaceId
+from fixbackend.metering import MeteringRecord
+from fixbackend.metering.metering_repository import (
+    BillableMinResources,
+    MeteringDailyEntity,
+    MeteringRecordEntity,
+    MeteringRepository,
+)
+
+
+def records(workspace_id: WorkspaceId, count: int, start: datetime) -> List[MeteringRecord]:
+    result = []
+    accounts = max(1, count // (30 * 24))
+    for num in range(count):
+        at = start + timedelta(hours=num // accounts)
+        result.append(
+            MeteringRecord(
+                id=uuid.uuid4(),
+                workspace_id=workspace_id,
+                cloud="aws",
+                account_id=CloudAccountId(f"account-{num % accounts}"),
+                account_name=f"Account {num % accounts}",
+                timestamp=at,
+                job_id=str(uuid.uuid4()),
+                task_id=str(uuid.uuid4()),
+                nr_of_resources_collected=1000,
+                nr_of_error_messages=0,
+                started_at=at,
+                duration=60,
+                product_tier=ProductTier.Business,
+            )
+        )
+    return result
+
+
+async def run(args: argparse.Namespace) -> None:
+    engine = create_async_engine(args.database_url)
+    repo = MeteringRepository(async_sessionmaker(engine))
+    print(f"{'rows':>10}{'insert (s)':>12}{'raw (ms)':>12}{'rollup (ms)':>14}")
+    try:
+        for count in args.rows:
+            workspace_id = WorkspaceId(uuid.uuid4())
+            start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+            to_insert = records(workspace_id, count, start)
+            before = perf_counter()
+            await repo.add(to_insert)
+            insert_time = perf_counter() - before
+            # billing periods start and end at 9 o'clock
+            start, end = start.replace(hour=9), to_insert[-1].timestamp.replace(hour=9)
+            latency = {}
+            for from_rollup in [False, True]:
+                timings = []
+                for _ in range(args.repeat):
+                    before = perf_counter()
+                    summary = repo.collect_summary(
+                        workspace_id,
+                        start=start,
+                        end=end,
+                        min_resources_collected=BillableMinResources,
+                        from_rollup=from_rollup,
+                    )
+                    _ = [s async for s in summary]
+                    timings.append(perf_counter() - before)
+                latency[from_rollup] = sorted(timings)[len(timings) // 2] * 1000
+            print(f"{count:>10}{insert_time:>12.2f}{latency[False]:>12.1f}{latency[True]:>14.1f}")
+            async with repo.session_maker() as session:
+                await session.execute(
+                    delete(MeteringRecordEntity).where(MeteringRecordEntity.tenant_id == workspace_id)
+                )
+                await session.execute(delete(MeteringDailyEntity).where(MeteringDailyEntity.tenant_id == workspace_id))
+                await session.commit()
+    finally:
+        await engine.dispose()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", required=True)
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000, 10_000, 100_000, 500_000])
+    parser.add_argument("--repeat", type=int, default=5, help="Number of summary computations per measurement")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
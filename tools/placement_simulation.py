@@ -0,0 +1,112 @@
+#  Copyright (c) 2024. Some Engineering
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Compares the placement of a synthetic tenant population on graph database servers.
+
+Tenant sizes follow a heavy tailed distribution: few large tenants hold most resources.
+Strategies: modulo of the tenant hash (as before), owner in the consistent hash ring, and the ring with bounded loads.
+For every strategy the spread of tenants and resources (max / mean per server) is reported,
+as well as the share of tenants and resources that move, when one server is added,
+and the spread of resources afterwards.
+
+Usage: PYTHONPATH=. python tools/placement_simulation.py --tenants 10000 --servers 4
+"""
+import argparse
+import hashlib
+import random
+import uuid
+from typing import Callable, Dict, List, Tuple
+
+from fixbackend.graph_db.placement import HashRing, PlacementEngine, ServerLoad
+from fixbackend.ids import WorkspaceId
+
+Placement = Dict[WorkspaceId, str]
+
+
+def modulo(tenants: List[WorkspaceId], resources: Dict[WorkspaceId, int], servers: List[str]) -> Placement:
+    return {t: servers[int(hashlib.sha256(str(t).encode()).hexdigest(), 16) % len(servers)] for t in tenants}
+
+
+def ring(tenants: List[WorkspaceId], resources: Dict[WorkspaceId, int], servers: List[str]) -> Placement:
+    hash_ring = HashRing({s: 1 for s in servers})
+    return {t: hash_ring.server_for(str(t)) for t in tenants}
+
+
+def bounded(load_factor: float) -> Callable[[List[WorkspaceId], Dict[WorkspaceId, int], List[str]], Placement]:
+    def place(tenants: List[WorkspaceId], resources: Dict[WorkspaceId, int], servers: List[str]) -> Placement:
+        engine = PlacementEngine(HashRing({s: 1 for s in servers}), load_factor=load_factor)
+        loads: Dict[str, ServerLoad] = {}
+        result = {}
+        # tenants are created one after the other
+        for t in tenants:
+            server = engine.place(t, loads)
+            loads[server] = loads.get(server, ServerLoad()).add(resources[t])
+            result[t] = server
+        return result
+
+    return place
+
+
+def spread(placement: Placement, resources: Dict[WorkspaceId, int], servers: List[str]) -> Tuple[float, float]:
+    tenants = {s: 0 for s in servers}
+    res = {s: 0 for s in servers}
+    for t, s in placement.items():
+        tenants[s] += 1
+        res[s] += resources[t]
+    return max(tenants.values()) / (len(placement) / len(servers)), max(res.values()) / (
+        sum(res.values()) / len(servers)
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tenants", type=int, default=10000, help="Number of simulated tenants")
+    parser.add_argument("--servers", type=int, default=4, help="Number of servers")
+    parser.add_argument("--load-factor", type=float, default=1.25, help="Load factor of the bounded placement")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    rnd = random.Random(args.seed)
+    tenants = [WorkspaceId(uuid.UUID(int=rnd.getrandbits(128))) for _ in range(args.tenants)]
+    # resources change after placement: tenants are placed without knowing their final size
+    resources = {t: int(rnd.paretovariate(1.2) * 1000) for t in tenants}
+    servers = [f"db-{num}" for num in range(args.servers)]
+    more_servers = servers + [f"db-{args.servers}"]
+    strategies = [("modulo", modulo), ("ring", ring), ("bounded", bounded(args.load_factor))]
+    print(
+        f"{'strategy':<10}{'tenants max/mean':>18}{'resources max/mean':>20}{'moved tenants':>15}{'moved res.':>12}{'res. after':>14}"
+    )
+    for name, strategy in strategies:
+        placement = strategy(tenants, resources, servers)
+        tenant_spread, resource_spread = spread(placement, resources, servers)
+        if name == "bounded":
+            # the existing tenants are rebalanced with the planner
+            engine = PlacementEngine(HashRing({s: 1 for s in more_servers}), load_factor=args.load_factor)
+            plan = engine.plan(placement, resources)
+            moved = [m.workspace_id for m in plan.moves]
+            after = placement | {m.workspace_id: m.target for m in plan.moves}
+        else:
+            # the placement is recomputed
+            after = strategy(tenants, resources, more_servers)
+            moved = [t for t in tenants if placement[t] != after[t]]
+        moved_tenants = len(moved) / len(tenants) * 100
+        moved_resources = sum(resources[t] for t in moved) / sum(resources.values()) * 100
+        _, resource_spread_after = spread(after, resources, more_servers)
+        print(
+            f"{name:<10}{tenant_spread:>18.2f}{resource_spread:>20.2f}"
+            f"{moved_tenants:>14.1f}%{moved_resources:>11.1f}%{resource_spread_after:>14.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+#  Copyright (c) 2024. Some Engineering
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Replays the scan schedule of a synthetic tenant population and reports the enqueue rate of collect jobs per minute.
+
+The population is created in bursts (e.g. a marketing campaign) and all tenants change their product tier
+at the same time (e.g. the end of a trial period), which is the worst case for aligned next runs.
+
+Usage: PYTHONPATH=. python tools/schedule_simulation.py --tenants 5000 --hours 48 --max-queue-depth 200 --workers 50
+"""
+import argparse
+import random
+import uuid
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from fixbackend.config import ProductTierSettings
+from fixbackend.dispatcher.next_run_repository import compute_next_run, schedule_offset
+from fixbackend.ids import ProductTier, WorkspaceId
+
+Start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+Minute = timedelta(minutes=1)
+
+
+class Tenant:
+    def __init__(self, workspace_id: WorkspaceId, tier: ProductTier, accounts: int, created: datetime) -> None:
+        self.workspace_id = workspace_id
+        self.tier = tier
+        self.accounts = accounts
+        self.created = created
+        self.next_run: Optional[datetime] = None
+
+
+def population(size: int, rnd: random.Random) -> List[Tenant]:
+    tiers = [ProductTier.Trial, ProductTier.Plus, ProductTier.Business, ProductTier.Enterprise]
+    tenants = []
+    for _ in range(size):
+        # 60% of all tenants are created in one of three bursts of 5 minutes, the rest during the first hour
+        if rnd.random() < 0.6:
+            created = Start + rnd.choice([0, 20, 40]) * Minute + rnd.randrange(5 * 60) * Minute / 60
+        else:
+            created = Start + rnd.randrange(3600) * Minute / 60
+        tier = rnd.choices(tiers, weights=[5, 3, 1, 1])[0]
+        tenants.append(Tenant(WorkspaceId(uuid.UUID(int=rnd.getrandbits(128))), tier, rnd.randint(1, 5), created))
+    return tenants
+
+
+def next_run(tenant: Tenant, spread: bool, now: datetime, last_run: Optional[datetime] = None) -> datetime:
+    interval = ProductTierSettings[tenant.tier].scan_interval
+    offset = schedule_offset(tenant.workspace_id, interval) if spread else None
+    return compute_next_run(interval, now, last_run, offset)
+
+
+def simulate(args: argparse.Namespace, spread: bool) -> Dict[str, float]:
+    rnd = random.Random(args.seed)
+    tenants = population(args.tenants, rnd)
+    tier_change_at = Start + timedelta(hours=args.hours / 2)
+    enqueued: Counter[int] = Counter()
+    queue_depth = 0
+    max_lag = timedelta(0)
+    minute = 0
+    now = Start
+    while now < Start + timedelta(hours=args.hours):
+        # workers pick up jobs from the queue
+        queue_depth = max(0, queue_depth - args.workers)
+        for tenant in tenants:
+            if tenant.next_run is None and tenant.created <= now:  # workspace created
+                tenant.next_run = next_run(tenant, spread, tenant.created)
+        if tier_change_at <= now < tier_change_at + Minute:  # all tenants change the product tier
+            for tenant in tenants:
+                if tenant.next_run is not None and tenant.tier == ProductTier.Trial:
+                    tenant.tier = ProductTier.Plus
+                    tenant.next_run = next_run(tenant, spread, now)
+        due = sorted(
+            (t for t in tenants if t.next_run is not None and t.next_run < now), key=lambda t: t.next_run or now
+        )
+        for tenant in due:
+            if args.max_queue_depth and queue_depth > args.max_queue_depth:
+                break  # defer the rest to the next minute
+            max_lag = max(max_lag, now - (tenant.next_run or now))
+            enqueued[minute] += tenant.accounts
+            queue_depth += tenant.accounts
+            tenant.next_run = next_run(tenant, spread, now, tenant.next_run)
+        now += Minute
+        minute += 1
+    rates = sorted(enqueued[m] for m in range(minute))
+    return dict(
+        peak=rates[-1],
+        p99=rates[int(len(rates) * 0.99)],
+        mean=sum(rates) / len(rates),
+        max_lag_minutes=max_lag.total_seconds() / 60,
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tenants", type=int, default=5000, help="Number of simulated tenants")
+    parser.add_argument("--hours", type=float, default=48, help="Simulated time frame in hours")
+    parser.add_argument("--max-queue-depth", type=int, default=0, help="Defer scheduling above this depth")
+    parser.add_argument("--workers", type=int, default=100, help="Jobs picked up by all workers per minute")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    print(f"{'mode':<10}{'peak/min':>10}{'p99/min':>10}{'mean/min':>10}{'max lag (min)':>15}")
+    for name, spread in [("aligned", False), ("spread", True)]:
+        result = simulate(args, spread)
+        print(
+            f"{name:<10}{result['peak']:>10}{result['p99']:>10}{result['mean']:>10.1f}"
+            f"{result['max_lag_minutes']:>15.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
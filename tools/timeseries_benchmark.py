@@ -0,0 +1,114 @@
+#  Copyright (c) 2024. Some Engineering
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU Affero General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU Affero General Public License for more details.
+#
+#  You should have received a copy of the GNU Affero General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Compares the dict based scatter representation of a grouped timeseries with the columnar one.
+
+For every size a synthetic timeseries with the given number of groups and timestamps is created (10% of values missing).
+Measured steps:
+- build: create the representation from the timeseries entries and sort the groups by average, biggest first.
+- values: extract the dense values of all groups, as done to render the timeline chart.
+- json: create the Scatters json, as returned by the API.
+
+Usage: PYTHONPATH=. python tools/timeseries_benchmark.py --groups 10 100 1000 --timestamps 30 720
+"""
+import argparse
+import random
+from datetime import datetime, timedelta, timezone
+from time import perf_counter
+from typing import Callable, Dict, List, Optional, Set, Tuple, TypeVar
+
+from fixbackend.inventory.inventory_schemas import Scatter, Scatters
+from fixbackend.inventory.timeseries import ColumnarScatters, Point
+
+T = TypeVar("T")
+start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+granularity = timedelta(hours=1)
+
+
+def entries(groups: int, timestamps: int) -> List[Point]:
+    rnd = random.Random(42)
+    result: List[Point] = []
+    for at in (start + granularity * i for i in range(timestamps)):
+        for g in range(groups):
+            if rnd.random() > 0.1:
+                result.append(({"account_id": f"account-{g}"}, at, float(rnd.randint(1, 100_000))))
+    rnd.shuffle(result)
+    return result
+
+
+def dict_based(points: List[Point], end: datetime) -> Scatters:
+    # the implementation of InventoryService.timeseries_scattered before the columnar representation
+    scatters: Dict[str, Scatter] = {}
+    ats: Set[datetime] = set()
+    for groups, at, v in points:
+        group_name = "::".join(f"{k}={v}" for k, v in sorted(groups.items())) if groups else "all"
+        ats.add(at)
+        scatter = Scatter(group_name=group_name, group=groups, values={at: v})
+        if existing := scatters.get(scatter.group_name):
+            existing.values.update(scatter.values)
+        else:
+            scatters[scatter.group_name] = scatter
+    return Scatters(
+        start=start,
+        end=end,
+        granularity=granularity,
+        ats=sorted(ats),
+        groups=sorted(scatters.values(), key=lambda x: x.avg, reverse=True),
+    )
+
+
+def measure(fn: Callable[[], T], repeat: int) -> Tuple[T, float]:
+    # best of repeat in milliseconds
+    best: Optional[float] = None
+    result: Optional[T] = None
+    for _ in range(repeat):
+        before = perf_counter()
+        result = fn()
+        duration = perf_counter() - before
+        best = duration if best is None else min(best, duration)
+    assert result is not None and best is not None
+    return result, best * 1000
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--groups", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--timestamps", type=int, nargs="+", default=[30, 720])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    print(
+        f"{'groups':>8}{'ats':>6}{'points':>9}"
+        f"{'build dict':>12}{'columnar':>10}{'values dict':>13}{'columnar':>10}{'json dict':>11}{'columnar':>10}  (ms)"
+    )
+    for timestamps in args.timestamps:
+        for groups in args.groups:
+            points = entries(groups, timestamps)
+            end = start + granularity * timestamps
+            scatters, build_dict = measure(lambda: dict_based(points, end), args.repeat)
+            columnar, build_col = measure(
+                lambda: ColumnarScatters.of(start, end, granularity, points).sorted_by_avg(), args.repeat
+            )
+            assert [s.group_name for s in scatters.groups] == columnar.group_names
+            _, values_dict = measure(lambda: [s.get_values(scatters.ats) for s in scatters.groups], args.repeat)
+            _, values_col = measure(lambda: columnar.fill_missing(0), args.repeat)
+            _, json_dict = measure(lambda: scatters.model_dump_json(), args.repeat)
+            _, json_col = measure(lambda: columnar.to_scatters().model_dump_json(), args.repeat)
+            print(
+                f"{groups:>8}{timestamps:>6}{len(points):>9}{build_dict:>12.1f}{build_col:>10.1f}"
+                f"{values_dict:>13.2f}{values_col:>10.2f}{json_dict:>11.1f}{json_col:>10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()